@@ -1,6 +1,6 @@
 import os
 import sys
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 SRC_DIR = os.path.join(BASE_DIR, "srcPYTHON")
@@ -9,13 +9,48 @@ if SRC_DIR not in sys.path:
 
 from ThePython import (
     run_delta_nbr_pipeline,
-    m2m_login,
-    m2m_logout,
     OUTPUT_DIR,
+    COMPOSITE_METHODS,
+    COMPOSITE_SCENES,
 )
+from m2m_credentials import get_credential_manager, active_clients
+from m2m_client import get_default_client
+from scene_cache import get_scene_cache
+from scene_search_cache import get_search_cache
+from instrumentation import (
+    prometheus_text,
+    merge_m2m_metrics,
+    m2m_metric_families,
+    stats_metric_families,
+)
+from job_queue import JobQueue, DONE, FAILED
+from tile_scheduler import run_tiles, shared_raster_pool, RASTER_WORKERS
+from tile_server import render_tile, tile_etag, get_tile_cache, list_sources, SCHEMES, TILE_MAX_AGE
+from tile_manifest import get_manifest
+from mosaic import mosaic_info
+from zonal_stats import zonal_stats, asset_zones_path, DEFAULT_THRESHOLD
+from burn_scars import read_scars, scars_etag
 
 app = Flask(__name__, static_folder=".", static_url_path="")
 
+# Background workers for /api/jobs, /api/run_dnbr and /api/run_dnbr_batch
+JOB_WORKERS = int(os.environ.get("DNBR_JOB_WORKERS", "2"))
+JOB_RESULT_TTL = int(os.environ.get("DNBR_JOB_RESULT_TTL", "3600"))
+jobs = JobQueue(max_workers=JOB_WORKERS, result_ttl=JOB_RESULT_TTL)
+
+
+# The static root is the repo / image root. Never hand out what lives next to the site:
+# data/ (caches, scenes, any local key files; results go through /outputs/ instead)
+# and dot paths (.git, .env, .gitignore, ...).
+STATIC_BLOCKED_DIRS = ("data",)
+
+
+@app.before_request
+def block_private_static():
+    parts = [p for p in request.path.split("/") if p]
+    if parts and (parts[0] in STATIC_BLOCKED_DIRS or any(p.startswith(".") for p in parts)):
+        return jsonify({"error": "Not found"}), 404
+
 
 @app.route("/")
 def root():
@@ -28,72 +63,218 @@ def _validate_iso_date(label, value):
         raise ValueError(f"{label} must be YYYY-MM-DD")
 
 
-@app.route("/api/run_dnbr", methods=["POST"])
-def api_run_dnbr():
-    data = request.get_json(force=True) or {}
-    try:
-        path = int(data["path"])
-        row = int(data["row"])
-        pre_start = data["pre_start"]
-        pre_end = data["pre_end"]
-        post_start = data["post_start"]
-        post_end = data["post_end"]
-        _validate_iso_date("pre_start", pre_start)
-        _validate_iso_date("pre_end", pre_end)
-        _validate_iso_date("post_start", post_start)
-        _validate_iso_date("post_end", post_end)
-    except (KeyError, ValueError) as e:
-        return jsonify({"error": f"Missing or invalid parameter: {e}"}), 400
+def _parse_run_request(data):
+    """Validate a single run request body. Raises KeyError / ValueError."""
+    params = {
+        "path": int(data["path"]),
+        "row": int(data["row"]),
+        "pre_start": data["pre_start"],
+        "pre_end": data["pre_end"],
+        "post_start": data["post_start"],
+        "post_end": data["post_end"],
+    }
+    _validate_iso_date("pre_start", params["pre_start"])
+    _validate_iso_date("pre_end", params["pre_end"])
+    _validate_iso_date("post_start", params["post_start"])
+    _validate_iso_date("post_end", params["post_end"])
 
-    username = os.environ.get("USGS_USERNAME")
-    token = os.environ.get("USGS_TOKEN")
-    if not username or not token:
-        return jsonify({"error": "USGS_USERNAME / USGS_TOKEN not set"}), 500
+    # optional multi-scene composite per window (see ThePython.composite_scene_bands)
+    composite = data.get("composite")
+    if composite is not None:
+        if composite not in COMPOSITE_METHODS:
+            raise ValueError(f"composite must be one of {', '.join(COMPOSITE_METHODS)}")
+        params["composite"] = composite
+        params["composite_scenes"] = int(data.get("composite_scenes", COMPOSITE_SCENES))
+        if not 2 <= params["composite_scenes"] <= 10:
+            raise ValueError("composite_scenes must be between 2 and 10")
+    return params
 
-    api_key = m2m_login(username, token)
-    tag = f"p{path:03d}r{row:03d}_{pre_start.replace('-', '')}_{post_start.replace('-', '')}"
 
-    try:
-        result = run_delta_nbr_pipeline(
-            api_key,
-            pre_start,
-            pre_end,
-            post_start,
-            post_end,
-            path,
-            row,
-            tag=tag,
-        )
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    finally:
-        m2m_logout(api_key)
-
-    png_path = result.get("png_path")
-    bounds = result.get("bounds")
-    stats = result.get("stats")
+def _job_key(params):
+    # identical (path, row, date window) submissions share one job
+    return (
+        params["path"], params["row"],
+        params["pre_start"], params["pre_end"],
+        params["post_start"], params["post_end"],
+        params.get("composite"), params.get("composite_scenes"),
+    )
+
+
+def _format_result(res):
+    png_path = res.get("png_path")
+    bounds = res.get("bounds")
     png_url = None
     if png_path and png_path.startswith(OUTPUT_DIR):
         png_url = f"/outputs/{os.path.basename(png_path)}"
 
-    return jsonify(
-        {
-            "stats": stats,
-            "bounds": {
-                "min_lat": bounds[0],
-                "min_lon": bounds[1],
-                "max_lat": bounds[2],
-                "max_lon": bounds[3],
-            }
-            if bounds
-            else None,
-            "png_url": png_url,
+    # XYZ template for L.tileLayer, rendered on demand by /tiles
+    tif_path = res.get("tif_path")
+    tiles_url = None
+    if tif_path and tif_path.startswith(OUTPUT_DIR):
+        tif_rel = os.path.relpath(tif_path, OUTPUT_DIR).replace(os.sep, "/")
+        tiles_url = f"/tiles/{{z}}/{{x}}/{{y}}.png?tif={tif_rel}&scheme=burn"
+
+    # burn scar polygons of this result, the map adds &bbox=...&z=...
+    scars_url = None
+    if tiles_url and res.get("scars_path"):
+        scars_url = f"/api/burn_scars?tif={tif_rel}"
+
+    # uint8 severity class GeoTIFF (classify_dnbr codes), for download / GIS
+    class_tif = res.get("class_tif_path")
+    class_tif_url = None
+    if class_tif and class_tif.startswith(OUTPUT_DIR) and os.path.isfile(class_tif):
+        class_tif_url = "/outputs/" + os.path.relpath(class_tif, OUTPUT_DIR).replace(os.sep, "/")
+
+    return {
+        "stats": res.get("stats"),
+        "bounds": {
+            "min_lat": bounds[0],
+            "min_lon": bounds[1],
+            "max_lat": bounds[2],
+            "max_lon": bounds[3],
         }
+        if bounds
+        else None,
+        "png_url": png_url,
+        "tiles_url": tiles_url,
+        "class_tif_url": class_tif_url,
+        "scars_url": scars_url,
+        "timings": res.get("timings"),   # seconds per raster stage (load / align / dnbr / write / png)
+        "composite": {
+            k: res["composite"][k] for k in ("pre", "post")
+        } if res.get("composite") else None,
+    }
+
+
+def _run_dnbr_job(params, username, token, progress=None):
+    """Runs on a job worker thread. The M2M key is shared across jobs (see m2m_credentials)."""
+    path = params["path"]
+    row = params["row"]
+    pre_start = params["pre_start"]
+    post_start = params["post_start"]
+    tag = f"p{path:03d}r{row:03d}_{pre_start.replace('-', '')}_{post_start.replace('-', '')}"
+    if params.get("composite"):
+        # its own output files, next to the single-scene run of the same window
+        tag += f"_{params['composite']}{params['composite_scenes']}"
+
+    if progress is not None:
+        progress("login")
+    client = get_credential_manager(username, token).client()
+    res = run_delta_nbr_pipeline(
+        client,
+        pre_start,
+        params["pre_end"],
+        post_start,
+        params["post_end"],
+        path,
+        row,
+        tag=tag,
+        progress=progress,
+        composite=params.get("composite"),
+        composite_scenes=params.get("composite_scenes"),
     )
 
+    return _format_result(res)
+
+
+def _job_response(job):
+    body = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "stage": job["stage"],
+        "stages": job["stages"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "status_url": f"/api/jobs/{job['id']}",
+    }
+    if job["status"] == DONE:
+        body.update(job["result"] or {})
+    if job["status"] == FAILED:
+        body["error"] = job["error"]
+    return body
+
+
+def _submit_run(data):
+    """Shared by /api/jobs and /api/run_dnbr. Returns (job, error_response)."""
+    try:
+        params = _parse_run_request(data)
+    except (KeyError, ValueError) as e:
+        return None, (jsonify({"error": f"Missing or invalid parameter: {e}"}), 400)
+
+    username = os.environ.get("USGS_USERNAME")
+    token = os.environ.get("USGS_TOKEN")
+    if not username or not token:
+        return None, (jsonify({"error": "USGS_USERNAME / USGS_TOKEN not set"}), 500)
+
+    job, _ = jobs.submit(_job_key(params), _run_dnbr_job, params, username, token)
+    return job, None
+
+
+@app.route("/api/jobs", methods=["POST"])
+def api_submit_job():
+    """Queue a dNBR run and return its job id straight away."""
+    job, err = _submit_run(request.get_json(force=True) or {})
+    if err:
+        return err
+    status = 200 if job["status"] == DONE else 202
+    return jsonify(_job_response(job)), status
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def api_job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job id"}), 404
+    return jsonify(_job_response(job))
+
+
+@app.route("/api/run_dnbr", methods=["POST"])
+def api_run_dnbr():
+    """
+    Synchronous version kept for old clients: submits to the same queue
+    (so it dedupes with /api/jobs) and waits for the result.
+    """
+    job, err = _submit_run(request.get_json(force=True) or {})
+    if err:
+        return err
+
+    job = jobs.wait(job["id"])
+    if job["status"] == FAILED:
+        return jsonify({"error": job["error"]}), 500
+    return jsonify(job["result"])
+
+
+def _run_batch_job(tiles, window, username, token, errors=(), progress=None):
+    """Runs on a job worker thread. Raster maths goes to the server-wide process pool."""
+    if progress is not None:
+        progress("login")
+    client = get_credential_manager(username, token).client()
+    if progress is not None:
+        progress(f"tiles ({len(tiles)})")
+    # downloads overlap on a thread pool, raster maths runs in worker processes
+    pool = shared_raster_pool() if RASTER_WORKERS > 0 else None
+    done, failed = run_tiles(client, tiles, [window], raster_pool=pool)
+
+    results = []
+    errors = list(errors)   # the requests that didn't parse
+    for entry in done:
+        t = entry["tile"]
+        results.append({"path": t["path"], "row": t["row"], **_format_result(entry["result"])})
+    for entry in failed:
+        t = entry["tile"]
+        errors.append({"path": t["path"], "row": t["row"], "error": entry["error"]})
+    return {"results": results, "errors": errors}
+
 
 @app.route("/api/run_dnbr_batch", methods=["POST"])
 def api_run_dnbr_batch():
+    """
+    Runs every path/row in "requests" over the first request's date window.
+    Goes through the job queue like /api/run_dnbr. With "async": true the job
+    comes straight back (202 + status_url, poll /api/jobs/<id>), otherwise the
+    request waits and returns {"results", "errors"} as before.
+    """
     data = request.get_json(force=True) or {}
     reqs = data.get("requests")
     if not isinstance(reqs, list) or not reqs:
@@ -117,61 +298,169 @@ def api_run_dnbr_batch():
     if not username or not token:
         return jsonify({"error": "USGS_USERNAME / USGS_TOKEN not set"}), 500
 
-    api_key = m2m_login(username, token)
-    results = []
+    tiles = []
     errors = []
+    for idx, r in enumerate(reqs):
+        try:
+            tiles.append({"path": int(r["path"]), "row": int(r["row"])})
+        except (KeyError, ValueError) as e:
+            errors.append({"index": idx, "error": f"Missing or invalid path/row: {e}"})
+
+    window = {
+        "pre_start": pre_start,
+        "pre_end": pre_end,
+        "post_start": post_start,
+        "post_end": post_end,
+    }
+
+    key = ("batch", tuple((t["path"], t["row"]) for t in tiles), tuple(e["index"] for e in errors),
+           pre_start, pre_end, post_start, post_end)
+    job, _ = jobs.submit(key, _run_batch_job, tiles, window, username, token, errors=errors)
+
+    if data.get("async"):
+        return jsonify(_job_response(job)), 200 if job["status"] == DONE else 202
+
+    job = jobs.wait(job["id"])
+    if job["status"] == FAILED:
+        return jsonify({"error": job["error"]}), 500
+    return jsonify(job["result"])
+
+
+@app.route("/api/tiles", methods=["GET"])
+def list_batch_tiles():
+    """
+    Manifest of the pre-generated batch tiles (see tile_manifest.py), plus
+    the province mosaic's tile URL once it's been built (mosaic.py).
+    Revalidated with If-None-Match, unchanged manifest -> 304.
+    """
+    tiles, etag = get_manifest()
+    mosaic = mosaic_info()
+    if mosaic:
+        etag = f"{etag}-{mosaic['version']}"
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        resp = jsonify({"tiles": tiles, "mosaic": mosaic})
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+@app.route("/api/zonal_stats", methods=["POST"])
+def api_zonal_stats():
+    """
+    Per-zone burned area + severity class histogram of a stored dNBR GeoTIFF.
+    Body: {"tif": <file under outputs, or "mosaic">,
+           "zones": "wrs2" | "<file>.geojson" in assets/ | GeoJSON object,
+           "id_field": optional property to name zones by, "threshold": optional (0.27)}
+    """
+    data = request.get_json(force=True) or {}
+    tif = data.get("tif")
+    zones = data.get("zones")
+    if not isinstance(tif, str) or not tif:
+        return jsonify({"error": "tif is required"}), 400
+    if not zones:
+        return jsonify({"error": "zones is required"}), 400
+    try:
+        threshold = float(data.get("threshold", DEFAULT_THRESHOLD))
+    except (TypeError, ValueError):
+        return jsonify({"error": "threshold must be a number"}), 400
+
+    try:
+        tif_path = list_sources(tif)[0]
+        if isinstance(zones, str) and zones != "wrs2":
+            zones = asset_zones_path(zones)
+    except FileNotFoundError as e:
+        return jsonify({"error": f"Not found: {e}"}), 404
+
     try:
-        for idx, r in enumerate(reqs):
-            try:
-                path = int(r["path"])
-                row = int(r["row"])
-            except (KeyError, ValueError) as e:
-                errors.append({"index": idx, "error": f"Missing or invalid path/row: {e}"})
-                continue
-
-            tag = f"p{path:03d}r{row:03d}_{pre_start.replace('-', '')}_{post_start.replace('-', '')}"
-            try:
-                res = run_delta_nbr_pipeline(
-                    api_key,
-                    pre_start,
-                    pre_end,
-                    post_start,
-                    post_end,
-                    path,
-                    row,
-                    tag=tag,
-                )
-            except Exception as e:
-                errors.append({"path": path, "row": row, "error": str(e)})
-                continue
-
-            png_path = res.get("png_path")
-            bounds = res.get("bounds")
-            stats = res.get("stats")
-            png_url = None
-            if png_path and png_path.startswith(OUTPUT_DIR):
-                png_url = f"/outputs/{os.path.basename(png_path)}"
-
-            results.append(
-                {
-                    "path": path,
-                    "row": row,
-                    "stats": stats,
-                    "bounds": {
-                        "min_lat": bounds[0],
-                        "min_lon": bounds[1],
-                        "max_lat": bounds[2],
-                        "max_lon": bounds[3],
-                    }
-                    if bounds
-                    else None,
-                    "png_url": png_url,
-                }
-            )
-    finally:
-        m2m_logout(api_key)
-
-    return jsonify({"results": results, "errors": errors})
+        result = zonal_stats(tif_path, zones, id_field=data.get("id_field"), threshold=threshold)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 400
+    result["tif"] = tif
+    return jsonify(result)
+
+
+@app.route("/api/burn_scars")
+def api_burn_scars():
+    """
+    Burn scar polygons (burn_scars.py) touching a bbox, as a GeoJSON FeatureCollection.
+    ?bbox=min_lon,min_lat,max_lon,max_lat (required), ?z=<map zoom> picks the outlines
+    simplified for that zoom (default 24 = exact pixel outlines),
+    ?tif=<file under outputs> for one result (otherwise every stored dNBR with scars).
+    """
+    try:
+        bbox = [float(v) for v in request.args.get("bbox", "").split(",")]
+        if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+            raise ValueError
+    except ValueError:
+        return jsonify({"error": "bbox must be min_lon,min_lat,max_lon,max_lat"}), 400
+    try:
+        z = int(request.args.get("z", "24"))
+    except ValueError:
+        return jsonify({"error": "z must be an integer"}), 400
+    if z < 0 or z > 24:
+        return jsonify({"error": "z out of range"}), 400
+
+    tif = request.args.get("tif") or None
+    try:
+        tif_paths = list_sources(tif)
+    except FileNotFoundError:
+        return jsonify({"error": f"Unknown tif: {tif}"}), 404
+
+    etag = scars_etag(tif_paths, bbox, z)
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        resp = jsonify(read_scars(tif_paths, bbox, z))
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.png")
+def serve_tile(z, x, y):
+    """
+    Web Mercator tile rendered from the dNBR GeoTIFFs in OUTPUT_DIR.
+    ?scheme=burn|usgs (default burn), ?tif=<file under outputs> for a single result
+    (otherwise every stored GeoTIFF that touches the tile is drawn).
+    """
+    scheme = request.args.get("scheme", "burn")
+    tif = request.args.get("tif") or None
+    if scheme not in SCHEMES:
+        return jsonify({"error": f"scheme must be one of {', '.join(SCHEMES)}"}), 400
+    if z < 0 or z > 24 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return jsonify({"error": "tile out of range"}), 400
+
+    try:
+        etag, sources = tile_etag(z, x, y, scheme, tif)
+    except FileNotFoundError:
+        return jsonify({"error": f"Unknown tif: {tif}"}), 404
+
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        png, etag = render_tile(z, x, y, scheme, tif, etag=etag, sources=sources)
+        resp = Response(png, mimetype="image/png")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = f"public, max-age={TILE_MAX_AGE}"
+    return resp
+
+
+@app.route("/metrics")
+def serve_metrics():
+    """
+    Prometheus text format: pipeline stage spans (see instrumentation.py),
+    M2M call counts / latency, scene, scene-search and tile cache counters.
+    """
+    clients = [get_default_client()] + active_clients()
+    body = prometheus_text(
+        m2m_metric_families(merge_m2m_metrics(c.metrics() for c in clients)),
+        stats_metric_families("dnbr_scene_cache", get_scene_cache().stats(), "Scene cache"),
+        stats_metric_families("dnbr_search_cache", get_search_cache().stats(), "Scene-search cache"),
+        stats_metric_families("dnbr_tile_cache", get_tile_cache().stats(), "Tile cache"),
+    )
+    return Response(body, mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/outputs/<path:filename>")
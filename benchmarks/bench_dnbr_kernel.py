@@ -0,0 +1,114 @@
+"""
+dNBR maths benchmark: compute_nbr / compute_delta_nbr / delta_nbr_stats /
+nodata np.where chain vs fused_dnbr.
+
+Builds synthetic pre/post NIR + SWIR2 bands (float32 reflectance, some
+zero-denominator pixels, a cloud mask) of a full Landsat scene, then times
+each path and records its peak traced memory. The bands themselves are
+allocated before tracing starts, so peak MB is only what the maths adds.
+The nodata-encoded outputs and the stats are checked to be identical.
+
+    python benchmarks/bench_dnbr_kernel.py
+    python benchmarks/bench_dnbr_kernel.py --size 2000x2000 --chunk-rows 64
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "srcPYTHON"))
+
+import numpy as np
+
+from ThePython import (
+    DELTA_NODATA,
+    KERNEL_CHUNK_ROWS,
+    compute_nbr,
+    compute_delta_nbr,
+    delta_nbr_stats,
+    delta_nbr_stats_finish,
+    fused_dnbr,
+)
+
+
+def synthetic_bands(height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    bands = []
+    for lo, hi in ((0.15, 0.45), (0.05, 0.25), (0.05, 0.35), (0.10, 0.35)):
+        b = rng.uniform(lo, hi, (height, width)).astype(np.float32)
+        bands.append(b)
+    nir_pre, swir_pre, nir_post, swir_post = bands
+    # fill pixels: both bands 0 -> denominator 0
+    for nir, swir in ((nir_pre, swir_pre), (nir_post, swir_post)):
+        idx = rng.integers(0, nir.size, nir.size // 200)
+        nir.reshape(-1)[idx] = 0
+        swir.reshape(-1)[idx] = 0
+    mask = rng.random((height, width), dtype=np.float32) < 0.1
+    return nir_pre, swir_pre, nir_post, swir_post, mask
+
+
+def legacy_chain(nir_pre, swir_pre, nir_post, swir_post, mask):
+    nbr_pre = compute_nbr(nir_pre, swir_pre, mask)
+    nbr_post = compute_nbr(nir_post, swir_post, mask)
+    delta = compute_delta_nbr(nbr_pre, nbr_post)
+    stats = delta_nbr_stats(delta)
+    out = np.where(np.isnan(delta), DELTA_NODATA, delta).astype("float32")
+    return out, stats
+
+
+def fused(nir_pre, swir_pre, nir_post, swir_post, mask, chunk_rows, in_place):
+    out, acc = fused_dnbr(nir_pre, swir_pre, nir_post, swir_post, mask,
+                          out=nir_pre if in_place else None, nodata=DELTA_NODATA, chunk_rows=chunk_rows)
+    return out, delta_nbr_stats_finish(acc)
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--size", default="7801x7901", help="HEIGHTxWIDTH of the synthetic scene")
+    ap.add_argument("--chunk-rows", type=int, default=KERNEL_CHUNK_ROWS)
+    ap.add_argument("--repeat", type=int, default=1)
+    args = ap.parse_args()
+
+    height, width = (int(v) for v in args.size.lower().split("x"))
+    bands = synthetic_bands(height, width)
+    print(f"scene {height}x{width} ({height * width * 4 / 1e6:.0f} MB per float32 band), "
+          f"chunk_rows={args.chunk_rows}")
+    print(f"{'path':22} {'seconds':>8} {'peak MB':>8}")
+
+    (ref, ref_stats), seconds, peak = min(
+        (measure(legacy_chain, *bands) for _ in range(args.repeat)), key=lambda r: r[1]
+    )
+    print(f"{'chain':22} {seconds:8.2f} {peak / 1e6:8.1f}")
+
+    ok = True
+    (out, stats), seconds, peak = min(
+        (measure(fused, *bands, args.chunk_rows, False) for _ in range(args.repeat)), key=lambda r: r[1]
+    )
+    same = np.array_equal(ref, out) and stats == ref_stats
+    ok &= same
+    print(f"{'fused (new out)':22} {seconds:8.2f} {peak / 1e6:8.1f}   identical: {same}")
+    del out
+
+    # last, it overwrites nir_pre
+    (out, stats), seconds, peak = measure(fused, *bands, args.chunk_rows, True)
+    same = np.array_equal(ref, out) and stats == ref_stats
+    ok &= same
+    print(f"{'fused (out=nir_pre)':22} {seconds:8.2f} {peak / 1e6:8.1f}   identical: {same}")
+    print("stats:", ref_stats)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+PNG export benchmark: the old matplotlib path vs dnbr_render's lookup tables.
+
+Writes a synthetic dNBR GeoTIFF (smooth field + burn patches + nodata border,
+the values line up with the thresholds on purpose), then for each exporter
+  - runs the old matplotlib version (copied below, as it was before dnbr_render)
+  - runs the current ThePython exporter
+  - checks the decoded RGBA pixels are identical
+  - reports wall time, peak traced memory and PNG size
+
+    python benchmarks/bench_png_render.py --size 7801x7901
+    python benchmarks/bench_png_render.py --size 2000x2000 --compress-level 1
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "srcPYTHON"))
+
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.transform import from_origin
+
+import dnbr_render
+from ThePython import (
+    DELTA_NBR_THRESHOLD,
+    export_burn_png_from_delta,
+    export_dnbr_class_png,
+    export_png_from_tif,
+)
+
+
+# ---- the old exporters, PNG part only ----
+
+def legacy_burn_png(tif_path, png_path, threshold=DELTA_NBR_THRESHOLD):
+    import matplotlib.pyplot as plt
+    from matplotlib import cm
+    from matplotlib.colors import Normalize
+
+    with rasterio.open(tif_path) as src:
+        data = src.read(1).astype("float32")
+        nodata = src.nodata
+    if nodata is not None:
+        data = np.where(data == nodata, np.nan, data)
+    burned = (data >= threshold) & np.isfinite(data)
+    h, w = data.shape
+    rgba = np.zeros((h, w, 4), dtype=np.float32)
+    if np.any(burned):
+        vmin = threshold
+        vmax = np.nanpercentile(data[burned], 99)
+        if vmin == vmax:
+            vmax = vmin + 0.01
+        norm = Normalize(vmin=vmin, vmax=vmax, clip=True)
+        rgba[burned] = cm.get_cmap("inferno")(norm(data[burned]))
+        rgba[burned, 3] = 1.0
+    plt.imsave(png_path, rgba)
+
+
+def legacy_classify_dnbr(delta):
+    # seven full-size masks, as classify_dnbr was before the searchsorted table
+    classes = np.zeros(delta.shape, dtype=np.uint8)
+    d = np.where(np.isfinite(delta), delta, np.nan)
+    classes[(d >= -0.500) & (d <= -0.251)] = 1
+    classes[(d >  -0.250) & (d <= -0.101)] = 2
+    classes[(d >  -0.100) & (d <=  0.099)] = 3
+    classes[(d >=  0.100) & (d <=  0.269)] = 4
+    classes[(d >=  0.270) & (d <=  0.439)] = 5
+    classes[(d >=  0.440) & (d <=  0.659)] = 6
+    classes[(d >=  0.660) & (d <=  1.300)] = 7
+    return classes
+
+
+def legacy_class_png(tif_path, png_path):
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import ListedColormap
+
+    with rasterio.open(tif_path) as src:
+        data = src.read(1).astype("float32")
+        nodata = src.nodata
+    if nodata is not None:
+        data = np.where(data == nodata, np.nan, data)
+    classes = legacy_classify_dnbr(data)
+    cmap = ListedColormap([
+        (0/255,   0/255,   0/255),
+        (122/255, 135/255, 55/255),
+        (172/255, 190/255, 77/255),
+        (0/255,   203/255, 0/255),
+        (255/255, 255/255, 0/255),
+        (245/255, 107/255, 0/255),
+        (230/255, 55/255,  0/255),
+        (122/255, 1/255,   119/255),
+    ])
+    plt.imsave(png_path, classes, cmap=cmap, vmin=0, vmax=7)
+
+
+def legacy_stretch_png(tif_path, png_path):
+    import matplotlib.pyplot as plt
+
+    with rasterio.open(tif_path) as src:
+        data = src.read(1).astype("float32")
+        nodata = src.nodata
+    if nodata is not None:
+        data = np.where(data == nodata, np.nan, data)
+    valid = np.isfinite(data)
+    vmin = np.nanpercentile(data[valid], 2)
+    vmax = np.nanpercentile(data[valid], 98)
+    if vmin == vmax:
+        vmin = np.nanmin(data[valid])
+        vmax = np.nanmax(data[valid])
+    plt.imsave(png_path, data, cmap="inferno", vmin=vmin, vmax=vmax)
+
+
+# ---- test data ----
+
+def synthetic_dnbr(height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    delta = 0.15 * np.sin(xx / 97.0) * np.cos(yy / 131.0) + rng.normal(0, 0.05, (height, width)).astype(np.float32)
+    for _ in range(12):
+        cy, cx = rng.integers(0, height), rng.integers(0, width)
+        r = rng.integers(min(height, width) // 40 + 1, min(height, width) // 8 + 2)
+        patch = (yy - cy) ** 2 + (xx - cx) ** 2 < r * r
+        delta[patch] += rng.uniform(0.2, 0.9)
+    # values sitting exactly on the class / colour edges
+    edges = np.array([-0.5, -0.251, -0.25, -0.101, -0.1, 0.099, 0.1, 0.269, 0.27, 0.439,
+                      0.44, 0.659, 0.66, 1.3, 1.31, DELTA_NBR_THRESHOLD], dtype=np.float32)
+    flat = delta.reshape(-1)
+    flat[rng.integers(0, flat.size, 20000)] = rng.choice(edges, 20000)
+    border = max(1, min(height, width) // 20)
+    delta[:border] = -9999.0
+    delta[:, -border:] = -9999.0
+    return delta.astype(np.float32)
+
+
+def write_tif(path, delta):
+    profile = {
+        "driver": "GTiff", "dtype": "float32", "count": 1, "nodata": -9999.0,
+        "height": delta.shape[0], "width": delta.shape[1],
+        "crs": "EPSG:32619", "transform": from_origin(300000, 5300000, 30, 30),
+        "tiled": True, "blockxsize": 512, "blockysize": 512,
+    }
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(delta, 1)
+
+
+def measure(fn, *args):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def decoded(path):
+    with Image.open(path) as im:
+        return np.asarray(im.convert("RGBA"))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--size", default="4000x4000", help="HEIGHTxWIDTH of the synthetic scene")
+    ap.add_argument("--compress-level", type=int, default=None)
+    ap.add_argument("--no-palette", action="store_true")
+    args = ap.parse_args()
+    warnings.filterwarnings("ignore", category=DeprecationWarning)   # cm.get_cmap in the old code
+
+    if args.compress_level is not None:
+        dnbr_render.PNG_COMPRESS_LEVEL = args.compress_level
+    if args.no_palette:
+        dnbr_render.PNG_PALETTE = False
+
+    height, width = (int(v) for v in args.size.lower().split("x"))
+    cases = [
+        ("burn", legacy_burn_png, export_burn_png_from_delta),
+        ("class", legacy_class_png, export_dnbr_class_png),
+        ("stretch", legacy_stretch_png, export_png_from_tif),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tif = os.path.join(tmp, "delta.tif")
+        write_tif(tif, synthetic_dnbr(height, width))
+        print(f"scene {height}x{width}, compress_level={dnbr_render.PNG_COMPRESS_LEVEL}, "
+              f"palette={dnbr_render.PNG_PALETTE}")
+        print(f"{'png':8} {'path':11} {'seconds':>8} {'peak MB':>8} {'size MB':>8}")
+
+        ok = True
+        for name, legacy, current in cases:
+            paths = {}
+            for label, fn in (("matplotlib", legacy), ("lut", current)):
+                png = os.path.join(tmp, f"{name}_{label}.png")
+                seconds, peak = measure(fn, tif, png)
+                paths[label] = png
+                print(f"{name:8} {label:11} {seconds:8.2f} {peak / 1e6:8.1f} {os.path.getsize(png) / 1e6:8.2f}")
+            same = np.array_equal(decoded(paths["matplotlib"]), decoded(paths["lut"]))
+            ok &= same
+            print(f"{name:8} pixel-identical: {same}")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""
+End-to-end benchmark suite, no USGS needed.
+
+Builds synthetic pre/post Landsat scenes + tar bundles (synthetic_landsat),
+serves them from a local fake M2M / download server (fake_m2m), points the
+pipeline at it and times:
+  download_cold      download_landsat_period, empty scene cache + new date window
+                     (scene-search, download-options/request, bundle stream + extract)
+  download_warm      same again, answered from the search + scene caches
+  process_landsat    full-scene dNBR on the cached bands (process_landsat_delta)
+  process_streaming  process_landsat_streaming into a GeoTIFF
+  write_delta_tif    dNBR array -> COG
+  export_burn_png / export_class_png / export_stretch_png   the PNG exporters
+  api_run_dnbr       POST /api/run_dnbr, cold caches (login, search, download, raster, PNG)
+  api_run_dnbr_batch POST /api/run_dnbr_batch over every tile, cold caches
+
+Each case runs --repeat times. Recorded per case: seconds (min / mean / p50 /
+p95 / max), throughput (megapixels/s for raster work, MB/s for downloads,
+requests/s for the endpoints) and peak memory (RSS sampled every 10 ms
+while it runs, absolute and above what the process held before the case).
+Results go to a JSON file stamped with the git commit, so two runs can be
+compared:
+
+    python benchmarks/bench_suite.py --size 2000x2000
+    python benchmarks/bench_suite.py --size 7801x7901 --repeat 5 --out before.json
+    python benchmarks/bench_suite.py --size 7801x7901 --repeat 5 --compare before.json
+
+Generated scenes are kept in --work-dir (default a temp dir) and reused when
+the same size / tiles are asked for again.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(REPO, "srcPYTHON"))
+sys.path.insert(0, REPO)
+
+PRE_DATE = "2022-09-18"
+POST_DATE = "2023-09-05"
+CASES = (
+    "download_cold", "download_warm",
+    "process_landsat", "process_streaming", "write_delta_tif",
+    "export_burn_png", "export_class_png", "export_stretch_png",
+    "api_run_dnbr", "api_run_dnbr_batch",
+)
+
+
+# ---- measuring ----
+
+class RSSSampler:
+    """Peak RSS of this process while the block runs (sampled in a thread)."""
+
+    def __init__(self, interval=0.01):
+        from instrumentation import current_rss
+        self._rss = current_rss
+        self.interval = interval
+        self.start_rss = self.peak = 0
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._rss() or 0)
+
+    def __enter__(self):
+        self.start_rss = self.peak = self._rss() or 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss() or 0)
+
+
+def percentile(values, q):
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(q * (len(s) - 1))))]
+
+
+def run_case(name, fn, repeat, work=None, unit=None, setup=None):
+    """
+    fn(i) is timed repeat times (setup(i), if given, runs first and isn't timed).
+    work: amount of work per run (megapixels / MB / requests) for the throughput, or a
+    callable returning it after each run. Returns the case dict.
+    """
+    seconds, peaks, growth, works = [], [], [], []
+    for i in range(repeat):
+        if setup is not None:
+            setup(i)
+        with RSSSampler() as rss:
+            t0 = time.perf_counter()
+            fn(i)
+            elapsed = time.perf_counter() - t0
+        seconds.append(elapsed)
+        peaks.append(rss.peak)
+        growth.append(rss.peak - rss.start_rss)
+        works.append(work() if callable(work) else work)
+        print(f"  {name} run {i + 1}/{repeat}: {elapsed:.3f}s, peak RSS +{(rss.peak - rss.start_rss) / 1e6:.0f} MB")
+
+    case = {
+        "runs": repeat,
+        "seconds": [round(s, 4) for s in seconds],
+        "min_seconds": round(min(seconds), 4),
+        "mean_seconds": round(sum(seconds) / len(seconds), 4),
+        "p50_seconds": round(percentile(seconds, 0.5), 4),
+        "p95_seconds": round(percentile(seconds, 0.95), 4),
+        "max_seconds": round(max(seconds), 4),
+        "peak_rss_mb": round(max(peaks) / 1e6, 1),
+        "peak_rss_growth_mb": round(max(growth) / 1e6, 1),
+    }
+    if unit and works[0]:
+        per_run = sum(works) / len(works)
+        case["work_per_run"] = round(per_run, 3)
+        case["throughput"] = round(per_run / case["p50_seconds"], 3) if case["p50_seconds"] else None
+        case["throughput_unit"] = unit
+    return case
+
+
+# ---- environment ----
+
+def git_info():
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], cwd=REPO, capture_output=True, text=True,
+                                  timeout=30).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "branch": git("rev-parse", "--abbrev-ref", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "subject": git("log", "-1", "--format=%s"),
+    }
+
+
+def machine_info():
+    import numpy
+    import rasterio
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "rasterio": rasterio.__version__,
+        "gdal": rasterio.__gdal_version__,
+    }
+
+
+def build_scenes(work_dir, size, tiles):
+    """Synthetic fires for every tile, reused from work_dir/scenes.json when it matches."""
+    from synthetic_landsat import make_fire
+
+    manifest = os.path.join(work_dir, "scenes.json")
+    key = {"size": list(size), "tiles": [list(t) for t in tiles], "pre": PRE_DATE, "post": POST_DATE}
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            saved = json.load(f)
+        if saved.get("key") == key and all(os.path.exists(s["bundle"]) for s in saved["scenes"]):
+            print(f"Reusing synthetic scenes in {work_dir}")
+            return saved["scenes"]
+
+    scenes = []
+    for i, (path, row) in enumerate(tiles):
+        t0 = time.perf_counter()
+        scenes += make_fire(os.path.join(work_dir, "synthetic"), path, row, PRE_DATE, POST_DATE,
+                            size=size, seed=10 * i)
+        print(f"Built synthetic scenes for {path:03d}/{row:03d} in {time.perf_counter() - t0:.1f}s")
+    with open(manifest, "w") as f:
+        json.dump({"key": key, "scenes": scenes}, f, indent=2, default=str)
+    return scenes
+
+
+def window_for(i):
+    """Date window for run i: always contains the synthetic dates, but new each run (search cache miss, no job dedupe)."""
+    pre, post = date.fromisoformat(PRE_DATE), date.fromisoformat(POST_DATE)
+    return {
+        "pre_start": (pre - timedelta(days=30 + i)).isoformat(), "pre_end": (pre + timedelta(days=20)).isoformat(),
+        "post_start": (post - timedelta(days=30 + i)).isoformat(), "post_end": (post + timedelta(days=20)).isoformat(),
+    }
+
+
+# ---- comparing ----
+
+def compare(base, new):
+    print()
+    print(f"{'case':20} {'base p50':>9} {'new p50':>9} {'ratio':>7}   {'base MB':>8} {'new MB':>8}")
+    for name, c in new["cases"].items():
+        b = base.get("cases", {}).get(name)
+        if not b:
+            print(f"{name:20} {'-':>9} {c['p50_seconds']:9.3f}")
+            continue
+        ratio = c["p50_seconds"] / b["p50_seconds"] if b["p50_seconds"] else float("nan")
+        print(f"{name:20} {b['p50_seconds']:9.3f} {c['p50_seconds']:9.3f} {ratio:7.2f}x  "
+              f"{b['peak_rss_growth_mb']:8.0f} {c['peak_rss_growth_mb']:8.0f}")
+    print(f"(base: {base.get('git', {}).get('commit', '?')[:10]}, new: {new['git']['commit'][:10]})")
+
+
+# ---- the suite ----
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--size", default="2000x2000", help="HEIGHTxWIDTH of each scene (7801x7901 is a real one)")
+    ap.add_argument("--tiles", default="10/26", help="comma separated path/row list, e.g. 10/26,10/27")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--cases", default=",".join(CASES), help="comma separated subset of: " + ", ".join(CASES))
+    ap.add_argument("--work-dir", default=None, help="where scenes / caches / outputs go (default a temp dir)")
+    ap.add_argument("--latency", type=float, default=0.0, help="seconds added to every fake M2M call")
+    ap.add_argument("--bandwidth-mbps", type=float, default=0.0, help="cap bundle downloads (0 = unlimited)")
+    ap.add_argument("--out", default=None, help="results JSON (default benchmarks/results/<commit>_<time>.json)")
+    ap.add_argument("--compare", default=None, help="earlier results JSON to compare against")
+    args = ap.parse_args()
+    # the pipeline runs from inside the work dir, so pin these down first
+    out_path = os.path.abspath(args.out) if args.out else None
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    size = tuple(int(v) for v in args.size.lower().split("x"))
+    tiles = [tuple(int(v) for v in t.split("/")) for t in args.tiles.split(",") if t.strip()]
+    cases = [c.strip() for c in args.cases.split(",") if c.strip()]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        ap.error(f"unknown case(s): {', '.join(sorted(unknown))}")
+
+    work_dir = os.path.abspath(args.work_dir or tempfile.mkdtemp(prefix="dnbr_bench_"))
+    os.makedirs(work_dir, exist_ok=True)
+    scenes = build_scenes(work_dir, size, tiles)
+
+    from fake_m2m import FakeM2MServer
+    server = FakeM2MServer(scenes, latency=args.latency, bandwidth_mbps=args.bandwidth_mbps).start()
+    print(f"Fake M2M at {server.service_url}")
+
+    # everything the pipeline reads at import time: fake M2M, caches + outputs inside work_dir
+    run_dir = os.path.join(work_dir, "run")
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(os.path.join(run_dir, "data", "outputs"))
+    os.makedirs(os.path.join(run_dir, "data", "dataAPI", "extracted"))
+    os.environ.update({
+        "M2M_SERVICE_URL": server.service_url,
+        "M2M_RATE_LIMIT": "0",
+        "M2M_KEY_FILE": os.path.join(run_dir, "data", "m2m_key.json"),
+        "DNBR_SCENE_CACHE_DIR": os.path.join(run_dir, "data", "scene_cache"),
+        "DNBR_SEARCH_CACHE_DB": os.path.join(run_dir, "data", "scene_search.sqlite"),
+        "DNBR_TILE_CACHE_DIR": os.path.join(run_dir, "data", "tile_cache"),
+        "USGS_USERNAME": "bench",
+        "USGS_TOKEN": "bench-token",
+    })
+    os.chdir(run_dir)
+
+    import ThePython as T
+    from scene_cache import get_scene_cache
+    from m2m_client import get_default_client
+
+    h, w = size
+    megapixels = h * w / 1e6
+    results = {}
+
+    def wipe_scene_cache(_=None):
+        cache = get_scene_cache()
+        max_bytes, pin = cache.max_bytes, cache.pin_seconds
+        cache.max_bytes, cache.pin_seconds = 0, 0
+        try:
+            cache.evict()
+        finally:
+            cache.max_bytes, cache.pin_seconds = max_bytes, pin
+
+    def bundle_mb():
+        return server.bytes_sent / 1e6
+
+    def reset_server(_=None):
+        wipe_scene_cache()
+        server.reset_counts()
+
+    client = get_default_client()
+    client.login("bench", "bench-token")
+    path, row = tiles[0]
+    bands = {}
+
+    try:
+        # ---- downloads ----
+        # the raster cases work on the bands this fetches, so it runs (once) even when not asked for
+        cold_runs = args.repeat if "download_cold" in cases else 1
+        if set(cases) - {"api_run_dnbr", "api_run_dnbr_batch"}:
+            def cold(i):
+                win = window_for(i)
+                bands["pre"] = T.download_landsat_period(client, win["pre_start"], win["pre_end"], path, row)
+                bands["post"] = T.download_landsat_period(client, win["post_start"], win["post_end"], path, row)
+            case = run_case("download_cold", cold, cold_runs, work=bundle_mb, unit="MB/s", setup=reset_server)
+            case["m2m_calls"] = dict(server.counts)
+            if "download_cold" in cases:
+                results["download_cold"] = case
+
+        if "download_warm" in cases:
+            def warm(i):
+                win = window_for(cold_runs - 1)
+                T.download_landsat_period(client, win["pre_start"], win["pre_end"], path, row)
+                T.download_landsat_period(client, win["post_start"], win["post_end"], path, row)
+            results["download_warm"] = run_case("download_warm", warm, args.repeat)
+
+        pre, post = bands.get("pre"), bands.get("post")
+        band_args = (pre["nir"], pre["swir"], post["nir"], post["swir"], pre["qa"], post["qa"]) if pre else None
+        out_dir = os.path.join(run_dir, "data", "outputs")
+        tif = os.path.join(out_dir, "bench_delta_nbr.tif")
+
+        # ---- raster ----
+        if "process_landsat" in cases:
+            results["process_landsat"] = run_case(
+                "process_landsat", lambda i: T.process_landsat_delta(*band_args, nodata=T.DELTA_NODATA),
+                args.repeat, work=megapixels, unit="MP/s")
+
+        if "process_streaming" in cases:
+            results["process_streaming"] = run_case(
+                "process_streaming",
+                lambda i: T.process_landsat_streaming(*band_args, os.path.join(out_dir, "bench_stream.tif")),
+                args.repeat, work=megapixels, unit="MP/s")
+
+        needs_tif = {"write_delta_tif", "export_burn_png", "export_class_png", "export_stretch_png"} & set(cases)
+        if needs_tif:
+            delta, profile, _ = T.process_landsat_delta(*band_args, nodata=T.DELTA_NODATA)
+
+            def write(i):
+                T.write_delta_tif(tif, delta, profile, nodata_encoded=True)
+            results["write_delta_tif"] = run_case("write_delta_tif", write,
+                                                  args.repeat if "write_delta_tif" in cases else 1,
+                                                  work=megapixels, unit="MP/s")
+            if "write_delta_tif" not in cases:
+                del results["write_delta_tif"]
+            del delta
+
+        exporters = {
+            "export_burn_png": lambda i: T.export_burn_png_from_delta(
+                tif, os.path.join(out_dir, "bench_burn.png"), threshold=T.BURN_VIS_THRESHOLD),
+            "export_class_png": lambda i: T.export_dnbr_class_png(tif, os.path.join(out_dir, "bench_class.png")),
+            "export_stretch_png": lambda i: T.export_png_from_tif(tif, os.path.join(out_dir, "bench_stretch.png")),
+        }
+        for name, fn in exporters.items():
+            if name in cases:
+                results[name] = run_case(name, fn, args.repeat, work=megapixels, unit="MP/s")
+
+        # ---- Flask endpoints, end to end ----
+        if "api_run_dnbr" in cases or "api_run_dnbr_batch" in cases:
+            import api_server
+            app = api_server.app.test_client()
+
+            if "api_run_dnbr" in cases:
+                def run_one(i):
+                    body = dict(window_for(100 + i), path=path, row=row)
+                    r = app.post("/api/run_dnbr", json=body)
+                    if r.status_code != 200:
+                        raise RuntimeError(f"/api/run_dnbr: HTTP {r.status_code} {r.get_data(as_text=True)[:300]}")
+                results["api_run_dnbr"] = run_case("api_run_dnbr", run_one, args.repeat,
+                                                   work=1, unit="req/s", setup=reset_server)
+                results["api_run_dnbr"]["m2m_calls"] = dict(server.counts)
+
+            if "api_run_dnbr_batch" in cases:
+                def run_batch(i):
+                    win = window_for(200 + i)
+                    body = {"requests": [dict(win, path=p, row=r) for p, r in tiles]}
+                    r = app.post("/api/run_dnbr_batch", json=body)
+                    data = r.get_json() or {}
+                    if r.status_code != 200 or data.get("errors"):
+                        raise RuntimeError(f"/api/run_dnbr_batch: HTTP {r.status_code} {data.get('errors')}")
+                results["api_run_dnbr_batch"] = run_case("api_run_dnbr_batch", run_batch, args.repeat,
+                                                         work=len(tiles), unit="tiles/s", setup=reset_server)
+                results["api_run_dnbr_batch"]["m2m_calls"] = dict(server.counts)
+            api_server.jobs.shutdown()
+    finally:
+        server.stop()
+
+    out = {
+        "git": git_info(),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": machine_info(),
+        "params": {
+            "size": list(size), "tiles": [list(t) for t in tiles], "repeat": args.repeat,
+            "latency": args.latency, "bandwidth_mbps": args.bandwidth_mbps,
+            "env": {k: v for k, v in os.environ.items() if k.startswith("DNBR_") and "CACHE" not in k},
+        },
+        "cases": {name: results[name] for name in CASES if name in results},
+    }
+
+    if out_path is None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        out_path = os.path.join(HERE, "results", f"{out['git']['commit'][:10] or 'nogit'}_{stamp}.json")
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w") as f:
+        json.dump(out, f, indent=2)
+
+    print()
+    print(f"{'case':20} {'p50 s':>8} {'p95 s':>8} {'throughput':>16} {'peak +MB':>9}")
+    for name, c in out["cases"].items():
+        tp = f"{c['throughput']:.2f} {c['throughput_unit']}" if c.get("throughput") else "-"
+        print(f"{name:20} {c['p50_seconds']:8.3f} {c['p95_seconds']:8.3f} {tp:>16} {c['peak_rss_growth_mb']:9.0f}")
+    print(f"Results written to {out_path}")
+
+    if compare_path:
+        with open(compare_path) as f:
+            compare(json.load(f), out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Runs the failure paths the benchmark suite never hits, against the fake M2M
+server (fake_m2m) with its fault knobs turned on:
+  key_refresh_on_auth    keys die after a few calls (key_max_calls): M2M answers
+                         AUTH_INVALID, the client refreshes the key through
+                         M2MCredentialManager and the call goes through
+  key_refresh_on_expiry  keys only live key_ttl seconds: the manager logs in again
+                         before it would use a stale key, and a second manager on the
+                         same key file (another gunicorn worker) picks that key up
+                         instead of logging in itself
+  stream_resume          the bundle stream is cut mid-member (drop_after_bytes):
+                         ResumableHTTPReader reconnects with a Range header and the
+                         stream-extracted bands come out byte for byte
+  download_resume        same cut on the download-then-extract path, with no retries
+                         left: the .part file and its .part.json journal stay behind,
+                         and the next download_file call picks up from the journal
+                         (Range request) instead of starting again
+  tiles_strict_json      a site deploy with no OUTPUT_DIR/batch_tiles: /api/tiles serves
+                         the shipped assets/batch_tiles/manifest.json, and the body has
+                         to be strict JSON (no NaN) or the map's r.json() throws
+
+    python benchmarks/check_failure_paths.py
+    python benchmarks/check_failure_paths.py --checks key_refresh_on_auth
+
+Prints ok / FAIL per check and exits non-zero if any failed.
+"""
+import argparse
+import filecmp
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(REPO, "srcPYTHON"))
+os.environ.setdefault("DNBR_DOWNLOAD_BACKOFF", "0.1")   # read at import, keep the retries quick
+
+from fake_m2m import FakeM2MServer
+from m2m_client import M2MClient
+from m2m_credentials import M2MCredentialManager
+from resumable_download import download_file
+from synthetic_landsat import make_scene, make_bundle
+
+GRID2LL = {"gridType": "WRS2", "responseShape": "polygon", "path": 10, "row": 26}
+
+
+def _manager(server, work_dir, **kw):
+    client = M2MClient(service_url=server.service_url, rate_limit=0, max_retries=0)
+    return M2MCredentialManager("check", "check-token", client=client,
+                                key_file=os.path.join(work_dir, "m2m_key.json"), **kw)
+
+
+def check_key_refresh_on_auth(work_dir):
+    server = FakeM2MServer([], key_max_calls=3).start()
+    try:
+        mgr = _manager(server, work_dir, ttl=3600)
+        client = mgr.client()
+        for _ in range(10):
+            client.call("grid2ll", GRID2LL)
+        counts = dict(server.counts)
+        mgr.shutdown()
+    finally:
+        server.stop()
+
+    print(f"  M2M calls: {counts}")
+    assert counts.get("grid2ll") == 10 + counts.get("auth_rejected", 0), "every rejected call should be retried once"
+    assert counts.get("auth_rejected", 0) >= 3, "keys never went stale, the refresh path didn't run"
+    assert counts.get("login-token") == 1 + counts["auth_rejected"], "expected one login per rejected key"
+
+
+def check_key_refresh_on_expiry(work_dir):
+    server = FakeM2MServer([], key_ttl=1.0).start()
+    try:
+        mgr = _manager(server, work_dir, ttl=1.0, refresh_margin=0.2)
+        client = mgr.client()
+        client.call("grid2ll", GRID2LL)
+        first_key = mgr.api_key()
+        time.sleep(1.0)
+        client.call("grid2ll", GRID2LL)
+        second_key = mgr.api_key()
+
+        # another worker's manager: same key file, should reuse the refreshed key
+        other = _manager(server, work_dir, ttl=1.0, refresh_margin=0.2)
+        other_key = other.api_key()
+        counts = dict(server.counts)
+        other._key = None   # both live in this one process, so only mgr logs out
+        mgr.shutdown()
+    finally:
+        server.stop()
+
+    print(f"  M2M calls: {counts}")
+    assert second_key != first_key, "the key was not renewed after its ttl"
+    assert counts.get("auth_rejected", 0) == 0, "the manager used a stale key instead of renewing it first"
+    assert counts.get("login-token") == 2, "expected exactly one login for the renewal"
+    assert other_key == second_key, "the second manager didn't pick up the shared key"
+
+
+def _bundle_scene(work_dir):
+    scene = make_scene(os.path.join(work_dir, "scene"), 10, 26, "2022-09-18", size=(512, 512))
+    scene["bundle"] = make_bundle(scene, os.path.join(work_dir, "scene"))
+    return scene
+
+
+def check_stream_resume(work_dir):
+    from ThePython import stream_extract_bands_from_url
+
+    scene = _bundle_scene(work_dir)
+    total = os.path.getsize(scene["bundle"])
+    server = FakeM2MServer([scene], drop_after_bytes=total // 3).start()
+    try:
+        bands = stream_extract_bands_from_url(server._bundle_url(scene), dest_dir=os.path.join(work_dir, "out"))
+        counts = dict(server.counts)
+    finally:
+        server.stop()
+
+    print(f"  bundle {total} bytes, requests: {counts}")
+    assert counts.get("bundle_dropped") == 1, "the stream was never cut"
+    assert counts.get("bundle_range") == 1, "the reader didn't resume with a Range request"
+    for band in ("nir", "swir", "qa"):
+        assert filecmp.cmp(bands[band], scene["bands"][band], shallow=False), f"{band} came out different"
+
+
+def check_download_resume(work_dir):
+    scene = _bundle_scene(work_dir)
+    total = os.path.getsize(scene["bundle"])
+    out_path = os.path.join(work_dir, "bundle.tar")
+    # past the first DOWNLOAD_CHUNK_SIZE (1 MB) read, a cut inside it leaves nothing to journal
+    server = FakeM2MServer([scene], drop_after_bytes=total * 3 // 4).start()
+    try:
+        url = server._bundle_url(scene)
+        try:
+            download_file(url, out_path, retries=0)
+        except RuntimeError as e:
+            print(f"  first try failed as planned: {e}")
+        else:
+            raise AssertionError("the first download should have been cut off")
+
+        assert not os.path.exists(out_path), "a truncated bundle ended up at out_path"
+        with open(out_path + ".part.json") as f:
+            journal = json.load(f)
+        done = sum(seg[2] for seg in journal["segments"])
+        assert 0 < done < total, f"journal says {done} of {total} bytes, expected part of it"
+
+        download_file(url, out_path)
+        counts = dict(server.counts)
+    finally:
+        server.stop()
+
+    print(f"  bundle {total} bytes, {done} journaled before the cut, requests: {counts}")
+    assert counts.get("bundle_range", 0) >= 2, "expected ranged GETs for the first try and the resume"
+    assert server.bytes_sent < 2 * total, "the resume re-downloaded bytes it already had"
+    assert not os.path.exists(out_path + ".part.json"), "the journal wasn't cleaned up"
+    assert filecmp.cmp(out_path, scene["bundle"], shallow=False), "resumed bundle differs from the original"
+
+
+def _no_constants(name):
+    raise ValueError(f"{name} is not valid JSON")
+
+
+def check_tiles_strict_json(work_dir):
+    # a copy of the shipped index, so nothing in assets/ gets rewritten
+    index_path = os.path.join(work_dir, "manifest.json")
+    shutil.copyfile(os.path.join(REPO, "assets", "batch_tiles", "manifest.json"), index_path)
+    os.environ["DNBR_MANIFEST_PATH"] = index_path
+    os.environ["DNBR_MANIFEST_SRC_DIR"] = os.path.join(work_dir, "no_batch_tiles")
+    sys.path.insert(0, REPO)
+    import api_server
+    import tile_manifest
+    assert tile_manifest.MANIFEST_PATH == index_path, "tile_manifest was imported before the env was set"
+
+    resp = api_server.app.test_client().get("/api/tiles")
+    assert resp.status_code == 200, f"/api/tiles: HTTP {resp.status_code}"
+    body = json.loads(resp.get_data(as_text=True), parse_constant=_no_constants)
+    print(f"  {len(body['tiles'])} tiles, strict JSON")
+    assert body["tiles"], "the shipped index came back empty"
+
+
+CHECKS = {
+    "key_refresh_on_auth": check_key_refresh_on_auth,
+    "key_refresh_on_expiry": check_key_refresh_on_expiry,
+    "stream_resume": check_stream_resume,
+    "download_resume": check_download_resume,
+    "tiles_strict_json": check_tiles_strict_json,
+}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--checks", default=",".join(CHECKS), help="comma separated subset of: " + ", ".join(CHECKS))
+    args = ap.parse_args()
+    names = [c.strip() for c in args.checks.split(",") if c.strip()]
+    unknown = set(names) - set(CHECKS)
+    if unknown:
+        ap.error(f"unknown check(s): {', '.join(sorted(unknown))}")
+
+    failed = []
+    for name in names:
+        work_dir = tempfile.mkdtemp(prefix=f"dnbr_check_{name}_")
+        print(f"{name}:")
+        try:
+            CHECKS[name](work_dir)
+            print(f"{name}: ok")
+        except Exception:
+            traceback.print_exc()
+            print(f"{name}: FAIL")
+            failed.append(name)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if failed:
+        print(f"{len(failed)} of {len(names)} check(s) failed: {', '.join(failed)}")
+        sys.exit(1)
+    print(f"all {len(names)} check(s) passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Checks the WRS-2 index (srcPYTHON/wrs2_index.py) against scene extents we
+already ship:
+  manifest   assets/batch_tiles/manifest.json, the 2022-2023 batch tiles
+  presets    the PRESET_GROUPS tiles in js/map.js (2017-2018 test)
+
+For every tile the centre of its lat/lon bounds is compared with
+WRS2Index.center(path, row) of the path/row in its id. A tile only counts if
+its bounds are actually that path/row's: the index centre closest to the bounds
+centre has to be the labelled one. Tiles that fail that are listed as excluded,
+with the path/row their bounds really belong to, and don't go into the error
+figures. (Some of the batch tiles are labelled one row off or share bounds with
+a neighbour, e.g. P017R016/R017 and P017R027/R028, so their bounds say nothing
+about the index.)
+Expect P017R015-R023, R028 and R029 of the manifest to be excluded.
+
+assets/tile_bounds.json holds the same batch scenes in UTM metres with no zone,
+so it isn't checked separately.
+
+    python benchmarks/check_wrs2_index.py
+    python benchmarks/check_wrs2_index.py --tol-lat 0.05 --tol-lon 0.2
+
+Prints one line per tile and exits non-zero if a matched tile is off by more
+than the tolerance, or if fewer than half the tiles match their label at all.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(REPO, "srcPYTHON"))
+
+import numpy as np
+
+from wrs2_index import get_wrs2_index
+
+MANIFEST_PATH = os.path.join(REPO, "assets", "batch_tiles", "manifest.json")
+MAP_JS_PATH = os.path.join(REPO, "js", "map.js")
+
+PATH_ROW_RE = re.compile(r"P(\d{3})R(\d{3})")
+# { id: "...", label: ..., url: ..., bounds: [[lat, lon], [lat, lon]] } inside PRESET_GROUPS
+PRESET_RE = re.compile(r'id:\s*"([^"]+)".*?bounds:\s*\[\s*\[\s*([-\d.]+)\s*,\s*([-\d.]+)\s*\]\s*,'
+                       r'\s*\[\s*([-\d.]+)\s*,\s*([-\d.]+)\s*\]\s*\]', re.S)
+
+
+def manifest_tiles():
+    with open(MANIFEST_PATH) as f:
+        index = json.load(f)
+    return [("manifest", e["tile"]["id"], e["tile"]["bounds"]) for e in index["files"].values()]
+
+
+def preset_tiles():
+    with open(MAP_JS_PATH) as f:
+        js = f.read()
+    start = js.index("PRESET_GROUPS")
+    end = js.index("];", start)
+    out = []
+    for tile_id, lat0, lon0, lat1, lon1 in PRESET_RE.findall(js[start:end]):
+        out.append(("presets", tile_id, [[float(lat0), float(lon0)], [float(lat1), float(lon1)]]))
+    return out
+
+
+def nearest_path_row(idx, lon, lat):
+    # equirectangular distance is plenty to tell neighbouring scenes apart
+    dlon = (idx.center_lon - lon + 180.0) % 360.0 - 180.0
+    d = (dlon * math.cos(math.radians(lat))) ** 2 + (idx.center_lat - lat) ** 2
+    return idx._path_row(int(np.argmin(d)))
+
+
+def check(tiles, tol_lat, tol_lon):
+    idx = get_wrs2_index()
+    idx._load()
+
+    shared = {}
+    for source, tile_id, bounds in tiles:
+        shared.setdefault((source, json.dumps(bounds)), []).append(tile_id)
+
+    matched, excluded, failed = [], [], []
+    for source, tile_id, bounds in tiles:
+        m = PATH_ROW_RE.search(tile_id)
+        if not m:
+            excluded.append(f"{source} {tile_id}: no path/row in the id")
+            continue
+        path, row = int(m.group(1)), int(m.group(2))
+        (lat0, lon0), (lat1, lon1) = bounds
+        lat, lon = (lat0 + lat1) / 2, (lon0 + lon1) / 2
+        clon, clat = idx.center(path, row)
+        dlat, dlon = lat - clat, lon - clon
+        label = f"P{path:03d}R{row:03d}"
+
+        near = nearest_path_row(idx, lon, lat)
+        if near != (path, row):
+            why = f"bounds are P{near[0]:03d}R{near[1]:03d}'s"
+            twins = [PATH_ROW_RE.search(t).group(0) for t in shared[(source, json.dumps(bounds))] if t != tile_id]
+            if twins:
+                why += ", same bounds as " + ", ".join(twins)
+            print(f"  {source:8s} {label}  excluded: {why} (off by {dlat:+.2f} lat / {dlon:+.2f} lon)")
+            excluded.append(f"{source} {label}")
+            continue
+
+        ok = abs(dlat) <= tol_lat and abs(dlon) <= tol_lon
+        print(f"  {source:8s} {label}  {dlat:+.3f} lat / {dlon:+.3f} lon{'' if ok else '  FAIL'}")
+        matched.append((dlat, dlon))
+        if not ok:
+            failed.append(f"{source} {label}")
+
+    return matched, excluded, failed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--tol-lat", type=float, default=0.03, help="max centre error in deg latitude (default 0.03)")
+    ap.add_argument("--tol-lon", type=float, default=0.15, help="max centre error in deg longitude (default 0.15)")
+    args = ap.parse_args()
+
+    tiles = manifest_tiles() + preset_tiles()
+    matched, excluded, failed = check(tiles, args.tol_lat, args.tol_lon)
+
+    if matched:
+        max_lat = max(abs(d[0]) for d in matched)
+        max_lon = max(abs(d[1]) for d in matched)
+        print(f"{len(matched)} of {len(tiles)} tiles checked, max error {max_lat:.3f} deg lat / {max_lon:.3f} deg lon")
+    if excluded:
+        print(f"{len(excluded)} excluded (bounds don't belong to their label): {', '.join(excluded)}")
+    if failed:
+        print(f"{len(failed)} off by more than {args.tol_lat} lat / {args.tol_lon} lon: {', '.join(failed)}")
+        sys.exit(1)
+    if len(matched) * 2 < len(tiles):
+        print("fewer than half the tiles match their own path/row, the index itself is probably off")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""
+Local stand-in for the USGS M2M JSON API + the bundle download host.
+
+Answers the endpoints the pipeline calls, from a list of synthetic scenes
+(synthetic_landsat.make_fire):
+  login-token, logout, grid2ll, scene-search (mbr filter, dates, cloud, paging),
+  download-options, download-request, download-retrieve
+and serves the scene bundles at /bundles/<displayId>.tar with HEAD, Range
+(206) and an ETag, so both the resumable downloader and the streaming tar
+extraction go through their normal code paths.
+
+Optional realism knobs: a fixed delay per M2M call (latency=) and a bandwidth
+cap for bundle downloads (bandwidth_mbps=). Every request is counted in
+server.counts, by endpoint.
+
+Every login-token hands out a new key, and logout revokes it. By default keys
+never expire. key_ttl= (seconds) and/or key_max_calls= make them go stale like
+real M2M keys do, so calls with an old key get AUTH_INVALID (counted as
+"auth_rejected") and the credential manager's refresh paths actually run.
+
+drop_after_bytes= cuts bundle GETs off: after that many body bytes the socket
+is shut, mid-response (counted as "bundle_dropped"), at most drops_per_bundle
+times per bundle, so resumable_download's Range resume and .part journal get
+used. GETs that carry a Range header are counted as "bundle_range".
+
+    server = FakeM2MServer(scenes, latency=0.2)
+    server.start()
+    os.environ["M2M_SERVICE_URL"] = server.service_url   # before importing ThePython
+    ...
+    server.stop()
+"""
+import json
+import os
+import re
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "srcPYTHON"))
+
+from wrs2_index import get_wrs2_index
+
+API_KEY = "fake-m2m-api-key"
+PRODUCT_NAME = "Landsat Collection 2 Level-2 Surface Reflectance Bundle"
+CHUNK = 256 * 1024
+
+
+def _scene_result(scene):
+    # the shape of one scene-search result (list-style metadata, like the real API)
+    return {
+        "entityId": scene["entityId"],
+        "displayId": scene["displayId"],
+        "temporalCoverage": {
+            "startDate": f"{scene['acquired']} 00:00:00",
+            "endDate": f"{scene['acquired']} 00:00:00",
+        },
+        "metadata": [
+            {"fieldName": "Landsat Product Identifier L2", "value": scene["displayId"]},
+            {"fieldName": "Date Acquired", "value": scene["acquired"]},
+            {"fieldName": "WRS Path", "value": f" {scene['path']:03d}"},
+            {"fieldName": "WRS Row", "value": f" {scene['row']:03d}"},
+            {"fieldName": "Scene Cloud Cover L1", "value": f"{scene['cloud']:.2f}"},
+        ],
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            pass   # client hung up between keep-alive requests (the stream extractor does)
+
+    @property
+    def fake(self):
+        return self.server.fake
+
+    # ---- M2M ----
+
+    def do_POST(self):
+        m = re.match(r"^/api/json/stable/([a-z0-9-]+)$", self.path)
+        if not m:
+            return self._send_json({"errorCode": "NOT_FOUND", "errorMessage": self.path}, 404)
+        endpoint = m.group(1)
+        self.fake._count(endpoint)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            payload = None
+
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+
+        if endpoint != "login-token":
+            key = self.headers.get("X-Auth-Token")
+            problem = self.fake._check_key(key)
+            if problem:
+                self.fake._count("auth_rejected")
+                return self._send_json({"errorCode": "AUTH_INVALID", "errorMessage": problem, "data": None})
+            if endpoint == "logout":
+                self.fake._revoke_key(key)
+
+        handler = getattr(self.fake, "m2m_" + endpoint.replace("-", "_"), None)
+        if handler is None:
+            return self._send_json({"errorCode": "UNKNOWN_ENDPOINT", "errorMessage": endpoint, "data": None})
+        self._send_json({"errorCode": None, "errorMessage": None, "data": handler(payload or {})})
+
+    def _send_json(self, obj, status=200):
+        data = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # ---- bundles ----
+
+    def do_HEAD(self):
+        self._bundle(head=True)
+
+    def do_GET(self):
+        self._bundle(head=False)
+
+    def _bundle(self, head):
+        m = re.match(r"^/bundles/([A-Za-z0-9_]+)\.tar(\?.*)?$", self.path)
+        scene = self.fake.by_display.get(m.group(1)) if m else None
+        if scene is None:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.fake._count("bundle_head" if head else "bundle_get")
+        if not head and self.headers.get("Range"):
+            self.fake._count("bundle_range")
+
+        path = scene["bundle"]
+        total = os.path.getsize(path)
+        etag = f'"{scene["displayId"]}-{total}"'
+        start, end = 0, total
+        status = 200
+        rng = self.headers.get("Range")
+        if rng:
+            rm = re.match(r"bytes=(\d+)-(\d*)$", rng)
+            if_range = self.headers.get("If-Range")
+            if rm and (not if_range or if_range == etag):
+                start = int(rm.group(1))
+                end = int(rm.group(2)) + 1 if rm.group(2) else total
+                end = min(end, total)
+                if start >= total:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{total}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-tar")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(end - start))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{total}")
+        self.end_headers()
+        if head:
+            return
+
+        per_chunk = CHUNK / (self.fake.bandwidth_mbps * 1e6 / 8) if self.fake.bandwidth_mbps else 0
+        drop_at = self.fake._drop_point(scene["displayId"], end - start)
+        try:
+            with open(path, "rb") as f:
+                f.seek(start)
+                left = end - start
+                while left > 0:
+                    if drop_at is not None and end - start - left >= drop_at:
+                        # hang up mid-body, the client sees a short read / reset
+                        self.fake._count("bundle_dropped")
+                        self.wfile.flush()
+                        self.connection.shutdown(socket.SHUT_RDWR)
+                        self.close_connection = True
+                        return
+                    n = min(CHUNK, left)
+                    if drop_at is not None:
+                        n = min(n, drop_at - (end - start - left))
+                    data = f.read(n)
+                    if not data:
+                        break
+                    self.wfile.write(data)
+                    left -= len(data)
+                    self.fake._sent(len(data))
+                    if per_chunk:
+                        time.sleep(per_chunk * len(data) / CHUNK)
+        except (BrokenPipeError, ConnectionResetError):
+            pass   # the streaming extractor hangs up once it has its three bands
+
+
+class FakeM2MServer:
+    def __init__(self, scenes, host="127.0.0.1", port=0, latency=0.0, bandwidth_mbps=0.0,
+                 key_ttl=0.0, key_max_calls=0, drop_after_bytes=0, drops_per_bundle=1):
+        self.scenes = list(scenes)
+        self.by_display = {s["displayId"]: s for s in self.scenes}
+        self.by_entity = {s["entityId"]: s for s in self.scenes}
+        self.latency = latency
+        self.bandwidth_mbps = bandwidth_mbps
+        self.key_ttl = key_ttl
+        self.key_max_calls = key_max_calls
+        self._keys = {}   # api key -> [issued at, calls made with it]
+        self.drop_after_bytes = drop_after_bytes
+        self.drops_per_bundle = drops_per_bundle
+        self._drops = {}  # displayId -> drops so far
+        self.counts = {}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._labels = {}
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def service_url(self):
+        return self.base_url + "/api/json/stable/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts = {}
+            self.bytes_sent = 0
+            self._drops = {}
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def _sent(self, n):
+        with self._lock:
+            self.bytes_sent += n
+
+    def _check_key(self, key):
+        # None if key is good for one more call, else why not
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None:
+                return "bad key"
+            if self.key_ttl and time.time() - entry[0] > self.key_ttl:
+                return "key expired"
+            if self.key_max_calls and entry[1] >= self.key_max_calls:
+                return "key expired"
+            entry[1] += 1
+            return None
+
+    def _drop_point(self, display_id, length):
+        # body offset to hang up at for this response, or None to send it all
+        if not self.drop_after_bytes or length <= self.drop_after_bytes:
+            return None
+        with self._lock:
+            if self._drops.get(display_id, 0) >= self.drops_per_bundle:
+                return None
+            self._drops[display_id] = self._drops.get(display_id, 0) + 1
+        return self.drop_after_bytes
+
+    def _revoke_key(self, key):
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def _bundle_url(self, scene):
+        return f"{self.base_url}/bundles/{scene['displayId']}.tar?token=fake"
+
+    # ---- endpoints (payload dict in, "data" out) ----
+
+    def m2m_login_token(self, payload):
+        with self._lock:
+            key = f"{API_KEY}-{len(self._keys) + 1}"
+            self._keys[key] = [time.time(), 0]
+        return key
+
+    def m2m_logout(self, payload):
+        return None   # the handler revokes the key
+
+    def m2m_grid2ll(self, payload):
+        ring = get_wrs2_index().polygon(int(payload["path"]), int(payload["row"]))
+        return {"shape": "polygon", "coordinates": [{"latitude": la, "longitude": lo} for lo, la in ring]}
+
+    def m2m_scene_search(self, payload):
+        f = payload.get("sceneFilter") or {}
+        sf = f.get("spatialFilter") or {}
+        af = f.get("acquisitionFilter") or {}
+        cf = f.get("cloudCoverFilter")
+        hits = []
+        for s in self.scenes:
+            if af and not (af.get("start", "0000") <= s["acquired"] <= af.get("end", "9999")):
+                continue
+            if cf and not (cf.get("min", 0) <= s["cloud"] <= cf.get("max", 100)):
+                continue
+            if sf.get("filterType") == "mbr":
+                ll, ur = sf["lowerLeft"], sf["upperRight"]
+                b = get_wrs2_index().bbox(s["path"], s["row"])
+                if b[0] > ur["longitude"] or b[2] < ll["longitude"] or b[1] > ur["latitude"] or b[3] < ll["latitude"]:
+                    continue
+            hits.append(s)
+
+        start = int(payload.get("startingNumber") or 1)
+        n = int(payload.get("maxResults") or 100)
+        page = hits[start - 1:start - 1 + n]
+        nxt = start + len(page)
+        return {
+            "results": [_scene_result(s) for s in page],
+            "recordsReturned": len(page),
+            "totalHits": len(hits),
+            "startingNumber": start,
+            "nextRecord": nxt if nxt <= len(hits) else None,
+        }
+
+    def m2m_download_options(self, payload):
+        out = []
+        for eid in payload.get("entityIds") or []:
+            if eid not in self.by_entity:
+                continue
+            out.append({"id": f"prod-{eid}", "entityId": eid, "productName": PRODUCT_NAME,
+                        "available": True, "filesize": os.path.getsize(self.by_entity[eid]["bundle"])})
+        return out
+
+    def m2m_download_request(self, payload):
+        available = []
+        for i, d in enumerate(payload.get("downloads") or []):
+            scene = self.by_entity.get(d.get("entityId"))
+            if scene is None:
+                continue
+            available.append({"downloadId": i + 1, "entityId": scene["entityId"],
+                              "displayId": scene["displayId"], "url": self._bundle_url(scene)})
+        label = payload.get("label") or "fake"
+        with self._lock:
+            self._labels[label] = available
+        return {"availableDownloads": available, "preparingDownloads": [], "failed": [], "label": label}
+
+    def m2m_download_retrieve(self, payload):
+        with self._lock:
+            available = self._labels.get(payload.get("label"), [])
+        return {"available": available, "requested": available, "queueSize": 0}
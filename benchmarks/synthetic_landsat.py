@@ -0,0 +1,268 @@
+"""
+Synthetic Landsat Collection 2 Level-2 scenes for the benchmarks.
+
+make_scene() writes SR_B5 / SR_B7 / QA_PIXEL GeoTIFFs that look like the real
+thing as far as the pipeline cares:
+  - uint16 DN on the L2 scale (reflectance = DN * 2.75e-5 - 0.2), DEFLATE tiled
+  - UTM grid at 30 m for the real WRS-2 path/row (footprint from wrs2_index),
+    snapped to the 30 m grid, so pre / post scenes of the same path/row are a
+    whole number of pixels apart like real acquisitions
+  - a tilted parallelogram of data inside fill (0 / QA fill bit), like the
+    rotated footprint of a real scene
+  - QA_PIXEL codes for clear land, water, cloud + dilated cloud, shadow, snow
+  - post scenes get burn scars (NIR down, SWIR2 up) so dNBR has something to find
+
+make_bundle() tars them up the way the download bundles come (with filler
+members for the bands we don't use around the ones we do), so the streaming
+extraction has to skip past them like it would for real.
+
+Full size is 7801 x 7901 (about what a real scene is); pass something smaller
+for quick runs. Every scene is built from a seed, so re-runs are identical.
+"""
+import math
+import os
+import sys
+import tarfile
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "srcPYTHON"))
+
+import numpy as np
+import rasterio
+from pyproj import Transformer
+from rasterio.transform import from_origin
+
+from wrs2_index import get_wrs2_index
+
+FULL_SIZE = (7801, 7901)   # rows, cols
+PIXEL = 30.0
+
+# QA_PIXEL values as they show up in real scenes
+QA_FILL = 1
+QA_CLEAR = 21824
+QA_WATER = 21952
+QA_CLOUD = 22280      # cloud + dilated cloud, high confidence
+QA_SHADOW = 23888
+QA_SNOW = 30048
+
+# bundle members that aren't read by the pipeline, as (suffix, which of our bands to copy)
+FILLER_MEMBERS = (
+    ("SR_B1.TIF", "swir"), ("SR_B2.TIF", "swir"), ("SR_B3.TIF", "swir"), ("SR_B4.TIF", "nir"),
+)
+FILLER_AFTER = (("SR_B6.TIF", "swir"), ("ST_B10.TIF", "nir"))
+
+
+def to_dn(reflectance):
+    return np.clip((reflectance + 0.2) / 2.75e-5, 1, 65535).astype(np.uint16)
+
+
+def utm_epsg(lon, lat):
+    zone = int((lon + 180) // 6) + 1
+    return (32600 if lat >= 0 else 32700) + zone
+
+
+def scene_grid(path, row, size=FULL_SIZE, shift=(0, 0)):
+    """(crs, transform) of a scene of the given size centred on the path/row, shifted by whole pixels."""
+    lon, lat = get_wrs2_index().center(path, row)
+    epsg = utm_epsg(lon, lat)
+    x, y = Transformer.from_crs("EPSG:4326", f"EPSG:{epsg}", always_xy=True).transform(lon, lat)
+    height, width = size
+    left = math.floor((x - width * PIXEL / 2) / PIXEL) * PIXEL + shift[1] * PIXEL
+    top = math.floor((y + height * PIXEL / 2) / PIXEL) * PIXEL - shift[0] * PIXEL
+    return f"EPSG:{epsg}", from_origin(left, top, PIXEL, PIXEL)
+
+
+def display_id(path, row, acquired, processed=None):
+    d = date.fromisoformat(acquired)
+    p = date.fromisoformat(processed) if processed else d
+    return f"LC08_L2SP_{path:03d}{row:03d}_{d:%Y%m%d}_{p:%Y%m%d}_02_T1"
+
+
+def entity_id(path, row, acquired):
+    d = date.fromisoformat(acquired)
+    return f"LC8{path:03d}{row:03d}{d.year}{d.timetuple().tm_yday:03d}LGN00"
+
+
+def _smooth_field(rng, shape, cell=64):
+    # cheap spatially correlated noise: coarse random grid blown up with bilinear interpolation
+    h, w = shape
+    gh, gw = h // cell + 2, w // cell + 2
+    coarse = rng.random((gh, gw), dtype=np.float32)
+    yi = np.arange(h, dtype=np.float32) / cell
+    xi = np.arange(w, dtype=np.float32) / cell
+    y0 = yi.astype(np.int32)
+    x0 = xi.astype(np.int32)
+    fy = (yi - y0)[:, None]
+    fx = (xi - x0)[None, :]
+    top = coarse[y0][:, x0] * (1 - fx) + coarse[y0][:, x0 + 1] * fx
+    bottom = coarse[y0 + 1][:, x0] * (1 - fx) + coarse[y0 + 1][:, x0 + 1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def _footprint(shape):
+    # tilted parallelogram of valid data (real scenes are rotated ~12 deg inside their grid)
+    h, w = shape
+    rows = np.arange(h, dtype=np.float32)[:, None]
+    cols = np.arange(w, dtype=np.float32)[None, :]
+    skew = 0.2 * w * (1 - rows / max(1, h - 1))
+    inset = 0.04 * w
+    return (cols >= skew + inset) & (cols <= skew + 0.8 * w - inset) & \
+           (rows >= 0.01 * h) & (rows <= 0.99 * h)
+
+
+def _blobs(rng, shape, count, radius, field=None):
+    h, w = shape
+    out = np.zeros(shape, dtype=bool)
+    for _ in range(count):
+        cy, cx = int(rng.integers(0, h)), int(rng.integers(0, w))
+        r = int(rng.integers(max(1, radius // 2), radius + 1))
+        y0, y1 = max(0, cy - r), min(h, cy + r)
+        x0, x1 = max(0, cx - r), min(w, cx + r)
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        d = ((yy - cy) ** 2 + (xx - cx) ** 2) / float(r * r)
+        if field is not None:
+            d = d + 0.5 * (field[y0:y1, x0:x1] - 0.5)   # ragged edges
+        out[y0:y1, x0:x1] |= d < 1
+    return out
+
+
+def _write(path, arr, crs, transform, nodata=None):
+    profile = {
+        "driver": "GTiff", "dtype": arr.dtype.name, "count": 1,
+        "height": arr.shape[0], "width": arr.shape[1],
+        "crs": crs, "transform": transform,
+        "tiled": True, "blockxsize": 256, "blockysize": 256, "compress": "deflate",
+    }
+    if nodata is not None:
+        profile["nodata"] = nodata
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(arr, 1)
+    return path
+
+
+def make_scene(out_dir, path, row, acquired, size=FULL_SIZE, shift=(0, 0), burned=False,
+               cloud_cover=10.0, seed=0, burn_seed=1234):
+    """
+    Write the three bands of one scene into out_dir.
+    Returns a dict with displayId / entityId / acquired / cloud / crs / transform
+    and the band paths under "bands" ({"nir", "swir", "qa"}).
+    burn_seed fixes where the scars are, so pre and post of one fire agree.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    crs, transform = scene_grid(path, row, size, shift)
+    did = display_id(path, row, acquired)
+    shape = size
+
+    veg = _smooth_field(rng, shape)
+    valid = _footprint(shape)
+    water = _smooth_field(rng, shape, cell=256) > 0.82
+
+    nir = 0.18 + 0.22 * veg
+    swir = 0.16 - 0.08 * veg
+    nir[water] = 0.03
+    swir[water] = 0.01
+
+    if burned:
+        # scars in pre-grid coordinates, moved with the shift so they land on the same ground
+        burn_rng = np.random.default_rng(burn_seed)
+        scar_field = _smooth_field(burn_rng, (shape[0] + 64, shape[1] + 64))
+        scars = _blobs(burn_rng, (shape[0] + 64, shape[1] + 64), 6, min(shape) // 10 + 2, scar_field)
+        r0, c0 = 32 + shift[0], 32 + shift[1]
+        scars = scars[r0:r0 + shape[0], c0:c0 + shape[1]]
+        severity = 0.4 + 0.6 * scar_field[r0:r0 + shape[0], c0:c0 + shape[1]]
+        nir = np.where(scars, nir * (1 - 0.6 * severity), nir)
+        swir = np.where(scars, swir + 0.15 * severity, swir)
+
+    nir = nir + rng.normal(0, 0.01, shape).astype(np.float32)
+    swir = swir + rng.normal(0, 0.01, shape).astype(np.float32)
+
+    qa = np.full(shape, QA_CLEAR, dtype=np.uint16)
+    qa[water] = QA_WATER
+    # clouds until roughly cloud_cover percent of the valid area is covered
+    cloud_field = _smooth_field(rng, shape, cell=128)
+    clouds = cloud_field > np.quantile(cloud_field[::16, ::16], 1 - cloud_cover / 100.0) if cloud_cover > 0 \
+        else np.zeros(shape, dtype=bool)
+    shadows = np.roll(clouds, (shape[0] // 60, shape[1] // 60), axis=(0, 1)) & ~clouds
+    snow = _blobs(rng, shape, 2, min(shape) // 30 + 1) & ~clouds
+    qa[shadows] = QA_SHADOW
+    qa[snow] = QA_SNOW
+    qa[clouds] = QA_CLOUD
+
+    nir_dn = to_dn(nir)
+    swir_dn = to_dn(swir)
+    nir_dn[~valid] = 0
+    swir_dn[~valid] = 0
+    qa[~valid] = QA_FILL
+
+    bands = {
+        "nir": _write(os.path.join(out_dir, f"{did}_SR_B5.TIF"), nir_dn, crs, transform, nodata=0),
+        "swir": _write(os.path.join(out_dir, f"{did}_SR_B7.TIF"), swir_dn, crs, transform, nodata=0),
+        "qa": _write(os.path.join(out_dir, f"{did}_QA_PIXEL.TIF"), qa, crs, transform, nodata=1),
+    }
+    cloud = round(100.0 * float(np.count_nonzero(clouds & valid)) / max(1, int(np.count_nonzero(valid))), 2)
+    return {
+        "displayId": did,
+        "entityId": entity_id(path, row, acquired),
+        "path": path,
+        "row": row,
+        "acquired": acquired,
+        "cloud": cloud,
+        "crs": crs,
+        "transform": tuple(transform)[:6],
+        "bands": bands,
+    }
+
+
+def make_bundle(scene, out_dir):
+    """Tar the scene's bands (plus filler members) into <displayId>.tar in out_dir. Returns its path."""
+    os.makedirs(out_dir, exist_ok=True)
+    did = scene["displayId"]
+    bands = scene["bands"]
+    tar_path = os.path.join(out_dir, f"{did}.tar")
+    mtl = os.path.join(out_dir, f"{did}_MTL.txt")
+    with open(mtl, "w") as f:
+        f.write(f"GROUP = LANDSAT_METADATA_FILE\n  LANDSAT_PRODUCT_ID = \"{did}\"\n"
+                f"  WRS_PATH = {scene['path']}\n  WRS_ROW = {scene['row']}\n"
+                f"  DATE_ACQUIRED = {scene['acquired']}\n  CLOUD_COVER = {scene['cloud']}\n"
+                f"END_GROUP = LANDSAT_METADATA_FILE\nEND\n")
+
+    with tarfile.open(tar_path, "w") as tf:
+        tf.add(mtl, arcname=f"{did}_MTL.txt")
+        for suffix, src in FILLER_MEMBERS:
+            tf.add(bands[src], arcname=f"{did}_{suffix}")
+        tf.add(bands["nir"], arcname=f"{did}_SR_B5.TIF")
+        tf.add(bands["swir"], arcname=f"{did}_SR_B7.TIF")
+        tf.add(bands["qa"], arcname=f"{did}_QA_PIXEL.TIF")
+        for suffix, src in FILLER_AFTER:
+            tf.add(bands[src], arcname=f"{did}_{suffix}")
+    os.remove(mtl)
+    return tar_path
+
+
+def make_fire(out_dir, path, row, pre_date, post_date, size=FULL_SIZE, post_shift=(3, -5), seed=0,
+              bundles=True):
+    """Pre + post scene of one path/row (post shifted by whole pixels, with burn scars). Returns [pre, post]."""
+    pre = make_scene(os.path.join(out_dir, "bands"), path, row, pre_date, size=size, seed=seed,
+                     burn_seed=seed + 1000)
+    post = make_scene(os.path.join(out_dir, "bands"), path, row, post_date, size=size, shift=post_shift,
+                      burned=True, seed=seed + 1, burn_seed=seed + 1000)
+    if bundles:
+        for s in (pre, post):
+            s["bundle"] = make_bundle(s, os.path.join(out_dir, "bundles"))
+    return [pre, post]
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("out_dir")
+    ap.add_argument("--size", default=f"{FULL_SIZE[0]}x{FULL_SIZE[1]}", help="HEIGHTxWIDTH")
+    ap.add_argument("--path", type=int, default=10)
+    ap.add_argument("--row", type=int, default=26)
+    args = ap.parse_args()
+    size = tuple(int(v) for v in args.size.lower().split("x"))
+    scenes = make_fire(args.out_dir, args.path, args.row, "2022-09-18", "2023-09-05", size=size)
+    print(json.dumps(scenes, indent=2, default=str))
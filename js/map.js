@@ -13,380 +13,24 @@ const esriImagery = L.tileLayer(
 ).addTo(map);
 
 // 2. PRE-GENERATED TILES
-// For now, define them manually. Later you can generate this list from Python.
+// The batch tiles come from /api/tiles (srcPYTHON/tile_manifest.py), grouped by
+// their "group" field. Only the old test outputs are still listed here.
 // bounds = [[lat_min, lon_min], [lat_max, lon_max]]
+const TILES_MANIFEST_URL = '/api/tiles';
+
+// Manifest groups without a checkbox of their own follow the add-ons checkbox
+const GROUP_CHECKBOXES = {
+  "2022–2023 strip": "chkStrip",
+  "2022–2023 add-ons": "chkAddons",
+  "2017–2018 test": "chkTest",
+};
+const DEFAULT_GROUP_CHECKBOX = "chkAddons";
+
+// Province mosaic of the batch tiles (srcPYTHON/mosaic.py), one tile pyramid.
+// When it's there the batch groups only draw their outlines, not their PNGs.
+let mosaicLayer = null;
 
 const PRESET_GROUPS = [
-  {
-    name: "2022–2023 strip",
-    tiles: [
-      {
-        "id": "P017R015_20220622_20231017",
-        "label": "Path 017 Row 015 (20220622 vs 20231017)",
-        "url": "assets/batch_tiles/delta_nbr_P017R015.png",
-        "bounds": [
-          [
-            64.45358231348361,
-            -70.47596139775203
-          ],
-          [
-            66.66239192535278,
-            -64.96400865783008
-          ]
-        ],
-        "preDate": "2022-06-22",
-        "postDate": "2023-10-17",
-        "percentChanged": 1.6233000982643335
-      },
-      {
-        "id": "P017R016_20220621_20231008",
-        "label": "Path 017 Row 016 (20220621 vs 20231008)",
-        "url": "assets/batch_tiles/delta_nbr_P017R016.png",
-        "bounds": [
-          [
-            61.642450523362676,
-            -74.06334280729966
-          ],
-          [
-            64.01941822651042,
-            -69.31067099111203
-          ]
-        ],
-        "preDate": "2022-06-21",
-        "postDate": "2023-10-08",
-        "percentChanged": 2.6595412237377247
-      },
-      {
-        "id": "P017R017_20220621_20230924",
-        "label": "Path 017 Row 017 (20220621 vs 20230924)",
-        "url": "assets/batch_tiles/delta_nbr_P017R017.png",
-        "bounds": [
-          [
-            61.642450523362676,
-            -74.06334280729966
-          ],
-          [
-            64.01941822651042,
-            -69.31067099111203
-          ]
-        ],
-        "preDate": "2022-06-21",
-        "postDate": "2023-09-24",
-        "percentChanged": NaN
-      },
-      {
-        "id": "P017R018_20220613_20230921",
-        "label": "Path 017 Row 018 (20220613 vs 20230921)",
-        "url": "assets/batch_tiles/delta_nbr_P017R018.png",
-        "bounds": [
-          [
-            60.39481958302447,
-            -75.07466650281606
-          ],
-          [
-            62.508126729595986,
-            -70.37572637785071
-          ]
-        ],
-        "preDate": "2022-06-13",
-        "postDate": "2023-09-21",
-        "percentChanged": NaN
-      },
-      {
-        "id": "P017R019_20220613_20230929",
-        "label": "Path 017 Row 019 (20220613 vs 20230929)",
-        "url": "assets/batch_tiles/delta_nbr_P017R019.png",
-        "bounds": [
-          [
-            58.993455372617966,
-            -75.91738792120645
-          ],
-          [
-            61.14646162083876,
-            -71.47490985050965
-          ]
-        ],
-        "preDate": "2022-06-13",
-        "postDate": "2023-09-29",
-        "percentChanged": NaN
-      },
-      {
-        "id": "P017R020_20220613_20230929",
-        "label": "Path 017 Row 020 (20220613 vs 20230929)",
-        "url": "assets/batch_tiles/delta_nbr_P017R020.png",
-        "bounds": [
-          [
-            57.589458646252055,
-            -76.70482199153804
-          ],
-          [
-            59.77587510993793,
-            -72.4919709439425
-          ]
-        ],
-        "preDate": "2022-06-13",
-        "postDate": "2023-09-29",
-        "percentChanged": NaN
-      },
-      {
-        "id": "P017R021_20220613_20230929",
-        "label": "Path 017 Row 021 (20220613 vs 20230929)",
-        "url": "assets/batch_tiles/delta_nbr_P017R021.png",
-        "bounds": [
-          [
-            56.18083542699742,
-            -77.4394565038548
-          ],
-          [
-            58.39733064381791,
-            -73.43258507203021
-          ]
-        ],
-        "preDate": "2022-06-13",
-        "postDate": "2023-09-29",
-        "percentChanged": 0.005500049051855906
-      },
-      {
-        "id": "P017R022_20220601_20231015",
-        "label": "Path 017 Row 022 (20220601 vs 20231015)",
-        "url": "assets/batch_tiles/delta_nbr_P017R022.png",
-        "bounds": [
-          [
-            53.360591740265306,
-            -72.58768125372254
-          ],
-          [
-            55.62022410035092,
-            -68.9314840243011
-          ]
-        ],
-        "preDate": "2022-06-01",
-        "postDate": "2023-10-15",
-        "percentChanged": NaN
-      },
-      {
-        "id": "P017R023_20220601_20231016",
-        "label": "Path 017 Row 023 (20220601 vs 20231016)",
-        "url": "assets/batch_tiles/delta_nbr_P017R023.png",
-        "bounds": [
-          [
-            51.9449926199231,
-            -73.20715492311919
-          ],
-          [
-            54.227081386192815,
-            -69.70231264418501
-          ]
-        ],
-        "preDate": "2022-06-01",
-        "postDate": "2023-10-16",
-        "percentChanged": NaN
-      },
-      {
-        "id": "P017R024_20220623_20231016",
-        "label": "Path 017 Row 024 (20220623 vs 20231016)",
-        "url": "assets/batch_tiles/delta_nbr_P017R024.png",
-        "bounds": [
-          [
-            50.590002812588565,
-            -76.96959729969399
-          ],
-          [
-            52.761172370422656,
-            -73.53115373204574
-          ]
-        ],
-        "preDate": "2022-06-23",
-        "postDate": "2023-10-16",
-        "percentChanged": 0.4373250375905166
-      },
-      {
-        "id": "P017R025_20220623_20231016",
-        "label": "Path 017 Row 025 (20220623 vs 20231016)",
-        "url": "assets/batch_tiles/delta_nbr_P017R025.png",
-        "bounds": [
-          [
-            49.167745005623004,
-            -77.52993525660447
-          ],
-          [
-            51.362388251674005,
-            -74.2184123114753
-          ]
-        ],
-        "preDate": "2022-06-23",
-        "postDate": "2023-10-16",
-        "percentChanged": 2.7716693528560112
-      },
-      {
-        "id": "P017R026_20220623_20231001",
-        "label": "Path 017 Row 026 (20220623 vs 20231001)",
-        "url": "assets/batch_tiles/delta_nbr_P017R026.png",
-        "bounds": [
-          [
-            47.74299847240343,
-            -78.064425247893
-          ],
-          [
-            49.95661289475822,
-            -74.86874671940906
-          ]
-        ],
-        "preDate": "2022-06-23",
-        "postDate": "2023-10-01",
-        "percentChanged": 0.0023518786806901353
-      },
-      {
-        "id": "P017R027_20220623_20230930",
-        "label": "Path 017 Row 027 (20220623 vs 20230930)",
-        "url": "assets/batch_tiles/delta_nbr_P017R027.png",
-        "bounds": [
-          [
-            46.318780573030125,
-            -78.5762543129112
-          ],
-          [
-            48.54970750434361,
-            -75.48624997913186
-          ]
-        ],
-        "preDate": "2022-06-23",
-        "postDate": "2023-09-30",
-        "percentChanged": 0.7798319101163529
-      },
-      {
-        "id": "P017R028_20220623_20230930",
-        "label": "Path 017 Row 028 (20220623 vs 20230930)",
-        "url": "assets/batch_tiles/delta_nbr_P017R028.png",
-        "bounds": [
-          [
-            46.318780573030125,
-            -78.5762543129112
-          ],
-          [
-            48.54970750434361,
-            -75.48624997913186
-          ]
-        ],
-        "preDate": "2022-06-23",
-        "postDate": "2023-09-30",
-        "percentChanged": 0.14668664730119946
-      },
-      {
-        "id": "P017R029_20220623_20230930",
-        "label": "Path 017 Row 029 (20220623 vs 20230930)",
-        "url": "assets/batch_tiles/delta_nbr_P017R029.png",
-        "bounds": [
-          [
-            42.15190928732031,
-            -80.0440052110615
-          ],
-          [
-            44.18720543072206,
-            -77.13986510212898
-          ]
-        ],
-        "preDate": "2022-06-23",
-        "postDate": "2023-09-30",
-        "percentChanged": 0.6325609189046061
-      },
-      {
-        "id": "P017R030_20220623_20230922",
-        "label": "Path 017 Row 030 (20220623 vs 20230922)",
-        "url": "assets/batch_tiles/delta_nbr_P017R030.png",
-        "bounds": [
-          [
-            42.15190928732031,
-            -80.0440052110615
-          ],
-          [
-            44.18720543072206,
-            -77.13986510212898
-          ]
-        ],
-        "preDate": "2022-06-23",
-        "postDate": "2023-09-22",
-        "percentChanged": 0.5065433787595666
-      }
-    ]
-  },
-  {
-    name: "2022–2023 add-ons",
-    tiles: [
-      {
-        "id": "P015R025_20220715_20230901",
-        "label": "Path 015 Row 025 (20220715 vs 20230901)",
-        "url": "assets/batch_tiles/delta_nbr_P015R025.png",
-        "bounds": [
-          [
-            49.234577957006906,
-            -74.43837933751148
-          ],
-          [
-            51.29105460751917,
-            -71.0739584724096
-          ]
-        ],
-        "preDate": "2022-07-15",
-        "postDate": "2023-09-01",
-        "percentChanged": 0.37476667287530907
-      },
-      {
-        "id": "P015R026_20220715_20230901",
-        "label": "Path 015 Row 026 (20220715 vs 20230901)",
-        "url": "assets/batch_tiles/delta_nbr_P015R026.png",
-        "bounds": [
-          [
-            47.81091525134761,
-            -74.97081517578542
-          ],
-          [
-            49.8888000219215,
-            -71.72380131049442
-          ]
-        ],
-        "preDate": "2022-07-15",
-        "postDate": "2023-09-01",
-        "percentChanged": 0.03619493494843399
-      },
-      {
-        "id": "P016R023_20220715_20230901",
-        "label": "Path 016 Row 023 (20220715 vs 20230901)",
-        "url": "assets/batch_tiles/delta_nbr_P016R023.png",
-        "bounds": [
-          [
-            52.04436334124006,
-            -74.83691208027719
-          ],
-          [
-            54.12164780295728,
-            -71.23352298129514
-          ]
-        ],
-        "preDate": "2022-07-15",
-        "postDate": "2023-09-01",
-        "percentChanged": 3.781955986122586
-      },
-      {
-        "id": "P018R023_20220715_20230901",
-        "label": "Path 018 Row 023 (20220715 vs 20230901)",
-        "url": "assets/batch_tiles/delta_nbr_P018R023.png",
-        "bounds": [
-          [
-            51.97478799531794,
-            -77.85539498072897
-          ],
-          [
-            54.194814135121064,
-            -74.3131023474264
-          ]
-        ],
-        "preDate": "2022-07-15",
-        "postDate": "2023-09-01",
-        "percentChanged": 9.227399722664932
-      }
-    ]
-  },
   {
     name: "2017–2018 test",
     tiles: [
@@ -496,13 +140,27 @@ function extendBounds(union, b) {
   return union.extend(b);
 }
 
-function buildPresetTiles() {
+function groupTiles(tiles) {
+  const groups = [];
+  tiles.forEach(tile => {
+    const name = tile.group || "Batch tiles";
+    let group = groups.find(g => g.name === name);
+    if (!group) {
+      group = { name, tiles: [] };
+      groups.push(group);
+    }
+    group.tiles.push(tile);
+  });
+  return groups;
+}
+
+function buildPresetTiles(groups) {
   boundsUnion = null;
-  PRESET_GROUPS.forEach(group => {
+  groups.forEach(group => {
     const grpLayer = L.layerGroup();
     group.tiles.forEach(tile => {
       const bounds = tile.bounds;
-      const layer = L.imageOverlay(tile.url, bounds, { opacity: PRESET_OVERLAY_OPACITY });
+      const drawPng = !(group.batch && mosaicLayer);
 
       const rect = L.rectangle(bounds, {
         color: '#ffd166',
@@ -515,7 +173,9 @@ function buildPresetTiles() {
         highlightRect(rect);
       });
 
-      layer.addTo(grpLayer);
+      if (drawPng) {
+        L.imageOverlay(tile.url, bounds, { opacity: PRESET_OVERLAY_OPACITY }).addTo(grpLayer);
+      }
       rect.addTo(grpLayer);
       presetRects.push(rect);
       boundsUnion = extendBounds(boundsUnion, bounds);
@@ -528,7 +188,35 @@ function buildPresetTiles() {
   }
 }
 
-buildPresetTiles();
+function loadPresetTiles() {
+  return fetch(TILES_MANIFEST_URL)
+    .then(r => {
+      if (!r.ok) throw new Error(`HTTP ${r.status}`);
+      return r.json();
+    })
+    .then(data => {
+      if (data && data.mosaic) {
+        // version in the URL: a rebuilt mosaic gets fresh tiles despite max-age
+        mosaicLayer = L.tileLayer(`${data.mosaic.url}&v=${data.mosaic.version}`, {
+          opacity: PRESET_OVERLAY_OPACITY,
+          maxNativeZoom: 14,
+          maxZoom: 19,
+        });
+      }
+      const groups = groupTiles((data && data.tiles) || []);
+      groups.forEach(g => { g.batch = true; });
+      return groups;
+    })
+    .catch(err => {
+      console.error('Failed to load batch tiles manifest', err);
+      return [];
+    })
+    .then(batchGroups => {
+      buildPresetTiles(batchGroups.concat(PRESET_GROUPS));
+      applyGroupCheckboxes();
+      setMosaicVisibility(chkMosaic && chkMosaic.checked);
+    });
+}
 
 // Show the grid by default
 wrsGridGroup.addTo(map);
@@ -537,12 +225,12 @@ wrsGridGroup.addTo(map);
 const chkStrip = document.getElementById("chkStrip");
 const chkAddons = document.getElementById("chkAddons");
 const chkTest = document.getElementById("chkTest");
+const chkMosaic = document.getElementById("chkMosaic");
 const chkGrid = document.getElementById("chkGrid");
 
-// Initial visibility: only grid on by default
-setGroupVisibility("2022–2023 strip", chkStrip && chkStrip.checked);
-setGroupVisibility("2022–2023 add-ons", chkAddons && chkAddons.checked);
-setGroupVisibility("2017–2018 test", chkTest && chkTest.checked);
+function groupCheckbox(name) {
+  return document.getElementById(GROUP_CHECKBOXES[name] || DEFAULT_GROUP_CHECKBOX);
+}
 
 function setGroupVisibility(name, visible) {
   const grp = presetGroups.find(g => g.name === name);
@@ -554,15 +242,108 @@ function setGroupVisibility(name, visible) {
   }
 }
 
-if (chkStrip) {
-  chkStrip.addEventListener("change", e => setGroupVisibility("2022–2023 strip", e.target.checked));
+// Initial visibility: only grid on by default
+function applyGroupCheckboxes() {
+  presetGroups.forEach(g => {
+    const chk = groupCheckbox(g.name);
+    setGroupVisibility(g.name, !!(chk && chk.checked));
+  });
 }
-if (chkAddons) {
-  chkAddons.addEventListener("change", e => setGroupVisibility("2022–2023 add-ons", e.target.checked));
+
+[chkStrip, chkAddons, chkTest].forEach(chk => {
+  if (!chk) return;
+  chk.addEventListener("change", e => {
+    presetGroups.forEach(g => {
+      if (groupCheckbox(g.name) === chk) setGroupVisibility(g.name, e.target.checked);
+    });
+  });
+});
+
+function setMosaicVisibility(visible) {
+  if (!mosaicLayer) return;
+  if (visible) {
+    mosaicLayer.addTo(map);
+  } else {
+    map.removeLayer(mosaicLayer);
+  }
 }
-if (chkTest) {
-  chkTest.addEventListener("change", e => setGroupVisibility("2017–2018 test", e.target.checked));
+
+if (chkMosaic) {
+  chkMosaic.addEventListener("change", e => setMosaicVisibility(e.target.checked));
 }
+
+// Burn scar polygons (srcPYTHON/burn_scars.py), fetched for the visible area after
+// every move; the server sends the outlines simplified for the current zoom.
+const SCARS_URL = '/api/burn_scars';
+const SCARS_MIN_ZOOM = 7;
+// same colours as the USGS severity classes in the PNGs / usgs tiles
+const SEVERITY_COLORS = {
+  low: '#ffff00',
+  moderate_low: '#f56b00',
+  moderate_high: '#e63700',
+  high: '#7a0177',
+};
+const chkScars = document.getElementById("chkScars");
+let scarsRequest = null;
+
+const scarsLayer = L.geoJSON(null, {
+  style: f => ({
+    color: SEVERITY_COLORS[f.properties.severity] || '#ffffff',
+    weight: 1,
+    fillOpacity: 0.15,
+  }),
+  onEachFeature: (feature, layer) => {
+    layer.on('click', (e) => {
+      lastFeatureClick = Date.now();   // don't let the map click pick a WRS tile too
+      showScarInfo(feature.properties);
+      if (L.DomEvent && L.DomEvent.stopPropagation) {
+        L.DomEvent.stopPropagation(e);
+      }
+    });
+  }
+});
+
+function loadScars() {
+  if (scarsRequest) scarsRequest.abort();
+  scarsRequest = null;
+  if (!(chkScars && chkScars.checked) || map.getZoom() < SCARS_MIN_ZOOM) {
+    scarsLayer.clearLayers();
+    return;
+  }
+  const b = map.getBounds();
+  const bbox = [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].map(v => v.toFixed(4)).join(',');
+  const ctrl = new AbortController();
+  scarsRequest = ctrl;
+  fetch(`${SCARS_URL}?bbox=${bbox}&z=${Math.round(map.getZoom())}`, { signal: ctrl.signal })
+    .then(r => {
+      if (!r.ok) throw new Error(`HTTP ${r.status}`);
+      return r.json();
+    })
+    .then(data => {
+      scarsLayer.clearLayers();
+      scarsLayer.addData(data);
+    })
+    .catch(err => {
+      if (err.name !== 'AbortError') console.error('Failed to load burn scars', err);
+    });
+}
+
+if (chkScars) {
+  chkScars.addEventListener("change", e => {
+    if (e.target.checked) {
+      scarsLayer.addTo(map);
+    } else {
+      map.removeLayer(scarsLayer);
+    }
+    loadScars();
+  });
+  if (chkScars.checked) scarsLayer.addTo(map);
+}
+map.on('moveend', loadScars);
+loadScars();
+
+loadPresetTiles();
+
 if (chkGrid) {
   chkGrid.addEventListener("change", e => {
     if (e.target.checked) {
@@ -596,6 +377,22 @@ function showTileInfo(tile) {
   `;
 }
 
+function showScarInfo(p) {
+  if (!tileInfoDiv) return;
+  const ha = v => (v == null ? '–' : `${v.toFixed(1)} ha`);
+  const num = v => (v == null ? '–' : v.toFixed(3));
+
+  tileInfoDiv.innerHTML = `
+    <p><strong>Burn scar</strong> <code>${p.scar_id}</code></p>
+    <p>Source: <code>${p.source}</code></p>
+    <p>Burned area: ${ha(p.burned_ha)} (outline ${ha(p.area_ha)})</p>
+    <p>Mean dNBR: ${num(p.mean_dnbr)}, max ${num(p.max_dnbr)}</p>
+    <p>Dominant severity: ${String(p.severity).replace(/_/g, ' ')}</p>
+    <p>Low ${ha(p.ha_low)} · Moderate-low ${ha(p.ha_moderate_low)} ·
+       Moderate-high ${ha(p.ha_moderate_high)} · High ${ha(p.ha_high)}</p>
+  `;
+}
+
 function highlightRect(rect) {
   if (lastHighlighted) {
     lastHighlighted.setStyle({ weight: 1, color: '#ffd166' });
@@ -804,6 +601,31 @@ const loadingOverlay = document.getElementById("loadingOverlay");
   }
 });
 
+const JOB_POLL_MS = 3000;
+
+// Poll /api/jobs/<id> until the job is done or failed, showing the current stage
+async function pollJob(job) {
+  while (job.status !== "done" && job.status !== "failed") {
+    if (apiResultEl) apiResultEl.textContent = `Running analysis... (${job.stage})`;
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_MS));
+    const resp = await fetch(job.status_url);
+    if (!resp.ok) {
+      const text = await resp.text();
+      throw new Error(`HTTP ${resp.status}: ${text}`);
+    }
+    job = await resp.json();
+  }
+  return job;
+}
+
+// Prefer the on-demand XYZ tiles (/tiles/...) over draping the whole PNG
+function apiResultLayer(res, bounds) {
+  if (res.tiles_url) {
+    return L.tileLayer(res.tiles_url, { opacity: 0.75, bounds: bounds, maxNativeZoom: 14, maxZoom: 19 });
+  }
+  return L.imageOverlay(res.png_url, bounds, { opacity: 0.75 });
+}
+
 function clearApiOverlays() {
   latestApiLayers.forEach(layer => {
     map.removeLayer(layer);
@@ -864,12 +686,12 @@ if (runApiBtn && apiResultEl) {
         return;
       }
 
-      // If multiple requests, use batch endpoint
+      // If multiple requests, use batch endpoint (queued as a job, then polled)
       if (requests.length > 1) {
         const batchResp = await fetch("/api/run_dnbr_batch", {
           method: "POST",
           headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({ requests })
+          body: JSON.stringify({ requests, async: true })
         });
 
         if (!batchResp.ok) {
@@ -877,7 +699,7 @@ if (runApiBtn && apiResultEl) {
           throw new Error(`HTTP ${batchResp.status}: ${text}`);
         }
 
-        const data = await batchResp.json();
+        const data = await pollJob(await batchResp.json());
         if (data.error) {
           apiResultEl.textContent = "Error: " + data.error;
           return;
@@ -908,7 +730,7 @@ if (runApiBtn && apiResultEl) {
               ];
           const label = `Custom P${String(res.path).padStart(3, "0")}R${String(res.row).padStart(3, "0")} (${preStart} → ${postStart})`;
 
-              const layer = L.imageOverlay(res.png_url, apiBounds, { opacity: 0.75 });
+              const layer = apiResultLayer(res, apiBounds);
               layer.addTo(map);
               latestApiLayers.push(layer);
             }
@@ -921,7 +743,8 @@ if (runApiBtn && apiResultEl) {
 
         apiResultEl.innerHTML = rows.join("") || "No results.";
       } else {
-        const resp = await fetch("/api/run_dnbr", {
+        // Submit as a background job, then poll until it finishes
+        const resp = await fetch("/api/jobs", {
           method: "POST",
           headers: { "Content-Type": "application/json" },
           body: JSON.stringify({
@@ -939,7 +762,7 @@ if (runApiBtn && apiResultEl) {
           throw new Error(`HTTP ${resp.status}: ${text}`);
         }
 
-        const data = await resp.json();
+        const data = await pollJob(await resp.json());
 
         if (data.error) {
           apiResultEl.textContent = "Error: " + data.error;
@@ -966,7 +789,7 @@ if (runApiBtn && apiResultEl) {
             const rowVal = document.getElementById("apiRow").value;
             const label = `Custom P${pathVal}R${rowVal} (${preStart} → ${postStart})`;
 
-            const layer = L.imageOverlay(data.png_url, apiBounds, { opacity: 0.75 });
+            const layer = apiResultLayer(data, apiBounds);
             layer.addTo(map);
             latestApiLayers.push(layer);
           }
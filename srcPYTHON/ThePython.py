@@ -5,8 +5,8 @@ import os
 import rasterio
 from pyproj import Transformer
 from rasterio.warp import reproject, Resampling
-import matplotlib.pyplot as plt
 import tarfile
+import shutil
 import glob
 import requests
 from botocore import UNSIGNED
@@ -14,12 +14,40 @@ from botocore.config import Config
 import json
 from rasterio.transform import array_bounds
 import time
-from rasterio.transform import xy
+from rasterio.windows import Window, from_bounds
+from rasterio.windows import bounds as window_bounds
+from rasterio.warp import transform_bounds
+import math
+import uuid
+import hashlib
+from contextlib import contextmanager, nullcontext
+from scene_cache import get_scene_cache
+from scene_search_cache import get_search_cache, OfflineCacheMiss
+from wrs2_index import wrs2_footprint_bbox
+from instrumentation import span
+from qa_mask import PackedMask, load_qa_mask, qa_obstruction_mask, qa_bitmask, as_bool
+from dnbr_render import (
+    INFERNO_RGBA,
+    USGS_CLASS_RGBA,
+    burn_index,
+    stretch_index,
+    write_png,
+    write_worldfile,
+)
+from resumable_download import download_file, ResumableHTTPReader
+from m2m_client import (
+    M2MClient,
+    M2MError,
+    SERVICE_URL as M2M_SERVICE_URL,
+    get_default_client,
+    resolve_client,
+)
 
 BASE_DIR = os.path.join(os.getcwd(), "data")  
 DOWNLOAD_DIR = os.path.join(BASE_DIR, "dataAPI")
 EXTRACT_DIR = os.path.join(DOWNLOAD_DIR, "extracted")
 OUTPUT_DIR = os.path.join(BASE_DIR, "outputs")
+COMPOSITE_DIR = os.path.join(BASE_DIR, "composites")
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 os.makedirs(EXTRACT_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -27,6 +55,69 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 DELTA_NBR_THRESHOLD = 0.1
 BURN_VIS_THRESHOLD = 0.15  # pixels below this are transparent in the web PNG
 MAX_CLOUD_COVER = 25
+DATASET = "landsat_ot_c2_l2"
+
+# Streaming (block-by-block) mode for process_landsat, for small workers that get OOM-killed on full scenes.
+# DNBR_STREAMING=1 turns it on for the pipeline, DNBR_STREAM_MAX_MEMORY_MB is the rough ceiling per block.
+STREAMING_DEFAULT = os.environ.get("DNBR_STREAMING", "0") == "1"
+STREAM_MAX_MEMORY_MB = int(os.environ.get("DNBR_STREAM_MAX_MEMORY_MB", "256"))
+# rough bytes held per pre-grid pixel while a block is in flight:
+# 3 pre reads + 3 post reprojections + masks (fused_dnbr writes dNBR over the pre NIR block)
+STREAM_BYTES_PER_PIXEL = 32
+
+# post -> pre alignment (align_stack): GDAL warper threads (0 = all cores) and its working memory per chunk
+WARP_THREADS = int(os.environ.get("DNBR_WARP_THREADS", "0")) or os.cpu_count() or 1
+WARP_MEM_MB = int(os.environ.get("DNBR_WARP_MEM_MB", "256"))
+
+# rows per step in fused_dnbr, its scratch buffers are 3 x chunk rows x scene width
+KERNEL_CHUNK_ROWS = int(os.environ.get("DNBR_KERNEL_CHUNK_ROWS", "256"))
+
+# Pull SR_B5/SR_B7/QA_PIXEL straight out of the bundle's HTTP stream instead of saving the whole tar first.
+# DNBR_STREAM_EXTRACT=0 goes back to download-then-extract.
+STREAM_EXTRACT = os.environ.get("DNBR_STREAM_EXTRACT", "1") == "1"
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# page size for the batched (union bbox) scene-search, see m2m_search_all
+SEARCH_PAGE_SIZE = int(os.environ.get("DNBR_SEARCH_PAGE_SIZE", "500"))
+
+# dNBR GeoTIFF layout: "cog" = tiled + compressed + internal overviews (see write_delta_tif),
+# "gtiff" = plain GeoTIFF with the source scene's profile like before
+OUTPUT_FORMAT = os.environ.get("DNBR_OUTPUT_FORMAT", "cog").lower()
+COG_COMPRESS = os.environ.get("DNBR_COG_COMPRESS", "DEFLATE").upper()   # or ZSTD
+COG_BLOCKSIZE = 512
+COG_OVERVIEW_RESAMPLING = "average"
+DELTA_NODATA = -9999.0
+
+# USGS burn severity table for classify_dnbr: (code, low, low inclusive, high, high inclusive).
+# The gaps between the published ranges (e.g. -0.251 .. -0.25) stay class 0, same as the table.
+DNBR_CLASS_TABLE = (
+    (1, -0.500, True,  -0.251, True),    # Enhanced regrowth, high
+    (2, -0.250, False, -0.101, True),    # Enhanced regrowth, low
+    (3, -0.100, False,  0.099, True),    # Unburned
+    (4,  0.100, True,   0.269, True),    # Low severity
+    (5,  0.270, True,   0.439, True),    # Moderate-low severity
+    (6,  0.440, True,   0.659, True),    # Moderate-high severity
+    (7,  0.660, True,   1.300, True),    # High severity
+)
+# DNBR_CLASS_BREAKS="-0.5,-0.25,-0.1,0.1,0.27,0.44,0.66,1.3" swaps the table for back to back
+# classes [b0, b1), [b1, b2) ... [b6, b7] (up to 7 classes, the colour table has 8 rows with 0)
+CLASS_BREAKS = os.environ.get("DNBR_CLASS_BREAKS", "").strip()
+# uint8 class GeoTIFF (<dNBR name>_class.tif) written next to every dNBR GeoTIFF,
+# the class PNG / usgs tiles read it instead of re-classifying the float32 raster
+CLASS_TIF = os.environ.get("DNBR_CLASS_TIF", "1") == "1"
+CLASS_NODATA = 0
+# burn scar polygons (<dNBR name>_scars.fgb, see burn_scars.py) after every run, DNBR_BURN_SCARS=0 skips them
+BURN_SCARS = os.environ.get("DNBR_BURN_SCARS", "1") == "1"
+
+# Multi-scene compositing (composite_scene_bands): instead of the one least cloudy scene per window,
+# take the DNBR_COMPOSITE_SCENES least cloudy ones and build a per-pixel clear-sky composite.
+# DNBR_COMPOSITE = median | latest (most recent clear pixel), empty = off (one scene, like before)
+COMPOSITE_METHOD = os.environ.get("DNBR_COMPOSITE", "").lower()
+COMPOSITE_SCENES = int(os.environ.get("DNBR_COMPOSITE_SCENES", "3"))
+COMPOSITE_METHODS = ("median", "latest")
+# synthetic QA_PIXEL of a composite: clear where some scene was clear, fill where none was
+COMPOSITE_QA_CLEAR = 1 << 6
+COMPOSITE_QA_FILL = 1
 
 
 
@@ -41,63 +132,126 @@ def load_band(band_path):
 
 
 
-#this is my load cloud/QA mask function, took me a while to realise that its not just 0 is cloud and 1 is clear skies, but instead theres a system of bits to represent differnet visual obstructions . QA is the cloud band stuff
-def load_cloud_mask(qa_path):
-    with rasterio.open(qa_path) as src:
-        qa = src.read(1)
-
-    FILL    = 0
-    DILATED = 1
-    CIRRUS  = 2
-    CLOUD   = 3
-    SHADOW  = 4
-    SNOW    = 5
-
-    mask = (
-        ((qa & (1 << FILL))    != 0) |
-        ((qa & (1 << DILATED)) != 0) |
-        ((qa & (1 << CIRRUS))  != 0) |
-        ((qa & (1 << CLOUD))   != 0) |
-        ((qa & (1 << SHADOW))  != 0) |
-        ((qa & (1 << SNOW))    != 0)
-    )
+# same as load_band for several bands of one scene, read by GDAL straight into one float32 (bands, h, w) array
+def load_band_stack(band_paths):
+    with rasterio.open(band_paths[0]) as src:
+        profile = src.profile
+        stack = np.empty((len(band_paths), src.height, src.width), dtype=np.float32)
+    for i, band_path in enumerate(band_paths):
+        with rasterio.open(band_path) as src:
+            src.read(1, out=stack[i])
+    return stack, profile
+
+
+# same again but one separate float32 array per band, so each can be freed (or written over) on its own
+def load_bands(band_paths):
+    arrays = []
+    profile = None
+    for band_path in band_paths:
+        with rasterio.open(band_path) as src:
+            if profile is None:
+                profile = src.profile
+            arr = np.empty((src.height, src.width), dtype=np.float32)
+            src.read(1, out=arr)
+        arrays.append(arr)
+    return arrays, profile
+
+
+@contextmanager
+def _timed(timings, stage):
+    # adds the seconds spent in the block to timings[stage] (timings=None: no-op)
+    # and records it as an instrumentation span, which is yielded (add bytes / arrays to it)
+    t0 = time.perf_counter()
+    try:
+        with span(stage) as sp:
+            yield sp
+    finally:
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + time.perf_counter() - t0, 3)
 
-    return mask
+
+
+#this is my load cloud/QA mask function, took me a while to realise that its not just 0 is cloud and 1 is clear skies, but instead theres a system of bits to represent differnet visual obstructions . QA is the cloud band stuff
+# the bit decoding (one combined bitmask, configurable flags, bit-packed masks + caching) lives in qa_mask.py
+def load_cloud_mask(qa_path, flags=None, packed=None):
+    return load_qa_mask(qa_path, flags=flags, packed=packed)
 
 
 #ok now for raster alignment. it aligns the source to the target projection and location. i need rasterio
 
-def align_raster(source_arr, source_profile, target_profile):
-    dst_arr = np.empty((target_profile['height'], target_profile['width']), dtype=np.float32) #making an empty array to hold the reprojected raster, size maatches target raster
+def grid_offset(source_profile, target_profile):
+    """
+    (row, col) of the source's top-left pixel on the target grid, if both
+    grids are the same CRS + pixel size and only shifted by whole pixels
+    (two scenes of the same path/row usually are). None otherwise.
+    """
+    st, tt = source_profile['transform'], target_profile['transform']
+    if source_profile['crs'] != target_profile['crs']:
+        return None
+    if (st.a, st.b, st.d, st.e) != (tt.a, tt.b, tt.d, tt.e) or st.b or st.d:
+        return None
+    col = (st.c - tt.c) / tt.a
+    row = (st.f - tt.f) / tt.e
+    if abs(col - round(col)) > 1e-6 or abs(row - round(row)) > 1e-6:
+        return None
+    return int(round(row)), int(round(col))
+
+
+def _shift_onto_grid(arr, offset, target_shape):
+    # whole-pixel shift: copy the overlap, everything else 0 (what reproject leaves there too)
+    row, col = offset
+    th, tw = target_shape
+    h, w = arr.shape[-2:]
+    dst = np.zeros(arr.shape[:-2] + (th, tw), dtype=arr.dtype)
+    r0, r1 = max(0, row), min(th, row + h)
+    c0, c1 = max(0, col), min(tw, col + w)
+    if r1 > r0 and c1 > c0:
+        dst[..., r0:r1, c0:c1] = arr[..., r0 - row:r1 - row, c0 - col:c1 - col]
+    return dst
+
+
+def align_stack(source_arr, source_profile, target_profile, resampling=Resampling.bilinear, num_threads=None):
+    """
+    Align a (h, w) array or a (bands, h, w) stack onto the target grid in one go.
+      - same grid: returned as is, nothing copied
+      - whole-pixel shift on the same grid (grid_offset): plain array copy, no warp
+      - anything else: one multi-threaded GDAL warp for every band (WARP_THREADS,
+        processed in WARP_MEM_MB chunks), so the transformer is only set up once
+    """
+    target_shape = (target_profile['height'], target_profile['width'])
+    offset = grid_offset(source_profile, target_profile)
+    if offset == (0, 0) and source_arr.shape[-2:] == target_shape:
+        return source_arr
+    if offset is not None:
+        return _shift_onto_grid(source_arr, offset, target_shape)
+
+    dst_arr = np.empty(source_arr.shape[:-2] + target_shape, dtype=source_arr.dtype) #empty array(s) to hold the reprojected raster, size matches target raster
     reproject(
-        source=source_arr, #2d array of the raster i want to reporject (eg post fire NIR)
+        source=source_arr, #2d array (or stack of them) of the raster i want to reporject (eg post fire NIR + SWIR)
         destination=dst_arr, #where aligned pixels will go 
         src_transform=source_profile['transform'], #metadata from source raster (size and whatnot)
         src_crs=source_profile['crs'], #tells rasterio how source pixels are atm 
         dst_transform=target_profile['transform'], #metadata from target of what grid/coord system we want from the target raster
         dst_crs=target_profile['crs'],
-        resampling=Resampling.bilinear #interpolations for fractional pizel shifts 
+        resampling=resampling,
+        num_threads=WARP_THREADS if num_threads is None else num_threads,
+        warp_mem_limit=WARP_MEM_MB,
     )
     return dst_arr
 
 
+def align_raster(source_arr, source_profile, target_profile):
+    # bilinear for interpolations for fractional pixel shifts
+    return align_stack(source_arr.astype(np.float32, copy=False), source_profile, target_profile,
+                       Resampling.bilinear)
+
+
 
 #ok now to realign the masks which have been  done by aligning a boolean mask to a target raster using neareast neighbour resampling 
 def align_mask(mask_source, source_profile, target_profile):
-   
-    dst_mask = np.empty((target_profile['height'], target_profile['width']), dtype=np.uint8)
-    
-    reproject(
-        source=mask_source.astype(np.uint8),  # turn to integer for resampling
-        destination=dst_mask,
-        src_transform=source_profile['transform'],
-        src_crs=source_profile['crs'],
-        dst_transform=target_profile['transform'],
-        dst_crs=target_profile['crs'],
-        resampling=Resampling.nearest     # nearest preserves 0/1 exactly
-    )
-    
-    return dst_mask.astype(bool)
+    # GDAL wants an integer type: bool and uint8 are the same bytes, so view it instead of copying. nearest preserves 0/1 exactly
+    dst_mask = align_stack(as_bool(mask_source).view(np.uint8), source_profile, target_profile, Resampling.nearest)
+    return dst_mask.view(bool)
 
 
 #ok now time to compute the NBR function
@@ -134,10 +288,163 @@ def delta_nbr_stats(delta, threshold=0.27): #0.27 is the deltanbr threshold i wi
         'valid_pixels': int(np.count_nonzero(valid)),
         'changed_pixels': int(np.count_nonzero(changed)),
         'percent_changed': percent_changed
-    } #this returns a dictonary with number of pixels that are valid(not masked), number of pixels above burn threshold, %changed is percent of valid pixels above burn threshold 
+    } #this returns a dictonary with number of pixels that are valid(not masked), number of pixels above burn threshold, %changed is percent of valid pixels above burn threshold
+
+
+# same stats as delta_nbr_stats but built up one block at a time (used by the streaming mode)
+def delta_nbr_stats_init():
+    return {'valid_pixels': 0, 'changed_pixels': 0}
+
+
+def delta_nbr_stats_update(acc, delta, threshold=0.27):
+    valid = ~np.isnan(delta)
+    acc['valid_pixels'] += int(np.count_nonzero(valid))
+    acc['changed_pixels'] += int(np.count_nonzero((delta >= threshold) & valid))
+    return acc
 
 
-def classify_dnbr(delta):
+def delta_nbr_stats_finish(acc):
+    valid_count = acc['valid_pixels']
+    if valid_count == 0:
+        return {
+            'valid_pixels': 0,
+            'changed_pixels': 0,
+            'percent_changed': 0.0
+        }
+    return {
+        'valid_pixels': valid_count,
+        'changed_pixels': acc['changed_pixels'],
+        'percent_changed': acc['changed_pixels'] / valid_count * 100
+    }
+
+
+
+def fused_dnbr(nir_pre, swir_pre, nir_post, swir_post, mask=None, out=None, nodata=None,
+               threshold=0.27, acc=None, chunk_rows=None):
+    """
+    compute_nbr (pre + post) -> compute_delta_nbr -> delta_nbr_stats_update ->
+    nodata encoding, in one pass over the scene a chunk of rows at a time.
+
+    Same float32 maths and the same numbers as that chain, but the only
+    full-size array is out; everything else lives in three chunk-sized
+    scratch buffers. out can be a preallocated float32 array, or nir_pre /
+    swir_pre themselves (each chunk of the pre bands is used up before it's
+    overwritten), otherwise a new one is made.
+
+    mask is True where the pixel should be dropped (mask_pre | mask_post),
+    a bool array or a qa_mask.PackedMask (unpacked a chunk at a time).
+    nodata=None leaves dropped pixels as NaN (like compute_delta_nbr),
+    a number writes it in directly, ready for dst.write.
+    The threshold counters go into acc (delta_nbr_stats_init() if not given).
+
+    Returns (delta, acc).
+    """
+    if chunk_rows is None:
+        chunk_rows = KERNEL_CHUNK_ROWS
+    if acc is None:
+        acc = delta_nbr_stats_init()
+    height, width = nir_pre.shape
+    if out is None:
+        out = np.empty((height, width), dtype=np.float32)
+
+    rows = max(1, min(chunk_rows, height))
+    denom_buf = np.empty((rows, width), dtype=np.float32)
+    nbr_buf = np.empty((rows, width), dtype=np.float32)
+    flag_buf = np.empty((rows, width), dtype=bool)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for r0 in range(0, height, rows):
+            r1 = min(height, r0 + rows)
+            denom, nbr_pre, flag = denom_buf[:r1 - r0], nbr_buf[:r1 - r0], flag_buf[:r1 - r0]
+            o = out[r0:r1]
+
+            # NBR pre (the pre bands are done with after this, so o may be one of them)
+            np.add(nir_pre[r0:r1], swir_pre[r0:r1], out=denom, dtype=np.float32)
+            np.subtract(nir_pre[r0:r1], swir_pre[r0:r1], out=nbr_pre, dtype=np.float32)
+            np.divide(nbr_pre, denom, out=nbr_pre)
+            np.equal(denom, 0, out=flag)
+            np.copyto(nbr_pre, np.nan, where=flag)
+
+            # NBR post, straight into o
+            np.add(nir_post[r0:r1], swir_post[r0:r1], out=denom, dtype=np.float32)
+            np.subtract(nir_post[r0:r1], swir_post[r0:r1], out=o, dtype=np.float32)
+            np.divide(o, denom, out=o)
+            np.equal(denom, 0, out=flag)
+            np.copyto(o, np.nan, where=flag)
+
+            # dNBR = pre - post, then the cloud/fill mask
+            np.subtract(nbr_pre, o, out=o)
+            if isinstance(mask, PackedMask):
+                np.copyto(o, np.nan, where=mask.unpack(slice(r0, r1)))
+            elif mask is not None:
+                np.copyto(o, np.nan, where=mask[r0:r1])
+
+            # stats (NaN >= threshold is False, so no valid mask needed for the count)
+            np.greater_equal(o, threshold, out=flag)
+            acc['changed_pixels'] += int(np.count_nonzero(flag))
+            np.isnan(o, out=flag)
+            acc['valid_pixels'] += int(flag.size - np.count_nonzero(flag))
+
+            if nodata is not None:
+                np.copyto(o, nodata, where=flag)
+
+    return out, acc
+
+def _class_table_from_breaks(breaks):
+    # N+1 increasing edges -> N back to back classes [b0, b1), [b1, b2) ... [bN-1, bN]
+    breaks = [float(b) for b in breaks]
+    increasing = all(b1 > b0 for b0, b1 in zip(breaks, breaks[1:]))
+    if not increasing or not 2 <= len(breaks) <= len(USGS_CLASS_RGBA):
+        raise RuntimeError(
+            f"dNBR class breaks must be 2 to {len(USGS_CLASS_RGBA)} increasing values, got {breaks}"
+        )
+    last = len(breaks) - 2
+    return tuple(
+        (i + 1, lo, True, hi, i == last) for i, (lo, hi) in enumerate(zip(breaks, breaks[1:]))
+    )
+
+
+if CLASS_BREAKS:
+    DNBR_CLASS_TABLE = _class_table_from_breaks(CLASS_BREAKS.split(","))
+
+_class_lut_cache = {}
+
+
+def dnbr_class_lut(table=None, dtype=np.float32):
+    """
+    (edges, codes) for classify_dnbr: a value d gets codes[searchsorted(edges, d, side="right")].
+    The table's inclusive / exclusive ends become half-open [lo, hi) edges with nextafter in
+    dtype, so the comparisons come out exactly like the old >= / <= masks did on that dtype.
+    Gaps between classes, and anything below the first / above the last, map to 0.
+    """
+    table = DNBR_CLASS_TABLE if table is None else tuple(table)
+    dtype = np.dtype(dtype) if np.dtype(dtype).kind == "f" else np.dtype(np.float32)
+    key = (table, dtype.str)
+    lut = _class_lut_cache.get(key)
+    if lut is not None:
+        return lut
+
+    up = dtype.type(np.inf)
+    edges, codes = [], [0]
+    for code, lo, lo_incl, hi, hi_incl in table:
+        lo_edge = dtype.type(lo) if lo_incl else np.nextafter(dtype.type(lo), up)
+        hi_edge = np.nextafter(dtype.type(hi), up) if hi_incl else dtype.type(hi)
+        if hi_edge <= lo_edge or (edges and lo_edge < edges[-1]):
+            raise RuntimeError(f"dNBR class table isn't increasing / overlaps at class {code}")
+        if edges and lo_edge == edges[-1]:
+            codes[-1] = code          # starts right where the previous class stopped
+        else:
+            edges.append(lo_edge)
+            codes.append(code)
+        edges.append(hi_edge)
+        codes.append(0)               # gap until the next class
+
+    lut = (np.array(edges, dtype=dtype), np.array(codes, dtype=np.uint8))
+    _class_lut_cache[key] = lut
+    return lut
+
+
+def classify_dnbr(delta, out=None, nodata=None, table=None, chunk_rows=None):
     """
     Classify dNBR into USGS burn severity classes.
 
@@ -150,87 +457,62 @@ def classify_dnbr(delta):
       5 = Moderate-low severity
       6 = Moderate-high severity
       7 = High severity
-    """
-    classes = np.zeros(delta.shape, dtype=np.uint8)
 
-    valid = np.isfinite(delta)
-    d = np.where(valid, delta, np.nan)
-
-    # ranges from the table (not scaled)
-    # Enhanced regrowth, high
-    classes[(d >= -0.500) & (d <= -0.251)] = 1
-    # Enhanced regrowth, low
-    classes[(d >  -0.250) & (d <= -0.101)] = 2
-    # Unburned
-    classes[(d >  -0.100) & (d <=  0.099)] = 3
-    # Low severity
-    classes[(d >=  0.100) & (d <=  0.269)] = 4
-    # Moderate-low severity
-    classes[(d >=  0.270) & (d <=  0.439)] = 5
-    # Moderate-high severity
-    classes[(d >=  0.440) & (d <=  0.659)] = 6
-    # High severity
-    classes[(d >=  0.660) & (d <=  1.300)] = 7
-
-    # any NaN stays 0 (background)
-    return classes
+    One searchsorted + table lookup per chunk of rows (KERNEL_CHUNK_ROWS) instead of
+    seven full-size masks, so the only extra memory is one chunk of indices.
+    NaN / inf and nodata (e.g. -9999 straight from the GeoTIFF) are 0.
+    table overrides the class ranges (default DNBR_CLASS_TABLE, see DNBR_CLASS_BREAKS).
+    """
+    delta = np.asarray(delta)
+    edges, codes = dnbr_class_lut(table, delta.dtype)
+    if out is None:
+        out = np.empty(delta.shape, dtype=np.uint8)
+    if chunk_rows is None:
+        chunk_rows = KERNEL_CHUNK_ROWS
+    if nodata is not None and np.isnan(nodata):
+        nodata = None             # NaN is already 0
+
+    # rows x everything else, so 1-D and 3-D arrays go through the same loop
+    d2 = delta.reshape(delta.shape[0] if delta.ndim > 1 else 1, -1)
+    o2 = out.reshape(d2.shape)
+    step = max(1, chunk_rows) if delta.ndim > 1 else d2.shape[1]
+    for r0 in range(0, d2.shape[0], step):
+        d = d2[r0:r0 + step]
+        o = o2[r0:r0 + step]
+        np.take(codes, np.searchsorted(edges, d, side="right"), out=o)
+        if nodata is not None:
+            np.copyto(o, 0, where=(d == nodata))
+    return out
 
-from matplotlib.colors import ListedColormap
 
 def export_dnbr_class_png(tif_path, png_path):
     """
     Read a dNBR GeoTIFF, classify it using USGS burn severity
     classes, and write a PNG with the USGS-like color scheme,
     plus a PNG world file.
+    If the pipeline already wrote the uint8 class GeoTIFF next to it
+    (write_class_tif) that is read as is, no float32 read / classification.
     """
-    with rasterio.open(tif_path) as src:
-        data = src.read(1).astype("float32")
-        transform = src.transform
-        nodata = src.nodata
-
-    # Turn nodata to NaN
-    if nodata is not None:
-        data = np.where(data == nodata, np.nan, data)
-
-    # Classify to 0–7
-    classes = classify_dnbr(data)
-
-    # Colors approximating the USGS table
-    # 0: background (black)
-    # 1: dark olive (enhanced regrowth, high)
-    # 2: light olive (enhanced regrowth, low)
-    # 3: bright green (unburned)
-    # 4: yellow (low severity)
-    # 5: orange (moderate-low)
-    # 6: red-orange (moderate-high)
-    # 7: purple (high severity)
-    cmap = ListedColormap([
-        (0/255,   0/255,   0/255),    # 0
-        (122/255, 135/255, 55/255),   # 1
-        (172/255, 190/255, 77/255),   # 2
-        (0/255,   203/255, 0/255),    # 3
-        (255/255, 255/255, 0/255),    # 4
-        (245/255, 107/255, 0/255),    # 5
-        (230/255, 55/255,  0/255),    # 6
-        (122/255, 1/255,   119/255),  # 7
-    ])
-
-    # Save PNG: classes are 0–7, use discrete cmap
-    plt.imsave(png_path, classes, cmap=cmap, vmin=0, vmax=7)
+    class_tif = fresh_class_tif(tif_path)
+    if class_tif is not None:
+        with rasterio.open(class_tif) as src:
+            classes = src.read(1)
+            transform = src.transform
+    else:
+        with rasterio.open(tif_path) as src:
+            data = src.read(1)
+            transform = src.transform
+            nodata = src.nodata
+
+        # Classify to 0–7 (nodata -> 0), the class codes are the rows of the colour table
+        # (see dnbr_render.USGS_CLASS_RGBA: black background, olive/green regrowth
+        # + unburned, yellow -> orange -> red-orange -> purple for severity)
+        classes = classify_dnbr(data, nodata=nodata)
+        del data
+    write_png(png_path, classes, USGS_CLASS_RGBA)
 
     # World file (.pgw) so it’s georeferenced
-    pixel_width = transform.a
-    pixel_height = transform.e
-    x_ul, y_ul = xy(transform, 0, 0, offset="center")
-
-    worldfile_path = os.path.splitext(png_path)[0] + ".pgw"
-    with open(worldfile_path, "w") as f:
-        f.write(f"{pixel_width}\n")
-        f.write("0.0\n")
-        f.write("0.0\n")
-        f.write(f"{pixel_height}\n")
-        f.write(f"{x_ul}\n")
-        f.write(f"{y_ul}\n")
+    worldfile_path = write_worldfile(png_path, transform)
 
     print("Wrote PNG:", png_path)
     print("Wrote world file:", worldfile_path)
@@ -240,57 +522,43 @@ def export_dnbr_class_png(tif_path, png_path):
 #this function is to get the landsatexplorer api to seearch for the images i want so i dont have to get my data from the website and manually put in my files in my code. i have to use my own password and username for earthexplorer
 
 
-WRS2_BBOX = {
-    (18, 24): (-116.123, 36.789, -114.456, 38.012),
-    (13, 32): (-120.321, 39.123, -118.654, 40.456),
-    # manually adding in the bounds of different path/rows, i will add all the ones for quebec but for now ill just do the two for testing 
-}
+# manual overrides, anything not in here comes from the bundled WRS-2 footprint index (wrs2_index.py)
+WRS2_BBOX = {}
 
 def wrs2_to_bbox(path, row):
-    return WRS2_BBOX.get((path, row))
+    bbox = WRS2_BBOX.get((path, row))
+    if bbox is None:
+        bbox = wrs2_footprint_bbox(path, row)
+    return bbox
 
 # cir0gHyF3eH89ARS4sI9sFcQT_31qZg@B1hhIby!D3@tF@S7kuT3TzLc1SroNjb8
 
 
-SERVICE_URL = "https://m2m.cr.usgs.gov/api/api/json/stable/"
+# all M2M traffic goes through m2m_client (pooled session, timeouts, retries, latency metrics)
+SERVICE_URL = M2M_SERVICE_URL
 
-def m2m_login(username, app_token):
+def m2m_login(username, app_token, client=None):
     """
     Logs in to USGS M2M using login-token and returns the API key.
     Mirrors the official example script.
+    If client (an M2MClient) is given, the key is also stored on it.
     """
-    url = SERVICE_URL + "login-token"
-    payload = {"username": username, "token": app_token}
-    json_data = json.dumps(payload)
-
-    resp = requests.post(url, json_data)
-    if resp is None:
-        raise RuntimeError("No output from service")
-
-    try:
-        output = resp.json()
-    except Exception as e:
-        raise RuntimeError(f"Failed to parse login-token JSON: {e}\nRaw: {resp.text}")
-
-    if output.get("errorCode") is not None:
-        raise RuntimeError(
-            f"Login failed: {output['errorCode']} - {output.get('errorMessage')}"
-        )
+    if client is None:
+        client = get_default_client()
+        payload = {"username": username, "token": app_token}
+        try:
+            api_key = client.call("login-token", payload, auth=False)
+        except M2MError as e:
+            raise RuntimeError(f"Login failed: {e.error_code} - {e.error_message}")
+    else:
+        api_key = client.login(username, app_token)
 
-    api_key = output["data"]
     print("Authenticated. API key:", api_key)
     return api_key
 
 
 
-def m2m_search(api_key, bbox, start, end, max_cloud=None):
-    """
-    Scene-search for landsat_ot_c2_l2 over an MBR bbox and date range.
-    bbox = (min_lon, min_lat, max_lon, max_lat)
-    """
-    url = SERVICE_URL + "scene-search"
-    headers = {"X-Auth-Token": api_key}
-
+def _scene_search_payload(bbox, start, end, max_cloud=None, max_results=5):
     min_lon, min_lat, max_lon, max_lat = bbox
 
     spatial_filter = {
@@ -325,35 +593,65 @@ def m2m_search(api_key, bbox, start, end, max_cloud=None):
     payload = {
         "datasetName": "landsat_ot_c2_l2",
         "sceneFilter": scene_filter,
-        "maxResults": 5,
+        "maxResults": max_results,
     }
+    return payload
 
-    resp = requests.post(url, headers=headers, json=payload)
 
-    if resp.status_code != 200:
-        print("scene-search HTTP status:", resp.status_code)
-        print("scene-search response text:", resp.text)
-    resp.raise_for_status()
+def m2m_search(api_key, bbox, start, end, max_cloud=None):
+    """
+    Scene-search for landsat_ot_c2_l2 over an MBR bbox and date range.
+    bbox = (min_lon, min_lat, max_lon, max_lat)
+    api_key can be a key string or an M2MClient.
+    """
+    client, key = resolve_client(api_key)
+    payload = _scene_search_payload(bbox, start, end, max_cloud)
+    data = client.call("scene-search", payload, api_key=key)
+    return data["results"]
 
-    data = resp.json()
-    if data.get("errorCode"):
-        raise Exception(
-            f"scene-search failed: {data['errorCode']} {data.get('errorMessage')}"
-        )
 
-    return data["data"]["results"]
+def m2m_search_all(api_key, bbox, start, end, max_cloud=None, page_size=None):
+    """
+    Same search as m2m_search but pages through every hit instead of stopping
+    at the first 5. Used for the big union-bbox searches in scene_discovery.
+    """
+    client, key = resolve_client(api_key)
+    if page_size is None:
+        page_size = SEARCH_PAGE_SIZE
+    payload = _scene_search_payload(bbox, start, end, max_cloud, max_results=page_size)
+
+    results = []
+    starting = 1
+    while True:
+        payload["startingNumber"] = starting
+        data = client.call("scene-search", payload, api_key=key)
+        page = data.get("results") or []
+        results.extend(page)
 
+        total = data.get("totalHits") or 0
+        next_record = data.get("nextRecord")
+        if not page or not next_record or next_record <= starting or len(results) >= total:
+            break
+        starting = next_record
 
+    return results
 
 
 
 
-def download_to_file(url, out_path):
-    r = requests.get(url, stream=True)
-    r.raise_for_status()
-    with open(out_path, "wb") as f:
-        for chunk in r.iter_content(1024 * 1024):
-            f.write(chunk)
+
+
+def download_to_file(url, out_path, expected_size=None, expected_sha256=None, segments=None):
+    # resumable: Range requests + a .part journal, retries with backoff, size/sha256 check
+    # (see resumable_download.py, DNBR_DOWNLOAD_SEGMENTS > 1 downloads ranges in parallel)
+    with span("download", file=os.path.basename(out_path)) as sp:
+        download_file(
+            url, out_path,
+            expected_size=expected_size,
+            expected_sha256=expected_sha256,
+            segments=segments,
+        )
+        sp.add_bytes(os.path.getsize(out_path))
     return out_path
 
 """
@@ -405,26 +703,18 @@ def m2m_search_wrs2(api_key, path, row, start, end):
 #this is for automated coord conversion 
 
 
-SERVICE_URL = "https://m2m.cr.usgs.gov/api/api/json/stable/"
-
-def _m2m_get_products_for_scene(api_key, scene):
+def _m2m_get_products_for_scenes(api_key, scenes):
     """
-    Call download-options and return the list of product dicts for this scene.
+    One download-options call for a whole list of scenes.
+    Returns {entityId: [product dicts]} (scenes M2M had nothing for are left out).
     """
-    headers = {"X-Auth-Token": api_key}
-    url = SERVICE_URL + "download-options"
+    client, key = resolve_client(api_key)
+    entity_ids = [s["entityId"] for s in scenes]
     payload = {
         "datasetName": "landsat_ot_c2_l2",
-        "entityIds": [scene["entityId"]],
+        "entityIds": entity_ids,
     }
-    resp = requests.post(url, headers=headers, json=payload)
-    resp.raise_for_status()
-    out = resp.json()
-
-    if out.get("errorCode"):
-        raise RuntimeError(f"download-options failed: {out['errorCode']} {out.get('errorMessage')}")
-
-    root = out.get("data")
+    root = client.call("download-options", payload, api_key=key)
     if root is None:
         raise RuntimeError("download-options returned data = null")
 
@@ -437,6 +727,21 @@ def _m2m_get_products_for_scene(api_key, scene):
     else:
         raise RuntimeError(f"Unexpected download-options structure: {type(root)}")
 
+    by_entity = {}
+    for p in products or []:
+        eid = p.get("entityId")
+        if eid is None and len(entity_ids) == 1:
+            eid = entity_ids[0]
+        if eid is not None:
+            by_entity.setdefault(eid, []).append(p)
+    return by_entity
+
+
+def _m2m_get_products_for_scene(api_key, scene):
+    """
+    Call download-options and return the list of product dicts for this scene.
+    """
+    products = _m2m_get_products_for_scenes(api_key, [scene]).get(scene["entityId"])
     if not products:
         raise RuntimeError("No products returned by download-options")
 
@@ -483,116 +788,176 @@ def _pick_sr_bundle_product(products):
     return bundle
 
 
-def _download_bundle_for_scene(api_key, scene, product):
+def _request_bundle_urls(api_key, scene_products, label=None):
     """
-    Use download-request (+ download-retrieve if needed) to download
-    the chosen bundle product. Returns path to the downloaded file.
+    One download-request for many (scene, product) pairs
+    (+ download-retrieve if some are still being prepared).
+    Returns {entityId: url}; anything M2M didn't hand a URL for is left out.
     """
-    headers = {"X-Auth-Token": api_key}
+    client, key = resolve_client(api_key)
+    entity_ids = [scene["entityId"] for scene, _ in scene_products]
+    by_display = {scene["displayId"]: scene["entityId"] for scene, _ in scene_products if scene.get("displayId")}
 
     # ---- download-request ----
-    req_url = SERVICE_URL + "download-request"
-    label = f"bundle_{scene['entityId']}"
+    if label is None:
+        label = f"bundle_{entity_ids[0]}" if len(entity_ids) == 1 else f"bundles_{uuid.uuid4().hex[:12]}"
 
     req_payload = {
-        "downloads": [{
-            "entityId": scene["entityId"],
-            "productId": product["id"]
-        }],
+        "downloads": [
+            {"entityId": scene["entityId"], "productId": product["id"]}
+            for scene, product in scene_products
+        ],
         "label": label
     }
 
-    resp = requests.post(req_url, headers=headers, json=req_payload)
-    resp.raise_for_status()
-    dr = resp.json()
+    with span("m2m_download_request", scenes=len(entity_ids)):
+        data = client.call("download-request", req_payload, api_key=key)
 
-    if dr.get("errorCode"):
-        raise RuntimeError(f"download-request failed: {dr['errorCode']} {dr.get('errorMessage')}")
+    urls = {}
+    unmatched = []
 
-    data = dr["data"]
+    def collect(items):
+        for d in items or []:
+            if not d.get("url"):
+                continue
+            eid = d.get("entityId") or by_display.get(d.get("displayId"))
+            if eid is None and len(entity_ids) == 1:
+                eid = entity_ids[0]
+            if eid is None:
+                unmatched.append(d["url"])
+            elif eid in entity_ids and eid not in urls:
+                urls[eid] = d["url"]
+
+    collect(data.get("availableDownloads"))
+
+    # download-request doesn't always say which scene a URL is for, and some
+    # bundles may still be preparing: download-retrieve lists both with entityIds
+    if len(urls) < len(entity_ids) and (unmatched or data.get("preparingDownloads")):
+        retrieve_payload = {"label": data.get("label", label)}
 
-    urls = []
-    if data.get("availableDownloads"):
-        urls = [d["url"] for d in data["availableDownloads"] if d.get("url")]
+        # the polling below is where a run can sit for most of a minute, so it gets its own span
+        with span("m2m_download_retrieve_wait", scenes=len(entity_ids)) as sp:
+            slept = 0
+            for attempt in range(5):
+                if attempt or not unmatched:
+                    print("Waiting for bundle to become available...")
+                    time.sleep(10)
+                    slept += 10
+                unmatched.clear()
+                d2 = client.call("download-retrieve", retrieve_payload, api_key=key)
+                collect(d2.get("available"))
+                if len(urls) == len(entity_ids):
+                    break
+            sp.set(attempts=attempt + 1, slept_seconds=slept, resolved=len(urls))
 
-    # If not ready, call download-retrieve a few times
-    if not urls and data.get("preparingDownloads"):
-        retrieve_url = SERVICE_URL + "download-retrieve"
-        retrieve_payload = {"label": data.get("label", label)}
+    return urls
 
-        for _ in range(5):
-            print("Waiting for bundle to become available...")
-            time.sleep(10)
-            resp2 = requests.post(retrieve_url, headers=headers, json=retrieve_payload)
-            resp2.raise_for_status()
-            dr2 = resp2.json()
-            if dr2.get("errorCode"):
-                raise RuntimeError(f"download-retrieve failed: {dr2['errorCode']} {dr2.get('errorMessage')}")
-
-            d2 = dr2["data"]
-            urls = [d["url"] for d in d2.get("available", []) if d.get("url")]
-            if urls:
-                break
 
+def _request_bundle_url(api_key, scene, product):
+    """
+    Use download-request (+ download-retrieve if needed) to get a
+    download URL for the chosen bundle product.
+    """
+    urls = _request_bundle_urls(api_key, [(scene, product)])
     if not urls:
         raise RuntimeError("Could not get a download URL for the bundle product")
 
-    bundle_url = urls[0]
+    bundle_url = urls[scene["entityId"]]
     print("Bundle download URL:", bundle_url)
+    return bundle_url
 
-    # Local bundle filename (let extension follow the URL)
-    filename = os.path.basename(bundle_url.split("?")[0])
-    if not filename:
-        filename = f"{scene['displayId']}_bundle.tar"
 
-    local_path = os.path.join(DOWNLOAD_DIR, filename)
-    print(f"Downloading bundle to {local_path}")
-    download_to_file(bundle_url, local_path)
-    return local_path
+def _band_for_member(name):
+    # which of our three bands (if any) a tar member is
+    name = name.upper()
+    if name.endswith("SR_B5.TIF"):
+        return "nir"
+    if name.endswith("SR_B7.TIF"):
+        return "swir"
+    if "QA_PIXEL.TIF" in name:
+        return "qa"
+    return None
 
 
-def _extract_landsat_bands_from_bundle(bundle_path):
+def _extract_landsat_bands_from_bundle(bundle_path, dest_dir=None):
     """
     Open the bundle (tar) and extract SR_B5, SR_B7, QA_PIXEL
-    into EXTRACT_DIR. Returns dict with local paths.
+    into dest_dir (EXTRACT_DIR by default). Returns dict with local paths.
     """
+    if dest_dir is None:
+        dest_dir = EXTRACT_DIR
     # Only tar support here; if you ever get zip, we can add zipfile logic
     if not tarfile.is_tarfile(bundle_path):
         raise RuntimeError(f"Bundle is not a tar file: {bundle_path}")
 
     bands = {"nir": None, "swir": None, "qa": None}
 
-    with tarfile.open(bundle_path, "r") as tf:
-        members = tf.getmembers()
+    with span("extract", bundle=os.path.basename(bundle_path)) as sp, tarfile.open(bundle_path, "r") as tf:
+        # Extract the members we found
+        os.makedirs(dest_dir, exist_ok=True)
 
-        nir_member = None
-        swir_member = None
-        qa_member = None
+        # walk members lazily (no getmembers()) and stop once all three are out
+        for m in tf:
+            band = _band_for_member(m.name)
+            if band is None or bands[band] is not None:
+                continue
+            tf.extract(m, dest_dir)
+            bands[band] = os.path.join(dest_dir, m.name)
+            sp.add_bytes(m.size)
+            if all(bands.values()):
+                break
 
-        for m in members:
-            name = m.name.upper()
-            if name.endswith("SR_B5.TIF"):
-                nir_member = m
-            elif name.endswith("SR_B7.TIF"):
-                swir_member = m
-            elif "QA_PIXEL.TIF" in name:
-                qa_member = m
+    print("Extracted bands from bundle:", bands)
 
-        # Extract the members we found
-        os.makedirs(EXTRACT_DIR, exist_ok=True)
+    missing = [k for k, v in bands.items() if v is None]
+    if missing:
+        raise RuntimeError(f"Bundle did not contain expected files for: {', '.join(missing)}")
 
-        def extract_member(member):
-            tf.extract(member, EXTRACT_DIR)
-            return os.path.join(EXTRACT_DIR, member.name)
+    return bands
 
-        if nir_member:
-            bands["nir"] = extract_member(nir_member)
-        if swir_member:
-            bands["swir"] = extract_member(swir_member)
-        if qa_member:
-            bands["qa"] = extract_member(qa_member)
 
-    print("Extracted bands from bundle:", bands)
+def stream_extract_bands_from_url(url, dest_dir=None):
+    """
+    Read the bundle straight off the HTTP response as a tar stream and only
+    write SR_B5, SR_B7 and QA_PIXEL to dest_dir (EXTRACT_DIR by default).
+    Every other member is skipped as it streams past, and we hang up as soon
+    as the three bands are out, so the full bundle never touches the disk.
+    Returns dict with local paths, same as _extract_landsat_bands_from_bundle.
+    """
+    if dest_dir is None:
+        dest_dir = EXTRACT_DIR
+    os.makedirs(dest_dir, exist_ok=True)
+
+    bands = {"nir": None, "swir": None, "qa": None}
+
+    # reconnects with a Range header if the stream drops part way through
+    # (span bytes = what came over the wire, band sizes go in the attrs)
+    with span("extract_stream") as sp, ResumableHTTPReader(url) as r:
+        try:
+            tf = tarfile.open(fileobj=r, mode="r|*")
+        except tarfile.TarError as e:
+            raise RuntimeError(f"Bundle is not a tar stream: {url} ({e})")
+
+        with tf:
+            for m in tf:
+                band = _band_for_member(m.name)
+                if band is None or bands[band] is not None or not m.isfile():
+                    continue  # stream mode skips over the member data for us
+
+                out_path = os.path.join(dest_dir, os.path.basename(m.name))
+                tmp_path = f"{out_path}.{uuid.uuid4().hex}.part"  # unique, other fetches may share dest_dir
+                src = tf.extractfile(m)
+                with open(tmp_path, "wb") as f:
+                    shutil.copyfileobj(src, f, STREAM_CHUNK_SIZE)
+                os.replace(tmp_path, out_path)
+                bands[band] = out_path
+                sp.set(**{f"{band}_bytes": m.size})
+
+                if all(bands.values()):
+                    break
+        sp.add_bytes(r.pos)
+
+    print("Stream-extracted bands from bundle:", bands)
 
     missing = [k for k, v in bands.items() if v is None]
     if missing:
@@ -602,7 +967,7 @@ def _extract_landsat_bands_from_bundle(bundle_path):
 
 
 
-def m2m_get_band_urls(api_key, scene):
+def m2m_get_band_urls(api_key, scene, bundle_url=None):
     """
     High-level helper:
       - get products for scene
@@ -611,23 +976,93 @@ def m2m_get_band_urls(api_key, scene):
       - extract SR_B5, SR_B7, QA_PIXEL
 
     Returns local file paths for the three bands. it also checks if its already downloaded so it doesnt have to again 
+    (first in the persistent scene cache, then in EXTRACT_DIR from older runs)
+
+    bundle_url: a URL already resolved by the batched discovery (scene_discovery),
+    skips download-options / download-request. If it has gone stale we ask again.
     """
     scene_id = scene["displayId"]  # e.g. LC08_L2SP_010026_20220918_20220928_02_T1
+    cache = get_scene_cache()
+
+    # Scene cache first, so nothing hits download-options / download-request for bands we already have
+    cached = cache.get_scene(scene_id)
+    if cached:
+        print("Scene cache hit:", scene_id)
+        return cached
 
     nir_path  = os.path.join(EXTRACT_DIR, f"{scene_id}_SR_B5.TIF")
     swir_path = os.path.join(EXTRACT_DIR, f"{scene_id}_SR_B7.TIF")
     qa_path   = os.path.join(EXTRACT_DIR, f"{scene_id}_QA_PIXEL.TIF")
 
-    # If we've already extracted them, reuse
+    # If we've already extracted them (before the cache existed), adopt them into the cache.
+    # put_scene moves the files, so only one caller may do it
     if all(os.path.exists(p) for p in [nir_path, swir_path, qa_path]):
-        return {"nir": nir_path, "swir": swir_path, "qa": qa_path}
+        with cache.scene_lock(scene_id):
+            cached = cache.get_scene(scene_id)
+            if cached:
+                return cached
+            if all(os.path.exists(p) for p in [nir_path, swir_path, qa_path]):
+                return cache.put_scene(scene_id, {"nir": nir_path, "swir": swir_path, "qa": qa_path})
+
+    if get_search_cache().offline:
+        raise OfflineCacheMiss(f"Offline: bands for {scene_id} are not in the scene cache")
+
+    if bundle_url:
+        try:
+            return _fetch_bundle_bands(scene_id, bundle_url)
+        except Exception as e:
+            print(f"Pre-resolved bundle URL failed for {scene_id} ({e}), requesting a new one")
 
     # Otherwise fall back to the full flow (request + download + extract)
     products = _m2m_get_products_for_scene(api_key, scene)
     bundle_product = _pick_sr_bundle_product(products)
-    bundle_path = _download_bundle_for_scene(api_key, scene, bundle_product)
-    bands = _extract_landsat_bands_from_bundle(bundle_path)
-    return bands
+
+    return _fetch_bundle_bands(scene_id, _request_bundle_url(api_key, scene, bundle_product))
+
+
+def _fetch_bundle_bands(scene_id, bundle_url):
+    """
+    Download / stream-extract the bundle at bundle_url and put the three bands in the scene cache.
+
+    Holds the scene cache's per-scene lock, so when several tiles / workers want the
+    same scene one of them downloads it and the rest wait and get the cached bands.
+    """
+    cache = get_scene_cache()
+
+    with cache.scene_lock(scene_id):
+        # someone else may have fetched it while we were waiting on the lock
+        cached = cache.get_scene(scene_id)
+        if cached:
+            print("Scene cache hit after lock:", scene_id)
+            return cached
+
+        # private extract dir per fetch, put_scene moves the bands out of it
+        work_dir = os.path.join(EXTRACT_DIR, f".{scene_id}.{uuid.uuid4().hex}")
+        try:
+            if STREAM_EXTRACT:
+                # pull the three bands out of the HTTP stream, the bundle itself is never saved
+                bands = stream_extract_bands_from_url(bundle_url, dest_dir=work_dir)
+                return cache.put_scene(scene_id, bands)
+
+            # Local bundle filename (let extension follow the URL). Prefixed with the scene id
+            # so the scene lock covers it and a crashed download can still resume from its journal
+            filename = os.path.basename(bundle_url.split("?")[0])
+            if not filename:
+                filename = "bundle.tar"
+            bundle_path = os.path.join(DOWNLOAD_DIR, f"{scene_id}_{filename}")
+            print(f"Downloading bundle to {bundle_path}")
+            download_to_file(bundle_url, bundle_path)
+            bands = _extract_landsat_bands_from_bundle(bundle_path, dest_dir=work_dir)
+
+            # the three bands now live in the cache, the rest of the bundle is dead weight
+            bands = cache.put_scene(scene_id, bands)
+            try:
+                os.remove(bundle_path)
+            except OSError:
+                pass
+            return bands
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
 
 
 def _scene_path_row_from_metadata(scene):
@@ -674,12 +1109,6 @@ def _scene_path_row_from_metadata(scene):
 
     return path_val, row_val
 
-import matplotlib.pyplot as plt
-from matplotlib import cm
-from matplotlib.colors import Normalize
-
-# ... your existing code ...
-
 def export_burn_png_from_delta(tif_path, png_path, threshold=DELTA_NBR_THRESHOLD):
     """
     Create a PNG where only pixels with delta NBR >= threshold
@@ -694,95 +1123,162 @@ def export_burn_png_from_delta(tif_path, png_path, threshold=DELTA_NBR_THRESHOLD
 
         # Mask nodata to NaN
         if nodata is not None:
-            data = np.where(data == nodata, np.nan, data)
+            data[data == nodata] = np.nan   # data is already our own float32 copy
 
         # Burned = above threshold
         burned = (data >= threshold) & np.isfinite(data)
 
-        # If literally nothing is burned, just make a fully transparent PNG
-        if not np.any(burned):
-            h, w = data.shape
-            rgba = np.zeros((h, w, 4), dtype=np.float32)
-        else:
+        # If literally nothing is burned this is just a fully transparent PNG
+        vmin = vmax = threshold
+        if np.any(burned):
             # Normalise only over burned pixels so the colours use a sensible range
-            vmin = threshold
-            vmax = np.nanpercentile(data[burned], 99)
+            vmax = np.percentile(data[burned], 99, overwrite_input=True)   # no NaNs in there, and it's a temp copy
             if vmin == vmax:
                 vmax = vmin + 0.01
 
-            norm = Normalize(vmin=vmin, vmax=vmax, clip=True)
-            cmap = cm.get_cmap("inferno")
+        # inferno on the burned pixels (opaque), everything else transparent
+        write_png(png_path, burn_index(data, burned, vmin, vmax), INFERNO_RGBA)
+
+    # ----- Write a PNG world file (.pgw) for location -----
+    worldfile_path = write_worldfile(png_path, transform)
 
-            # Start with fully transparent
-            h, w = data.shape
-            rgba = np.zeros((h, w, 4), dtype=np.float32)
+    print("Wrote burn-only PNG:", png_path)
+    print("Wrote world file:", worldfile_path)
 
-            # Apply colormap only to burned pixels
-            normed_vals = norm(data[burned])
-            colors = cmap(normed_vals)  # returns RGBA in [0,1]
 
-            rgba[burned] = colors
-            # Force alpha = 1 for burned pixels (opaque)
-            rgba[burned, 3] = 1.0
 
-        # Save PNG
-        plt.imsave(png_path, rgba)
 
-    # ----- Write a PNG world file (.pgw) for location -----
-    pixel_width = transform.a
-    pixel_height = transform.e  # usually negative
+def scene_cloud(s):
+    """Cloud cover of a scene-search result (9999 when we can't tell)."""
+    md = s.get("metadata")
 
-    from rasterio.transform import xy
-    x_ul, y_ul = xy(transform, 0, 0, offset="center")
+    # dict-style
+    if isinstance(md, dict):
+        try:
+            return float(md.get("cloudCoverFull",
+                                md.get("cloudCover", 9999)))
+        except (TypeError, ValueError):
+            return 9999.0
+
+    # list-style
+    if isinstance(md, list):
+        val = 9999.0
+        for item in md:
+            if not isinstance(item, dict):
+                continue
+            name = str(item.get("fieldName", "")).strip().lower()
+            v = item.get("value", "")
+            if name in (
+                "cloudcoverfull",
+                "cloudcover",
+                "cloud_cover",
+                "scene cloud cover l1",
+            ):
+                if isinstance(v, str):
+                    v = v.replace("percent", "").strip()
+                try:
+                    val = float(v)
+                except (TypeError, ValueError):
+                    pass
+        return val
 
-    worldfile_path = os.path.splitext(png_path)[0] + ".pgw"
-    with open(worldfile_path, "w") as f:
-        f.write(f"{pixel_width}\n")  # pixel size in X
-        f.write("0.0\n")             # rotation about Y
-        f.write("0.0\n")             # rotation about X
-        f.write(f"{pixel_height}\n") # pixel size in Y
-        f.write(f"{x_ul}\n")         # X of UL pixel centre
-        f.write(f"{y_ul}\n")         # Y of UL pixel centre
+    return 9999.0
 
-    print("Wrote burn-only PNG:", png_path)
-    print("Wrote world file:", worldfile_path)
 
+def tile_bbox(api_key, path, row):
+    # Path/row -> bbox (min_lon, min_lat, max_lon, max_lat)
+    bbox = wrs2_to_bbox(path, row)
+    if bbox is None:
+        search_cache = get_search_cache()
+        bbox = search_cache.get_bbox(path, row)
+        if bbox is None:
+            print(f"No WRS-2 footprint for path {path}, row {row}, asking M2M grid2ll...")
+            bbox = wrs2_to_bbox_api(api_key, path, row)
+            search_cache.put_bbox(path, row, bbox)
+    return bbox
+
+
+def _scene_acquired(s):
+    # acquisition date as YYYY-MM-DD, wherever this scene-search result keeps it
+    tc = s.get("temporalCoverage")
+    if isinstance(tc, dict) and tc.get("startDate"):
+        return str(tc["startDate"])[:10]
+    md = s.get("metadata")
+    if isinstance(md, dict):
+        for key in ("DATE_ACQUIRED", "acquisitionDate", "Date Acquired"):
+            if md.get(key):
+                return str(md[key])[:10]
+    elif isinstance(md, list):
+        for item in md:
+            if isinstance(item, dict) and str(item.get("fieldName", "")).strip().lower() in (
+                "date acquired", "acquisition date", "date_acquired"
+            ):
+                return str(item.get("value", ""))[:10] or None
+    return None
 
 
+def normalize_scene(s):
+    """The bits of a scene-search result we actually use, for the search cache."""
+    path, row = _scene_path_row_from_metadata(s)
+    return {
+        "entityId": s["entityId"],
+        "displayId": s["displayId"],
+        "path": path,
+        "row": row,
+        "acquired": _scene_acquired(s),
+        "cloud": scene_cloud(s),
+    }
 
-def download_landsat_period(api_key, start_date, end_date, path, row):
-    """
-    Given WRS-2 path/row + date range:
-      - Get bbox (from WRS2_BBOX or grid2ll)
-      - Run scene-search over that bbox + date
-      - Filter to exact WRS path/row
-      - Pick the least cloudy scene
-      - Download SR bundle, extract SR_B5, SR_B7, QA_PIXEL
 
-    Returns: dict with local file paths:
-      {
-        "nir":  "...SR_B5.TIF",
-        "swir": "...SR_B7.TIF",
-        "qa":   "...QA_PIXEL.TIF"
-      }
+def scene_from_record(rec):
+    # back to the shape scene-search returns, as far as the rest of the pipeline cares
+    return {
+        "entityId": rec["entityId"],
+        "displayId": rec["displayId"],
+        "temporalCoverage": {"startDate": rec["acquired"]},
+        "metadata": {
+            "WRS_PATH": rec["path"],
+            "WRS_ROW": rec["row"],
+            "cloudCover": rec["cloud"] if rec["cloud"] is not None else 9999.0,
+        },
+    }
+
+
+def search_tile_scenes(api_key, path, row, start_date, end_date, max_cloud=None):
     """
-    # ---- 1) Path/row -> bbox (min_lon, min_lat, max_lon, max_lat) ----
-    bbox = wrs2_to_bbox(path, row)
-    if bbox is None:
-        print(f"No bounding box in WRS2_BBOX for path {path}, row {row}, asking M2M grid2ll...")
-        bbox = wrs2_to_bbox_api(api_key, path, row)
+    Scenes for exactly this WRS path/row + date range, least cloudy first.
+    Answered from the scene-search cache when it can (see scene_search_cache),
+    otherwise scene-search over the tile bbox and the result is cached.
+    """
+    if max_cloud is None:
+        max_cloud = MAX_CLOUD_COVER
+    search_cache = get_search_cache()
 
-    min_lon, min_lat, max_lon, max_lat = bbox
-    print("Using bbox:", bbox)
+    records = search_cache.get(DATASET, path, row, start_date, end_date, max_cloud)
+    if records is not None:
+        print(f"Scene-search cache hit: {path:03d}/{row:03d} {start_date}→{end_date} ({len(records)} scene(s))")
+        return [scene_from_record(r) for r in records]
 
-    # ---- 2) Scene-search over that bbox + date range ----
-    scenes = m2m_search(api_key, bbox, start_date, end_date)
+    with span("m2m_search", path=path, row=row, start=start_date, end=end_date) as sp:
+        bbox = tile_bbox(api_key, path, row)
+        print("Using bbox:", bbox)
+        scenes = m2m_search(api_key, bbox, start_date, end_date, max_cloud=max_cloud)
+        sp.set(scenes=len(scenes))
+
+    records = []
+    for s in scenes:
+        rec = normalize_scene(s)
+        if rec["path"] == path and rec["row"] == row:
+            records.append(rec)
+    search_cache.put(DATASET, path, row, start_date, end_date, max_cloud, records)
+    return [scene_from_record(r) for r in sorted(records, key=lambda r: r["cloud"])]
 
-    if not scenes:
-        raise Exception(
-            f"No scenes found between {start_date} and {end_date} for bbox {bbox}"
-        )
 
+def pick_scene_for_tile(scenes, start_date, end_date, path, row):
+    """
+    Filter scene-search results to the exact WRS path/row and return the least
+    cloudy one. Raises if nothing matches.
+    """
     # ---- Filter to exact WRS path/row from metadata ----
     exact_scenes = []
     for s in scenes:
@@ -801,59 +1297,85 @@ def download_landsat_period(api_key, start_date, end_date, path, row):
         )
 
     # ---- Prefer the least cloudy scene ----
-    def scene_cloud(s):
-        md = s.get("metadata")
-
-        # dict-style
-        if isinstance(md, dict):
-            try:
-                return float(md.get("cloudCoverFull",
-                                    md.get("cloudCover", 9999)))
-            except (TypeError, ValueError):
-                return 9999.0
-
-        # list-style
-        if isinstance(md, list):
-            val = 9999.0
-            for item in md:
-                if not isinstance(item, dict):
-                    continue
-                name = str(item.get("fieldName", "")).strip().lower()
-                v = item.get("value", "")
-                if name in (
-                    "cloudcoverfull",
-                    "cloudcover",
-                    "cloud_cover",
-                    "scene cloud cover l1",
-                ):
-                    if isinstance(v, str):
-                        v = v.replace("percent", "").strip()
-                    try:
-                        val = float(v)
-                    except (TypeError, ValueError):
-                        pass
-            return val
-
-        return 9999.0
-
     scenes_sorted = sorted(scenes, key=scene_cloud)
     scene = scenes_sorted[0]
 
     print("Chosen scene:", scene["displayId"])
     print("  WRS from metadata:", _scene_path_row_from_metadata(scene))
     print("  Cloud cover (if available):", scene_cloud(scene))
+    return scene
+
 
-    # ---- 3) Download bundle + extract bands ----
-    band_paths = m2m_get_band_urls(api_key, scene)
+def pick_scenes_for_tile(scenes, start_date, end_date, path, row, n):
+    """
+    Up to n scenes of the exact WRS path/row, least cloudy first (for compositing).
+    Raises like pick_scene_for_tile if nothing matches.
+    """
+    first = pick_scene_for_tile(scenes, start_date, end_date, path, row)
+    others = [s for s in scenes if s is not first and _scene_path_row_from_metadata(s) == (path, row)]
+    picked = [first] + sorted(others, key=scene_cloud)[:max(0, n - 1)]
+    for s in picked[1:]:
+        print(f"  + composite scene {s['displayId']} (cloud {scene_cloud(s)})")
+    return picked
+
+
+def download_scene_bands(api_key, scene, bundle_url=None):
+    """Download bundle + extract bands for an already chosen scene."""
+    band_paths = m2m_get_band_urls(api_key, scene, bundle_url=bundle_url)
     print("Band paths:", band_paths)
 
     if not band_paths:
         raise Exception("No band paths found for scene")
-
-    # ---- 4) Return dict of file paths ----
     return band_paths
 
 
+def download_landsat_period(api_key, start_date, end_date, path, row, composite=None, composite_scenes=None):
+    """
+    Given WRS-2 path/row + date range (api_key can be a key string or an M2MClient):
+      - Get bbox (from WRS2_BBOX or grid2ll)
+      - Run scene-search over that bbox + date
+      - Filter to exact WRS path/row
+      - Pick the least cloudy scene
+      - Download SR bundle, extract SR_B5, SR_B7, QA_PIXEL
+
+    Returns: dict with local file paths:
+      {
+        "nir":  "...SR_B5.TIF",
+        "swir": "...SR_B7.TIF",
+        "qa":   "...QA_PIXEL.TIF"
+      }
+    For many tiles at once see scene_discovery.discover_scenes, which does the
+    searching / download-options / download-request in a handful of calls.
+
+    composite="median" / "latest" (default DNBR_COMPOSITE) downloads the
+    composite_scenes least cloudy scenes instead (default DNBR_COMPOSITE_SCENES)
+    and returns the band paths of their clear-sky composite, see
+    composite_scene_bands (plus "count" and "composite" entries).
+    """
+    if composite is None:
+        composite = COMPOSITE_METHOD
+    if composite_scenes is None:
+        composite_scenes = COMPOSITE_SCENES
+
+    # ---- 1 + 2) Path/row -> bbox, scene-search over that bbox + date range ----
+    # (cached, see scene_search_cache; comes back already filtered to this path/row)
+    scenes = search_tile_scenes(api_key, path, row, start_date, end_date)
+
+    if composite and composite_scenes > 1:
+        picked = pick_scenes_for_tile(scenes, start_date, end_date, path, row, composite_scenes)
+        if len(picked) > 1:
+            # each scene goes through the scene cache, so re-runs only redo the compositing
+            bands = [download_scene_bands(api_key, s) for s in picked]
+            return composite_scene_bands(bands, picked, method=composite, path=path, row=row)
+        print("Only one scene in the window, nothing to composite")
+        return download_scene_bands(api_key, picked[0])
+
+    scene = pick_scene_for_tile(scenes, start_date, end_date, path, row)
+
+    # ---- 3) Download bundle + extract bands, return dict of file paths ----
+    return download_scene_bands(api_key, scene)
+
+
 
 
 
@@ -872,8 +1394,7 @@ def wrs2_to_bbox_api(api_key, path, row):
     (min_lon, min_lat, max_lon, max_lat) in WGS84.
     Handles several coordinate formats.
     """
-    url = SERVICE_URL + "grid2ll"
-    headers = {"X-Auth-Token": api_key}
+    client, key = resolve_client(api_key)
     payload = {
         "gridType": "WRS2",
         "path": f"{path:03d}",
@@ -881,19 +1402,7 @@ def wrs2_to_bbox_api(api_key, path, row):
         "responseShape": "polygon"
     }
 
-    resp = requests.post(url, headers=headers, json=payload)
-    if resp.status_code != 200:
-        print("grid2ll HTTP status:", resp.status_code)
-        print("grid2ll response:", resp.text)
-    resp.raise_for_status()
-
-    out = resp.json()
-    if out.get("errorCode"):
-        raise RuntimeError(
-            f"grid2ll failed: {out['errorCode']} - {out.get('errorMessage')}"
-        )
-
-    data = out["data"]
+    data = client.call("grid2ll", payload, api_key=key)
     coords = data.get("coordinates")
     if coords is None:
         raise RuntimeError(f"grid2ll: unexpected data structure, no 'coordinates': {data}")
@@ -928,44 +1437,70 @@ def wrs2_to_bbox_api(api_key, path, row):
 
 # in ThePython.py
 
-def run_dnbr_job(fire_id, pre_start, pre_end, post_start, post_end, path, row, api_key):
+def run_dnbr_job(fire_id, pre_start, pre_end, post_start, post_end, path, row, api_key,
+                 streaming=None):
     """
     Full pipeline for one fire or one custom request.
     Returns dict with file paths + stats + bounds.
+    streaming=True uses process_landsat_streaming (defaults to DNBR_STREAMING).
     """
-    pre_bands = download_landsat_period(api_key, pre_start, pre_end, path, row)
-    post_bands = download_landsat_period(api_key, post_start, post_end, path, row)
+    if streaming is None:
+        streaming = STREAMING_DEFAULT
 
-    nbr_pre, nbr_post, delta, out_profile = process_landsat(
-        pre_bands["nir"], pre_bands["swir"],
-        post_bands["nir"], post_bands["swir"],
-        pre_bands["qa"],  post_bands["qa"]
-    )
+    with span("dnbr_job", fire_id=fire_id, path=path, row=row, streaming=streaming):
+        return _run_dnbr_job(fire_id, pre_start, pre_end, post_start, post_end, path, row, api_key, streaming)
 
-    # ---- write GeoTIFF ----
-    out_tif = os.path.join(OUTPUT_DIR, f"{fire_id}_delta_nbr.tif")
-    profile = out_profile.copy()
-    profile.update({
-        "driver": "GTiff",
-        "dtype": "float32",
-        "count": 1,
-        "nodata": -9999.0,
-    })
 
-    delta_to_write = np.where(
-        np.isnan(delta),
-        profile["nodata"],
-        delta
-    ).astype("float32")
+def _run_dnbr_job(fire_id, pre_start, pre_end, post_start, post_end, path, row, api_key, streaming):
+    with span("download_pre"):
+        pre_bands = download_landsat_period(api_key, pre_start, pre_end, path, row)
+    with span("download_post"):
+        post_bands = download_landsat_period(api_key, post_start, post_end, path, row)
 
-    with rasterio.open(out_tif, "w", **profile) as dst:
-        dst.write(delta_to_write, 1)
+    out_tif = os.path.join(OUTPUT_DIR, f"{fire_id}_delta_nbr.tif")
+    class_tif = class_tif_path(out_tif) if CLASS_TIF else None
+
+    timings = {}
+    if streaming:
+        # ---- stream GeoTIFF block by block ----
+        with _timed(timings, "streaming"):
+            profile, stats = process_landsat_streaming(
+                pre_bands["nir"], pre_bands["swir"],
+                post_bands["nir"], post_bands["swir"],
+                pre_bands["qa"],  post_bands["qa"],
+                out_tif, class_tif=class_tif
+            )
+    else:
+        delta, out_profile, stats = process_landsat_delta(
+            pre_bands["nir"], pre_bands["swir"],
+            post_bands["nir"], post_bands["swir"],
+            pre_bands["qa"],  post_bands["qa"],
+            nodata=DELTA_NODATA,
+            timings=timings,
+        )
+
+        # ---- write GeoTIFF (COG unless DNBR_OUTPUT_FORMAT=gtiff) ----
+        with _timed(timings, "write_tif") as sp:
+            profile = write_delta_tif(out_tif, delta, out_profile, nodata_encoded=True)
+            sp.add_bytes(os.path.getsize(out_tif))
+        if class_tif:
+            with _timed(timings, "write_class_tif") as sp:
+                write_class_tif(class_tif, classify_dnbr(delta, nodata=DELTA_NODATA), profile)
+                sp.add_bytes(os.path.getsize(class_tif))
+        del delta
 
     # ---- write classified PNG using your USGS scale ----
     out_png = os.path.join(OUTPUT_DIR, f"{fire_id}_dnbr_usgs.png")
-    export_dnbr_class_png(out_tif, out_png)   # the function we discussed earlier
+    with _timed(timings, "export_png") as sp:
+        export_dnbr_class_png(out_tif, out_png)   # reads class_tif when it's there
+        sp.add_bytes(os.path.getsize(out_png))
+
+    scars = None
+    if BURN_SCARS:
+        with _timed(timings, "vectorize") as sp:
+            scars = vectorize_scars(out_tif)
+            sp.add_bytes(os.path.getsize(scars))
 
-    stats = delta_nbr_stats(delta)            # already returns % and can include area
     bounds = get_latlon_bounds(profile)
 
     return {
@@ -977,8 +1512,11 @@ def run_dnbr_job(fire_id, pre_start, pre_end, post_start, post_end, path, row, a
         "path": path,
         "row": row,
         "tif_path": out_tif,
+        "class_tif_path": class_tif,
+        "scars_path": scars,
         "png_path": out_png,
         "stats": stats,
+        "timings": timings,
         "bounds": {
             "min_lat": bounds[0],
             "min_lon": bounds[1],
@@ -994,56 +1532,131 @@ def run_delta_nbr_pipeline(
     pre_start, pre_end,
     post_start, post_end,
     path, row,
-    tag=None
+    tag=None,
+    streaming=None,
+    progress=None,
+    composite=None,
+    composite_scenes=None,
 ):
     """
     Core function: given dates + WRS-2 path/row, run the whole pipeline
     and return useful info (paths, stats, bounds).
     This is what JS will indirectly trigger.
+    api_key can be a key string or an M2MClient (pooled session, retries, metrics).
+    streaming=True keeps memory bounded via process_landsat_streaming
+    (defaults to the DNBR_STREAMING env var).
+    progress is an optional callback, called with the name of each stage
+    as it starts ("download_pre", "download_post", "process", "export_png").
+    composite / composite_scenes: build each window from several scenes,
+    see download_landsat_period (defaults DNBR_COMPOSITE / DNBR_COMPOSITE_SCENES).
     """
-    pre_bands = download_landsat_period(api_key, pre_start, pre_end, path, row)
-    post_bands = download_landsat_period(api_key, post_start, post_end, path, row)
+    def report(stage):
+        if progress is not None:
+            progress(stage)
+
+    with span("pipeline", path=path, row=row, tag=tag):
+        report("download_pre")
+        with span("download_pre"):
+            pre_bands = download_landsat_period(api_key, pre_start, pre_end, path, row,
+                                                composite=composite, composite_scenes=composite_scenes)
+        report("download_post")
+        with span("download_post"):
+            post_bands = download_landsat_period(api_key, post_start, post_end, path, row,
+                                                 composite=composite, composite_scenes=composite_scenes)
+
+        return delta_nbr_from_bands(pre_bands, post_bands, tag=tag, streaming=streaming, progress=progress)
+
+
+def delta_nbr_from_bands(pre_bands, post_bands, tag=None, streaming=None, progress=None):
+    """
+    Raster half of run_delta_nbr_pipeline: takes the pre/post band path
+    dicts from download_landsat_period, writes the dNBR GeoTIFF + burn PNG
+    and returns the same dict (paths, stats, bounds, timings = seconds per stage).
+
+    Kept as its own top-level function so the tile scheduler can run it in a
+    worker process while other tiles are still downloading.
+    """
+    if streaming is None:
+        streaming = STREAMING_DEFAULT
+
+    with span("raster", tag=tag, streaming=streaming):
+        return _delta_nbr_from_bands(pre_bands, post_bands, tag, streaming, progress)
 
-    nbr_pre, nbr_post, delta, out_profile = process_landsat(
-        pre_bands["nir"], pre_bands["swir"],
-        post_bands["nir"], post_bands["swir"],
-        pre_bands["qa"],  post_bands["qa"]
-    )
+
+def _delta_nbr_from_bands(pre_bands, post_bands, tag, streaming, progress):
+
+    def report(stage):
+        if progress is not None:
+            progress(stage)
 
     safe_tag = str(tag).replace(" ", "_") if tag else "web"
     out_base = f"delta_nbr_{safe_tag}"
 
     out_tif = os.path.join(OUTPUT_DIR, f"{out_base}.tif")
-    out_profile.update({
-        "driver": "GTiff",
-        "dtype": "float32",
-        "count": 1,
-        "nodata": -9999.0,
-    })
-    delta_to_write = np.where(
-        np.isnan(delta),
-        out_profile["nodata"],
-        delta
-    ).astype("float32")
+    class_tif = class_tif_path(out_tif) if CLASS_TIF else None
+
+    timings = {}
+    report("process")
+    if streaming:
+        with _timed(timings, "streaming"):
+            out_profile, stats = process_landsat_streaming(
+                pre_bands["nir"], pre_bands["swir"],
+                post_bands["nir"], post_bands["swir"],
+                pre_bands["qa"],  post_bands["qa"],
+                out_tif, class_tif=class_tif
+            )
+    else:
+        delta, out_profile, stats = process_landsat_delta(
+            pre_bands["nir"], pre_bands["swir"],
+            post_bands["nir"], post_bands["swir"],
+            pre_bands["qa"],  post_bands["qa"],
+            nodata=DELTA_NODATA,
+            timings=timings,
+        )
 
-    with rasterio.open(out_tif, "w", **out_profile) as dst:
-        dst.write(delta_to_write, 1)
+        with _timed(timings, "write_tif") as sp:
+            out_profile = write_delta_tif(out_tif, delta, out_profile, nodata_encoded=True)
+            sp.add_bytes(os.path.getsize(out_tif))
+        if class_tif:
+            with _timed(timings, "write_class_tif") as sp:
+                write_class_tif(class_tif, classify_dnbr(delta, nodata=DELTA_NODATA), out_profile)
+                sp.add_bytes(os.path.getsize(class_tif))
+        del delta
 
+    report("export_png")
     out_png = os.path.join(OUTPUT_DIR, f"{out_base}.png")
     # Only show burned pixels; anything below threshold is fully transparent
-    export_burn_png_from_delta(out_tif, out_png, threshold=BURN_VIS_THRESHOLD)
+    with _timed(timings, "export_png") as sp:
+        export_burn_png_from_delta(out_tif, out_png, threshold=BURN_VIS_THRESHOLD)
+        sp.add_bytes(os.path.getsize(out_png))
 
-    bounds = get_latlon_bounds(out_profile)
+    scars = None
+    if BURN_SCARS:
+        report("vectorize")
+        with _timed(timings, "vectorize") as sp:
+            scars = vectorize_scars(out_tif)
+            sp.add_bytes(os.path.getsize(scars))
 
-    # Maybe also return stats here
-    stats = delta_nbr_stats(delta)
+    bounds = get_latlon_bounds(out_profile)
 
-    return {
+    result = {
         "tif_path": out_tif,
+        "class_tif_path": class_tif,   # uint8 severity classes, None with DNBR_CLASS_TIF=0
+        "scars_path": scars,           # burn scar polygons, None with DNBR_BURN_SCARS=0
         "png_path": out_png,
         "bounds": bounds,          # (min_lat, min_lon, max_lat, max_lon)
-        "stats": stats
+        "stats": stats,
+        "timings": timings,
     }
+    if "composite" in pre_bands or "composite" in post_bands:
+        # how many scenes went into each window (per pixel counts are in the "count" rasters)
+        result["composite"] = {
+            "pre": pre_bands.get("composite"),
+            "post": post_bands.get("composite"),
+            "pre_count_path": pre_bands.get("count"),
+            "post_count_path": post_bands.get("count"),
+        }
+    return result
 
 
 
@@ -1060,14 +1673,16 @@ def export_png_from_tif(tif_path, png_path):
 
         # Mask nodata to NaN
         if nodata is not None:
-            data = np.where(data == nodata, np.nan, data)
+            data[data == nodata] = np.nan   # data is already our own float32 copy
 
         valid = np.isfinite(data)
 
         if np.any(valid):
             # Use percentiles so the contrast looks good
-            vmin = np.nanpercentile(data[valid], 2)
-            vmax = np.nanpercentile(data[valid], 98)
+            vals = data[valid]
+            vmin = np.percentile(vals, 2, overwrite_input=True)   # scalar q keeps float32, like nanpercentile did
+            vmax = np.percentile(vals, 98, overwrite_input=True)
+            del vals
             if vmin == vmax:
                 vmin = np.nanmin(data[valid])
                 vmax = np.nanmax(data[valid])
@@ -1076,24 +1691,10 @@ def export_png_from_tif(tif_path, png_path):
             vmin, vmax = 0.0, 1.0
 
         # Save PNG with a colormap and explicit scaling
-        plt.imsave(png_path, data, cmap="inferno", vmin=vmin, vmax=vmax)
+        write_png(png_path, stretch_index(data, vmin, vmax), INFERNO_RGBA)
 
     # ----- Write a PNG world file (.pgw) for location -----
-    # Pixel size (x,y)
-    pixel_width = transform.a
-    pixel_height = transform.e  # usually negative
-
-    # Upper-left pixel *center* in the raster CRS
-    x_ul, y_ul = xy(transform, 0, 0, offset="center")
-
-    worldfile_path = os.path.splitext(png_path)[0] + ".pgw"
-    with open(worldfile_path, "w") as f:
-        f.write(f"{pixel_width}\n")  # pixel size in X
-        f.write("0.0\n")             # rotation about Y (usually 0)
-        f.write("0.0\n")             # rotation about X (usually 0)
-        f.write(f"{pixel_height}\n") # pixel size in Y (negative for north-up)
-        f.write(f"{x_ul}\n")         # X of center of upper-left pixel
-        f.write(f"{y_ul}\n")         # Y of center of upper-left pixel
+    worldfile_path = write_worldfile(png_path, transform)
 
     print("Wrote PNG:", png_path)
     print("Wrote world file:", worldfile_path)
@@ -1103,15 +1704,14 @@ def export_png_from_tif(tif_path, png_path):
 def m2m_logout(api_key):
     """
     Optional: log out to invalidate the API key.
+    api_key can be a key string or an M2MClient.
     """
-    url = SERVICE_URL + "logout"
-    headers = {"X-Auth-Token": api_key}
     try:
-        resp = requests.post(url, headers=headers, json=None)
-        if resp.ok:
-            print("Logged out of M2M.")
+        if isinstance(api_key, M2MClient):
+            api_key.logout()
         else:
-            print("Logout returned status:", resp.status_code)
+            get_default_client().call("logout", None, api_key=api_key)
+        print("Logged out of M2M.")
     except Exception as e:
         print("Logout failed:", e)
 
@@ -1119,6 +1719,164 @@ def m2m_logout(api_key):
 
 from rasterio.transform import array_bounds
 from pyproj import Transformer
+import rasterio.shutil
+
+
+def convert_to_cog(src_path, dst_path, overview_resampling=None, predictor=3):
+    """
+    Copy src_path into a cloud-optimized GeoTIFF at dst_path: 512px tiles,
+    DEFLATE/ZSTD + predictor, internal overviews (average, nodata aware),
+    header + overviews up front so readers only fetch the windows / zoom levels they need.
+    Class rasters pass overview_resampling="mode" (averaging class codes makes no sense)
+    and predictor=2, which the old-GDAL path needs for integers.
+    """
+    if overview_resampling is None:
+        overview_resampling = COG_OVERVIEW_RESAMPLING
+    with rasterio.Env() as env:
+        has_cog_driver = "COG" in env.drivers()
+
+    if has_cog_driver:
+        rasterio.shutil.copy(
+            src_path, dst_path,
+            driver="COG",
+            compress=COG_COMPRESS,
+            predictor="YES",              # floating point predictor for float32, horizontal for ints
+            blocksize=COG_BLOCKSIZE,
+            overview_resampling=overview_resampling,
+            BIGTIFF="IF_SAFER",
+        )
+        return dst_path
+
+    # older GDAL: tiled copy, overviews on it, then a copy that puts them up front
+    tmp_path = dst_path + ".ovr.tif"
+    rasterio.shutil.copy(src_path, tmp_path, driver="GTiff", tiled=True,
+                         blockxsize=COG_BLOCKSIZE, blockysize=COG_BLOCKSIZE)
+    with rasterio.open(tmp_path, "r+") as ds:
+        factors = []
+        f = 2
+        while max(ds.width, ds.height) // f >= COG_BLOCKSIZE:
+            factors.append(f)
+            f *= 2
+        if factors:
+            ds.build_overviews(factors, Resampling[overview_resampling])
+    rasterio.shutil.copy(
+        tmp_path, dst_path,
+        driver="GTiff", tiled=True, blockxsize=COG_BLOCKSIZE, blockysize=COG_BLOCKSIZE,
+        compress=COG_COMPRESS, predictor=predictor, copy_src_overviews=True,
+    )
+    os.remove(tmp_path)
+    return dst_path
+
+
+def delta_tif_profile(profile):
+    # float32 + nodata -9999 on top of the source scene profile, same as it's always been
+    out = profile.copy()
+    out.update({
+        "driver": "GTiff",
+        "dtype": "float32",
+        "count": 1,
+        "nodata": DELTA_NODATA,
+    })
+    return out
+
+
+def write_delta_tif(out_tif, delta, profile, output_format=None, nodata_encoded=False):
+    """
+    Write a dNBR array (NaN = no data) as float32 with nodata -9999.
+    output_format "cog" (default, DNBR_OUTPUT_FORMAT) writes a COG, "gtiff" the plain GeoTIFF.
+    nodata_encoded=True means delta already has -9999 in it (fused_dnbr with
+    nodata set) and is written as is, without the extra full-size copy.
+    Returns the profile that was written with.
+    """
+    if output_format is None:
+        output_format = OUTPUT_FORMAT
+    profile = delta_tif_profile(profile)
+
+    if nodata_encoded:
+        delta_to_write = delta.astype("float32", copy=False)
+    else:
+        delta_to_write = np.where(
+            np.isnan(delta),
+            profile["nodata"],
+            delta
+        ).astype("float32")
+
+    if output_format != "cog":
+        with rasterio.open(out_tif, "w", **profile) as dst:
+            dst.write(delta_to_write, 1)
+        return profile
+
+    # plain scratch file first, the COG driver can only copy from an existing dataset
+    tmp_path = out_tif + ".tmp.tif"
+    with rasterio.open(tmp_path, "w", **profile) as dst:
+        dst.write(delta_to_write, 1)
+    del delta_to_write
+    try:
+        convert_to_cog(tmp_path, out_tif)
+    finally:
+        os.remove(tmp_path)
+    return profile
+
+
+def vectorize_scars(tif_path):
+    """Burn scar polygons of a dNBR GeoTIFF next to it (burn_scars.vectorize_burn_scars), returns the path."""
+    from burn_scars import vectorize_burn_scars   # burn_scars imports this module
+    return vectorize_burn_scars(tif_path)["path"]
+
+
+def class_tif_path(tif_path):
+    """Where the uint8 class GeoTIFF of a dNBR GeoTIFF goes: delta_nbr_x.tif -> delta_nbr_x_class.tif"""
+    return os.path.splitext(tif_path)[0] + "_class.tif"
+
+
+def fresh_class_tif(tif_path):
+    """The class GeoTIFF of tif_path if there is one at least as new as the dNBR, else None."""
+    path = class_tif_path(tif_path)
+    try:
+        if os.stat(path).st_mtime_ns >= os.stat(tif_path).st_mtime_ns:
+            return path
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def class_tif_profile(profile):
+    # uint8 class codes (classify_dnbr), 0 = background / nodata
+    out = profile.copy()
+    out.update({
+        "driver": "GTiff",
+        "dtype": "uint8",
+        "count": 1,
+        "nodata": CLASS_NODATA,
+    })
+    return out
+
+
+def write_class_tif(out_tif, classes, profile, output_format=None):
+    """
+    Write a classify_dnbr array as a uint8 GeoTIFF (COG with mode overviews unless
+    DNBR_OUTPUT_FORMAT=gtiff). 1 byte/pixel, so the class PNG and the usgs tiles
+    read a quarter of what the float32 dNBR costs and skip the classification.
+    Returns the profile that was written with.
+    """
+    if output_format is None:
+        output_format = OUTPUT_FORMAT
+    profile = class_tif_profile(profile)
+
+    if output_format != "cog":
+        with rasterio.open(out_tif, "w", **profile) as dst:
+            dst.write(classes, 1)
+        return profile
+
+    tmp_path = out_tif + ".tmp.tif"
+    with rasterio.open(tmp_path, "w", **profile) as dst:
+        dst.write(classes, 1)
+    try:
+        convert_to_cog(tmp_path, out_tif, overview_resampling="mode", predictor=2)
+    finally:
+        os.remove(tmp_path)
+    return profile
+
 
 def get_latlon_bounds(profile):
     """
@@ -1145,49 +1903,485 @@ def get_latlon_bounds(profile):
 
 #------------------below i do my functions , most of them being inside a mega function: process landsat--------------------------------------------------
 
-def process_landsat(pre_nir_path, pre_swir_path, post_nir_path, post_swir_path, qa_pre_path, qa_post_path):
-
-    #these are the loadband and load cloud mask functions
-    nir_pre, pre_profile = load_band(pre_nir_path)
-    swir_pre, _ = load_band(pre_swir_path)
-    mask_pre = load_cloud_mask(qa_pre_path)
-
-    nir_post, post_profile = load_band(post_nir_path)
-    swir_post, _ = load_band(post_swir_path)
-    mask_post = load_cloud_mask(qa_post_path)
-
-
-    #now for the combination of masks (but first i need to match them up using my align_raster function bc theyre not identical pixle locations)
-    mask_post_aligned = align_mask(mask_post, post_profile, pre_profile)
-    mask_both = mask_pre | mask_post_aligned
-    #print("Mask Pre True count:", np.sum(mask_pre)) 
-    #print("Mask Post True count:", np.sum(mask_post))
-    #print("Mask Both True count:", np.sum(mask_both)) 
-    #print("Mask Both total pixels:", mask_both.size)
-    #print("Mask Both True %:", np.sum(mask_both) / mask_both.size * 100)
-
-    #this is realigning postfire bands to prefire bands 
-    nir_post_aligned = align_raster(nir_post, post_profile, pre_profile)
-    swir_post_aligned = align_raster(swir_post, post_profile, pre_profile)
-    #print("Pre NIR min/max:", np.nanmin(nir_pre), np.nanmax(nir_pre))
-    #print("Pre SWIR min/max:", np.nanmin(swir_pre), np.nanmax(swir_pre))
-    #print("Post NIR (aligned) min/max:", np.nanmin(nir_post_aligned), np.nanmax(nir_post_aligned))
-    #print("Post SWIR (aligned) min/max:", np.nanmin(swir_post_aligned), np.nanmax(swir_post_aligned))
-
-    
+def process_landsat(pre_nir_path, pre_swir_path, post_nir_path, post_swir_path, qa_pre_path, qa_post_path,
+                    qa_flags=None):
+    """
+    Returns (nbr_pre, nbr_post, delta, pre_profile), delta with NaN for no data.
+    The two NBR scenes cost two more full-size arrays; if all you need is the
+    dNBR, process_landsat_delta does it in one chunked pass.
+    qa_flags: which QA_PIXEL flags to drop (qa_mask.QA_MASK_FLAGS by default).
+    """
+    nir_pre, swir_pre, nir_post, swir_post, mask_both, pre_profile = _load_aligned_bands(
+        pre_nir_path, pre_swir_path, post_nir_path, post_swir_path, qa_pre_path, qa_post_path,
+        qa_flags=qa_flags
+    )
+    mask_both = as_bool(mask_both)
     #compute nbr
     nbr_pre = compute_nbr(nir_pre, swir_pre, mask_both)
-    nbr_post = compute_nbr(nir_post_aligned, swir_post_aligned, mask_both)
-
+    nbr_post = compute_nbr(nir_post, swir_post, mask_both)
     #delta nbr
     delta = compute_delta_nbr(nbr_pre, nbr_post)
-
     #compute stats
-    stats = delta_nbr_stats(delta)
-    print(stats)
+    print(delta_nbr_stats(delta))
     return nbr_pre, nbr_post, delta, pre_profile
 
 
+def process_landsat_delta(pre_nir_path, pre_swir_path, post_nir_path, post_swir_path, qa_pre_path, qa_post_path,
+                          nodata=None, timings=None, qa_flags=None):
+    """
+    process_landsat through fused_dnbr: returns (delta, pre_profile, stats).
+    dNBR is written over the pre NIR band, so on top of the bands themselves
+    only a few chunk-sized buffers get allocated. With nodata set (-9999) the
+    array comes back ready for write_delta_tif(..., nodata_encoded=True).
+    Pass a dict as timings to get seconds per stage (load_pre, load_post, align, dnbr).
+    The cloud masks stay bit-packed the whole way with DNBR_QA_PACKED=1.
+    """
+    nir_pre, swir_pre, nir_post, swir_post, mask_both, pre_profile = _load_aligned_bands(
+        pre_nir_path, pre_swir_path, post_nir_path, post_swir_path, qa_pre_path, qa_post_path, timings,
+        qa_flags=qa_flags
+    )
+    with _timed(timings, "dnbr") as sp:
+        delta, acc = fused_dnbr(nir_pre, swir_pre, nir_post, swir_post, mask_both, out=nir_pre, nodata=nodata)
+        sp.add_array("delta", delta)
+    stats = delta_nbr_stats_finish(acc)
+    print(stats)
+    if timings is not None:
+        print("Stage timings (s):", timings)
+    return delta, pre_profile, stats
+
+
+def _load_aligned_bands(pre_nir_path, pre_swir_path, post_nir_path, post_swir_path, qa_pre_path, qa_post_path,
+                        timings=None, qa_flags=None):
+
+    #these are the loadband and load cloud mask functions
+    #pre NIR / SWIR are two separate arrays, not one stack: process_landsat_delta writes the dNBR over
+    #the pre NIR, and a view into a (2, h, w) stack would keep the pre SWIR alive as long as the delta
+    #post is one stack (both bands go through a single warp) and is gone once the dNBR is done
+    #masks come back as PackedMask with DNBR_QA_PACKED=1, bool arrays otherwise
+    with _timed(timings, "load_pre") as sp:
+        (nir_pre, swir_pre), pre_profile = load_bands([pre_nir_path, pre_swir_path])
+        mask_pre = load_cloud_mask(qa_pre_path, flags=qa_flags)
+        sp.add_array("nir", nir_pre)
+        sp.add_array("swir", swir_pre)
+        sp.add_array("mask", mask_pre)
+
+    with _timed(timings, "load_post") as sp:
+        post, post_profile = load_band_stack([post_nir_path, post_swir_path])
+        mask_post = load_cloud_mask(qa_post_path, flags=qa_flags)
+        sp.add_array("bands", post)
+        sp.add_array("mask", mask_post)
+
+    with _timed(timings, "align") as sp:
+        #now for the combination of masks (but first i need to match them up bc theyre not always identical pixle locations)
+        #same grid -> OR them as they are (byte-wise over the packed bits), no warp
+        same_grid = (grid_offset(post_profile, pre_profile) == (0, 0)
+                     and (post_profile['height'], post_profile['width']) == (pre_profile['height'], pre_profile['width']))
+        if not same_grid:
+            mask_post = align_mask(mask_post, post_profile, pre_profile)
+        mask_both = mask_pre
+        mask_both |= mask_post
+        del mask_post
+
+        #this is realigning postfire bands to prefire bands, NIR + SWIR in one warp
+        #(free when the scenes share the grid, a plain shifted copy when they're whole pixels apart)
+        post = align_stack(post, post_profile, pre_profile, Resampling.bilinear)
+        sp.add_array("bands", post)
+
+    return nir_pre, swir_pre, post[0], post[1], mask_both, pre_profile
+
+
+#------------------streaming version of process_landsat: same maths, but one block of rows at a time--------------------------------------------------
+
+def _stream_block_rows(width, height, max_memory_mb):
+    # how many pre-grid rows fit under the memory ceiling (always at least 1)
+    budget = int(max_memory_mb * 1024 * 1024)
+    rows = budget // max(1, width * STREAM_BYTES_PER_PIXEL)
+    return int(max(1, min(height, rows)))
+
+
+def _read_matching_window(src, dst_bounds, dst_crs, pad=2):
+    """
+    Read only the part of src that covers dst_bounds (given in dst_crs), plus a
+    couple of pixels of padding so bilinear resampling has its neighbours.
+    Returns (array, window_transform) or (None, None) if src doesn't cover it.
+    """
+    left, bottom, right, top = transform_bounds(dst_crs, src.crs, *dst_bounds, densify_pts=21)
+    win = from_bounds(left, bottom, right, top, transform=src.transform)
+
+    col0 = max(0, int(math.floor(win.col_off)) - pad)
+    row0 = max(0, int(math.floor(win.row_off)) - pad)
+    col1 = min(src.width, int(math.ceil(win.col_off + win.width)) + pad)
+    row1 = min(src.height, int(math.ceil(win.row_off + win.height)) + pad)
+    if col1 <= col0 or row1 <= row0:
+        return None, None
+
+    win = Window(col0, row0, col1 - col0, row1 - row0)
+    return src.read(1, window=win), src.window_transform(win)
+
+
+def _align_window(src_arr, src_transform, src_crs, dst_shape, dst_transform, dst_crs, dtype, resampling):
+    # same as align_raster / align_mask but onto one block of the target grid
+    dst = np.zeros(dst_shape, dtype=dtype)
+    if src_arr is None:
+        return dst
+    reproject(
+        source=src_arr,
+        destination=dst,
+        src_transform=src_transform,
+        src_crs=src_crs,
+        dst_transform=dst_transform,
+        dst_crs=dst_crs,
+        resampling=resampling,
+        num_threads=WARP_THREADS,
+    )
+    return dst
+
+
+def _read_on_grid(src, offset, win, dtype):
+    """
+    Block win of the target grid read straight from a source that sits a
+    whole number of pixels away on the same grid (grid_offset), 0 where it
+    doesn't reach. None if it doesn't overlap the block at all.
+    """
+    row, col = offset
+    h, w = int(win.height), int(win.width)
+    r0, c0 = int(win.row_off) - row, int(win.col_off) - col   # block in source pixel coords
+    rr0, rr1 = max(0, r0), min(src.height, r0 + h)
+    cc0, cc1 = max(0, c0), min(src.width, c0 + w)
+    if rr1 <= rr0 or cc1 <= cc0:
+        return None
+    dst = np.zeros((h, w), dtype=dtype)
+    dst[rr0 - r0:rr1 - r0, cc0 - c0:cc1 - c0] = src.read(1, window=Window(cc0, rr0, cc1 - cc0, rr1 - rr0))
+    return dst
+
+
+def process_landsat_streaming(pre_nir_path, pre_swir_path, post_nir_path, post_swir_path,
+                              qa_pre_path, qa_post_path, out_tif, max_memory_mb=None,
+                              output_format=None, qa_flags=None, class_tif=None):
+    """
+    Bounded-memory version of process_landsat. Walks the pre-scene grid in
+    blocks of rows, reprojects only the matching window of the post scene,
+    computes masked dNBR for the block and writes it straight into out_tif.
+
+    Nothing full-scene ever sits in memory, so nbr_pre / nbr_post / delta are
+    not returned. Returns (out_profile, stats) where stats is the same dict
+    delta_nbr_stats gives, accumulated block by block.
+    With output_format "cog" the strips go to a scratch file that is then
+    copied into a COG (the COG driver streams, so memory stays bounded).
+    class_tif: also classify each block (classify_dnbr) into a uint8 class
+    GeoTIFF there, same pass, same layout.
+    """
+    if max_memory_mb is None:
+        max_memory_mb = STREAM_MAX_MEMORY_MB
+    if output_format is None:
+        output_format = OUTPUT_FORMAT
+    strip_tif = out_tif + ".strips.tif" if output_format == "cog" else out_tif
+    class_strip_tif = None
+    if class_tif:
+        class_strip_tif = class_tif + ".strips.tif" if output_format == "cog" else class_tif
+
+    with rasterio.open(pre_nir_path) as pre_nir, \
+         rasterio.open(pre_swir_path) as pre_swir, \
+         rasterio.open(qa_pre_path) as pre_qa, \
+         rasterio.open(post_nir_path) as post_nir, \
+         rasterio.open(post_swir_path) as post_swir, \
+         rasterio.open(qa_post_path) as post_qa:
+
+        out_profile = delta_tif_profile(pre_nir.profile)
+        # strip layout so each block of rows is a straight append
+        out_profile.pop("blockxsize", None)
+        out_profile.pop("blockysize", None)
+        out_profile["tiled"] = False
+
+        width, height = pre_nir.width, pre_nir.height
+        dst_crs = pre_nir.crs
+        block_rows = _stream_block_rows(width, height, max_memory_mb)
+        print(f"Streaming {width}x{height} in blocks of {block_rows} rows (~{max_memory_mb} MB ceiling)")
+
+        acc = delta_nbr_stats_init()
+        post_offset = grid_offset(post_nir.profile, pre_nir.profile)
+        if post_offset is not None:
+            print(f"Post scene is on the pre grid (offset {post_offset} px), skipping reprojection")
+
+        class_out = nullcontext()
+        if class_strip_tif:
+            class_out = rasterio.open(class_strip_tif, "w", **class_tif_profile(out_profile))
+            class_codes = np.empty((block_rows, width), dtype=np.uint8)
+
+        def write_block(delta, win):
+            dst.write(delta, 1, window=win)
+            if class_dst is not None:
+                classes = classify_dnbr(delta, out=class_codes[:delta.shape[0]], nodata=out_profile["nodata"])
+                class_dst.write(classes, 1, window=win)
+
+        with rasterio.open(strip_tif, "w", **out_profile) as dst, class_out as class_dst:
+            for row_off in range(0, height, block_rows):
+                win = Window(0, row_off, width, min(block_rows, height - row_off))
+                shape = (int(win.height), width)
+                win_transform = pre_nir.window_transform(win)
+                win_bounds = window_bounds(win, pre_nir.transform)
+
+                nir_pre = pre_nir.read(1, window=win).astype('float32')
+                swir_pre = pre_swir.read(1, window=win).astype('float32')
+                mask_pre = qa_obstruction_mask(pre_qa.read(1, window=win), qa_flags)
+
+                if post_offset is not None:
+                    # same grid, whole pixels apart: read the post block directly, no warp
+                    qa = _read_on_grid(post_qa, post_offset, win, np.uint16)
+                    mask_post = qa_obstruction_mask(qa, qa_flags) if qa is not None else np.ones(shape, dtype=bool)
+                    nir_post = _read_on_grid(post_nir, post_offset, win, np.float32)
+                    swir_post = _read_on_grid(post_swir, post_offset, win, np.float32)
+                    if nir_post is None:
+                        nir_post = np.zeros(shape, dtype=np.float32)
+                        swir_post = np.zeros(shape, dtype=np.float32)
+                    mask_pre |= mask_post
+                    delta, _ = fused_dnbr(nir_pre, swir_pre, nir_post, swir_post, mask_pre,
+                                          out=nir_pre, nodata=out_profile["nodata"], acc=acc)
+                    write_block(delta, win)
+                    continue
+
+                # post-fire block, pulled from only the part of the post scene that covers it
+                arr, tr = _read_matching_window(post_qa, win_bounds, dst_crs)
+                mask_post_src = qa_obstruction_mask(arr, qa_flags).view(np.uint8) if arr is not None else None
+                mask_post = _align_window(mask_post_src, tr, post_qa.crs, shape, win_transform, dst_crs,
+                                          np.uint8, Resampling.nearest).view(bool)
+                if arr is None:
+                    # post scene doesn't reach this block at all
+                    mask_post[:] = True
+
+                arr, tr = _read_matching_window(post_nir, win_bounds, dst_crs)
+                nir_post = _align_window(arr.astype('float32') if arr is not None else None, tr, post_nir.crs,
+                                         shape, win_transform, dst_crs, np.float32, Resampling.bilinear)
+                arr, tr = _read_matching_window(post_swir, win_bounds, dst_crs)
+                swir_post = _align_window(arr.astype('float32') if arr is not None else None, tr, post_swir.crs,
+                                          shape, win_transform, dst_crs, np.float32, Resampling.bilinear)
+
+                mask_pre |= mask_post
+                delta, _ = fused_dnbr(nir_pre, swir_pre, nir_post, swir_post, mask_pre,
+                                      out=nir_pre, nodata=out_profile["nodata"], acc=acc)
+
+                write_block(delta, win)
+
+    if strip_tif != out_tif:
+        try:
+            convert_to_cog(strip_tif, out_tif)
+        finally:
+            os.remove(strip_tif)
+    if class_strip_tif and class_strip_tif != class_tif:
+        try:
+            convert_to_cog(class_strip_tif, class_tif, overview_resampling="mode", predictor=2)
+        finally:
+            os.remove(class_strip_tif)
+
+    stats = delta_nbr_stats_finish(acc)
+    print(stats)
+    return out_profile, stats
+
+
+
+
+#------------------multi-scene compositing: several scenes of one window -> one clear-sky scene--------------------------------------------------
+
+# rough bytes per target pixel and scene while a block is in flight:
+# NIR + SWIR float32 + clear flag, the sorted copies for the median, plus the outputs
+COMPOSITE_BYTES_PER_PIXEL_PER_SCENE = 26
+
+
+def _composite_block_rows(width, height, n_scenes, max_memory_mb):
+    budget = int(max_memory_mb * 1024 * 1024)
+    rows = budget // max(1, width * (n_scenes * COMPOSITE_BYTES_PER_PIXEL_PER_SCENE + 8))
+    return int(max(1, min(height, rows)))
+
+
+def _composite_scene_block(srcs, offset, win, shape, win_bounds, win_transform, dst_crs, qa_flags):
+    """
+    NIR, SWIR (float32) and clear flags of one scene on one block of the
+    reference grid, None if the scene doesn't reach the block.
+    """
+    nir_src, swir_src, qa_src = srcs
+    if offset is not None:
+        qa = _read_on_grid(qa_src, offset, win, np.uint16)
+        if qa is None:
+            return None
+        clear = ~qa_obstruction_mask(qa, qa_flags)
+        nir = _read_on_grid(nir_src, offset, win, np.float32)
+        swir = _read_on_grid(swir_src, offset, win, np.float32)
+    else:
+        arr, tr = _read_matching_window(qa_src, win_bounds, dst_crs)
+        if arr is None:
+            return None
+        # warp the clear flags (not the obstruction mask) so pixels outside the scene come out not clear
+        clear_src = (~qa_obstruction_mask(arr, qa_flags)).view(np.uint8)
+        clear = _align_window(clear_src, tr, qa_src.crs, shape, win_transform, dst_crs,
+                              np.uint8, Resampling.nearest).view(bool)
+        arr, tr = _read_matching_window(nir_src, win_bounds, dst_crs)
+        nir = _align_window(arr.astype('float32') if arr is not None else None, tr, nir_src.crs,
+                            shape, win_transform, dst_crs, np.float32, Resampling.bilinear)
+        arr, tr = _read_matching_window(swir_src, win_bounds, dst_crs)
+        swir = _align_window(arr.astype('float32') if arr is not None else None, tr, swir_src.crs,
+                             shape, win_transform, dst_crs, np.float32, Resampling.bilinear)
+    # DN 0 is fill in the SR bands (and what _read_on_grid pads with)
+    clear &= (nir > 0) & (swir > 0)
+    return nir, swir, clear
+
+
+def _median_composite(stack, clear, count):
+    """nanmedian over the clear observations of each pixel, via one sort (NaN sorts last)."""
+    stack[~clear] = np.nan
+    stack.sort(axis=0)
+    lo = np.maximum(count.astype(np.intp) - 1, 0) // 2
+    hi = count.astype(np.intp) // 2
+    lo_val = np.take_along_axis(stack, lo[None], axis=0)[0]
+    hi_val = np.take_along_axis(stack, np.minimum(hi, stack.shape[0] - 1)[None], axis=0)[0]
+    return (lo_val + hi_val) * 0.5
+
+
+def composite_scene_bands(scene_bands, scenes, method=None, path=None, row=None, out_dir=None,
+                          max_memory_mb=None, qa_flags=None):
+    """
+    Per-pixel clear-sky composite of several scenes of the same path/row.
+
+    scene_bands: band path dicts from download_scene_bands, scenes: the matching
+    scene-search results, least cloudy first (its grid is the composite's grid).
+      median - median of the clear observations, NIR and SWIR each
+      latest - the most recent clear observation
+    Walks the grid in blocks of rows, so memory stays around max_memory_mb
+    (DNBR_STREAM_MAX_MEMORY_MB) whatever the number of scenes.
+
+    Writes composite SR_B5 / SR_B7 (uint16 DN like the originals), a QA_PIXEL
+    that is clear where at least one scene was clear and fill elsewhere, and
+    a uint8 raster of how many scenes contributed to each pixel. Returns the
+    same dict as download_scene_bands plus "count" (that raster) and
+    "composite" (method, scenes, pixels per contributing-scene count).
+    Composites are kept in COMPOSITE_DIR and reused when the same scenes come back.
+    """
+    if method is None:
+        method = COMPOSITE_METHOD or "median"
+    method = method.lower()
+    if method not in COMPOSITE_METHODS:
+        raise RuntimeError(f"Unknown composite method {method!r}, expected one of {', '.join(COMPOSITE_METHODS)}")
+    if max_memory_mb is None:
+        max_memory_mb = STREAM_MAX_MEMORY_MB
+    if out_dir is None:
+        out_dir = COMPOSITE_DIR
+    os.makedirs(out_dir, exist_ok=True)
+
+    ids = [s["displayId"] for s in scenes]
+    dates = [(_scene_acquired(s) or "0000-00-00").replace("-", "") for s in scenes]
+    qa_bits = qa_bitmask(qa_flags)
+    digest = hashlib.sha1(json.dumps([method, ids, qa_bits]).encode()).hexdigest()[:10]
+    pr = f"{path:03d}{row:03d}" if path is not None and row is not None else "000000"
+    # the date in the 4th "_" field, where get_landsat_date_from_band_path looks for it
+    base = os.path.join(out_dir, f"COMP_{method.upper()}_{pr}_{max(dates)}_{digest}")
+    out = {
+        "nir": base + "_SR_B5.TIF",
+        "swir": base + "_SR_B7.TIF",
+        "qa": base + "_QA_PIXEL.TIF",
+        "count": base + "_COUNT.TIF",
+    }
+    meta_path = base + ".json"
+
+    if os.path.exists(meta_path) and all(os.path.exists(p) for p in out.values()):
+        with open(meta_path) as f:
+            out["composite"] = json.load(f)
+        print(f"Composite cache hit: {os.path.basename(base)}")
+        return out
+
+    # newest last: "latest" paints scenes in this order, so the most recent clear pixel wins
+    order = sorted(range(len(scenes)), key=lambda i: dates[i])
+
+    with span("composite", method=method, scenes=len(scenes), path=path, row=row) as sp:
+        readers = []
+        try:
+            for b in scene_bands:
+                readers.append((rasterio.open(b["nir"]), rasterio.open(b["swir"]), rasterio.open(b["qa"])))
+            ref = readers[0][0]
+            width, height, dst_crs = ref.width, ref.height, ref.crs
+            offsets = [grid_offset(r[0].profile, ref.profile) for r in readers]
+
+            band_profile = ref.profile.copy()
+            band_profile.update({
+                "driver": "GTiff", "dtype": "uint16", "count": 1, "nodata": 0,
+                "tiled": True, "blockxsize": COG_BLOCKSIZE, "blockysize": COG_BLOCKSIZE,
+                "compress": COG_COMPRESS, "predictor": 2, "BIGTIFF": "IF_SAFER",
+            })
+            qa_profile = dict(band_profile, nodata=None)
+            count_profile = dict(band_profile, dtype="uint8", nodata=None)
+
+            block_rows = _composite_block_rows(width, height, len(readers), max_memory_mb)
+            print(f"Compositing {len(readers)} scenes ({method}) over {width}x{height} "
+                  f"in blocks of {block_rows} rows (~{max_memory_mb} MB ceiling)")
+
+            tmp = {k: f"{p}.{os.getpid()}.tmp.tif" for k, p in out.items()}
+            histogram = np.zeros(len(readers) + 1, dtype=np.int64)
+            with rasterio.open(tmp["nir"], "w", **band_profile) as nir_dst, \
+                 rasterio.open(tmp["swir"], "w", **band_profile) as swir_dst, \
+                 rasterio.open(tmp["qa"], "w", **qa_profile) as qa_dst, \
+                 rasterio.open(tmp["count"], "w", **count_profile) as count_dst:
+                for row_off in range(0, height, block_rows):
+                    win = Window(0, row_off, width, min(block_rows, height - row_off))
+                    shape = (int(win.height), width)
+                    win_transform = ref.window_transform(win)
+                    win_bounds = window_bounds(win, ref.transform)
+
+                    blocks = []
+                    for i in order:
+                        b = _composite_scene_block(readers[i], offsets[i], win, shape, win_bounds,
+                                                   win_transform, dst_crs, qa_flags)
+                        if b is not None:
+                            blocks.append(b)
+
+                    count = np.zeros(shape, dtype=np.uint8)
+                    if not blocks:
+                        nir_out = np.zeros(shape, dtype=np.float32)
+                        swir_out = np.zeros(shape, dtype=np.float32)
+                    elif method == "latest":
+                        nir_out = np.zeros(shape, dtype=np.float32)
+                        swir_out = np.zeros(shape, dtype=np.float32)
+                        for nir, swir, clear in blocks:
+                            nir_out[clear] = nir[clear]
+                            swir_out[clear] = swir[clear]
+                            count += clear
+                    else:
+                        clear = np.stack([b[2] for b in blocks])
+                        count = clear.sum(axis=0, dtype=np.uint8)
+                        nir_out = _median_composite(np.stack([b[0] for b in blocks]), clear, count)
+                        swir_out = _median_composite(np.stack([b[1] for b in blocks]), clear, count)
+                    del blocks
+
+                    have = count > 0
+                    nir_dst.write(np.where(have, np.rint(nir_out), 0).astype(np.uint16), 1, window=win)
+                    swir_dst.write(np.where(have, np.rint(swir_out), 0).astype(np.uint16), 1, window=win)
+                    qa_dst.write(np.where(have, COMPOSITE_QA_CLEAR, COMPOSITE_QA_FILL).astype(np.uint16),
+                                 1, window=win)
+                    count_dst.write(count, 1, window=win)
+                    histogram += np.bincount(count.ravel(), minlength=len(readers) + 1)
+        finally:
+            for r in readers:
+                for ds in r:
+                    ds.close()
+
+        for k, p in out.items():
+            os.replace(tmp[k], p)
+
+        total = int(histogram.sum())
+        info = {
+            "method": method,
+            "scenes": ids,
+            "acquired": dates,
+            "pixels_by_scene_count": [int(n) for n in histogram],
+            "clear_fraction": round(1.0 - histogram[0] / total, 4) if total else 0.0,
+            "mean_scene_count": round(float((histogram * np.arange(len(histogram))).sum()) / total, 3) if total else 0.0,
+        }
+        with open(meta_path, "w") as f:
+            json.dump(info, f, indent=1)
+        sp.set(clear_fraction=info["clear_fraction"], mean_scene_count=info["mean_scene_count"])
+        sp.add_bytes(sum(os.path.getsize(p) for p in out.values()))
+
+    print(f"Composite {os.path.basename(base)}: {info['clear_fraction'] * 100:.1f}% clear, "
+          f"{info['mean_scene_count']} scenes per pixel on average")
+    out["composite"] = info
+    return out
 
 
 #-----------------------------------------------------------------------------------
@@ -1214,27 +2408,16 @@ if __name__ == "__main__":
     pre_bands = download_landsat_period(api_key, pre_start, pre_end, path, row)
     post_bands = download_landsat_period(api_key, post_start, post_end, path, row)
 
-    nbr_pre, nbr_post, delta, out_profile = process_landsat(
+    # only the dNBR is needed here, so the fused low-memory pass (nodata already -9999)
+    delta, out_profile, stats = process_landsat_delta(
         pre_bands["nir"], pre_bands["swir"],
         post_bands["nir"], post_bands["swir"],
-        pre_bands["qa"],  post_bands["qa"]
+        pre_bands["qa"],  post_bands["qa"],
+        nodata=DELTA_NODATA,
     )
 
     out_tif = os.path.join(OUTPUT_DIR, "delta_nbr_float32_nd.tif")
-    out_profile.update({
-        "driver": "GTiff",
-        "dtype": "float32",
-        "count": 1,
-        "nodata": -9999.0,
-    })
-    delta_to_write = np.where(
-        np.isnan(delta),
-        out_profile["nodata"],
-        delta
-    ).astype("float32")
-
-    with rasterio.open(out_tif, "w", **out_profile) as dst:
-        dst.write(delta_to_write, 1)
+    out_profile = write_delta_tif(out_tif, delta, out_profile, nodata_encoded=True)
 
     print("Wrote:", out_tif)
 
@@ -21,6 +21,8 @@ from ThePython import (  # noqa: E402
     DOWNLOAD_DIR,
     EXTRACT_DIR,
 )
+from tile_scheduler import run_tiles  # noqa: E402
+from m2m_client import M2MClient  # noqa: E402
 
 # Targeted sets — pick one at a time to keep runs light
 JAMES_BAY_2023 = [
@@ -88,45 +90,20 @@ WINDOWS = [
 ]
 
 
-def clean_dir(path):
+def clean_dir(path, keep=()):
+    # keep: filename suffixes to leave in place
     if os.path.isdir(path):
         for entry in os.listdir(path):
             full = os.path.join(path, entry)
             if os.path.isfile(full):
-                os.remove(full)
+                if not entry.endswith(keep):
+                    os.remove(full)
             elif os.path.isdir(full):
                 shutil.rmtree(full, ignore_errors=True)
 
 
-def run_tile(api_key, tile):
-    last_err = None
-    for win in WINDOWS:
-        pre_start = win["pre_start"]
-        pre_end = win["pre_end"]
-        post_start = win["post_start"]
-        post_end = win["post_end"]
-        tag = f"{tile['id'].lower()}_{pre_start.replace('-', '')}_{post_start.replace('-', '')}"
-        print(f"  Trying window PRE {pre_start}→{pre_end}, POST {post_start}→{post_end}")
-        try:
-            res = run_delta_nbr_pipeline(
-                api_key,
-                pre_start, pre_end,
-                post_start, post_end,
-                tile["path"], tile["row"],
-                tag=tag
-            )
-            # Echo bounds to paste into map.js
-            b = res.get("bounds")
-            if b:
-                min_lat, min_lon, max_lat, max_lon = b
-                print(f"  Bounds for {tag}: [[{min_lat}, {min_lon}], [{max_lat}, {max_lon}]]")
-            return res
-        except Exception as e:
-            last_err = e
-            print(f"  Window failed: {e}")
-            continue
-    # If all windows fail, raise the last error
-    raise last_err if last_err else RuntimeError("No windows attempted")
+def tile_tag(tile, win):
+    return f"{tile['id'].lower()}_{win['pre_start'].replace('-', '')}_{win['post_start'].replace('-', '')}"
 
 
 def main():
@@ -135,24 +112,43 @@ def main():
     if not username or not token:
         raise RuntimeError("USGS_USERNAME / USGS_TOKEN not set")
 
-    api_key = m2m_login(username, token)
+    # one pooled, retrying M2M session shared by all the download threads
+    client = M2MClient()
+    m2m_login(username, token, client=client)
     successes = []
     failures = []
 
     try:
-        for tile in TILES:
-            print(f"Processing {tile['id']}...")
-            try:
-                res = run_tile(api_key, tile)
-                successes.append(res)
-            except Exception as e:
-                failures.append({"tile": tile, "error": str(e)})
-                print(f"Failed {tile['id']}: {e}")
-            finally:
-                clean_dir(DOWNLOAD_DIR)
-                clean_dir(EXTRACT_DIR)
+        # downloads overlap on threads, raster maths in worker processes
+        # (DNBR_DOWNLOAD_WORKERS / DNBR_RASTER_WORKERS to tune)
+        done, failed = run_tiles(
+            client,
+            TILES,
+            WINDOWS,
+            tag_fn=tile_tag,
+        )
+        for entry in done:
+            res = entry["result"]
+            # Echo bounds to paste into map.js
+            b = res.get("bounds")
+            if b:
+                min_lat, min_lon, max_lat, max_lon = b
+                tag = tile_tag(entry["tile"], entry["window"])
+                print(f"  Bounds for {tag}: [[{min_lat}, {min_lon}], [{max_lat}, {max_lon}]]")
+            successes.append(res)
+        for entry in failed:
+            failures.append({"tile": entry["tile"], "error": entry["error"]})
+            print(f"Failed {entry['tile']['id']}: {entry['error']}")
     finally:
-        m2m_logout(api_key)
+        m2m_logout(client)
+        print("M2M latency per endpoint:")
+        client.print_metrics()
+        client.close()
+        # extracted bands live in the scene cache now (shared with later runs),
+        # so only the scratch download/extract dirs get wiped. Half-done bundle
+        # downloads (.part + .part.json journal) stay so the next run resumes them
+        clean_dir(EXTRACT_DIR)
+        clean_dir(DOWNLOAD_DIR, keep=(".part", ".part.json"))
 
     print("\nDone.")
     print(f"Successes: {len(successes)}")
@@ -0,0 +1,391 @@
+"""
+Burn scar polygons from a dNBR GeoTIFF, so the map has something to click.
+
+    vectorize_burn_scars("data/outputs/delta_nbr_web.tif")
+    # -> data/outputs/delta_nbr_web_scars.fgb
+
+A scar is a 4-connected patch of dNBR >= BURN_VIS_THRESHOLD (what the burn
+PNG / tiles draw). Each one gets its burned area, mean / max dNBR and the
+hectares per USGS severity class (classify_dnbr, or the class GeoTIFF when
+the pipeline wrote one), plus its dominant class as "severity".
+
+The raster is walked in strips of 512 rows (the COG tiles). Each strip is
+polygonized in pixel coordinates (so the seams line up exactly), its polygons
+are burned back into a label strip for the per-scar sums, and scars that run
+into the next strip are stitched by comparing the last label row with the next
+strip's first one. A scar is finished as soon as a strip doesn't continue it,
+so only the open scars + one strip of pixels are held, whatever the scene size.
+Finished scars under DNBR_SCAR_MIN_HA are dropped, and holes under it filled.
+
+Every scar is stored once per zoom range in SCAR_LEVELS, simplified
+(topology preserving) to about one screen pixel at the range's deepest zoom,
+and left out of ranges where it would be smaller than 2x2 screen pixels. The
+deepest range keeps the exact pixel outlines. Output is FlatGeobuf (packed
+R-tree spatial index, so bbox reads only touch the features they need) in
+EPSG:4326, next to the dNBR; DNBR_SCAR_FORMAT=geojson writes GeoJSON instead.
+
+read_scars() answers bbox + zoom queries for /api/burn_scars.
+
+    python burn_scars.py                  # vectorize every dNBR in OUTPUT_DIR that needs it
+    python burn_scars.py some.tif ...     # just these
+
+Env:
+  DNBR_SCAR_MIN_HA         smallest scar / hole kept, hectares (default 1)
+  DNBR_SCAR_FORMAT         fgb | geojson (default fgb)
+  DNBR_SCAR_MAX_FEATURES   most features one read_scars call returns (default 5000)
+"""
+import hashlib
+import math
+import os
+import sys
+from contextlib import nullcontext
+
+import numpy as np
+import pyogrio.raw
+import rasterio
+import shapely
+from affine import Affine
+from shapely.affinity import affine_transform
+from rasterio.features import rasterize, shapes
+from rasterio.warp import transform_bounds, transform_geom
+from rasterio.windows import Window
+from shapely.geometry import Polygon, mapping, shape
+
+from ThePython import (
+    BURN_VIS_THRESHOLD,
+    COG_BLOCKSIZE,
+    OUTPUT_DIR,
+    classify_dnbr,
+    fresh_class_tif,
+)
+
+SCAR_MIN_HA = float(os.environ.get("DNBR_SCAR_MIN_HA", "1"))
+SCAR_FORMAT = os.environ.get("DNBR_SCAR_FORMAT", "fgb").lower()
+SCAR_MAX_FEATURES = int(os.environ.get("DNBR_SCAR_MAX_FEATURES", "5000"))
+SCAR_FORMATS = {"fgb": ("FlatGeobuf", ".fgb"), "geojson": ("GeoJSON", ".geojson")}
+
+# (minzoom, maxzoom) of the stored geometries; the last range is the exact outline
+SCAR_LEVELS = ((0, 8), (9, 10), (11, 12), (13, 24))
+# Web Mercator metres per 256px-tile pixel at zoom 0, on the equator
+MERC_RES0 = 2 * 20037508.342789244 / 256
+COORD_PRECISION = 1e-6   # degrees, ~0.1 m, keeps the GeoJSON small
+
+# classify_dnbr codes dNBR >= BURN_VIS_THRESHOLD can land in
+SEVERITY_NAMES = {4: "low", 5: "moderate_low", 6: "moderate_high", 7: "high"}
+
+FIELDS = (
+    ("scar_id", object),
+    ("minzoom", np.int32),
+    ("maxzoom", np.int32),
+    ("area_ha", np.float64),
+    ("burned_ha", np.float64),
+    ("mean_dnbr", np.float64),
+    ("max_dnbr", np.float64),
+    ("severity", object),
+    ("severity_code", np.int32),
+) + tuple((f"ha_{name}", np.float64) for name in SEVERITY_NAMES.values())
+
+
+def scars_path(tif_path, fmt=None):
+    """delta_nbr_x.tif -> delta_nbr_x_scars.fgb (or .geojson)"""
+    ext = SCAR_FORMATS[fmt or SCAR_FORMAT][1]
+    return os.path.splitext(tif_path)[0] + "_scars" + ext
+
+
+def fresh_scars(tif_path):
+    """The scars file of tif_path (either format) if it's at least as new as the dNBR, else None."""
+    tif_mtime = os.stat(tif_path).st_mtime_ns
+    for fmt in SCAR_FORMATS:
+        path = scars_path(tif_path, fmt)
+        try:
+            if os.stat(path).st_mtime_ns >= tif_mtime:
+                return path
+        except FileNotFoundError:
+            pass
+    return None
+
+
+class _Scar:
+    """One open scar: its pieces (GeoJSON dicts in pixel coords) and running sums."""
+
+    def __init__(self):
+        self.pieces = []
+        self.pixels = 0
+        self.dnbr_sum = 0.0
+        self.dnbr_max = -np.inf
+        self.classes = np.zeros(8, dtype=np.int64)
+
+    def absorb(self, other):
+        self.pieces += other.pieces
+        self.pixels += other.pixels
+        self.dnbr_sum += other.dnbr_sum
+        self.dnbr_max = max(self.dnbr_max, other.dnbr_max)
+        self.classes += other.classes
+
+
+def _fill_small_holes(geom, min_px):
+    polys = list(geom.geoms) if geom.geom_type == "MultiPolygon" else [geom]
+    kept = [
+        Polygon(p.exterior, [r for r in p.interiors if Polygon(r).area >= min_px])
+        for p in polys
+    ]
+    return kept[0] if len(kept) == 1 else shapely.MultiPolygon(kept)
+
+
+def _level_tolerances(src, pixel_m):
+    # ground size of a screen pixel at each range's deepest zoom, in raster pixels
+    _, lat0, _, lat1 = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+    coslat = math.cos(math.radians((lat0 + lat1) / 2))
+    out = []
+    for i, (minzoom, maxzoom) in enumerate(SCAR_LEVELS):
+        last = i == len(SCAR_LEVELS) - 1
+        out.append(0.0 if last else MERC_RES0 * coslat / 2 ** maxzoom / pixel_m)
+    return out
+
+
+def vectorize_burn_scars(tif_path, out_path=None, threshold=BURN_VIS_THRESHOLD, min_ha=None,
+                         block_rows=COG_BLOCKSIZE):
+    """
+    Polygonize dNBR >= threshold of tif_path into out_path (default scars_path(tif_path)).
+    Returns {"path", "scars", "features", "dropped", "burned_ha"}.
+    """
+    if min_ha is None:
+        min_ha = SCAR_MIN_HA
+    if out_path is None:
+        out_path = scars_path(tif_path)
+    ext = os.path.splitext(out_path)[1].lower()
+    driver = next((d for d, e in SCAR_FORMATS.values() if e == ext), None)
+    if driver is None:
+        raise RuntimeError(f"Burn scars go to .fgb or .geojson, not {out_path}")
+    stem = os.path.splitext(os.path.basename(tif_path))[0]
+
+    class_tif = fresh_class_tif(tif_path)
+    features = {name: [] for name, _ in FIELDS}
+    geoms = []
+    done = {"scars": 0, "dropped": 0, "burned_px": 0}
+
+    with rasterio.open(tif_path) as src:
+        units = src.crs.linear_units_factor[1] if src.crs.is_projected else None
+        if units is None:
+            raise RuntimeError(f"{tif_path} isn't in a projected CRS, can't compute areas")
+        pixel_m = abs(src.transform.a) * units
+        pixel_ha = abs(src.transform.a * src.transform.e) * units * units / 10000.0
+        min_px = min_ha / pixel_ha
+        tolerances = _level_tolerances(src, pixel_m)
+        nodata = src.nodata
+        crs = src.crs
+        width, height = src.width, src.height
+        # pixel coords -> raster CRS, in shapely's (a, b, d, e, xoff, yoff) order
+        t = src.transform
+        to_crs = (t.a, t.b, t.d, t.e, t.c, t.f)
+
+        def finish(scar):
+            if scar.pixels < min_px:
+                done["dropped"] += 1
+                return
+            # union the strip pieces back together (they share exact integer edges);
+            # shapely objects only for the scars that are kept, most pieces are specks
+            pieces = [shape(p) for p in scar.pieces]
+            geom = shapely.union_all(pieces) if len(pieces) > 1 else pieces[0]
+            geom = _fill_small_holes(geom, min_px)
+            done["scars"] += 1
+            done["burned_px"] += scar.pixels
+            sev = scar.classes[4:8]
+            code = int(np.argmax(sev)) + 4 if sev.any() else 0
+            props = {
+                "scar_id": f"{stem}-{done['scars']}",
+                "area_ha": geom.area * pixel_ha,
+                "burned_ha": scar.pixels * pixel_ha,
+                "mean_dnbr": scar.dnbr_sum / scar.pixels,
+                "max_dnbr": float(scar.dnbr_max),
+                "severity": SEVERITY_NAMES.get(code, "unclassified"),
+                "severity_code": code,
+            }
+            for c, name in SEVERITY_NAMES.items():
+                props[f"ha_{name}"] = int(scar.classes[c]) * pixel_ha
+
+            for (minzoom, maxzoom), tol in zip(SCAR_LEVELS, tolerances):
+                if tol and geom.area < (2 * tol) ** 2:
+                    continue   # under 2x2 screen pixels at this zoom
+                g = shapely.simplify(geom, tol, preserve_topology=True) if tol else shapely.simplify(geom, 0)
+                g = affine_transform(g, to_crs)
+                g = shape(transform_geom(crs, "EPSG:4326", mapping(g)))
+                g = shapely.set_precision(g, COORD_PRECISION)
+                if g.is_empty:
+                    continue
+                if g.geom_type == "Polygon":
+                    g = shapely.MultiPolygon([g])
+                geoms.append(shapely.to_wkb(g))
+                for name, value in props.items():
+                    features[name].append(value)
+                features["minzoom"].append(minzoom)
+                features["maxzoom"].append(maxzoom)
+
+        open_scars = {}          # id -> _Scar, only the ones the previous strip's last row touches
+        carry = None             # scar id per column of the previous strip's last row (0 = none)
+        next_id = 1
+        with rasterio.open(class_tif) if class_tif else nullcontext() as csrc:
+            for row_off in range(0, height, block_rows):
+                win = Window(0, row_off, width, min(block_rows, height - row_off))
+                delta = src.read(1, window=win)
+                burned = delta >= threshold
+                if nodata is not None:
+                    burned &= delta != nodata
+                if not burned.any():
+                    for scar in open_scars.values():
+                        finish(scar)
+                    open_scars, carry = {}, None
+                    continue
+
+                classes = csrc.read(1, window=win) if csrc is not None else classify_dnbr(delta, nodata=nodata)
+
+                # pixel coordinates, rows counted from the top of the raster
+                strip_tr = Affine.translation(0, row_off)
+                pieces = [
+                    g for g, _ in shapes(burned.view(np.uint8), mask=burned, connectivity=4, transform=strip_tr)
+                ]
+                labels = rasterize(
+                    ((p, i) for i, p in enumerate(pieces, start=1)),
+                    out_shape=burned.shape, transform=strip_tr, fill=0, dtype="uint32",
+                )
+
+                n = len(pieces) + 1
+                lab = labels[burned]
+                d = delta[burned].astype(np.float64)
+                px = np.bincount(lab, minlength=n)
+                dsum = np.bincount(lab, weights=d, minlength=n)
+                dmax = np.full(n, -np.inf)
+                np.maximum.at(dmax, lab, d)
+                cls = np.bincount(lab.astype(np.int64) * 8 + classes[burned], minlength=n * 8).reshape(n, 8)
+
+                # which open scars each piece continues (4-connected across the seam)
+                owner = np.zeros(n, dtype=np.int64)
+                merged = {}
+
+                def root(sid):
+                    while sid in merged:
+                        sid = merged[sid]
+                    return sid
+
+                if carry is not None:
+                    first = labels[0]
+                    both = (carry > 0) & (first > 0)
+                    for sid, piece in np.unique(np.stack([carry[both], first[both]], axis=1), axis=0):
+                        sid = root(int(sid))
+                        cur = root(int(owner[piece]))
+                        if cur == 0:
+                            owner[piece] = sid
+                        elif cur != sid:
+                            # one piece joins two open scars: they're one scar
+                            open_scars[cur].absorb(open_scars.pop(sid))
+                            merged[sid] = cur
+                owner = np.array([root(int(s)) for s in owner])
+
+                for i in range(1, n):
+                    sid = owner[i]
+                    if sid == 0:
+                        sid = owner[i] = next_id
+                        next_id += 1
+                        open_scars[sid] = _Scar()
+                    scar = open_scars[sid]
+                    scar.pieces.append(pieces[i - 1])
+                    scar.pixels += int(px[i])
+                    scar.dnbr_sum += float(dsum[i])
+                    scar.dnbr_max = max(scar.dnbr_max, float(dmax[i]))
+                    scar.classes += cls[i]
+
+                carry = owner[labels[-1]]
+                still_open = set(np.unique(carry).tolist()) - {0}
+                for sid in [s for s in open_scars if s not in still_open]:
+                    finish(open_scars.pop(sid))
+
+            for scar in open_scars.values():
+                finish(scar)
+
+    field_data = [np.array(features[name], dtype=dtype) for name, dtype in FIELDS]
+    tmp = f"{out_path}.{os.getpid()}.tmp"
+    layer_options = {"SPATIAL_INDEX": "YES"} if driver == "FlatGeobuf" else None
+    pyogrio.raw.write(
+        tmp, np.array(geoms, dtype=object), field_data, [name for name, _ in FIELDS],
+        driver=driver, geometry_type="MultiPolygon", crs="EPSG:4326",
+        layer=stem, layer_options=layer_options,
+    )
+    os.replace(tmp, out_path)
+
+    result = {
+        "path": out_path,
+        "scars": done["scars"],
+        "features": len(geoms),
+        "dropped": done["dropped"],
+        "burned_ha": done["burned_px"] * pixel_ha,
+    }
+    print(f"Wrote {result['scars']} burn scars ({result['features']} features, "
+          f"{result['dropped']} under {min_ha} ha dropped): {out_path}")
+    return result
+
+
+def read_scars(tif_paths, bbox, zoom, limit=None):
+    """
+    GeoJSON FeatureCollection of the scars of tif_paths whose outline touches
+    bbox (min_lon, min_lat, max_lon, max_lat), at the detail for zoom.
+    dNBRs without a (fresh) scars file are skipped. At most limit features,
+    "truncated" says whether there were more.
+    """
+    if limit is None:
+        limit = SCAR_MAX_FEATURES
+    zoom = int(zoom)
+    where = f"minzoom <= {zoom} AND maxzoom >= {zoom}"
+    out = []
+    truncated = False
+    for tif_path in tif_paths:
+        path = fresh_scars(tif_path)
+        if path is None:
+            continue
+        source = os.path.relpath(tif_path, OUTPUT_DIR).replace(os.sep, "/")
+        meta, _, wkb, field_data = pyogrio.raw.read(path, bbox=tuple(bbox), where=where,
+                                                    max_features=limit - len(out) + 1)
+        names = list(meta["fields"])
+        for i, g in enumerate(wkb):
+            if len(out) == limit:
+                truncated = True
+                break
+            props = {name: _json_value(field_data[k][i]) for k, name in enumerate(names)}
+            out.append({
+                "type": "Feature",
+                "id": props["scar_id"],
+                "geometry": mapping(shapely.from_wkb(g)),
+                "properties": dict(props, source=source),
+            })
+        if truncated:
+            break
+    return {"type": "FeatureCollection", "features": out, "truncated": truncated}
+
+
+def scars_etag(tif_paths, bbox, zoom):
+    """ETag for a read_scars answer: the query plus mtime + size of every scars file it reads."""
+    parts = [f"{v:.6f}" for v in bbox] + [str(int(zoom)), str(SCAR_MAX_FEATURES)]
+    for tif_path in tif_paths:
+        path = fresh_scars(tif_path)
+        if path is not None:
+            st = os.stat(path)
+            parts.append(f"{path}:{st.st_mtime_ns}-{st.st_size}")
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
+def _json_value(v):
+    if isinstance(v, np.generic):
+        v = v.item()
+    if isinstance(v, float) and not math.isfinite(v):
+        return None
+    return v
+
+
+if __name__ == "__main__":
+    from tile_server import list_sources
+
+    todo = sys.argv[1:] or [p for p in list_sources() if fresh_scars(p) is None]
+    for tif in todo:
+        try:
+            vectorize_burn_scars(tif)
+        except Exception as e:
+            print(f"Could not vectorize {tif}: {e}")
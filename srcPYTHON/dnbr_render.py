@@ -0,0 +1,184 @@
+"""
+dNBR -> PNG without matplotlib.
+
+The exporters used to build a float32 RGBA copy of the whole scene, run it
+through cm.get_cmap / Normalize and plt.imsave (which makes a uint8 copy of
+that again). On a full Landsat scene that's ~1 GB of temporaries and several
+seconds per PNG, and importing matplotlib alone adds a second or so to every
+worker start.
+
+Here every colour scheme is a small uint8 RGBA lookup table and a raster is
+turned into row indexes into that table (uint16, 2 bytes/pixel), computed in
+chunks. The PNG is then written straight from the indexes:
+  - palette PNG ("P" + tRNS) when the image uses <= 256 table rows, 1 byte/pixel
+  - plain RGBA PNG otherwise
+
+The index maths is the same sequence of numpy operations matplotlib's
+Normalize + Colormap do (same dtypes, same truncation), so the decoded pixels
+are identical to the old plt.imsave output. benchmarks/bench_png_render.py
+checks that and times both paths.
+
+Env:
+  DNBR_PNG_COMPRESS_LEVEL   zlib level 0-9 (default 6, same as Pillow/matplotlib)
+  DNBR_PNG_PALETTE          write palette PNGs when possible (default 1)
+"""
+import os
+
+import numpy as np
+from PIL import Image
+from rasterio.transform import xy
+
+PNG_COMPRESS_LEVEL = int(os.environ.get("DNBR_PNG_COMPRESS_LEVEL", "6"))
+PNG_PALETTE = os.environ.get("DNBR_PNG_PALETTE", "1") == "1"
+
+CHUNK_PIXELS = 1 << 20   # pixels normalised per step, keeps the float temporaries ~8 MB
+
+# matplotlib's "inferno", (lut * 255).astype(uint8), 256 x RGB
+_INFERNO_HEX = (
+    "00000300000400000601000701010901010b02010e02021003021204031404031605041806041b07051d08061f090621"
+    "0a07230b07260d08280e082a0f092d10092f120a32130a34140b36160b39170b3b190b3e1a0b401c0c431d0c451f0c47"
+    "200c4a220b4c240b4e260b50270b52290b542b0a562d0a582e0a5a300a5c32095d34095f3509603709613909623b0964"
+    "3c09653e0966400966410967430a68450a69460a69480b6a4a0b6a4b0c6b4d0c6b4f0d6c500d6c520e6c530e6d550f6d"
+    "570f6d58106d5a116d5b116e5d126e5f126e60136e62146e63146e65156e66156e68166e6a176e6b176e6d186e6e186e"
+    "70196e72196d731a6d751b6d761b6d781c6d7a1c6d7b1d6c7d1d6c7e1e6c801f6b811f6b83206b85206a86216a88216a"
+    "8922698b22698d23698e24689024689125679325679526669626669827659928649b28649c29639e2963a02a62a12b61"
+    "a32b61a42c60a62c5fa72d5fa92e5eab2e5dac2f5cae305baf315bb1315ab23259b43358b53357b73456b83556ba3655"
+    "bb3754bd3753be3852bf3951c13a50c23b4fc43c4ec53d4dc73e4cc83e4bc93f4acb4049cc4148cd4247cf4446d04544"
+    "d14643d24742d44841d54940d64a3fd74b3ed94d3dda4e3bdb4f3adc5039dd5238de5337df5436e05634e25733e35832"
+    "e45a31e55b30e65c2ee65e2de75f2ce8612be9622aea6428eb6527ec6726ed6825ed6a23ee6c22ef6d21f06f1ff0701e"
+    "f1721df2741cf2751af37719f37918f47a16f57c15f57e14f68012f68111f78310f7850ef8870df8880cf88a0bf98c09"
+    "f98e08f99008fa9107fa9306fa9506fa9706fb9906fb9b06fb9d06fb9e07fba007fba208fba40afba60bfba80dfbaa0e"
+    "fbac10fbae12fbb014fbb116fbb318fbb51afbb71cfbb91efabb21fabd23fabf25fac128f9c32af9c52cf9c72ff8c931"
+    "f8cb34f8cd37f7cf3af7d13cf6d33ff6d542f5d745f5d948f4db4bf4dc4ff3de52f3e056f3e259f2e45df2e660f1e864"
+    "f1e968f1eb6cf1ed70f1ee74f1f079f1f27df2f381f2f485f3f689f4f78df5f891f6fa95f7fb99f9fc9dfafda0fcfea4"
+)
+
+# colormap tables follow matplotlib's layout: N colours, then under, over, bad
+CMAP_N = 256
+UNDER = CMAP_N
+OVER = CMAP_N + 1
+BAD = CMAP_N + 2
+
+INFERNO_RGBA = np.zeros((CMAP_N + 3, 4), dtype=np.uint8)
+INFERNO_RGBA[:CMAP_N, :3] = np.frombuffer(bytes.fromhex(_INFERNO_HEX), dtype=np.uint8).reshape(CMAP_N, 3)
+INFERNO_RGBA[:CMAP_N, 3] = 255
+INFERNO_RGBA[UNDER] = INFERNO_RGBA[0]
+INFERNO_RGBA[OVER] = INFERNO_RGBA[CMAP_N - 1]
+# INFERNO_RGBA[BAD] stays (0, 0, 0, 0)
+
+# classify_dnbr codes 0-7, same colours as the USGS table (0 = background, black)
+USGS_CLASS_RGBA = np.array([
+    (0, 0, 0, 255),
+    (122, 135, 55, 255),
+    (172, 190, 77, 255),
+    (0, 203, 0, 255),
+    (255, 255, 0, 255),
+    (245, 107, 0, 255),
+    (230, 55, 0, 255),
+    (122, 1, 119, 255),
+], dtype=np.uint8)
+
+
+def _index_chunk(x, vmin, vmax, clip, n):
+    # Normalize.__call__
+    x = np.array(x, copy=True)
+    if vmin == vmax:
+        x.fill(0)
+    else:
+        if clip:
+            x = np.clip(x, vmin, vmax)
+        x -= vmin
+        x /= (vmax - vmin)
+    # Colormap.__call__
+    x *= n
+    x[x == n] = n - 1
+    under = x < 0
+    over = x >= n
+    bad = np.isnan(x)
+    with np.errstate(invalid="ignore"):
+        idx = x.astype(np.uint16)   # in-range values truncate like astype(int), the rest is overwritten
+    idx[under] = n
+    idx[over] = n + 1
+    idx[bad] = n + 2
+    return idx
+
+
+def normalize_index(values, vmin, vmax, clip=False, n=CMAP_N):
+    """
+    Row in an (n + 3)-row colormap table for every value, the way
+    Normalize(vmin, vmax, clip) + an n-colour Colormap would pick it:
+    0..n-1 colours, n under, n + 1 over, n + 2 NaN.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind != "f":
+        values = values.astype(np.float32 if values.dtype.itemsize <= 2 else np.float64)
+    # matplotlib keeps vmin/vmax as python floats, which end up float64
+    vmin = np.float64(float(vmin))
+    vmax = np.float64(float(vmax))
+
+    flat = values.ravel()
+    out = np.empty(flat.size, dtype=np.uint16)
+    for s in range(0, flat.size, CHUNK_PIXELS):
+        out[s:s + CHUNK_PIXELS] = _index_chunk(flat[s:s + CHUNK_PIXELS], vmin, vmax, clip, n)
+    return out.reshape(values.shape)
+
+
+def burn_index(data, burned, vmin, vmax):
+    """export_burn_png_from_delta's look: inferno over the burned pixels (clipped to vmin..vmax), the rest BAD (transparent)."""
+    index = np.full(data.shape, BAD, dtype=np.uint16)
+    if np.any(burned):
+        index[burned] = normalize_index(data[burned], vmin, vmax, clip=True)
+    return index
+
+
+def stretch_index(data, vmin, vmax):
+    """export_png_from_tif's look: inferno stretched vmin..vmax, NaN transparent."""
+    return normalize_index(data, vmin, vmax, clip=False)
+
+
+def rgba_from_index(index, lut):
+    return lut.take(index, axis=0, mode="clip")
+
+
+def _png_image(index, lut, palette):
+    if palette:
+        counts = np.zeros(len(lut), dtype=np.int64)
+        flat = index.ravel()
+        for s in range(0, flat.size, CHUNK_PIXELS):
+            counts += np.bincount(flat[s:s + CHUNK_PIXELS], minlength=len(lut))[:len(lut)]
+        used = np.flatnonzero(counts)
+        # under/over rows repeat a colour, they can share a palette entry
+        colors, inverse = np.unique(lut[used], axis=0, return_inverse=True)
+        if len(colors) <= 256:
+            remap = np.zeros(len(lut), dtype=np.uint8)
+            remap[used] = inverse.ravel()
+            img = Image.fromarray(remap[index], "P")
+            img.putpalette(colors[:, :3].tobytes())
+            alpha = colors[:, 3]
+            return img, ({"transparency": alpha.tobytes()} if (alpha < 255).any() else {})
+    return Image.fromarray(rgba_from_index(index, lut), "RGBA"), {}
+
+
+def write_png(png_path, index, lut, compress_level=None, palette=None):
+    """Write lut[index] as a PNG (palette PNG when it fits, RGBA otherwise)."""
+    img, extra = _png_image(index, lut, PNG_PALETTE if palette is None else palette)
+    img.save(
+        png_path, format="PNG",
+        compress_level=PNG_COMPRESS_LEVEL if compress_level is None else compress_level,
+        **extra,
+    )
+    return png_path
+
+
+def write_worldfile(png_path, transform):
+    """PNG world file (.pgw) next to png_path: pixel size, rotation, centre of the upper-left pixel."""
+    x_ul, y_ul = xy(transform, 0, 0, offset="center")
+    worldfile_path = os.path.splitext(png_path)[0] + ".pgw"
+    with open(worldfile_path, "w") as f:
+        f.write(f"{transform.a}\n")  # pixel size in X
+        f.write("0.0\n")             # rotation about Y
+        f.write("0.0\n")             # rotation about X
+        f.write(f"{transform.e}\n")  # pixel size in Y (negative for north-up)
+        f.write(f"{x_ul}\n")
+        f.write(f"{y_ul}\n")
+    return worldfile_path
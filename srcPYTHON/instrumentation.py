@@ -0,0 +1,305 @@
+"""
+Spans for every stage of the dNBR pipeline (M2M search, download-request and
+the download-retrieve polling, bundle download / extraction, band loading,
+alignment, dNBR maths, GeoTIFF + PNG export) instead of scattered prints.
+
+    with span("download", url=url) as sp:
+        ...
+        sp.add_bytes(os.path.getsize(path))
+        sp.add_array("pre", stack)
+
+A span records its duration, bytes moved, the arrays it produced (shape,
+dtype, MB), RSS at the end and the process peak RSS, plus how much it pushed
+that peak up (the number to look at for memory hot spots). Spans nest per
+thread, so a line knows its parent and the root span it belongs to ("trace").
+
+Finished spans go to:
+  - a JSON lines file, one line per span, if DNBR_SPANS_JSONL is set
+    (appends, so several workers / processes can share one file)
+  - in-process totals + a duration histogram per span name, rendered as
+    Prometheus text by prometheus_text() (api_server's /metrics)
+
+Spans from raster worker processes (tile_scheduler) land in the JSONL file
+but not in the api process' /metrics totals.
+
+Env:
+  DNBR_INSTRUMENT     record spans at all (default 1)
+  DNBR_SPANS_JSONL    path of the JSON lines file (default off)
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: no getrusage, peak RSS is left out
+    resource = None
+
+INSTRUMENT = os.environ.get("DNBR_INSTRUMENT", "1") == "1"
+SPANS_JSONL = os.environ.get("DNBR_SPANS_JSONL", "")
+
+# seconds, upper bounds of the duration histogram (+Inf is added when rendering)
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_MB = 1024 * 1024
+
+_local = threading.local()
+_lock = threading.Lock()
+_totals = {}
+_jsonl_lock = threading.Lock()
+
+
+def current_rss():
+    """Resident set size of this process in bytes (None where /proc isn't there)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def peak_rss():
+    """High-water mark of the RSS of this process in bytes."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Span:
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = dict(attrs)
+        self.bytes = 0
+        self.arrays = {}
+        self.span_id = uuid.uuid4().hex[:12]
+        stack = getattr(_local, "stack", None)
+        parent = stack[-1] if stack else None
+        self.parent = parent.span_id if parent else None
+        self.trace = parent.trace if parent else self.span_id
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add_bytes(self, n):
+        self.bytes += int(n or 0)
+
+    def add_array(self, label, arr):
+        self.arrays[label] = {
+            "shape": list(arr.shape),
+            "dtype": str(getattr(arr, "dtype", type(arr).__name__)),   # PackedMask has no dtype
+            "mb": round(arr.nbytes / _MB, 2),
+        }
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the block as one span called name. Yields the Span (add bytes / arrays / attrs to it)."""
+    sp = Span(name, attrs)
+    if not INSTRUMENT:
+        yield sp
+        return
+
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(sp)
+    peak_before = peak_rss()
+    started = time.time()
+    t0 = time.perf_counter()
+    error = None
+    try:
+        yield sp
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        seconds = time.perf_counter() - t0
+        stack.pop()
+        _finish(sp, started, seconds, error, peak_before)
+
+
+def _finish(sp, started, seconds, error, peak_before):
+    rss = current_rss()
+    peak = peak_rss()
+    record = {
+        "ts": round(started, 3),
+        "name": sp.name,
+        "trace": sp.trace,
+        "span_id": sp.span_id,
+        "parent": sp.parent,
+        "pid": os.getpid(),
+        "seconds": round(seconds, 4),
+        "ok": error is None,
+        "error": error,
+        "bytes": sp.bytes,
+        "rss_mb": round(rss / _MB, 1) if rss is not None else None,
+        "peak_rss_mb": round(peak / _MB, 1) if peak is not None else None,
+        "peak_rss_growth_mb": round((peak - peak_before) / _MB, 1) if peak is not None else None,
+        "arrays": sp.arrays,
+        "attrs": sp.attrs,
+    }
+
+    with _lock:
+        t = _totals.get(sp.name)
+        if t is None:
+            t = _totals[sp.name] = {
+                "count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 0,
+                "buckets": [0] * len(DURATION_BUCKETS),
+            }
+        t["count"] += 1
+        t["errors"] += error is not None
+        t["seconds"] += seconds
+        t["max_seconds"] = max(t["max_seconds"], seconds)
+        t["bytes"] += sp.bytes
+        for i, le in enumerate(DURATION_BUCKETS):
+            if seconds <= le:
+                t["buckets"][i] += 1
+
+    if SPANS_JSONL:
+        _write_jsonl(record)
+
+
+def _write_jsonl(record):
+    line = json.dumps(record, default=str) + "\n"
+    try:
+        with _jsonl_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(SPANS_JSONL)), exist_ok=True)
+            with open(SPANS_JSONL, "a") as f:
+                f.write(line)
+    except OSError as e:
+        print(f"Could not write span to {SPANS_JSONL}: {e}")
+
+
+def span_totals():
+    """{span name: {count, errors, seconds, max_seconds, bytes}} for this process."""
+    with _lock:
+        return {
+            name: {k: v for k, v in t.items() if k != "buckets"}
+            for name, t in _totals.items()
+        }
+
+
+# ---- Prometheus text format ----
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _num(v):
+    if v is None:
+        return "NaN"
+    if isinstance(v, bool):
+        return "1" if v else "0"
+    if isinstance(v, float) and v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def metric_family(name, kind, help_text, samples):
+    """
+    Lines for one metric: samples is a list of (labels dict, value)
+    or (suffix, labels dict, value) for histogram / summary parts.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for s in samples:
+        suffix, labels, value = s if len(s) == 3 else ("", s[0], s[1])
+        lines.append(f"{name}{suffix}{_label_str(labels)} {_num(value)}")
+    return lines
+
+
+def span_metric_families():
+    with _lock:
+        totals = {name: dict(t, buckets=list(t["buckets"])) for name, t in _totals.items()}
+
+    hist, errors, nbytes, max_s = [], [], [], []
+    for name in sorted(totals):
+        t = totals[name]
+        for le, n in zip(DURATION_BUCKETS, t["buckets"]):
+            hist.append(("_bucket", {"span": name, "le": le}, n))
+        hist.append(("_bucket", {"span": name, "le": "+Inf"}, t["count"]))
+        hist.append(("_sum", {"span": name}, t["seconds"]))
+        hist.append(("_count", {"span": name}, t["count"]))
+        errors.append(({"span": name}, t["errors"]))
+        nbytes.append(({"span": name}, t["bytes"]))
+        max_s.append(({"span": name}, t["max_seconds"]))
+
+    lines = []
+    lines += metric_family("dnbr_span_seconds", "histogram", "Duration of pipeline stages.", hist)
+    lines += metric_family("dnbr_span_errors_total", "counter", "Pipeline stages that raised.", errors)
+    lines += metric_family("dnbr_span_bytes_total", "counter", "Bytes moved by pipeline stages.", nbytes)
+    lines += metric_family("dnbr_span_max_seconds", "gauge", "Slowest run of each stage.", max_s)
+    lines += metric_family("dnbr_process_rss_bytes", "gauge", "Resident set size.", [({}, current_rss())])
+    lines += metric_family("dnbr_process_peak_rss_bytes", "gauge", "Peak resident set size.", [({}, peak_rss())])
+    return lines
+
+
+def merge_m2m_metrics(all_metrics):
+    """
+    Add up M2MClient.metrics() of several clients. Percentiles can't be
+    added, the worst client's are kept.
+    """
+    out = {}
+    for metrics in all_metrics:
+        for endpoint, m in metrics.items():
+            o = out.get(endpoint)
+            if o is None:
+                out[endpoint] = dict(m)
+                continue
+            for k in ("calls", "errors", "retries", "total_seconds"):
+                o[k] += m[k]
+            for k in ("p50_seconds", "p95_seconds", "max_seconds"):
+                o[k] = max(o[k], m[k])
+            o["avg_seconds"] = o["total_seconds"] / o["calls"] if o["calls"] else 0.0
+    return out
+
+
+def m2m_metric_families(metrics):
+    """metrics: {endpoint: M2MClient.metrics() entry}, see merge_m2m_metrics for several clients."""
+    calls, errors, retries, latency = [], [], [], []
+    for endpoint in sorted(metrics):
+        m = metrics[endpoint]
+        labels = {"endpoint": endpoint}
+        calls.append((labels, m["calls"]))
+        errors.append((labels, m["errors"]))
+        retries.append((labels, m["retries"]))
+        latency.append(("", dict(labels, quantile="0.5"), m["p50_seconds"]))
+        latency.append(("", dict(labels, quantile="0.95"), m["p95_seconds"]))
+        latency.append(("_sum", labels, m["total_seconds"]))
+        latency.append(("_count", labels, m["calls"]))
+
+    lines = []
+    lines += metric_family("m2m_requests_total", "counter", "M2M API calls.", calls)
+    lines += metric_family("m2m_errors_total", "counter", "M2M API calls that failed.", errors)
+    lines += metric_family("m2m_retries_total", "counter", "M2M API calls retried.", retries)
+    lines += metric_family("m2m_request_seconds", "summary", "M2M API call latency.", latency)
+    return lines
+
+
+def stats_metric_families(prefix, stats, help_text):
+    """One gauge per numeric entry of a cache's stats() dict (e.g. dnbr_scene_cache_hits)."""
+    lines = []
+    for key in sorted(stats):
+        value = stats[key]
+        if isinstance(value, (int, float)):
+            lines += metric_family(f"{prefix}_{key}", "gauge", f"{help_text} {key}.", [({}, value)])
+    return lines
+
+
+def prometheus_text(*families):
+    """Join metric families (lists of lines) into a /metrics body, span metrics first."""
+    lines = span_metric_families()
+    for fam in families:
+        lines += fam
+    return "\n".join(lines) + "\n"
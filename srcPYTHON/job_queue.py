@@ -0,0 +1,150 @@
+"""
+Small in-process job queue for long dNBR runs.
+
+The web endpoints submit work here instead of running the whole pipeline
+inside the request. Each job gets an id, runs on a local thread pool, and
+records which stage it's in so the frontend can poll it.
+
+Jobs are keyed (e.g. by path/row + date window) so identical submissions
+land on the same job instead of downloading the same scenes twice.
+Finished jobs are kept for result_ttl seconds so repeat requests are
+answered straight from the cached result.
+
+Note: state lives in this process only. Run gunicorn with a single worker
+(the default in the Dockerfile) or GET /api/jobs/<id> may hit a worker that
+never saw the job.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    def __init__(self, max_workers=2, result_ttl=3600):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dnbr-job")
+        self._lock = threading.Lock()
+        self._jobs = {}      # job_id -> job dict
+        self._by_key = {}    # dedupe key -> job_id
+        self._futures = {}   # job_id -> Future
+        self.result_ttl = result_ttl
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Queue fn(*args, progress=..., **kwargs) unless a live job with the same
+        key already exists. Failed and expired jobs are not reused.
+        Returns (job snapshot, created).
+        """
+        with self._lock:
+            self._purge_expired()
+            job_id = self._by_key.get(key)
+            if job_id is not None:
+                job = self._jobs.get(job_id)
+                if job is not None and job["status"] != FAILED:
+                    return self._snapshot(job), False
+
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            job = {
+                "id": job_id,
+                "key": key,
+                "status": QUEUED,
+                "stage": QUEUED,
+                "stages": [{"stage": QUEUED, "at": now}],
+                "created_at": now,
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None,
+            }
+            self._jobs[job_id] = job
+            self._by_key[key] = job_id
+            self._futures[job_id] = self._pool.submit(self._run, job_id, fn, args, kwargs)
+            return self._snapshot(job), True
+
+    def get(self, job_id):
+        with self._lock:
+            self._purge_expired()
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job is not None else None
+
+    def wait(self, job_id, timeout=None):
+        """
+        Block until the job finishes (or timeout), then return its snapshot.
+        Used by the old synchronous endpoint so it still dedupes.
+        """
+        with self._lock:
+            fut = self._futures.get(job_id)
+        if fut is not None:
+            try:
+                fut.result(timeout=timeout)
+            except Exception:
+                pass  # the error is recorded on the job itself
+        return self.get(job_id)
+
+    def shutdown(self, wait=False):
+        self._pool.shutdown(wait=wait)
+
+    # ---- internals ----
+
+    def _set_stage(self, job_id, stage, status=None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["stage"] = stage
+            job["stages"].append({"stage": stage, "at": time.time()})
+            if status is not None:
+                job["status"] = status
+
+    def _run(self, job_id, fn, args, kwargs):
+        with self._lock:
+            self._jobs[job_id]["started_at"] = time.time()
+        self._set_stage(job_id, RUNNING, status=RUNNING)
+
+        def progress(stage):
+            self._set_stage(job_id, stage)
+
+        try:
+            result = fn(*args, progress=progress, **kwargs)
+        except Exception as e:
+            with self._lock:
+                job = self._jobs[job_id]
+                job["error"] = str(e)
+                job["finished_at"] = time.time()
+            self._set_stage(job_id, FAILED, status=FAILED)
+            print(f"Job {job_id} failed: {e}")
+            raise
+
+        with self._lock:
+            job = self._jobs[job_id]
+            job["result"] = result
+            job["finished_at"] = time.time()
+        self._set_stage(job_id, DONE, status=DONE)
+        return result
+
+    def _purge_expired(self):
+        # caller holds the lock
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None and now - job["finished_at"] > self.result_ttl
+        ]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            self._futures.pop(job_id, None)
+            if self._by_key.get(job["key"]) == job_id:
+                del self._by_key[job["key"]]
+
+    @staticmethod
+    def _snapshot(job):
+        snap = dict(job)
+        snap["stages"] = list(job["stages"])
+        snap.pop("key", None)
+        return snap
@@ -0,0 +1,281 @@
+"""
+Shared client for the USGS M2M JSON API.
+
+One requests.Session (keep-alive + a connection pool) for every M2M call
+instead of a bare requests.post each time, plus:
+  - per-endpoint timeouts (scene-search can be slow, logout shouldn't hang)
+  - a simple rate limit so batch runs don't hammer the service
+  - retries with exponential backoff on 429 / 5xx / dropped connections
+    (honours Retry-After when the server sends one)
+  - per-endpoint latency numbers, see M2MClient.metrics()
+
+Every pipeline function in ThePython that used to take an api_key string
+also accepts an M2MClient; a plain string goes through the shared default
+client.
+
+Env:
+  M2M_SERVICE_URL   (default the stable USGS endpoint, point it at a fake server for testing)
+  M2M_RATE_LIMIT    max requests per second across all threads (default 5, 0 = unlimited)
+  M2M_MAX_RETRIES   (default 4)
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+SERVICE_URL = os.environ.get("M2M_SERVICE_URL", "https://m2m.cr.usgs.gov/api/api/json/stable/")
+M2M_RATE_LIMIT = float(os.environ.get("M2M_RATE_LIMIT", "5"))
+M2M_MAX_RETRIES = int(os.environ.get("M2M_MAX_RETRIES", "4"))
+
+# (connect, read) timeouts in seconds per endpoint
+ENDPOINT_TIMEOUTS = {
+    "login-token": (10, 30),
+    "logout": (10, 15),
+    "scene-search": (10, 120),
+    "download-options": (10, 60),
+    "download-request": (10, 60),
+    "download-retrieve": (10, 60),
+    "grid2ll": (10, 30),
+}
+DEFAULT_TIMEOUT = (10, 60)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+LATENCY_SAMPLES = 500
+
+
+class M2MError(RuntimeError):
+    """M2M answered, but with an errorCode."""
+
+    def __init__(self, endpoint, error_code, error_message=None):
+        self.endpoint = endpoint
+        self.error_code = error_code
+        self.error_message = error_message
+        super().__init__(f"{endpoint} failed: {error_code} {error_message}")
+
+
+class M2MClient:
+    def __init__(self, api_key=None, service_url=None, timeouts=None,
+                 max_retries=None, backoff=1.0, rate_limit=None, pool_size=16,
+                 credentials=None):
+        self.api_key = api_key
+        # optional M2MCredentialManager: supplies the key and refreshes it on auth errors
+        self.credentials = credentials
+        self.service_url = service_url or SERVICE_URL
+        self.timeouts = dict(ENDPOINT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self.max_retries = M2M_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = backoff
+        rate_limit = M2M_RATE_LIMIT if rate_limit is None else rate_limit
+        self._min_interval = 1.0 / rate_limit if rate_limit and rate_limit > 0 else 0.0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._rate_lock = threading.Lock()
+        self._next_slot = 0.0
+        self._metrics_lock = threading.Lock()
+        self._metrics = {}
+
+    # ---- plumbing ----
+
+    def _wait_for_slot(self):
+        if not self._min_interval:
+            return
+        with self._rate_lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self._min_interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _record(self, endpoint, seconds, error=False, retried=False):
+        with self._metrics_lock:
+            m = self._metrics.setdefault(endpoint, {
+                "calls": 0, "errors": 0, "retries": 0,
+                "total_seconds": 0.0, "max_seconds": 0.0,
+                "latencies": deque(maxlen=LATENCY_SAMPLES),
+            })
+            if retried:
+                m["retries"] += 1
+                return
+            m["calls"] += 1
+            m["total_seconds"] += seconds
+            m["max_seconds"] = max(m["max_seconds"], seconds)
+            m["latencies"].append(seconds)
+            if error:
+                m["errors"] += 1
+
+    def _retry_delay(self, attempt, resp=None):
+        if resp is not None:
+            retry_after = resp.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        return self.backoff * (2 ** attempt)
+
+    def current_key(self):
+        if self.credentials is not None:
+            return self.credentials.api_key()
+        return self.api_key
+
+    def call(self, endpoint, payload=None, api_key=None, auth=True):
+        """
+        POST payload to endpoint and return the "data" part of the reply.
+        Raises M2MError if M2M sends back an errorCode.
+        With credentials set, an auth error refreshes the key and retries once.
+        """
+        if not auth or api_key or self.credentials is None:
+            return self._call(endpoint, payload, api_key if api_key else (self.api_key if auth else None))
+
+        key = self.credentials.api_key()
+        try:
+            return self._call(endpoint, payload, key)
+        except Exception as e:
+            from m2m_credentials import is_auth_error
+            if not is_auth_error(e):
+                raise
+            print(f"{endpoint}: M2M key rejected ({e}), refreshing")
+            return self._call(endpoint, payload, self.credentials.refresh(stale_key=key))
+
+    def _call(self, endpoint, payload, key):
+        url = self.service_url + endpoint
+        headers = {}
+        if key:
+            headers["X-Auth-Token"] = key
+        timeout = self.timeouts.get(endpoint, DEFAULT_TIMEOUT)
+
+        attempt = 0
+        while True:
+            self._wait_for_slot()
+            t0 = time.perf_counter()
+            try:
+                resp = self.session.post(url, headers=headers, json=payload, timeout=timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._record(endpoint, time.perf_counter() - t0, error=True)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._retry_delay(attempt)
+                print(f"{endpoint}: {e.__class__.__name__}, retrying in {delay:.1f}s")
+                self._record(endpoint, 0, retried=True)
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            elapsed = time.perf_counter() - t0
+            if resp.status_code in RETRY_STATUS and attempt < self.max_retries:
+                self._record(endpoint, elapsed, error=True)
+                delay = self._retry_delay(attempt, resp)
+                print(f"{endpoint}: HTTP {resp.status_code}, retrying in {delay:.1f}s")
+                self._record(endpoint, 0, retried=True)
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            try:
+                out = resp.json()
+            except ValueError:
+                self._record(endpoint, elapsed, error=True)
+                print(f"{endpoint} HTTP status:", resp.status_code)
+                print(f"{endpoint} response text:", resp.text[:500])
+                resp.raise_for_status()
+                raise RuntimeError(f"Failed to parse {endpoint} JSON: {resp.text[:500]}")
+
+            if out is None:
+                self._record(endpoint, elapsed, error=True)
+                raise RuntimeError(f"No output from {endpoint}")
+
+            if out.get("errorCode"):
+                self._record(endpoint, elapsed, error=True)
+                raise M2MError(endpoint, out["errorCode"], out.get("errorMessage"))
+
+            if not resp.ok:
+                self._record(endpoint, elapsed, error=True)
+                print(f"{endpoint} HTTP status:", resp.status_code)
+                print(f"{endpoint} response text:", resp.text[:500])
+                resp.raise_for_status()
+
+            self._record(endpoint, elapsed)
+            return out.get("data")
+
+    # ---- auth ----
+
+    def login(self, username, app_token):
+        """login-token, keeps the key on the client and returns it."""
+        self.api_key = self.call(
+            "login-token", {"username": username, "token": app_token}, auth=False
+        )
+        return self.api_key
+
+    def logout(self, api_key=None):
+        key = api_key or self.api_key
+        if not key:
+            return
+        self.call("logout", None, api_key=key)
+        if key == self.api_key:
+            self.api_key = None
+
+    def close(self):
+        self.session.close()
+
+    # ---- metrics ----
+
+    def metrics(self):
+        """
+        Per-endpoint latency numbers:
+        {endpoint: {calls, errors, retries, avg_seconds, p50_seconds, p95_seconds, max_seconds}}
+        (percentiles over the last LATENCY_SAMPLES calls)
+        """
+        out = {}
+        with self._metrics_lock:
+            for endpoint, m in self._metrics.items():
+                lat = sorted(m["latencies"])
+
+                def pct(q):
+                    if not lat:
+                        return 0.0
+                    return lat[min(len(lat) - 1, int(round(q * (len(lat) - 1))))]
+
+                out[endpoint] = {
+                    "calls": m["calls"],
+                    "errors": m["errors"],
+                    "retries": m["retries"],
+                    "total_seconds": m["total_seconds"],
+                    "avg_seconds": m["total_seconds"] / m["calls"] if m["calls"] else 0.0,
+                    "p50_seconds": pct(0.50),
+                    "p95_seconds": pct(0.95),
+                    "max_seconds": m["max_seconds"],
+                }
+        return out
+
+    def print_metrics(self):
+        print(json.dumps(self.metrics(), indent=2))
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def get_default_client():
+    """Process-wide client used when the pipeline is handed a plain api_key string."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = M2MClient()
+        return _default_client
+
+
+def resolve_client(api_key):
+    """
+    Accept either an M2MClient or an api_key string.
+    Returns (client, key) to call client.call(..., api_key=key) with.
+    """
+    if isinstance(api_key, M2MClient):
+        # None lets the client pick its own (possibly refreshed) key
+        return api_key, None
+    return get_default_client(), api_key
@@ -0,0 +1,218 @@
+"""
+Process-wide M2M API key manager.
+
+Instead of login-token / logout around every web request, the key is logged
+in once and reused until it's close to expiring (M2M keys last ~2 hours),
+or until M2M says it's no longer valid, and only then refreshed. Threads in
+the same process share it behind a lock; gunicorn workers share it through a
+small key file (flock'd), so a refresh in one worker is picked up by the rest
+instead of every worker racing its own login.
+
+Logout only happens at shutdown, by the last process still using the key.
+
+Env:
+  M2M_KEY_TTL_SECONDS      how long a key is trusted after login (default 7200)
+  M2M_KEY_REFRESH_MARGIN   refresh this many seconds before that (default 300)
+  M2M_KEY_FILE             shared key file (default $XDG_CACHE_HOME/dnbr/m2m_api_key.json,
+                           i.e. ~/.cache/...). Keep it out of the repo / static root: the Flask
+                           app serves that tree, and a live key must never be downloadable.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; locking then only covers threads, not processes
+    fcntl = None
+
+from m2m_client import M2MClient, M2MError, get_default_client
+
+M2M_KEY_TTL = float(os.environ.get("M2M_KEY_TTL_SECONDS", "7200"))
+M2M_KEY_REFRESH_MARGIN = float(os.environ.get("M2M_KEY_REFRESH_MARGIN", "300"))
+M2M_KEY_FILE = os.environ.get(
+    "M2M_KEY_FILE",
+    os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+        "dnbr", "m2m_api_key.json",
+    ),
+)
+
+
+def is_auth_error(exc):
+    """True if an M2M call failed because the key is bad / expired."""
+    if isinstance(exc, M2MError):
+        return str(exc.error_code or "").upper().startswith("AUTH")
+    response = getattr(exc, "response", None)
+    return response is not None and response.status_code in (401, 403)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class M2MCredentialManager:
+    def __init__(self, username, app_token, client=None, ttl=None, refresh_margin=None, key_file=None):
+        self.username = username
+        self.app_token = app_token
+        # the session used for login/logout; pipeline calls go through self.client()
+        self.auth_client = client or get_default_client()
+        self.ttl = M2M_KEY_TTL if ttl is None else ttl
+        self.refresh_margin = M2M_KEY_REFRESH_MARGIN if refresh_margin is None else refresh_margin
+        self.key_file = key_file or M2M_KEY_FILE
+        self._lock = threading.Lock()
+        self._key = None
+        self._expires_at = 0.0
+        self._registered = False
+        self._client = None
+
+    # ---- shared key file ----
+
+    @contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.key_file) or ".", mode=0o700, exist_ok=True)
+        with open(self.key_file + ".lock", "a") as lock_f:
+            if fcntl is not None:
+                fcntl.flock(lock_f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+    def _read_file(self):
+        try:
+            with open(self.key_file) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if state.get("username") != self.username:
+            return {}
+        return state
+
+    def _write_file(self, state):
+        tmp = self.key_file + ".tmp"
+        # created 0600 up front, so the key is never readable by others, not even briefly
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f)
+        os.chmod(tmp, 0o600)   # O_CREAT doesn't change the mode of a leftover tmp file
+        os.replace(tmp, self.key_file)
+
+    def _fresh(self, expires_at):
+        return expires_at - self.refresh_margin > time.time()
+
+    # ---- public ----
+
+    def api_key(self):
+        """Current key, logging in (or picking up another worker's key) if needed."""
+        with self._lock:
+            if self._key and self._fresh(self._expires_at):
+                return self._key
+            return self._refresh_locked(stale_key=self._key)
+
+    def refresh(self, stale_key=None):
+        """
+        Force a new key, unless someone already replaced stale_key in the
+        meantime (then that newer key is used).
+        """
+        with self._lock:
+            return self._refresh_locked(stale_key=stale_key or self._key, force=True)
+
+    def _refresh_locked(self, stale_key=None, force=False):
+        with self._file_lock():
+            state = self._read_file()
+            key = state.get("api_key")
+            expires_at = state.get("expires_at", 0.0)
+            usable = key and self._fresh(expires_at) and (not force or key != stale_key)
+
+            if not usable:
+                print("Logging in to M2M (shared key expired or missing)")
+                key = self.auth_client.call(
+                    "login-token", {"username": self.username, "token": self.app_token}, auth=False
+                )
+                expires_at = time.time() + self.ttl
+                state = {"username": self.username, "api_key": key, "expires_at": expires_at,
+                         "pids": state.get("pids", [])}
+
+            pids = [p for p in state.get("pids", []) if p != os.getpid() and _pid_alive(p)]
+            state["pids"] = pids + [os.getpid()]
+            self._write_file(state)
+
+        self._key = key
+        self._expires_at = expires_at
+        if not self._registered:
+            atexit.register(self.shutdown)
+            self._registered = True
+        return key
+
+    def client(self):
+        """An M2MClient that always uses the current key and refreshes on auth errors."""
+        with self._lock:
+            if self._client is None:
+                # same endpoint and pooled session as the login client
+                self._client = M2MClient(credentials=self, service_url=self.auth_client.service_url)
+                self._client.session.close()
+                self._client.session = self.auth_client.session
+            return self._client
+
+    def shutdown(self):
+        """Log out, but only if no other live process is still using the shared key."""
+        with self._lock:
+            if not self._key:
+                return
+            with self._file_lock():
+                state = self._read_file()
+                pids = [p for p in state.get("pids", []) if p != os.getpid() and _pid_alive(p)]
+                last_user = state.get("api_key") != self._key or not pids
+                if state.get("api_key") == self._key:
+                    if pids:
+                        state["pids"] = pids
+                        self._write_file(state)
+                    else:
+                        try:
+                            os.remove(self.key_file)
+                        except OSError:
+                            pass
+            if last_user:
+                try:
+                    self.auth_client.call("logout", None, api_key=self._key)
+                    print("Logged out of M2M.")
+                except Exception as e:
+                    print("Logout failed:", e)
+            self._key = None
+            self._expires_at = 0.0
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def active_clients():
+    """Pipeline clients of every manager made so far in this process (for /metrics)."""
+    with _managers_lock:
+        managers = list(_managers.values())
+    return [m._client for m in managers if m._client is not None]
+
+
+def get_credential_manager(username=None, app_token=None):
+    """One manager per username per process (env USGS_USERNAME / USGS_TOKEN by default)."""
+    username = username or os.environ.get("USGS_USERNAME")
+    app_token = app_token or os.environ.get("USGS_TOKEN")
+    if not username or not app_token:
+        raise RuntimeError("USGS_USERNAME / USGS_TOKEN not set")
+    with _managers_lock:
+        mgr = _managers.get(username)
+        if mgr is None:
+            mgr = M2MCredentialManager(username, app_token)
+            _managers[username] = mgr
+        return mgr
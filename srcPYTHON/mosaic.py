@@ -0,0 +1,440 @@
+"""
+Province-wide dNBR mosaic of the batch tiles.
+
+The per path/row GeoTIFFs in the batch folder (OUTPUT_DIR/batch_tiles) are
+merged onto one fixed grid covering Quebec (EPSG:32198, Quebec Lambert, 30 m),
+so the map draws one tiled pyramid (/tiles/{z}/{x}/{y}.png?tif=mosaic)
+instead of 20+ overlapping full-res PNG overlays.
+
+Where tiles overlap (neighbouring rows / paths) MOSAIC_RULE decides:
+  least_cloud - the tile with the most clear pixels wins. Scene cloud cover
+                isn't kept with the outputs, but clouds / shadow / water are
+                nodata in the GeoTIFF, so the share of valid pixels is the
+                same ranking
+  latest      - the tile with the latest post-fire date wins
+  max         - highest dNBR per pixel
+Pixels the winner has no data for are filled from the next tile down.
+
+Layout (MOSAIC_DIR):
+  dnbr_mosaic.tif          full res, 512px tiles, sparse (empty blocks take no space)
+  dnbr_mosaic_ovr2.tif ... one file per overview level, nodata-aware average
+  dnbr_mosaic.vrt          level 0 + the levels as its overviews, what gets read
+  mosaic_index.json        footprint / date / clear share + mtime and size per tile
+
+Updating is incremental: only tiles that are new, changed (mtime / size) or
+gone are looked at, only the 512px blocks under their old and new footprints
+are recomposed (from every tile touching the block), and then only the
+overview blocks above those. Blocks rewritten in a compressed GeoTIFF are
+appended at the end of the file, run with --rebuild now and then to compact.
+
+    python mosaic.py             # update
+    python mosaic.py --rebuild   # from scratch (also done when grid / rule change)
+
+Env:
+  DNBR_MOSAIC_DIR      (default OUTPUT_DIR/mosaic)
+  DNBR_MOSAIC_SRC_DIR  tiles to merge (default DNBR_MANIFEST_SRC_DIR, OUTPUT_DIR/batch_tiles)
+  DNBR_MOSAIC_CRS      (default EPSG:32198)
+  DNBR_MOSAIC_RES      metres (default 30)
+  DNBR_MOSAIC_BOUNDS   west,south,east,north in degrees (default -80,44,-56,67)
+  DNBR_MOSAIC_RULE     least_cloud | latest | max (default least_cloud)
+"""
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.warp import reproject, transform_bounds, Resampling
+from rasterio.windows import Window
+
+from ThePython import OUTPUT_DIR, DELTA_NODATA, COG_COMPRESS, COG_BLOCKSIZE
+from tile_manifest import FNAME_RE, MANIFEST_SRC_DIR
+from instrumentation import span
+
+MOSAIC_DIR = os.environ.get("DNBR_MOSAIC_DIR", os.path.join(OUTPUT_DIR, "mosaic"))
+MOSAIC_SRC_DIR = os.environ.get("DNBR_MOSAIC_SRC_DIR", MANIFEST_SRC_DIR)
+MOSAIC_CRS = os.environ.get("DNBR_MOSAIC_CRS", "EPSG:32198")
+MOSAIC_RES = float(os.environ.get("DNBR_MOSAIC_RES", "30"))
+MOSAIC_BOUNDS = tuple(float(v) for v in os.environ.get("DNBR_MOSAIC_BOUNDS", "-80,44,-56,67").split(","))
+MOSAIC_RULE = os.environ.get("DNBR_MOSAIC_RULE", "least_cloud").lower()
+
+MOSAIC_RULES = ("least_cloud", "latest", "max")
+MOSAIC_NAME = "dnbr_mosaic"
+MOSAIC_VRT = os.path.join(MOSAIC_DIR, MOSAIC_NAME + ".vrt")
+INDEX_VERSION = 1
+BLOCK = COG_BLOCKSIZE
+
+
+def mosaic_grid(crs=MOSAIC_CRS, res=MOSAIC_RES, lonlat_bounds=MOSAIC_BOUNDS):
+    """Level 0 grid: lon/lat box in crs, snapped outwards to whole blocks."""
+    left, bottom, right, top = transform_bounds("EPSG:4326", crs, *lonlat_bounds, densify_pts=21)
+    step = res * BLOCK
+    left = math.floor(left / step) * step
+    bottom = math.floor(bottom / step) * step
+    right = math.ceil(right / step) * step
+    top = math.ceil(top / step) * step
+    return {
+        "crs": crs,
+        "res": res,
+        "bounds": [left, bottom, right, top],
+        "width": int(round((right - left) / res)),
+        "height": int(round((top - bottom) / res)),
+    }
+
+
+def level_count(grid):
+    n = 1
+    while max(grid["width"], grid["height"]) > BLOCK * 2 ** (n - 1):
+        n += 1
+    return n
+
+
+def _level_path(level, mosaic_dir=MOSAIC_DIR):
+    if level == 0:
+        return os.path.join(mosaic_dir, MOSAIC_NAME + ".tif")
+    return os.path.join(mosaic_dir, f"{MOSAIC_NAME}_ovr{2 ** level}.tif")
+
+
+def _level_shape(grid, level):
+    f = 2 ** level
+    return -(-grid["height"] // f), -(-grid["width"] // f)
+
+
+def _level_transform(grid, level):
+    left, _, _, top = grid["bounds"]
+    return from_origin(left, top, grid["res"] * 2 ** level, grid["res"] * 2 ** level)
+
+
+def _create_level(grid, level, mosaic_dir):
+    height, width = _level_shape(grid, level)
+    profile = {
+        "driver": "GTiff",
+        "dtype": "float32",
+        "count": 1,
+        "width": width,
+        "height": height,
+        "crs": grid["crs"],
+        "transform": _level_transform(grid, level),
+        "nodata": DELTA_NODATA,
+        "tiled": True,
+        "blockxsize": BLOCK,
+        "blockysize": BLOCK,
+        "compress": COG_COMPRESS,
+        "predictor": 3,
+        "BIGTIFF": "YES",
+        "sparse_ok": True,   # nothing written yet = no blocks on disk
+    }
+    with rasterio.open(_level_path(level, mosaic_dir), "w", **profile):
+        pass
+
+
+def _write_vrt(grid, levels, mosaic_dir):
+    """dnbr_mosaic.vrt: level 0 with the level files as overviews (GDAL reads the one the zoom needs)."""
+    height, width = _level_shape(grid, 0)
+    t = _level_transform(grid, 0)
+    srs = rasterio.crs.CRS.from_user_input(grid["crs"]).to_wkt()
+
+    def source(level):
+        h, w = _level_shape(grid, level)
+        name = os.path.basename(_level_path(level, mosaic_dir))
+        return (
+            f'<SourceFilename relativeToVRT="1">{name}</SourceFilename><SourceBand>1</SourceBand>'
+            f'<SourceProperties RasterXSize="{w}" RasterYSize="{h}" DataType="Float32" '
+            f'BlockXSize="{BLOCK}" BlockYSize="{BLOCK}"/>'
+        )
+
+    lines = [
+        f'<VRTDataset rasterXSize="{width}" rasterYSize="{height}">',
+        f'  <SRS>{srs.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")}</SRS>',
+        f"  <GeoTransform>{t.c!r}, {t.a!r}, 0.0, {t.f!r}, 0.0, {t.e!r}</GeoTransform>",
+        f'  <Metadata><MDI key="updated">{time.time():.3f}</MDI></Metadata>',
+        '  <VRTRasterBand dataType="Float32" band="1">',
+        f"    <NoDataValue>{DELTA_NODATA!r}</NoDataValue>",
+        f'    <SimpleSource>{source(0)}<SrcRect xOff="0" yOff="0" xSize="{width}" ySize="{height}"/>'
+        f'<DstRect xOff="0" yOff="0" xSize="{width}" ySize="{height}"/></SimpleSource>',
+    ]
+    for level in range(1, levels):
+        lines.append(f"    <Overview>{source(level)}</Overview>")
+    lines += ["  </VRTRasterBand>", "</VRTDataset>", ""]
+
+    # a new file every update: the tile server keys its cache / ETags on the VRT's mtime + size
+    tmp = os.path.join(mosaic_dir, f".{MOSAIC_NAME}.{os.getpid()}.vrt")
+    with open(tmp, "w") as f:
+        f.write("\n".join(lines))
+    os.replace(tmp, os.path.join(mosaic_dir, MOSAIC_NAME + ".vrt"))
+
+
+# ---- per tile facts (index entries) ----
+
+def _tile_entry(tif_path, st, grid):
+    m = FNAME_RE.match(os.path.basename(tif_path))
+    with rasterio.open(tif_path) as src:
+        bounds = transform_bounds(src.crs, grid["crs"], *src.bounds, densify_pts=21)
+        # share of valid pixels, from the smallest overview so it stays cheap
+        factors = src.overviews(1)
+        f = factors[-1] if factors else max(1, max(src.width, src.height) // 1024)
+        data = src.read(1, out_shape=(max(1, src.height // f), max(1, src.width // f)),
+                        resampling=Resampling.nearest)
+        valid = np.isfinite(data)
+        if src.nodata is not None:
+            valid &= data != src.nodata
+    return {
+        "mtime_ns": st.st_mtime_ns,
+        "size": st.st_size,
+        "bounds": list(bounds),
+        "pre": m.group("pre"),
+        "post": m.group("post"),
+        "clear": round(float(np.count_nonzero(valid)) / valid.size, 4),
+    }
+
+
+def _priority(entry, rule):
+    # sorted ascending, painted in that order: the last one wins
+    if rule == "latest":
+        return (entry["post"], entry["pre"], entry["clear"])
+    return (entry["clear"], entry["post"], entry["pre"])
+
+
+# ---- block maths ----
+
+def _blocks_under(bounds, grid):
+    """(block_row, block_col) of the level 0 blocks touching bounds."""
+    left, bottom, right, top = grid["bounds"]
+    span_m = grid["res"] * BLOCK
+    c0 = max(0, int(math.floor((bounds[0] - left) / span_m)))
+    c1 = min(-(-grid["width"] // BLOCK), int(math.ceil((bounds[2] - left) / span_m)))
+    r0 = max(0, int(math.floor((top - bounds[3]) / span_m)))
+    r1 = min(-(-grid["height"] // BLOCK), int(math.ceil((top - bounds[1]) / span_m)))
+    return {(r, c) for r in range(r0, r1) for c in range(c0, c1)}
+
+
+def _block_window(grid, level, brow, bcol):
+    height, width = _level_shape(grid, level)
+    col0, row0 = bcol * BLOCK, brow * BLOCK
+    return Window(col0, row0, min(BLOCK, width - col0), min(BLOCK, height - row0))
+
+
+def _warp_onto(src, dst_transform, shape, dst_crs):
+    """src (full res) nearest-neighbour onto the block grid, NaN where it has no data. None if disjoint."""
+    h, w = shape
+    left, top = dst_transform * (0, 0)
+    right, bottom = dst_transform * (w, h)
+    sl, sb, sr, st = transform_bounds(dst_crs, src.crs, left, bottom, right, top, densify_pts=21)
+    inv = ~src.transform
+    c0, r0 = inv * (sl, st)
+    c1, r1 = inv * (sr, sb)
+    col0 = max(0, int(math.floor(min(c0, c1))) - 1)
+    row0 = max(0, int(math.floor(min(r0, r1))) - 1)
+    col1 = min(src.width, int(math.ceil(max(c0, c1))) + 1)
+    row1 = min(src.height, int(math.ceil(max(r0, r1))) + 1)
+    if col1 <= col0 or row1 <= row0:
+        return None
+
+    window = Window(col0, row0, col1 - col0, row1 - row0)
+    data = src.read(1, window=window).astype("float32", copy=False)
+    if src.nodata is not None:
+        data[data == src.nodata] = np.nan
+    out = np.full(shape, np.nan, dtype=np.float32)
+    reproject(
+        source=data,
+        destination=out,
+        src_transform=src.window_transform(window),
+        src_crs=src.crs,
+        src_nodata=np.nan,
+        dst_transform=dst_transform,
+        dst_crs=dst_crs,
+        dst_nodata=np.nan,
+        resampling=Resampling.nearest,
+    )
+    return out
+
+
+def _compose_block(grid, brow, bcol, contributors, datasets, rule):
+    win = _block_window(grid, 0, brow, bcol)
+    shape = (int(win.height), int(win.width))
+    transform = rasterio.windows.transform(win, _level_transform(grid, 0))
+    out = np.full(shape, np.nan, dtype=np.float32)
+    for fname in contributors:
+        data = _warp_onto(datasets[fname], transform, shape, grid["crs"])
+        if data is None:
+            continue
+        if rule == "max":
+            np.fmax(out, data, out=out)
+        else:
+            valid = ~np.isnan(data)
+            out[valid] = data[valid]
+    return out
+
+
+def _average_block(src, grid, level, brow, bcol):
+    """Level `level` block as the nodata-aware 2x2 average of level - 1."""
+    prev_h, prev_w = _level_shape(grid, level - 1)
+    col0, row0 = bcol * BLOCK * 2, brow * BLOCK * 2
+    win = Window(col0, row0, min(2 * BLOCK, prev_w - col0), min(2 * BLOCK, prev_h - row0))
+    data = src.read(1, window=win).astype("float32", copy=False)
+    h, w = data.shape
+    if h % 2 or w % 2:
+        padded = np.full((h + h % 2, w + w % 2), DELTA_NODATA, dtype=np.float32)
+        padded[:h, :w] = data
+        data = padded
+    valid = data != DELTA_NODATA
+    values = np.where(valid, data, np.float32(0))
+    valid = valid.view(np.uint8)
+    # four strided adds, a lot cheaper than reshape(...).sum(axis=(1, 3))
+    total = values[0::2, 0::2] + values[1::2, 0::2] + values[0::2, 1::2] + values[1::2, 1::2]
+    count = valid[0::2, 0::2] + valid[1::2, 0::2] + valid[0::2, 1::2] + valid[1::2, 1::2]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / count, np.nan).astype(np.float32)
+
+
+def _write_block(dst, win, block):
+    """Write NaN as nodata; an all-empty block that's empty on disk too is left out (stays sparse)."""
+    encoded = np.where(np.isnan(block), DELTA_NODATA, block).astype(np.float32)
+    if not np.any(encoded != DELTA_NODATA):
+        if not np.any(dst.read(1, window=win) != DELTA_NODATA):
+            return False
+    dst.write(encoded, 1, window=win)
+    return True
+
+
+# ---- index ----
+
+def _index_path(mosaic_dir):
+    return os.path.join(mosaic_dir, "mosaic_index.json")
+
+
+def _load_index(mosaic_dir):
+    try:
+        with open(_index_path(mosaic_dir)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_index(index, mosaic_dir):
+    path = _index_path(mosaic_dir)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp, path)
+
+
+_update_lock = threading.Lock()
+
+
+def update_mosaic(src_dir=MOSAIC_SRC_DIR, mosaic_dir=MOSAIC_DIR, rule=None, grid=None, rebuild=False):
+    """
+    Bring the mosaic up to date with the tiles in src_dir, touching only
+    the blocks under tiles that are new, changed or removed.
+    Returns {"tiles", "changed", "removed", "blocks", "seconds", "rebuilt"}.
+    """
+    rule = (rule or MOSAIC_RULE).lower()
+    if rule not in MOSAIC_RULES:
+        raise RuntimeError(f"Unknown mosaic rule {rule!r}, expected one of {', '.join(MOSAIC_RULES)}")
+    grid = grid or mosaic_grid()
+    levels = level_count(grid)
+
+    with _update_lock, span("mosaic_update", rule=rule) as sp:
+        t0 = time.perf_counter()
+        os.makedirs(mosaic_dir, exist_ok=True)
+
+        index = None if rebuild else _load_index(mosaic_dir)
+        if (index is None or index.get("version") != INDEX_VERSION or index.get("grid") != grid
+                or index.get("rule") != rule
+                or not all(os.path.exists(_level_path(lv, mosaic_dir)) for lv in range(levels))):
+            rebuild = True
+            index = {"version": INDEX_VERSION, "grid": grid, "rule": rule, "files": {}}
+            for lv in range(levels):
+                _create_level(grid, lv, mosaic_dir)
+        old = index["files"]
+
+        files, changed = {}, []
+        names = sorted(os.listdir(src_dir)) if os.path.isdir(src_dir) else []
+        for fname in names:
+            if not FNAME_RE.match(fname):
+                continue
+            tif_path = os.path.join(src_dir, fname)
+            try:
+                st = os.stat(tif_path)
+            except FileNotFoundError:
+                continue
+            prev = old.get(fname)
+            if prev and prev["mtime_ns"] == st.st_mtime_ns and prev["size"] == st.st_size:
+                files[fname] = prev
+                continue
+            try:
+                files[fname] = _tile_entry(tif_path, st, grid)
+            except Exception as e:
+                print(f"Mosaic: skipping {fname}: {e}")
+                if prev:
+                    files[fname] = prev
+                continue
+            changed.append(fname)
+        removed = [fname for fname in old if fname not in files]
+
+        dirty = set()
+        for fname in changed + removed:
+            for entry in (old.get(fname), files.get(fname)):
+                if entry:
+                    dirty |= _blocks_under(entry["bounds"], grid)
+
+        # contributors per block, lowest priority first
+        ordered = sorted(files, key=lambda n: _priority(files[n], rule))
+        footprints = {n: _blocks_under(files[n]["bounds"], grid) for n in ordered}
+
+        written = 0
+        datasets = {}
+        try:
+            with rasterio.open(_level_path(0, mosaic_dir), "r+") as dst:
+                for brow, bcol in sorted(dirty):
+                    contributors = [n for n in ordered if (brow, bcol) in footprints[n]]
+                    for n in contributors:
+                        if n not in datasets:
+                            datasets[n] = rasterio.open(os.path.join(src_dir, n))
+                    block = _compose_block(grid, brow, bcol, contributors, datasets, rule)
+                    written += _write_block(dst, _block_window(grid, 0, brow, bcol), block)
+        finally:
+            for ds in datasets.values():
+                ds.close()
+
+        for lv in range(1, levels):
+            dirty = {(r // 2, c // 2) for r, c in dirty}
+            with rasterio.open(_level_path(lv - 1, mosaic_dir)) as src, \
+                    rasterio.open(_level_path(lv, mosaic_dir), "r+") as dst:
+                for brow, bcol in sorted(dirty):
+                    block = _average_block(src, grid, lv, brow, bcol)
+                    written += _write_block(dst, _block_window(grid, lv, brow, bcol), block)
+
+        index["files"] = files
+        _save_index(index, mosaic_dir)
+        if changed or removed or rebuild or not os.path.exists(os.path.join(mosaic_dir, MOSAIC_NAME + ".vrt")):
+            _write_vrt(grid, levels, mosaic_dir)
+
+        seconds = time.perf_counter() - t0
+        sp.set(tiles=len(files), changed=len(changed), removed=len(removed), blocks=written, rebuilt=rebuild)
+        print(f"Mosaic: {len(changed)} tiles changed, {len(removed)} removed, "
+              f"{written} blocks written in {seconds:.1f}s ({len(files)} tiles, rule {rule})")
+        return {"tiles": len(files), "changed": changed, "removed": removed, "blocks": written,
+                "seconds": seconds, "rebuilt": rebuild}
+
+
+def mosaic_info(mosaic_dir=MOSAIC_DIR):
+    """What the frontend needs to draw the mosaic, None if it hasn't been built."""
+    vrt = os.path.join(mosaic_dir, MOSAIC_NAME + ".vrt")
+    try:
+        st = os.stat(vrt)
+    except FileNotFoundError:
+        return None
+    return {
+        "url": "/tiles/{z}/{x}/{y}.png?tif=mosaic",
+        "version": f"{st.st_mtime_ns}-{st.st_size}",
+    }
+
+
+if __name__ == "__main__":
+    update_mosaic(rebuild="--rebuild" in sys.argv[1:])
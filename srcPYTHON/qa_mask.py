@@ -0,0 +1,169 @@
+"""
+Landsat Collection 2 QA_PIXEL -> obstruction mask.
+
+All the flags we drop are tested with one combined bitmask,
+(qa & bits) != 0, instead of one full-scene boolean per flag. Which flags
+count is configurable, e.g. add water for lakes that look like burn scars,
+or leave snow out for late-season scenes:
+    DNBR_QA_MASK_FLAGS=fill,dilated,cirrus,cloud,shadow,snow,water
+
+Masks can also be kept bit-packed (np.packbits along rows, 8 pixels per
+byte) with PackedMask: 1/8 the memory of a bool array, and combining pre and
+post masks is a byte-wise OR over that. fused_dnbr unpacks one chunk of rows
+at a time, so a full bool mask never has to exist.
+
+When the QA band lives in the scene cache, its packed mask is cached there
+too (as its own band, "qa_mask_<bits>"), so a re-run of the same scene reads
+a few MB instead of decoding the QA band again. It counts towards the cache
+size and is evicted like any other band.
+
+Env:
+  DNBR_QA_MASK_FLAGS   (default fill,dilated,cirrus,cloud,shadow,snow)
+  DNBR_QA_PACKED       keep full-scene masks bit-packed in memory (default 0)
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import rasterio
+
+from scene_cache import get_scene_cache
+
+# QA_PIXEL bit numbers
+QA_BITS = {
+    "fill": 0,
+    "dilated": 1,     # dilated cloud
+    "cirrus": 2,
+    "cloud": 3,
+    "shadow": 4,      # cloud shadow
+    "snow": 5,
+    "clear": 6,
+    "water": 7,
+}
+DEFAULT_QA_FLAGS = ("fill", "dilated", "cirrus", "cloud", "shadow", "snow")
+
+QA_MASK_FLAGS = tuple(
+    f.strip().lower() for f in os.environ.get("DNBR_QA_MASK_FLAGS", ",".join(DEFAULT_QA_FLAGS)).split(",")
+    if f.strip()
+)
+QA_PACKED = os.environ.get("DNBR_QA_PACKED", "0") == "1"
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def qa_bitmask(flags=None):
+    """Combined bitmask for a list of flag names (default QA_MASK_FLAGS). An int is passed through."""
+    if flags is None:
+        flags = QA_MASK_FLAGS
+    if isinstance(flags, (int, np.integer)):
+        return int(flags)
+    bits = 0
+    for name in flags:
+        if name not in QA_BITS:
+            raise RuntimeError(f"Unknown QA flag {name!r}, expected one of {', '.join(QA_BITS)}")
+        bits |= 1 << QA_BITS[name]
+    return bits
+
+
+def qa_obstruction_mask(qa, flags=None):
+    """
+    Turn a QA_PIXEL array (full scene or just a block of it) into a boolean
+    mask, True where any of the flags is set (fill / cloud / shadow / snow etc.).
+    """
+    return np.bitwise_and(qa, qa_bitmask(flags)) != 0
+
+
+class PackedMask:
+    """A (h, w) bool mask stored as np.packbits(mask, axis=-1)."""
+
+    def __init__(self, bits, shape):
+        self.bits = bits
+        self.shape = tuple(shape)
+
+    @classmethod
+    def pack(cls, mask):
+        return cls(np.packbits(mask, axis=-1), mask.shape)
+
+    def unpack(self, rows=slice(None)):
+        """bool array for all rows, or just a slice of them."""
+        return np.unpackbits(self.bits[rows], axis=-1, count=self.shape[1]).view(bool)
+
+    def __ior__(self, other):
+        if not isinstance(other, PackedMask):
+            other = PackedMask.pack(other)
+        if other.shape != self.shape:
+            raise RuntimeError(f"Mask shapes differ: {self.shape} vs {other.shape}")
+        np.bitwise_or(self.bits, other.bits, out=self.bits)
+        return self
+
+    def count(self):
+        """Number of True pixels (the padding bits at the end of each row are always 0)."""
+        return int(_POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, bits=self.bits, shape=np.array(self.shape, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as z:
+            return cls(z["bits"], z["shape"])
+
+
+def as_bool(mask):
+    return mask.unpack() if isinstance(mask, PackedMask) else mask
+
+
+def _cached_display_id(cache, qa_path):
+    # cached bands live at <cache root>/<displayId>/<file>
+    scene_dir = os.path.dirname(os.path.abspath(qa_path))
+    if os.path.dirname(scene_dir) == os.path.abspath(cache.root):
+        return os.path.basename(scene_dir)
+    return None
+
+
+def load_qa_mask(qa_path, flags=None, packed=None):
+    """
+    Obstruction mask for a QA_PIXEL GeoTIFF: a PackedMask with packed=True
+    (default QA_PACKED), a bool array otherwise. Read from / stored in the
+    scene cache when the QA band is a cached one.
+    """
+    if packed is None:
+        packed = QA_PACKED
+    bits = qa_bitmask(flags)
+
+    cache = get_scene_cache()
+    display_id = _cached_display_id(cache, qa_path)
+    band = f"qa_mask_{bits:04x}"
+
+    mask = None
+    if display_id is not None:
+        cached = cache.get(display_id, band)
+        if cached is not None:
+            try:
+                mask = PackedMask.load(cached)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Cached QA mask {cached} unreadable ({e}), decoding the QA band again")
+
+    if mask is None:
+        with rasterio.open(qa_path) as src:
+            qa = src.read(1)
+        if display_id is None and not packed:
+            return qa_obstruction_mask(qa, bits)
+        mask = PackedMask.pack(qa_obstruction_mask(qa, bits))
+        del qa
+        if display_id is not None:
+            tmp_dir = tempfile.mkdtemp(dir=cache.root)
+            try:
+                tmp_path = os.path.join(tmp_dir, f"{band}.npz")
+                mask.save(tmp_path)
+                cache.put(display_id, band, tmp_path, move=True)
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return mask if packed else mask.unpack()
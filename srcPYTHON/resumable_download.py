@@ -0,0 +1,369 @@
+"""
+Resumable HTTP downloads for the big Level-2 bundles.
+
+download_file() writes into <out_path>.part and keeps a small journal next to
+it (<out_path>.part.json) with the URL, the expected size/ETag and how far
+each byte range has got. If the connection drops, the next attempt (or the
+next run, even after a crash) asks for the missing bytes with a Range header
+instead of starting again from zero. When everything is in, the size (and the
+sha256 if one was given) is checked before the .part file is renamed into
+place, so a truncated bundle can never end up at out_path.
+
+With segments > 1 the file is split into that many byte ranges that download
+in parallel, which helps on big bundles when one TCP stream can't fill the
+pipe. Servers that don't do Range (no Accept-Ranges / Content-Length) fall
+back to a plain single GET that restarts from zero on retry.
+
+ResumableHTTPReader is the same idea for code that wants a file-like stream
+(the streaming tar extraction): reads transparently pick up where they left
+off after a dropped connection.
+
+Env:
+  DNBR_DOWNLOAD_RETRIES   attempts per byte range (default 5)
+  DNBR_DOWNLOAD_BACKOFF   first retry delay in seconds, doubles each time (default 2)
+  DNBR_DOWNLOAD_SEGMENTS  parallel ranges per file (default 1)
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import urllib3
+
+DOWNLOAD_RETRIES = int(os.environ.get("DNBR_DOWNLOAD_RETRIES", "5"))
+DOWNLOAD_BACKOFF = float(os.environ.get("DNBR_DOWNLOAD_BACKOFF", "2"))
+DOWNLOAD_SEGMENTS = int(os.environ.get("DNBR_DOWNLOAD_SEGMENTS", "1"))
+DOWNLOAD_TIMEOUT = (15, 120)              # (connect, read) seconds
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+JOURNAL_EVERY_BYTES = 16 * 1024 * 1024    # how often progress is written to the journal
+
+# worth retrying: dropped connections, timeouts, and these status codes
+RETRY_STATUS = {429, 500, 502, 503, 504}
+RETRY_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.Timeout,
+)
+
+# no content-encoding, otherwise byte offsets in Range don't line up with what we wrote
+_IDENTITY = {"Accept-Encoding": "identity"}
+
+
+class RetryableHTTPError(Exception):
+    pass
+
+
+def _backoff_sleep(attempt, backoff):
+    delay = backoff * (2 ** attempt)
+    print(f"  retrying in {delay:.0f}s...")
+    time.sleep(delay)
+
+
+def _check_status(resp):
+    if resp.status_code in RETRY_STATUS:
+        raise RetryableHTTPError(f"HTTP {resp.status_code}")
+    resp.raise_for_status()
+
+
+def probe(url):
+    """
+    HEAD the URL: returns (total_size or None, accepts_ranges, validator)
+    where validator is the ETag / Last-Modified used to detect a changed file.
+    """
+    try:
+        resp = requests.head(url, allow_redirects=True, headers=_IDENTITY, timeout=DOWNLOAD_TIMEOUT)
+    except RETRY_EXCEPTIONS:
+        return None, False, None
+    if not resp.ok:
+        return None, False, None
+
+    length = resp.headers.get("Content-Length")
+    total = int(length) if length and length.isdigit() else None
+    accepts_ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+    validator = resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+    return total, accepts_ranges, validator
+
+
+# ---- journal ----
+
+def _load_journal(journal_path, url, total, validator):
+    try:
+        with open(journal_path) as f:
+            journal = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # compare without the query string: M2M hands out a freshly signed URL for the same file each time
+    if journal.get("url", "").split("?")[0] != url.split("?")[0] or journal.get("total") != total:
+        return None
+    if validator and journal.get("validator") and journal["validator"] != validator:
+        return None  # the file on the server changed, start over
+    return journal
+
+
+def _save_journal(journal_path, journal):
+    tmp = journal_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(journal, f)
+    os.replace(tmp, journal_path)
+
+
+def _plan_segments(total, segments):
+    size = -(-total // segments)  # ceil
+    return [[start, min(start + size, total), 0] for start in range(0, total, size)]
+
+
+# ---- ranged download ----
+
+def _download_segment(url, part_path, seg, state, retries, backoff):
+    """
+    Fill bytes [start, end) of part_path. seg is [start, end, done] and is
+    updated in place (under state["lock"]) so the journal always knows how far
+    this range got.
+    """
+    start, end = seg[0], seg[1]
+    attempt = 0
+    while True:
+        with state["lock"]:
+            done = seg[2]
+        if start + done >= end:
+            return
+
+        headers = dict(_IDENTITY)
+        headers["Range"] = f"bytes={start + done}-{end - 1}"
+        if state.get("validator"):
+            headers["If-Range"] = state["validator"]
+
+        try:
+            with requests.get(url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT) as r:
+                _check_status(r)
+                if r.status_code != 206:
+                    # server sent the whole file (changed file or no Range support after all)
+                    raise RuntimeError(f"Server ignored Range request (HTTP {r.status_code})")
+
+                since_journal = 0
+                with open(part_path, "r+b") as f:
+                    f.seek(start + done)
+                    for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        if not chunk:
+                            continue
+                        chunk = chunk[: end - (start + done)]
+                        f.write(chunk)
+                        done += len(chunk)
+                        since_journal += len(chunk)
+                        with state["lock"]:
+                            seg[2] = done
+                        if since_journal >= JOURNAL_EVERY_BYTES:
+                            f.flush()
+                            state["save"]()
+                            since_journal = 0
+                        if start + done >= end:
+                            break
+                    f.flush()
+                state["save"]()
+
+            if start + done < end:
+                raise requests.exceptions.ChunkedEncodingError(
+                    f"Connection closed at byte {start + done} of range {start}-{end - 1}"
+                )
+            return
+        except RETRY_EXCEPTIONS + (RetryableHTTPError,) as e:
+            state["save"]()
+            if attempt >= retries:
+                raise RuntimeError(f"Download of {url} failed after {retries} retries: {e}")
+            print(f"  range {start}-{end - 1} interrupted at {start + done}: {e}")
+            _backoff_sleep(attempt, backoff)
+            attempt += 1
+
+
+def _download_ranged(url, part_path, journal_path, total, validator, segments, retries, backoff):
+    journal = _load_journal(journal_path, url, total, validator)
+    if journal is not None and os.path.exists(part_path) and os.path.getsize(part_path) == total:
+        done_bytes = sum(s[2] for s in journal["segments"])
+        print(f"Resuming download: {done_bytes}/{total} bytes already on disk")
+    else:
+        journal = {
+            "url": url,
+            "total": total,
+            "validator": validator,
+            "segments": _plan_segments(total, max(1, segments)),
+        }
+        # preallocate (sparse) so every segment can write at its own offset
+        with open(part_path, "wb") as f:
+            f.truncate(total)
+        _save_journal(journal_path, journal)
+
+    lock = threading.Lock()
+
+    def save():
+        with lock:
+            snapshot = dict(journal)
+            snapshot["segments"] = [list(s) for s in journal["segments"]]
+        _save_journal(journal_path, snapshot)
+
+    state = {"lock": lock, "save": save, "validator": validator}
+    todo = [seg for seg in journal["segments"] if seg[0] + seg[2] < seg[1]]
+
+    if len(todo) <= 1:
+        for seg in todo:
+            _download_segment(url, part_path, seg, state, retries, backoff)
+    else:
+        with ThreadPoolExecutor(max_workers=len(todo), thread_name_prefix="dl-seg") as pool:
+            futures = [
+                pool.submit(_download_segment, url, part_path, seg, state, retries, backoff)
+                for seg in todo
+            ]
+            for fut in futures:
+                fut.result()
+
+
+# ---- plain download (no Range support) ----
+
+def _download_plain(url, part_path, retries, backoff):
+    attempt = 0
+    while True:
+        try:
+            with requests.get(url, stream=True, headers=_IDENTITY, timeout=DOWNLOAD_TIMEOUT) as r:
+                _check_status(r)
+                length = r.headers.get("Content-Length")
+                expected = int(length) if length and length.isdigit() else None
+                written = 0
+                with open(part_path, "wb") as f:
+                    for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                        written += len(chunk)
+                if expected is not None and written != expected:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Got {written} of {expected} bytes"
+                    )
+                return
+        except RETRY_EXCEPTIONS + (RetryableHTTPError,) as e:
+            if attempt >= retries:
+                raise RuntimeError(f"Download of {url} failed after {retries} retries: {e}")
+            print(f"  download interrupted: {e}")
+            _backoff_sleep(attempt, backoff)
+            attempt += 1
+
+
+def _sha256_of(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def download_file(url, out_path, expected_size=None, expected_sha256=None,
+                  segments=None, retries=None, backoff=None):
+    """
+    Download url to out_path, resuming from <out_path>.part if an earlier
+    attempt was cut off. Verifies the final size (and sha256 if given) before
+    renaming into place. Returns out_path.
+    """
+    if segments is None:
+        segments = DOWNLOAD_SEGMENTS
+    if retries is None:
+        retries = DOWNLOAD_RETRIES
+    if backoff is None:
+        backoff = DOWNLOAD_BACKOFF
+
+    part_path = out_path + ".part"
+    journal_path = part_path + ".json"
+
+    total, accepts_ranges, validator = probe(url)
+    if expected_size is not None:
+        if total is not None and total != expected_size:
+            raise RuntimeError(f"Server reports {total} bytes for {url}, expected {expected_size}")
+        total = expected_size
+
+    if total and accepts_ranges:
+        _download_ranged(url, part_path, journal_path, total, validator, segments, retries, backoff)
+    else:
+        _download_plain(url, part_path, retries, backoff)
+
+    size = os.path.getsize(part_path)
+    if total is not None and size != total:
+        raise RuntimeError(f"Downloaded {size} bytes for {url}, expected {total}")
+    if expected_sha256:
+        digest = _sha256_of(part_path)
+        if digest.lower() != expected_sha256.lower():
+            # corrupt: throw away the partial state so the next try starts clean
+            os.remove(part_path)
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            raise RuntimeError(f"Checksum mismatch for {url}: got {digest}, expected {expected_sha256}")
+
+    os.replace(part_path, out_path)
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+    return out_path
+
+
+class ResumableHTTPReader:
+    """
+    Read-only file-like view of an HTTP response that reconnects with a Range
+    header after a dropped connection and carries on from the same byte.
+    Meant for sequential readers like tarfile's stream mode.
+    """
+
+    def __init__(self, url, retries=None, backoff=None):
+        self.url = url
+        self.retries = DOWNLOAD_RETRIES if retries is None else retries
+        self.backoff = DOWNLOAD_BACKOFF if backoff is None else backoff
+        self.pos = 0
+        self.total = None
+        self.validator = None
+        self._resp = None
+        self._open()
+
+    def _open(self):
+        headers = dict(_IDENTITY)
+        if self.pos:
+            headers["Range"] = f"bytes={self.pos}-"
+            if self.validator:
+                headers["If-Range"] = self.validator
+        resp = requests.get(self.url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+        _check_status(resp)
+        if self.pos and resp.status_code != 206:
+            resp.close()
+            raise RuntimeError(f"Server can't resume {self.url} (HTTP {resp.status_code})")
+        if self._resp is None:
+            length = resp.headers.get("Content-Length")
+            self.total = int(length) if length and length.isdigit() else None
+            self.validator = resp.headers.get("ETag") or resp.headers.get("Last-Modified")
+        self._resp = resp
+
+    def read(self, size=-1):
+        attempt = 0
+        while True:
+            try:
+                data = self._resp.raw.read(size if size is not None and size >= 0 else None)
+                if not data and self.total is not None and self.pos < self.total and size != 0:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Connection closed at byte {self.pos} of {self.total}"
+                    )
+                self.pos += len(data)
+                return data
+            except RETRY_EXCEPTIONS + (RetryableHTTPError, urllib3.exceptions.HTTPError, OSError) as e:
+                if attempt >= self.retries:
+                    raise RuntimeError(f"Stream of {self.url} failed after {self.retries} retries: {e}")
+                print(f"  stream interrupted at byte {self.pos}: {e}")
+                self._resp.close()
+                _backoff_sleep(attempt, self.backoff)
+                attempt += 1
+                try:
+                    self._open()
+                except RETRY_EXCEPTIONS + (RetryableHTTPError,):
+                    continue
+
+    def close(self):
+        if self._resp is not None:
+            self._resp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,256 @@
+"""
+Persistent on-disk cache for extracted Landsat bands.
+
+Bands are stored once per (displayId, band) under SCENE_CACHE_DIR, so adjacent
+tiles, repeated date windows and re-runs never download the same bundle twice.
+The index is a small SQLite db next to the files. SQLite does the locking,
+so several gunicorn workers / scheduler threads can read and write at once;
+files are written to a temp name and renamed into place so nobody ever sees
+a half-copied band. scene_lock() hands out a per-scene lock (flock on
+<root>/locks/<displayId>.lock) so only one thread / worker fetches a scene at
+a time and the others just pick up its bands.
+
+Size is capped at SCENE_CACHE_MAX_GB. When a put goes over, the least recently
+used bands are deleted first. Anything used in the last SCENE_CACHE_PIN_SECONDS
+is left alone so a raster job that just got a path back doesn't lose its file.
+
+Hit/miss/eviction counts are kept in the db too, so they add up across workers.
+
+Env:
+  DNBR_SCENE_CACHE_DIR      (default ./data/scene_cache)
+  DNBR_SCENE_CACHE_MAX_GB   (default 20)
+"""
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; scene_lock then only covers threads, not processes
+    fcntl = None
+
+SCENE_CACHE_DIR = os.environ.get(
+    "DNBR_SCENE_CACHE_DIR", os.path.join(os.getcwd(), "data", "scene_cache")
+)
+SCENE_CACHE_MAX_GB = float(os.environ.get("DNBR_SCENE_CACHE_MAX_GB", "20"))
+SCENE_CACHE_PIN_SECONDS = 15 * 60
+
+SCENE_BANDS = ("nir", "swir", "qa")
+
+# flock is per open file, so threads in one process also need a plain lock per scene
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+
+class SceneCache:
+    def __init__(self, root=SCENE_CACHE_DIR, max_bytes=None, pin_seconds=SCENE_CACHE_PIN_SECONDS):
+        self.root = root
+        self.max_bytes = int(SCENE_CACHE_MAX_GB * 1024 ** 3) if max_bytes is None else int(max_bytes)
+        self.pin_seconds = pin_seconds
+        self.db_path = os.path.join(root, "index.sqlite")
+        os.makedirs(root, exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " display_id TEXT NOT NULL,"
+                " band TEXT NOT NULL,"
+                " path TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created REAL NOT NULL,"
+                " last_access REAL NOT NULL,"
+                " PRIMARY KEY (display_id, band))"
+            )
+            con.execute("CREATE TABLE IF NOT EXISTS metrics (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _connect(self):
+        # one short-lived connection per call: sqlite connections can't be shared across threads
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _bump(con, name, n=1):
+        con.execute(
+            "INSERT INTO metrics (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, n),
+        )
+
+    # ---- lookups ----
+
+    def get(self, display_id, band):
+        """Path of the cached band, or None. Counts a hit or a miss."""
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT path FROM entries WHERE display_id = ? AND band = ?", (display_id, band)
+            ).fetchone()
+            if row and os.path.exists(row[0]):
+                con.execute(
+                    "UPDATE entries SET last_access = ? WHERE display_id = ? AND band = ?",
+                    (time.time(), display_id, band),
+                )
+                self._bump(con, "hits")
+                return row[0]
+            if row:
+                # file vanished underneath us (someone cleaned the dir by hand)
+                con.execute("DELETE FROM entries WHERE display_id = ? AND band = ?", (display_id, band))
+            self._bump(con, "misses")
+            return None
+
+    def get_scene(self, display_id, bands=SCENE_BANDS):
+        """
+        Dict of band -> path if every band is cached, else None.
+        Stops at the first missing band so a partial scene counts as one miss.
+        """
+        out = {}
+        for band in bands:
+            p = self.get(display_id, band)
+            if p is None:
+                return None
+            out[band] = p
+        return out
+
+    def has_scene(self, display_id, bands=SCENE_BANDS):
+        """True if every band is cached. Doesn't count as a hit/miss or touch last_access."""
+        with self._connect() as con:
+            rows = con.execute(
+                f"SELECT path FROM entries WHERE display_id = ? AND band IN ({','.join('?' * len(bands))})",
+                (display_id, *bands),
+            ).fetchall()
+        return len(rows) == len(bands) and all(os.path.exists(r[0]) for r in rows)
+
+    # ---- locking ----
+
+    @contextmanager
+    def scene_lock(self, display_id):
+        """
+        Exclusive lock for fetching display_id, across threads and processes.
+        Whoever gets it second should re-check get_scene() before downloading.
+        """
+        with _thread_locks_guard:
+            tlock = _thread_locks.setdefault((self.root, display_id), threading.Lock())
+        lock_dir = os.path.join(self.root, "locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        with tlock, open(os.path.join(lock_dir, f"{display_id}.lock"), "a") as lock_f:
+            if fcntl is not None:
+                fcntl.flock(lock_f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_f, fcntl.LOCK_UN)
+
+    # ---- inserts ----
+
+    def put(self, display_id, band, src_path, move=True):
+        """
+        Store src_path as (display_id, band) and return the cached path.
+        With move=True the source file is moved instead of copied.
+        """
+        scene_dir = os.path.join(self.root, display_id)
+        os.makedirs(scene_dir, exist_ok=True)
+        final_path = os.path.join(scene_dir, os.path.basename(src_path))
+        tmp_path = f"{final_path}.{uuid.uuid4().hex}.tmp"
+
+        if move:
+            shutil.move(src_path, tmp_path)
+        else:
+            shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, final_path)
+
+        size = os.path.getsize(final_path)
+        now = time.time()
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO entries (display_id, band, path, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (display_id, band, final_path, size, now, now),
+            )
+            self._bump(con, "puts")
+            self._bump(con, "bytes_written", size)
+
+        self.evict()
+        return final_path
+
+    def put_scene(self, display_id, band_paths, move=True):
+        """put() every band in a {"nir": ..., "swir": ..., "qa": ...} dict, returns the cached dict."""
+        return {band: self.put(display_id, band, p, move=move) for band, p in band_paths.items()}
+
+    # ---- eviction ----
+
+    def evict(self):
+        """Drop least recently used bands until the cache fits in max_bytes."""
+        removed = []
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                total = con.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+                if total > self.max_bytes:
+                    cutoff = time.time() - self.pin_seconds
+                    rows = con.execute(
+                        "SELECT display_id, band, path, size FROM entries "
+                        "WHERE last_access < ? ORDER BY last_access ASC",
+                        (cutoff,),
+                    ).fetchall()
+                    for display_id, band, path, size in rows:
+                        if total <= self.max_bytes:
+                            break
+                        con.execute(
+                            "DELETE FROM entries WHERE display_id = ? AND band = ?", (display_id, band)
+                        )
+                        removed.append(path)
+                        total -= size
+                    if removed:
+                        self._bump(con, "evictions", len(removed))
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+
+        for path in removed:
+            try:
+                os.remove(path)
+                scene_dir = os.path.dirname(path)
+                if not os.listdir(scene_dir):
+                    os.rmdir(scene_dir)
+            except OSError:
+                pass
+        if removed:
+            print(f"Scene cache evicted {len(removed)} band file(s)")
+        return removed
+
+    # ---- metrics ----
+
+    def stats(self):
+        with self._connect() as con:
+            metrics = dict(con.execute("SELECT name, value FROM metrics").fetchall())
+            entries, size = con.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        hits = metrics.get("hits", 0)
+        misses = metrics.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "puts": metrics.get("puts", 0),
+            "evictions": metrics.get("evictions", 0),
+            "bytes_written": metrics.get("bytes_written", 0),
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_default_cache = None
+
+
+def get_scene_cache():
+    """Process-wide SceneCache using the env settings."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SceneCache()
+    return _default_cache
@@ -0,0 +1,161 @@
+"""
+Batched scene discovery for many tiles at once.
+
+download_landsat_period does one scene-search per (tile, window, pre/post)
+over the tile's bbox, then one download-options and one download-request per
+scene. For 20 tiles x 2 windows that's 80+ round trips one after the other.
+
+discover_scenes does the same work in a handful of calls:
+  1) one scene-search per distinct date range over the union bbox of every
+     tile (paged through with m2m_search_all)
+  2) results split up by WRS path/row (_scene_path_row_from_metadata), least
+     cloudy scene picked per tile, same as download_landsat_period
+  3) one download-options call for every chosen scene not already in the scene cache
+  4) one multi-entry download-request for all of their bundles
+
+Searches go through the scene-search cache (scene_search_cache): a date
+range is only searched if at least one tile has no fresh cached answer for
+it, and the results are cached per tile afterwards.
+
+The returned plan is handed to the download stage (tile_scheduler) which then
+only has to fetch the bundles. Only the first window's scenes get bundle URLs
+up front (resolve_windows); fallback windows rarely run, so their bundles are
+requested the normal way if they're ever needed.
+"""
+from ThePython import (
+    DATASET,
+    MAX_CLOUD_COVER,
+    tile_bbox,
+    m2m_search_all,
+    normalize_scene,
+    scene_from_record,
+    pick_scene_for_tile,
+    _scene_path_row_from_metadata,
+    _m2m_get_products_for_scenes,
+    _pick_sr_bundle_product,
+    _request_bundle_urls,
+)
+from scene_cache import get_scene_cache
+from scene_search_cache import get_search_cache
+
+PHASES = ("pre", "post")
+
+
+def union_bbox(bboxes):
+    bboxes = list(bboxes)
+    return (
+        min(b[0] for b in bboxes),
+        min(b[1] for b in bboxes),
+        max(b[2] for b in bboxes),
+        max(b[3] for b in bboxes),
+    )
+
+
+def _date_range(window, phase):
+    return window[f"{phase}_start"], window[f"{phase}_end"]
+
+
+def discover_scenes(api_key, tiles, windows, resolve_windows=1):
+    """
+    Pick a scene for every (tile, window, phase) and pre-resolve bundle URLs.
+
+    Returns a plan dict:
+      {
+        (tile index, window index): {
+            "pre":  {"scene": scene, "bundle_url": url or None} or {"error": "message"},
+            "post": {...},
+        },
+        ...
+      }
+    """
+    search_cache = get_search_cache()
+    path_rows = list(dict.fromkeys((t["path"], t["row"]) for t in tiles))
+    print(f"Batched discovery: {len(tiles)} tile(s)")
+
+    ranges = []
+    for window in windows:
+        for phase in PHASES:
+            dr = _date_range(window, phase)
+            if dr not in ranges:
+                ranges.append(dr)
+
+    by_range = {}
+    bbox = None
+    for start, end in ranges:
+        # cached answers first, only search if some tile is missing one
+        cached = {}
+        for pr in path_rows:
+            records = search_cache.get(DATASET, pr[0], pr[1], start, end, MAX_CLOUD_COVER)
+            if records is not None:
+                cached[pr] = [scene_from_record(r) for r in records]
+        if len(cached) == len(path_rows):
+            by_range[(start, end)] = cached
+            print(f"  {start}→{end}: all {len(path_rows)} path/row(s) from the scene-search cache")
+            continue
+
+        # ---- 1) one search per date range over the union footprint ----
+        if bbox is None:
+            bbox = union_bbox(tile_bbox(api_key, p, r) for p, r in path_rows)
+            print(f"  union bbox {bbox}")
+        scenes = m2m_search_all(api_key, bbox, start, end, max_cloud=MAX_CLOUD_COVER)
+
+        # ---- 2) partition by WRS path/row ----
+        records_by_pr = {pr: [] for pr in path_rows}
+        for s in scenes:
+            pr = _scene_path_row_from_metadata(s)
+            if pr in records_by_pr:
+                records_by_pr[pr].append(normalize_scene(s))
+        for pr, records in records_by_pr.items():
+            search_cache.put(DATASET, pr[0], pr[1], start, end, MAX_CLOUD_COVER, records)
+        by_range[(start, end)] = {
+            pr: [scene_from_record(r) for r in sorted(records, key=lambda r: r["cloud"])]
+            for pr, records in records_by_pr.items()
+        }
+        print(f"  {start}→{end}: {len(scenes)} scene(s) searched, "
+              f"{sum(map(len, records_by_pr.values()))} on the requested path/row(s)")
+
+    plan = {}
+    for ti, tile in enumerate(tiles):
+        path, row = tile["path"], tile["row"]
+        for wi, window in enumerate(windows):
+            entry = {}
+            for phase in PHASES:
+                start, end = _date_range(window, phase)
+                candidates = by_range[(start, end)].get((path, row), [])
+                try:
+                    entry[phase] = {
+                        "scene": pick_scene_for_tile(candidates, start, end, path, row),
+                        "bundle_url": None,
+                    }
+                except Exception as e:
+                    entry[phase] = {"error": str(e)}
+            plan[(ti, wi)] = entry
+
+    # ---- 3 + 4) download-options + download-request, once each ----
+    cache = get_scene_cache()
+    wanted = {}
+    for (ti, wi), entry in plan.items():
+        if wi >= resolve_windows:
+            continue
+        for phase in PHASES:
+            scene = entry[phase].get("scene")
+            if scene is not None and not cache.has_scene(scene["displayId"]):
+                wanted[scene["entityId"]] = scene
+
+    if wanted:
+        products = _m2m_get_products_for_scenes(api_key, list(wanted.values()))
+        pairs = [
+            (scene, _pick_sr_bundle_product(products[eid]))
+            for eid, scene in wanted.items()
+            if products.get(eid)
+        ]
+        urls = _request_bundle_urls(api_key, pairs) if pairs else {}
+        print(f"  bundle URLs resolved for {len(urls)}/{len(wanted)} scene(s)")
+
+        for entry in plan.values():
+            for phase in PHASES:
+                scene = entry[phase].get("scene")
+                if scene is not None:
+                    entry[phase]["bundle_url"] = urls.get(scene["entityId"])
+
+    return plan
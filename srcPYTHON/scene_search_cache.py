@@ -0,0 +1,214 @@
+"""
+Persistent cache for M2M scene-search results.
+
+Keyed by (dataset, path, row, start, end, max_cloud). Each search stores the
+normalized scene records for that exact path/row (displayId, entityId, path,
+row, acquisition date, cloud cover), already ranked least cloudy first, so a
+repeat request doesn't hit scene-search or redo the ranking.
+
+Historical windows (ending more than HISTORICAL_AFTER_DAYS ago) basically
+never change, so they're kept much longer than recent ones, where new
+acquisitions can still show up.
+
+grid2ll bboxes are cached here too, they never change.
+
+Offline mode (DNBR_M2M_OFFLINE=1) answers only from the cache, ignoring the
+TTL, and raises if something isn't cached. Together with the scene cache a
+warm request then never touches the network.
+
+Env:
+  DNBR_SEARCH_CACHE_DB                    (default ./data/scene_search.sqlite)
+  DNBR_SEARCH_CACHE_TTL_HOURS             recent windows (default 6)
+  DNBR_SEARCH_CACHE_HISTORICAL_TTL_DAYS   historical windows (default 30)
+  DNBR_SEARCH_CACHE_HISTORICAL_AFTER_DAYS (default 60)
+  DNBR_M2M_OFFLINE                        (default 0)
+"""
+import datetime
+import os
+import sqlite3
+import time
+
+SEARCH_CACHE_DB = os.environ.get(
+    "DNBR_SEARCH_CACHE_DB", os.path.join(os.getcwd(), "data", "scene_search.sqlite")
+)
+SEARCH_CACHE_TTL = float(os.environ.get("DNBR_SEARCH_CACHE_TTL_HOURS", "6")) * 3600
+SEARCH_CACHE_HISTORICAL_TTL = float(os.environ.get("DNBR_SEARCH_CACHE_HISTORICAL_TTL_DAYS", "30")) * 86400
+HISTORICAL_AFTER_DAYS = int(os.environ.get("DNBR_SEARCH_CACHE_HISTORICAL_AFTER_DAYS", "60"))
+OFFLINE = os.environ.get("DNBR_M2M_OFFLINE", "0") == "1"
+
+
+class OfflineCacheMiss(RuntimeError):
+    """Offline mode and the answer isn't in the cache."""
+
+
+class SceneSearchCache:
+    def __init__(self, db_path=SEARCH_CACHE_DB, ttl=None, historical_ttl=None, offline=None):
+        self.db_path = db_path
+        self.ttl = SEARCH_CACHE_TTL if ttl is None else ttl
+        self.historical_ttl = SEARCH_CACHE_HISTORICAL_TTL if historical_ttl is None else historical_ttl
+        self.offline = OFFLINE if offline is None else offline
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS searches ("
+                " dataset TEXT NOT NULL, path INTEGER NOT NULL, row INTEGER NOT NULL,"
+                " start_date TEXT NOT NULL, end_date TEXT NOT NULL, max_cloud REAL NOT NULL,"
+                " fetched REAL NOT NULL, expires REAL NOT NULL,"
+                " PRIMARY KEY (dataset, path, row, start_date, end_date, max_cloud))"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS scenes ("
+                " entity_id TEXT PRIMARY KEY, display_id TEXT NOT NULL,"
+                " path INTEGER, row INTEGER, acquired TEXT, cloud REAL)"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS search_scenes ("
+                " dataset TEXT NOT NULL, path INTEGER NOT NULL, row INTEGER NOT NULL,"
+                " start_date TEXT NOT NULL, end_date TEXT NOT NULL, max_cloud REAL NOT NULL,"
+                " rank INTEGER NOT NULL, entity_id TEXT NOT NULL,"
+                " PRIMARY KEY (dataset, path, row, start_date, end_date, max_cloud, rank))"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS bboxes ("
+                " path INTEGER NOT NULL, row INTEGER NOT NULL,"
+                " min_lon REAL, min_lat REAL, max_lon REAL, max_lat REAL,"
+                " PRIMARY KEY (path, row))"
+            )
+            con.execute("CREATE TABLE IF NOT EXISTS metrics (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _connect(self):
+        # one short-lived connection per call, same as scene_cache
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _bump(con, name, n=1):
+        con.execute(
+            "INSERT INTO metrics (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, n),
+        )
+
+    def ttl_for(self, end):
+        """Longer TTL once the window is far enough in the past that nothing new will land in it."""
+        try:
+            end_date = datetime.date.fromisoformat(str(end)[:10])
+        except ValueError:
+            return self.ttl
+        if (datetime.date.today() - end_date).days > HISTORICAL_AFTER_DAYS:
+            return self.historical_ttl
+        return self.ttl
+
+    # ---- searches ----
+
+    def get(self, dataset, path, row, start, end, max_cloud):
+        """
+        Cached scene records for this search, least cloudy first, or None.
+        In offline mode expired entries are still returned and a miss raises.
+        """
+        key = (dataset, path, row, start, end, float(max_cloud))
+        with self._connect() as con:
+            hit = con.execute(
+                "SELECT expires FROM searches WHERE dataset = ? AND path = ? AND row = ? "
+                "AND start_date = ? AND end_date = ? AND max_cloud = ?",
+                key,
+            ).fetchone()
+            if hit is None or (hit[0] < time.time() and not self.offline):
+                self._bump(con, "misses")
+                if self.offline:
+                    raise OfflineCacheMiss(
+                        f"Offline: no cached scene-search for {path:03d}/{row:03d} {start}→{end}"
+                    )
+                return None
+
+            rows = con.execute(
+                "SELECT s.entity_id, s.display_id, s.path, s.row, s.acquired, s.cloud "
+                "FROM search_scenes ss JOIN scenes s ON s.entity_id = ss.entity_id "
+                "WHERE ss.dataset = ? AND ss.path = ? AND ss.row = ? AND ss.start_date = ? "
+                "AND ss.end_date = ? AND ss.max_cloud = ? ORDER BY ss.rank",
+                key,
+            ).fetchall()
+            self._bump(con, "hits")
+
+        return [
+            {"entityId": r[0], "displayId": r[1], "path": r[2], "row": r[3], "acquired": r[4], "cloud": r[5]}
+            for r in rows
+        ]
+
+    def put(self, dataset, path, row, start, end, max_cloud, records):
+        """Store the records for one search (ranked by cloud here). An empty list is cached too."""
+        key = (dataset, path, row, start, end, float(max_cloud))
+        records = sorted(records, key=lambda r: r["cloud"] if r["cloud"] is not None else 9999.0)
+        now = time.time()
+        with self._connect() as con:
+            con.execute("BEGIN IMMEDIATE")
+            try:
+                con.execute(
+                    "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    key + (now, now + self.ttl_for(end)),
+                )
+                con.execute(
+                    "DELETE FROM search_scenes WHERE dataset = ? AND path = ? AND row = ? "
+                    "AND start_date = ? AND end_date = ? AND max_cloud = ?",
+                    key,
+                )
+                for rank, r in enumerate(records):
+                    con.execute(
+                        "INSERT OR REPLACE INTO scenes VALUES (?, ?, ?, ?, ?, ?)",
+                        (r["entityId"], r["displayId"], r["path"], r["row"], r["acquired"], r["cloud"]),
+                    )
+                    con.execute(
+                        "INSERT INTO search_scenes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        key + (rank, r["entityId"]),
+                    )
+                self._bump(con, "puts")
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+
+    # ---- grid2ll ----
+
+    def get_bbox(self, path, row):
+        with self._connect() as con:
+            r = con.execute(
+                "SELECT min_lon, min_lat, max_lon, max_lat FROM bboxes WHERE path = ? AND row = ?",
+                (path, row),
+            ).fetchone()
+        if r is None and self.offline:
+            raise OfflineCacheMiss(f"Offline: no cached bbox for {path:03d}/{row:03d}")
+        return tuple(r) if r else None
+
+    def put_bbox(self, path, row, bbox):
+        with self._connect() as con:
+            con.execute("INSERT OR REPLACE INTO bboxes VALUES (?, ?, ?, ?, ?, ?)", (path, row, *bbox))
+
+    # ---- metrics ----
+
+    def stats(self):
+        with self._connect() as con:
+            metrics = dict(con.execute("SELECT name, value FROM metrics").fetchall())
+            searches = con.execute("SELECT COUNT(*) FROM searches").fetchone()[0]
+            scenes = con.execute("SELECT COUNT(*) FROM scenes").fetchone()[0]
+        hits = metrics.get("hits", 0)
+        misses = metrics.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "puts": metrics.get("puts", 0),
+            "searches": searches,
+            "scenes": scenes,
+            "offline": self.offline,
+        }
+
+
+_default_cache = None
+
+
+def get_search_cache():
+    """Process-wide SceneSearchCache using the env settings."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SceneSearchCache()
+    return _default_cache
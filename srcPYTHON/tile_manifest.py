@@ -0,0 +1,245 @@
+"""
+Manifest of the pre-generated batch tiles for the map (what
+list_titles_for_frontent.py used to print as a JS constant).
+
+Each dNBR GeoTIFF in the batch folder (delta_nbr_P017R023_20220919_20231016.tif)
+gets one entry: id, label, PNG url, lat/lon bounds, dates, percent changed.
+The entries live in a sidecar index (manifest.json, next to the PNGs) together
+with the mtime + size of the GeoTIFF they were computed from, so a rescan only
+opens the files that are new or changed. Deleted GeoTIFFs drop out of the
+manifest. Where the batch folder doesn't exist at all (the site deploy, which
+ships the PNGs + manifest.json but not the GeoTIFFs) the index is served as is.
+
+    tiles, etag = get_manifest()          # rescans at most every RESCAN_SECONDS
+
+The frontend fetches it from /api/tiles (ETag / If-None-Match).
+
+    python tile_manifest.py          # update the index, print the JSON
+    python tile_manifest.py --js     # old output: const PRESET_TILES = [...];
+
+Env:
+  DNBR_MANIFEST_SRC_DIR        GeoTIFFs to index (default OUTPUT_DIR/batch_tiles)
+  DNBR_MANIFEST_PATH           the sidecar index (default assets/batch_tiles/manifest.json)
+  DNBR_MANIFEST_GROUP          map group for newly indexed tiles (default "Batch tiles")
+  DNBR_MANIFEST_RESCAN_SECONDS min seconds between rescans from the api (default 10)
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import numpy as np
+import rasterio
+
+from ThePython import (
+    OUTPUT_DIR,
+    get_latlon_bounds,
+    delta_nbr_stats_init,
+    delta_nbr_stats_update,
+    delta_nbr_stats_finish,
+)
+
+SITE_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+MANIFEST_SRC_DIR = os.environ.get("DNBR_MANIFEST_SRC_DIR", os.path.join(OUTPUT_DIR, "batch_tiles"))
+MANIFEST_PATH = os.environ.get(
+    "DNBR_MANIFEST_PATH", os.path.join(SITE_DIR, "assets", "batch_tiles", "manifest.json")
+)
+MANIFEST_GROUP = os.environ.get("DNBR_MANIFEST_GROUP", "Batch tiles")
+RESCAN_SECONDS = float(os.environ.get("DNBR_MANIFEST_RESCAN_SECONDS", "10"))
+
+MANIFEST_VERSION = 1
+
+# Matches:
+# delta_nbr_P017R023_20220919_20231016.tif
+FNAME_RE = re.compile(
+    r"^delta_nbr_p(?P<path>\d{3})r(?P<row>\d{3})_(?P<pre>\d{8})_(?P<post>\d{8})\.tif$",
+    re.IGNORECASE,
+)
+
+
+def _iso(d):
+    return f"{d[:4]}-{d[4:6]}-{d[6:]}"
+
+
+def _png_url(path, row):
+    # batch PNGs don't have dates in the name
+    png_name = f"delta_nbr_P{path:03d}R{row:03d}.png"
+    if os.path.exists(os.path.join(SITE_DIR, "assets", "batch_tiles", png_name)):
+        return f"assets/batch_tiles/{png_name}"
+    if os.path.exists(os.path.join(MANIFEST_SRC_DIR, png_name)):
+        rel = os.path.relpath(os.path.join(MANIFEST_SRC_DIR, png_name), OUTPUT_DIR)
+        if not rel.startswith(".."):
+            return "/outputs/" + rel.replace(os.sep, "/")
+    return f"assets/batch_tiles/{png_name}"
+
+
+def _finite_or_none(value):
+    # NaN / inf would end up as bare NaN in /api/tiles, which isn't JSON (r.json() in map.js throws)
+    if value is None or not np.isfinite(value):
+        return None
+    return value
+
+
+def compute_tile(tif_path, group=MANIFEST_GROUP):
+    """Manifest entry for one batch GeoTIFF (stats block by block, never the whole raster)."""
+    fname = os.path.basename(tif_path)
+    m = FNAME_RE.match(fname)
+    if not m:
+        raise RuntimeError(f"Not a batch tile filename: {fname}")
+    path = int(m.group("path"))
+    row = int(m.group("row"))
+    pre_date = m.group("pre")
+    post_date = m.group("post")
+
+    acc = delta_nbr_stats_init()
+    with rasterio.open(tif_path) as src:
+        profile = src.profile
+        nodata = src.nodata
+        for _, win in src.block_windows(1):
+            data = src.read(1, window=win).astype("float32")
+            if nodata is not None:
+                data = np.where(data == nodata, np.nan, data)
+            delta_nbr_stats_update(acc, data)
+
+    percent = _finite_or_none(delta_nbr_stats_finish(acc).get("percent_changed"))
+
+    min_lat, min_lon, max_lat, max_lon = get_latlon_bounds(profile)
+
+    tile = {
+        "id": f"P{path:03d}R{row:03d}_{pre_date}_{post_date}",
+        "label": f"Path {path:03d} Row {row:03d} ({pre_date} vs {post_date})",
+        "url": _png_url(path, row),
+        "bounds": [[min_lat, min_lon], [max_lat, max_lon]],
+        "preDate": _iso(pre_date),
+        "postDate": _iso(post_date),
+        "percentChanged": percent,
+        "group": group,
+    }
+    rel = os.path.relpath(tif_path, OUTPUT_DIR)
+    if not rel.startswith(".."):
+        tile["tif"] = rel.replace(os.sep, "/")   # for /tiles/...?tif=
+    return tile
+
+
+def load_index(index_path=MANIFEST_PATH):
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return {"version": MANIFEST_VERSION, "files": {}}
+    except ValueError as e:
+        print(f"Ignoring unreadable tile manifest {index_path}: {e}")
+        return {"version": MANIFEST_VERSION, "files": {}}
+    if index.get("version") != MANIFEST_VERSION:
+        print(f"Tile manifest {index_path} has version {index.get('version')}, rebuilding")
+        return {"version": MANIFEST_VERSION, "files": {}}
+    # json.load accepts NaN, older / hand-edited indexes may have it
+    for entry in index.get("files", {}).values():
+        tile = entry.get("tile") or {}
+        if "percentChanged" in tile:
+            tile["percentChanged"] = _finite_or_none(tile["percentChanged"])
+    return index
+
+
+def _save_index(index, index_path):
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    tmp = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp, index_path)
+
+
+def update_manifest(src_dir=MANIFEST_SRC_DIR, index_path=MANIFEST_PATH):
+    """
+    Bring the sidecar index up to date with src_dir and save it if anything
+    changed. Only new GeoTIFFs, or ones whose mtime / size moved, are opened.
+
+    Returns {"tiles": [...], "etag": str, "computed": n, "removed": n}.
+    """
+    index = load_index(index_path)
+    old = index["files"]
+    files = {}
+    computed = removed = 0
+
+    names = sorted(os.listdir(src_dir)) if os.path.isdir(src_dir) else []
+    for fname in names:
+        if not fname.lower().endswith(".tif") or fname.lower().endswith("_class.tif"):
+            continue   # class GeoTIFFs (write_class_tif) ride along with their dNBR
+        if not FNAME_RE.match(fname):
+            print("Skipping unrecognized filename:", fname)
+            continue
+        tif_path = os.path.join(src_dir, fname)
+        try:
+            st = os.stat(tif_path)
+        except FileNotFoundError:
+            continue   # deleted between listdir and stat
+
+        prev = old.get(fname)
+        if prev and prev.get("mtime_ns") == st.st_mtime_ns and prev.get("size") == st.st_size:
+            files[fname] = prev
+            continue
+
+        group = (prev or {}).get("tile", {}).get("group") or MANIFEST_GROUP
+        try:
+            tile = compute_tile(tif_path, group=group)
+        except Exception as e:
+            # e.g. a tile still being written by the batch run, retried next scan
+            print(f"Could not index {fname}: {e}")
+            if prev:
+                files[fname] = prev
+            continue
+        files[fname] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "tile": tile}
+        computed += 1
+
+    if not os.path.isdir(src_dir):
+        # site deploy: no GeoTIFFs here, serve the index as it was shipped
+        files = old
+    for fname in old:
+        removed += fname not in files
+
+    if computed or removed:
+        index["files"] = files
+        try:
+            _save_index(index, index_path)
+        except OSError as e:
+            print(f"Could not save tile manifest {index_path}: {e}")
+        print(f"Tile manifest: {computed} tiles (re)computed, {removed} removed, {len(files)} total")
+
+    tiles = [files[fname]["tile"] for fname in sorted(files)]
+    return {"tiles": tiles, "etag": manifest_etag(tiles), "computed": computed, "removed": removed}
+
+
+def manifest_etag(tiles):
+    body = json.dumps(tiles, sort_keys=True).encode()
+    return hashlib.sha1(body).hexdigest()[:16]
+
+
+_lock = threading.Lock()
+_cached = None
+_cached_at = 0.0
+
+
+def get_manifest(force=False):
+    """(tiles, etag), rescanning the batch folder at most every RESCAN_SECONDS."""
+    global _cached, _cached_at
+    with _lock:
+        now = time.monotonic()
+        if force or _cached is None or now - _cached_at >= RESCAN_SECONDS:
+            _cached = update_manifest()
+            _cached_at = now
+        return _cached["tiles"], _cached["etag"]
+
+
+if __name__ == "__main__":
+    result = update_manifest()
+    if "--js" in sys.argv[1:]:
+        print("const PRESET_TILES = ")
+        print(json.dumps(result["tiles"], indent=2))
+        print(";")
+    else:
+        print(json.dumps(result["tiles"], indent=2))
@@ -0,0 +1,241 @@
+"""
+Tile scheduler: runs many path/rows at once instead of one after another.
+
+Each tile goes through two stages:
+  1) download  - M2M search + bundle download for the pre and post windows
+                 (network bound, runs on a thread pool)
+  2) raster    - dNBR maths, GeoTIFF + PNG export
+                 (CPU bound, runs on a process pool)
+
+While one tile is crunching numbers the next ones are already downloading.
+If a tile fails in either stage it moves on to its next date window (same as
+bulk_generate.run_tile used to do), and only ends up in errors once every
+window has failed.
+
+If a raster worker dies (OOM kill etc.) the process pool is broken for good:
+the tiles it was running fail like any other raster error, and the pool is
+replaced once so the remaining tiles still get a working one.
+
+Long-running processes (the web server) should pass shared_raster_pool() in
+as raster_pool, so the spawn workers (and their rasterio / ThePython imports)
+are paid for once instead of on every call.
+
+Before any of that, scene_discovery.discover_scenes finds the scenes for
+every tile with a few batched M2M calls, so the download stage only has to
+fetch bundles. If discovery itself fails, tiles do their own search like before.
+
+Concurrency per stage comes from the arguments, or from env:
+  DNBR_DOWNLOAD_WORKERS (default 4)
+  DNBR_RASTER_WORKERS   (default 2, 0 = run the raster stage on the download thread)
+  DNBR_BATCH_DISCOVERY  (default 1, 0 = one search per tile/window like download_landsat_period;
+                         off while DNBR_COMPOSITE is set, discovery picks a single scene)
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, BrokenExecutor, wait, FIRST_COMPLETED
+
+from ThePython import download_landsat_period, download_scene_bands, delta_nbr_from_bands, COMPOSITE_METHOD
+from scene_discovery import discover_scenes
+
+DOWNLOAD_WORKERS = int(os.environ.get("DNBR_DOWNLOAD_WORKERS", "4"))
+RASTER_WORKERS = int(os.environ.get("DNBR_RASTER_WORKERS", "2"))
+BATCH_DISCOVERY = os.environ.get("DNBR_BATCH_DISCOVERY", "1") == "1"
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def _new_raster_pool(workers):
+    # spawn (not fork) so the workers don't inherit the web server's threads/locks
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def shared_raster_pool(broken=None):
+    """
+    Process-wide raster pool with RASTER_WORKERS workers, created on first use.
+    Pass the pool you got back as broken= to swap it for a fresh one
+    (a no-op if another caller already did).
+    """
+    global _shared_pool
+    with _shared_pool_lock:
+        if broken is not None and _shared_pool is broken:
+            broken.shutdown(wait=False)
+            _shared_pool = None
+        if _shared_pool is None:
+            _shared_pool = _new_raster_pool(max(1, RASTER_WORKERS))
+        return _shared_pool
+
+
+def default_tag(tile, window):
+    return (
+        f"p{tile['path']:03d}r{tile['row']:03d}_"
+        f"{window['pre_start'].replace('-', '')}_{window['post_start'].replace('-', '')}"
+    )
+
+
+def _planned_bands(api_key, planned):
+    if "error" in planned:
+        raise RuntimeError(planned["error"])
+    return download_scene_bands(api_key, planned["scene"], bundle_url=planned["bundle_url"])
+
+
+def _download_stage(api_key, tile, window, planned=None):
+    if planned is not None:
+        # scenes (and usually bundle URLs) already found by discover_scenes
+        return _planned_bands(api_key, planned["pre"]), _planned_bands(api_key, planned["post"])
+
+    pre_bands = download_landsat_period(
+        api_key, window["pre_start"], window["pre_end"], tile["path"], tile["row"]
+    )
+    post_bands = download_landsat_period(
+        api_key, window["post_start"], window["post_end"], tile["path"], tile["row"]
+    )
+    return pre_bands, post_bands
+
+
+def _download_and_process(api_key, tile, window, tag, planned=None):
+    # raster_workers=0: do both stages on the same download thread
+    pre_bands, post_bands = _download_stage(api_key, tile, window, planned)
+    return pre_bands, post_bands, delta_nbr_from_bands(pre_bands, post_bands, tag=tag)
+
+
+def run_tiles(api_key, tiles, windows, tag_fn=default_tag,
+              download_workers=None, raster_workers=None, on_tile_done=None,
+              batch_discovery=None, raster_pool=None):
+    """
+    Run the dNBR pipeline for every tile in tiles ({"path", "row", ...} dicts),
+    trying each window in windows (dicts with pre_start/pre_end/post_start/post_end)
+    in order until one works.
+
+    on_tile_done(tile, bands) is called once a tile is finished (success or
+    final failure) with the list of band dicts it downloaded, e.g. to clean up.
+
+    raster_pool: an existing process pool (e.g. shared_raster_pool()) to run the
+    raster stage on. It is left running afterwards. Without one, a pool of
+    raster_workers processes is made for this call and shut down at the end.
+
+    Returns (results, errors) in the same order as tiles:
+      results: [{"tile": tile, "window": window, "result": <run_delta_nbr_pipeline dict>}, ...]
+      errors:  [{"tile": tile, "error": "message"}, ...]
+    """
+    if download_workers is None:
+        download_workers = DOWNLOAD_WORKERS
+    if raster_workers is None:
+        raster_workers = RASTER_WORKERS
+    if batch_discovery is None:
+        # discovery plans one scene per window, compositing (DNBR_COMPOSITE) needs the per-tile search
+        batch_discovery = BATCH_DISCOVERY and not COMPOSITE_METHOD
+    if not windows:
+        raise ValueError("windows must be a non-empty list")
+
+    plan = {}
+    if batch_discovery and tiles:
+        try:
+            plan = discover_scenes(api_key, tiles, windows)
+        except Exception as e:
+            print(f"Batched discovery failed ({e}), tiles will search on their own")
+            plan = {}
+
+    io_pool = ThreadPoolExecutor(max_workers=max(1, download_workers), thread_name_prefix="tile-io")
+    shared = raster_pool is not None
+    if not shared and raster_workers > 0:
+        raster_pool = _new_raster_pool(raster_workers)
+
+    pending = {}                          # future -> (stage, tile index, window index)
+    last_error = {}                       # tile index -> last exception
+    bands_seen = {i: [] for i in range(len(tiles))}
+    finished = {}                         # tile index -> result entry / error entry
+
+    def start(ti, wi):
+        tile, window = tiles[ti], windows[wi]
+        print(f"Queueing {tile.get('id', default_tag(tile, window))}: "
+              f"PRE {window['pre_start']}→{window['pre_end']}, POST {window['post_start']}→{window['post_end']}")
+        planned = plan.get((ti, wi))
+        if raster_pool is None:
+            fut = io_pool.submit(_download_and_process, api_key, tile, window, tag_fn(tile, window), planned)
+            pending[fut] = ("all", ti, wi)
+        else:
+            fut = io_pool.submit(_download_stage, api_key, tile, window, planned)
+            pending[fut] = ("download", ti, wi)
+
+    def finish(ti, entry):
+        finished[ti] = entry
+        if on_tile_done is not None:
+            try:
+                on_tile_done(tiles[ti], bands_seen[ti])
+            except Exception as e:
+                print(f"on_tile_done failed for tile {ti}: {e}")
+
+    def fail(stage, ti, wi, e):
+        # this window didn't work out, try the tile's next one
+        last_error[ti] = e
+        print(f"  {stage} failed for tile {tiles[ti].get('id', ti)}: {e}")
+        if wi + 1 < len(windows):
+            start(ti, wi + 1)
+        else:
+            finish(ti, {"tile": tiles[ti], "error": str(e)})
+
+    def submit_raster(ti, wi, pre_bands, post_bands):
+        nonlocal raster_pool
+        tile, window = tiles[ti], windows[wi]
+        try:
+            try:
+                rfut = raster_pool.submit(delta_nbr_from_bands, pre_bands, post_bands, tag=tag_fn(tile, window))
+            except BrokenExecutor as e:
+                # a worker died earlier, swap in a fresh pool and give it one more go
+                print(f"Raster pool is broken ({e}), starting a new one")
+                if shared:
+                    raster_pool = shared_raster_pool(broken=raster_pool)
+                else:
+                    raster_pool.shutdown(wait=False)
+                    raster_pool = _new_raster_pool(raster_workers)
+                rfut = raster_pool.submit(delta_nbr_from_bands, pre_bands, post_bands, tag=tag_fn(tile, window))
+        except Exception as e:
+            fail("raster", ti, wi, e)
+            return
+        pending[rfut] = ("raster", ti, wi)
+
+    try:
+        for ti in range(len(tiles)):
+            start(ti, 0)
+
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for fut in done:
+                stage, ti, wi = pending.pop(fut)
+                tile, window = tiles[ti], windows[wi]
+                try:
+                    value = fut.result()
+                except Exception as e:
+                    fail(stage, ti, wi, e)
+                    continue
+
+                if stage == "download":
+                    pre_bands, post_bands = value
+                    bands_seen[ti].extend([pre_bands, post_bands])
+                    submit_raster(ti, wi, pre_bands, post_bands)
+                elif stage == "all":
+                    pre_bands, post_bands, res = value
+                    bands_seen[ti].extend([pre_bands, post_bands])
+                    finish(ti, {"tile": tile, "window": window, "result": res})
+                else:
+                    finish(ti, {"tile": tile, "window": window, "result": value})
+    finally:
+        io_pool.shutdown(wait=True)
+        if raster_pool is not None and not shared:
+            raster_pool.shutdown(wait=True)
+
+    results = []
+    errors = []
+    for ti in range(len(tiles)):
+        entry = finished.get(ti)
+        if entry is None:
+            err = last_error.get(ti)
+            errors.append({"tile": tiles[ti], "error": str(err) if err else "Tile was never run"})
+        elif "error" in entry:
+            errors.append(entry)
+        else:
+            results.append(entry)
+    return results, errors
@@ -0,0 +1,406 @@
+"""
+XYZ (Web Mercator) tiles rendered on demand from the dNBR GeoTIFFs in OUTPUT_DIR.
+
+Instead of one multi-MB PNG per result draped as an L.imageOverlay, the map
+asks for 256x256 tiles. For each tile only the window of each GeoTIFF that
+covers it is read, at the resolution the zoom level needs (GDAL picks the
+COG overview for us when out_shape is smaller than the window), then warped
+to EPSG:3857 and coloured with the same schemes as the PNG exports:
+  burn  - export_burn_png_from_delta: inferno over dNBR >= BURN_VIS_THRESHOLD, rest transparent
+  usgs  - export_dnbr_class_png: USGS severity classes (background transparent here),
+          read from the uint8 <name>_class.tif next to the dNBR when the pipeline wrote one
+
+?tif=mosaic draws the province mosaic (mosaic.py) through its VRT, which has
+the mosaic's level files as overviews.
+
+Rendered tiles are cached in memory (LRU) and on disk. The cache key / ETag
+covers the tile, the scheme and the mtime+size of every GeoTIFF drawn into
+it, so re-running a tile just produces new keys and browsers revalidate.
+Those old keys are never asked for again, so the disk cache is capped at
+DNBR_TILE_DISK_CACHE_MB: once a put takes it over, the least recently used
+files (mtime, bumped on every disk hit) are pruned down to 90% of the cap.
+
+Env:
+  DNBR_TILE_CACHE_DIR    (default ./data/tile_cache)
+  DNBR_TILE_MEM_CACHE    tiles kept in memory (default 1024)
+  DNBR_TILE_DISK_CACHE_MB  size cap of the on-disk tiles (default 1024)
+  DNBR_TILE_MAX_AGE      Cache-Control max-age in seconds (default 3600)
+"""
+import glob
+import hashlib
+import io
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+from affine import Affine
+from PIL import Image
+from rasterio.warp import reproject, transform_bounds, Resampling
+
+from ThePython import OUTPUT_DIR, BURN_VIS_THRESHOLD, classify_dnbr, fresh_class_tif
+from dnbr_render import INFERNO_RGBA, USGS_CLASS_RGBA, burn_index, rgba_from_index
+from mosaic import MOSAIC_DIR, MOSAIC_VRT
+
+TILE_SIZE = 256
+TILE_CACHE_DIR = os.environ.get("DNBR_TILE_CACHE_DIR", os.path.join(os.getcwd(), "data", "tile_cache"))
+TILE_MEM_CACHE = int(os.environ.get("DNBR_TILE_MEM_CACHE", "1024"))
+TILE_DISK_CACHE_MB = float(os.environ.get("DNBR_TILE_DISK_CACHE_MB", "1024"))
+TILE_MAX_AGE = int(os.environ.get("DNBR_TILE_MAX_AGE", "3600"))
+RENDER_VERSION = "2"   # bump when the rendering changes so old cached tiles aren't served
+
+SCHEMES = ("burn", "usgs")
+WEB_MERCATOR = "EPSG:3857"
+MERC_HALF = 20037508.342789244
+
+# same colours as export_dnbr_class_png, class 0 (background / nodata) transparent
+USGS_RGBA = USGS_CLASS_RGBA.copy()
+USGS_RGBA[0, 3] = 0
+
+
+def tile_bounds(z, x, y):
+    """(left, bottom, right, top) of an XYZ tile in EPSG:3857 metres."""
+    size = 2 * MERC_HALF / (2 ** z)
+    left = -MERC_HALF + x * size
+    top = MERC_HALF - y * size
+    return left, top - size, left + size, top
+
+
+def _is_dnbr_tif(path):
+    name = os.path.basename(path).lower()
+    # skip the scratch files write_delta_tif / streaming leave around while they work,
+    # and the class GeoTIFFs (they're drawn through their dNBR, see _SourceInfo.class_path)
+    return name.endswith(".tif") and not name.endswith((".tmp.tif", ".strips.tif", ".ovr.tif", "_class.tif"))
+
+
+def list_sources(tif=None):
+    """
+    dNBR GeoTIFFs to draw: just tif (relative to OUTPUT_DIR) if given, else all of them.
+    tif="mosaic" is the province mosaic (mosaic.py), it's never part of "all".
+    """
+    root = os.path.realpath(OUTPUT_DIR)
+    if tif == "mosaic":
+        if not os.path.isfile(MOSAIC_VRT):
+            raise FileNotFoundError(tif)
+        return [MOSAIC_VRT]
+    if tif:
+        path = os.path.realpath(os.path.join(root, tif))
+        if not path.startswith(root + os.sep) or not os.path.isfile(path) or not _is_dnbr_tif(path):
+            raise FileNotFoundError(tif)
+        return [path]
+    paths = glob.glob(os.path.join(root, "*.tif")) + glob.glob(os.path.join(root, "*", "*.tif"))
+    mosaic_dir = os.path.realpath(MOSAIC_DIR)
+    return sorted(p for p in paths if _is_dnbr_tif(p) and os.path.dirname(p) != mosaic_dir)
+
+
+class _SourceInfo:
+    """Per-GeoTIFF facts the renderer needs, recomputed only when the file changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self.version, self.class_path = _file_version(path)
+        with rasterio.open(path) as src:
+            self.bounds_3857 = transform_bounds(src.crs, WEB_MERCATOR, *src.bounds, densify_pts=21)
+            self.burn_vmax = self._burn_vmax(src)
+
+    @staticmethod
+    def _burn_vmax(src):
+        # export_burn_png_from_delta stretches to the 99th percentile of burned pixels;
+        # do the same once per file, from the smallest overview so it stays cheap
+        factors = src.overviews(1)
+        f = factors[-1] if factors else max(1, max(src.width, src.height) // 1024)
+        data = src.read(
+            1, out_shape=(max(1, src.height // f), max(1, src.width // f)), resampling=Resampling.nearest
+        ).astype("float32")
+        if src.nodata is not None:
+            data = np.where(data == src.nodata, np.nan, data)
+        burned = (data >= BURN_VIS_THRESHOLD) & np.isfinite(data)
+        if not np.any(burned):
+            return BURN_VIS_THRESHOLD + 0.01
+        vmax = float(np.nanpercentile(data[burned], 99))
+        return vmax if vmax != BURN_VIS_THRESHOLD else BURN_VIS_THRESHOLD + 0.01
+
+
+_info_lock = threading.Lock()
+_info_cache = {}
+
+
+def _file_version(path):
+    # mtime+size of the dNBR, plus its class GeoTIFF's when there's a fresh one
+    st = os.stat(path)
+    version = f"{st.st_mtime_ns}-{st.st_size}"
+    class_path = fresh_class_tif(path)
+    if class_path is not None:
+        cst = os.stat(class_path)
+        version += f"-c{cst.st_mtime_ns}-{cst.st_size}"
+    return version, class_path
+
+
+def _source_info(path):
+    version, _ = _file_version(path)
+    with _info_lock:
+        info = _info_cache.get(path)
+    if info is None or info.version != version:
+        info = _SourceInfo(path)
+        with _info_lock:
+            _info_cache[path] = info
+    return info
+
+
+def _sources_for_tile(z, x, y, tif=None):
+    left, bottom, right, top = tile_bounds(z, x, y)
+    out = []
+    for path in list_sources(tif):
+        info = _source_info(path)
+        b = info.bounds_3857
+        if b[0] < right and b[2] > left and b[1] < top and b[3] > bottom:
+            out.append(info)
+    return out
+
+
+def tile_etag(z, x, y, scheme="burn", tif=None):
+    """ETag / cache key for a tile. Cheap: only stats the GeoTIFFs, no pixel reads."""
+    sources = _sources_for_tile(z, x, y, tif)
+    key = "|".join([RENDER_VERSION, scheme, f"{z}/{x}/{y}"] + [f"{s.path}:{s.version}" for s in sources])
+    return hashlib.sha1(key.encode()).hexdigest(), sources
+
+
+def _read_source_tile(info, z, x, y, classes=False):
+    """
+    dNBR of one GeoTIFF warped onto the 256x256 tile grid (NaN where it has no data), or None.
+    classes=True reads its uint8 class GeoTIFF instead (0 where it has no data).
+    """
+    left, bottom, right, top = tile_bounds(z, x, y)
+    dst_transform = Affine((right - left) / TILE_SIZE, 0, left, 0, -(top - bottom) / TILE_SIZE, top)
+
+    with rasterio.open(info.class_path if classes else info.path) as src:
+        # tile footprint in the source CRS, clipped to the raster
+        sl, sb, sr, st = transform_bounds(WEB_MERCATOR, src.crs, left, bottom, right, top, densify_pts=21)
+        inv = ~src.transform
+        c0, r0 = inv * (sl, st)
+        c1, r1 = inv * (sr, sb)
+        col0 = max(0, int(math.floor(min(c0, c1))) - 1)
+        row0 = max(0, int(math.floor(min(r0, r1))) - 1)
+        col1 = min(src.width, int(math.ceil(max(c0, c1))) + 1)
+        row1 = min(src.height, int(math.ceil(max(r0, r1))) + 1)
+        if col1 <= col0 or row1 <= row0:
+            return None
+
+        win_w, win_h = col1 - col0, row1 - row0
+        # only read as many pixels as the tile can show; GDAL serves this from an overview
+        scale = max(1.0, ((sr - sl) / TILE_SIZE) / abs(src.res[0]))
+        out_w = max(1, int(math.ceil(win_w / scale)))
+        out_h = max(1, int(math.ceil(win_h / scale)))
+        window = rasterio.windows.Window(col0, row0, win_w, win_h)
+        data = src.read(1, window=window, out_shape=(out_h, out_w), resampling=Resampling.nearest)
+        if classes:
+            fill = 0
+        else:
+            fill = np.nan
+            data = data.astype("float32")
+            if src.nodata is not None:
+                data[data == src.nodata] = np.nan
+
+        src_transform = src.window_transform(window) * Affine.scale(win_w / out_w, win_h / out_h)
+        dst = np.full((TILE_SIZE, TILE_SIZE), fill, dtype=data.dtype)
+        reproject(
+            source=data,
+            destination=dst,
+            src_transform=src_transform,
+            src_crs=src.crs,
+            src_nodata=fill,
+            dst_transform=dst_transform,
+            dst_crs=WEB_MERCATOR,
+            dst_nodata=fill,
+            resampling=Resampling.nearest,
+        )
+    return dst
+
+
+def _colorize(delta, scheme, info):
+    if scheme == "usgs":
+        if delta.dtype == np.uint8:
+            return USGS_RGBA[delta]      # already classes, from the class GeoTIFF
+        return USGS_RGBA[classify_dnbr(delta)]
+
+    burned = (delta >= BURN_VIS_THRESHOLD) & np.isfinite(delta)
+    return rgba_from_index(burn_index(delta, burned, BURN_VIS_THRESHOLD, info.burn_vmax), INFERNO_RGBA)
+
+
+def _encode_png(rgba):
+    buf = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buf, format="PNG", optimize=False)
+    return buf.getvalue()
+
+
+_EMPTY_PNG = None
+
+
+def _empty_png():
+    global _EMPTY_PNG
+    if _EMPTY_PNG is None:
+        _EMPTY_PNG = _encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+    return _EMPTY_PNG
+
+
+class TileCache:
+    """Rendered PNG bytes by ETag: in-memory LRU in front of a directory of files."""
+
+    def __init__(self, root=TILE_CACHE_DIR, max_items=TILE_MEM_CACHE, max_disk_bytes=None):
+        self.root = root
+        self.max_items = max_items
+        self.max_disk_bytes = int(TILE_DISK_CACHE_MB * 1024 * 1024) if max_disk_bytes is None else int(max_disk_bytes)
+        self._lock = threading.Lock()
+        self._prune_lock = threading.Lock()
+        self._mem = OrderedDict()
+        self._disk_bytes = None   # running total, from a scan of root on the first put
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.pruned = 0
+
+    def _path(self, etag):
+        return os.path.join(self.root, etag[:2], etag + ".png")
+
+    def _remember(self, etag, png):
+        with self._lock:
+            self._mem[etag] = png
+            self._mem.move_to_end(etag)
+            while len(self._mem) > self.max_items:
+                self._mem.popitem(last=False)
+
+    def get(self, etag):
+        with self._lock:
+            png = self._mem.get(etag)
+            if png is not None:
+                self._mem.move_to_end(etag)
+                self.hits += 1
+                return png
+        path = self._path(etag)
+        try:
+            with open(path, "rb") as f:
+                png = f.read()
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)  # LRU for prune(): mtime = last use
+        except OSError:
+            pass
+        with self._lock:
+            self.disk_hits += 1
+        self._remember(etag, png)
+        return png
+
+    def put(self, etag, png):
+        self._remember(etag, png)
+        path = self._path(etag)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(png)
+        os.replace(tmp, path)
+
+        if self._disk_bytes is None:
+            self.prune()   # first put: scan to find out where we are
+            return
+        with self._lock:
+            self._disk_bytes += len(png)
+            over = self._disk_bytes > self.max_disk_bytes
+        if over:
+            self.prune()
+
+    def _scan(self):
+        files = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if not name.endswith(".png"):
+                    continue
+                p = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, p))
+        return files
+
+    def prune(self):
+        """Delete the least recently used tile files until the disk cache is under 90% of max_disk_bytes."""
+        if not self._prune_lock.acquire(blocking=False):
+            return 0   # someone else is already on it
+        try:
+            files = self._scan()
+            total = sum(size for _, size, _ in files)
+            removed = 0
+            if total > self.max_disk_bytes:
+                target = self.max_disk_bytes * 0.9
+                for _, size, p in sorted(files):
+                    if total <= target:
+                        break
+                    try:
+                        os.remove(p)
+                    except OSError:
+                        continue
+                    total -= size
+                    removed += 1
+                if removed:
+                    print(f"Tile cache pruned {removed} file(s) from disk")
+            with self._lock:
+                self._disk_bytes = total
+                self.pruned += removed
+            return removed
+        finally:
+            self._prune_lock.release()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "in_memory": len(self._mem), "disk_bytes": self._disk_bytes, "pruned": self.pruned}
+
+
+_tile_cache = None
+
+
+def get_tile_cache():
+    global _tile_cache
+    if _tile_cache is None:
+        _tile_cache = TileCache()
+    return _tile_cache
+
+
+def render_tile(z, x, y, scheme="burn", tif=None, etag=None, sources=None):
+    """
+    PNG bytes for tile z/x/y and its ETag.
+    Pass etag/sources from tile_etag if you already have them.
+    Raises ValueError for a bad scheme / tile, FileNotFoundError for an unknown tif.
+    """
+    if scheme not in SCHEMES:
+        raise ValueError(f"scheme must be one of {', '.join(SCHEMES)}")
+    if z < 0 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"tile {z}/{x}/{y} is out of range")
+    if etag is None:
+        etag, sources = tile_etag(z, x, y, scheme, tif)
+    if not sources:
+        return _empty_png(), etag
+
+    cache = get_tile_cache()
+    png = cache.get(etag)
+    if png is not None:
+        return png, etag
+
+    # later files win where they overlap (same order as list_sources)
+    rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    for info in sources:
+        delta = _read_source_tile(info, z, x, y, classes=scheme == "usgs" and info.class_path is not None)
+        if delta is None:
+            continue
+        layer = _colorize(delta, scheme, info)
+        drawn = layer[..., 3] > 0
+        rgba[drawn] = layer[drawn]
+
+    png = _encode_png(rgba) if rgba[..., 3].any() else _empty_png()
+    cache.put(etag, png)
+    return png, etag
@@ -1,16 +1,23 @@
 import os
-import numpy as np
-import rasterio
 
 from ThePython import (
     m2m_login,
     m2m_logout,
     download_landsat_period,
-    process_landsat,
+    process_landsat_delta,
+    DELTA_NODATA,
     export_png_from_tif,
     OUTPUT_DIR,
     export_burn_png_from_delta,
+    write_delta_tif,
+    classify_dnbr,
+    class_tif_path,
+    write_class_tif,
+    vectorize_scars,
+    CLASS_TIF,
+    BURN_SCARS,
 )
+from mosaic import update_mosaic
 
 
 def get_landsat_date_from_band_path(band_path: str) -> str:
@@ -68,37 +75,29 @@ def run_batch():
 
             # 2) run delta NBR pipeline
             try:
-                nbr_pre, nbr_post, delta, out_profile = process_landsat(
+                delta, out_profile, stats = process_landsat_delta(
                     pre_bands["nir"], pre_bands["swir"],
                     post_bands["nir"], post_bands["swir"],
                     pre_bands["qa"],  post_bands["qa"],
+                    nodata=DELTA_NODATA,
                 )
             except Exception as e:
-                print(f"process_landsat failed for {path:03d}/{row:03d}: {e}")
+                print(f"process_landsat_delta failed for {path:03d}/{row:03d}: {e}")
                 continue
 
             # 3) write tile-specific GeoTIFF
             tif_name = f"delta_nbr_P{path:03d}R{row:03d}_{pre_date}_{post_date}.tif"
             tif_path = os.path.join(batch_dir, tif_name)
 
-            out_profile = out_profile.copy()
-            out_profile.update({
-                "driver": "GTiff",
-                "dtype": "float32",
-                "count": 1,
-                "nodata": -9999.0,
-            })
-
-            delta_to_write = np.where(
-                np.isnan(delta),
-                out_profile["nodata"],
-                delta
-            ).astype("float32")
-
-            with rasterio.open(tif_path, "w", **out_profile) as dst:
-                dst.write(delta_to_write, 1)
-
+            # COG (tiled, compressed, overviews) unless DNBR_OUTPUT_FORMAT=gtiff
+            out_profile = write_delta_tif(tif_path, delta, out_profile, nodata_encoded=True)
             print("  Wrote TIF:", tif_path)
+            if CLASS_TIF:
+                # uint8 severity classes next to it, for the usgs tiles / zonal stats
+                class_tif = class_tif_path(tif_path)
+                write_class_tif(class_tif, classify_dnbr(delta, nodata=DELTA_NODATA), out_profile)
+                print("  Wrote class TIF:", class_tif)
+            del delta
 
             # 4) export PNG for web
             # 4) export PNG for web (burn-only, transparent background)
@@ -108,9 +107,18 @@ def run_batch():
             export_burn_png_from_delta(tif_path, png_path)
             print("  Wrote burn-only PNG:", png_path)
 
+            # 5) clickable burn scar polygons for the map
+            if BURN_SCARS:
+                try:
+                    vectorize_scars(tif_path)
+                except Exception as e:
+                    print(f"  Burn scar vectorization failed for {path:03d}/{row:03d}: {e}")
 
     m2m_logout(api_key)
 
+    # merge the new / re-run tiles into the province mosaic (only their blocks are rewritten)
+    update_mosaic(src_dir=batch_dir)
+
 
 if __name__ == "__main__":
     run_batch()
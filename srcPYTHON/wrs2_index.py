@@ -0,0 +1,258 @@
+"""
+WRS-2 path/row footprints without asking M2M.
+
+assets/wrs2_descending.npz holds the scene centre + ground-track heading of
+every descending (daytime) WRS-2 path/row: paths 1-233, rows 1-122. Footprint
+corners, bboxes and a coarse lat/lon grid for spatial lookups are built from
+that the first time something asks, then every query is a few array lookups.
+
+The npz is generated from the WRS-2 orbit definition (see build_arrays), run
+this file to regenerate it:
+    python srcPYTHON/wrs2_index.py
+
+  - 233 paths, 248 rows per orbit, sun-synchronous, 16 day repeat
+  - inclination 98.2 deg
+  - row 60 is on the equator (descending node), path 1 crosses it at 64.60 W,
+    each next path is 360/233 deg further west
+  - scene footprint ~185 km across track x 180 km along track
+
+Checked with benchmarks/check_wrs2_index.py against the tile bounds in
+assets/batch_tiles/manifest.json and the presets in js/map.js: centres within
+~0.02 deg lat / ~0.1 deg lon on the 14 tiles whose bounds are their own path/row
+(P015R025-R026, P016R023, P017R024-R027, P017R030, P018R023 and the five
+2017-2018 presets). The manifest's P017R015-R023, R028 and R029 are left out:
+their bounds are a neighbouring scene's (one row off, or shared with R017 /
+R027 / R030), so they're 1.3-3.2 deg away from any index, this one included.
+"""
+import math
+import os
+
+import numpy as np
+
+WRS2_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets", "wrs2_descending.npz")
+
+N_PATHS = 233
+N_ROWS = 248
+MAX_DESC_ROW = 122          # rows after this are the ascending (night) half of the orbit
+INCLINATION = 98.2
+PATH1_NODE_LON = -64.60
+SCENE_ACROSS_KM = 185.0
+SCENE_ALONG_KM = 180.0
+EARTH_RADIUS_KM = 6371.0
+WGS84_E2 = 0.00669437999014
+GRID_DEG = 1.0              # spatial index cell size
+
+
+def _ground_point(path, row):
+    """Geocentric (lat, lon) in degrees of the WRS-2 point for path/row (arrays OK, row can be fractional)."""
+    inc = math.radians(INCLINATION)
+    # argument of latitude: ascending node = 0, descending node (row 60) = 180
+    u = np.radians(180.0 + (np.asarray(row, dtype=np.float64) - 60.0) * 360.0 / N_ROWS)
+    lat = np.degrees(np.arcsin(np.sin(inc) * np.sin(u)))
+    lon_in_plane = np.degrees(np.arctan2(np.cos(inc) * np.sin(u), np.cos(u))) - 180.0
+    # the ground track drifts west by 16/233 of a turn per orbit
+    drift = (np.degrees(u) - 180.0) * 16.0 / N_PATHS
+    lon = PATH1_NODE_LON - (np.asarray(path, dtype=np.float64) - 1) * 360.0 / N_PATHS + lon_in_plane - drift
+    return lat, (lon + 180.0) % 360.0 - 180.0
+
+
+def _to_geodetic(lat):
+    return np.degrees(np.arctan(np.tan(np.radians(lat)) / (1.0 - WGS84_E2)))
+
+
+def _bearing(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    dlon = lon2 - lon1
+    y = np.sin(dlon) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return np.degrees(np.arctan2(y, x))
+
+
+def _destination(lat, lon, bearing, dist_km):
+    lat, lon, bearing = map(np.radians, (lat, lon, bearing))
+    d = dist_km / EARTH_RADIUS_KM
+    lat2 = np.arcsin(np.sin(lat) * np.cos(d) + np.cos(lat) * np.sin(d) * np.cos(bearing))
+    lon2 = lon + np.arctan2(np.sin(bearing) * np.sin(d) * np.cos(lat), np.cos(d) - np.sin(lat) * np.sin(lat2))
+    return np.degrees(lat2), np.degrees(lon2)
+
+
+def build_arrays():
+    """Centres + headings for every descending path/row, in (path - 1) * MAX_DESC_ROW + (row - 1) order."""
+    paths, rows = np.meshgrid(np.arange(1, N_PATHS + 1), np.arange(1, MAX_DESC_ROW + 1), indexing="ij")
+    paths = paths.ravel()
+    rows = rows.ravel()
+    lat, lon = _ground_point(paths, rows)
+    lat_a, lon_a = _ground_point(paths, rows - 0.01)
+    lat_b, lon_b = _ground_point(paths, rows + 0.01)
+    heading = _bearing(lat_a, lon_a, lat_b, lon_b)
+    return {
+        "center_lat": lat.astype(np.float32),   # geocentric, footprints are built on the sphere
+        "center_lon": lon.astype(np.float32),
+        "heading": heading.astype(np.float32),
+    }
+
+
+def write_index(out_path=WRS2_INDEX_PATH):
+    arrays = build_arrays()
+    np.savez_compressed(out_path, n_paths=N_PATHS, max_row=MAX_DESC_ROW, **arrays)
+    print(f"Wrote {len(arrays['center_lat'])} WRS-2 path/rows to {out_path}")
+
+
+class WRS2Index:
+    def __init__(self, npz_path=WRS2_INDEX_PATH):
+        self.npz_path = npz_path
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        with np.load(self.npz_path) as z:
+            self.max_row = int(z["max_row"])
+            self.n_paths = int(z["n_paths"])
+            clat = z["center_lat"].astype(np.float64)
+            clon = z["center_lon"].astype(np.float64)
+            heading = z["heading"].astype(np.float64)
+
+        # corners: front-right, back-right, back-left, front-left (along track = heading)
+        half_across = SCENE_ACROSS_KM / 2.0
+        half_along = SCENE_ALONG_KM / 2.0
+        diag = math.hypot(half_across, half_along)
+        off = math.degrees(math.atan2(half_across, half_along))
+        lats, lons = [], []
+        for rel in (off, 180.0 - off, 180.0 + off, -off):
+            la, lo = _destination(clat, clon, heading + rel, diag)
+            lats.append(_to_geodetic(la))
+            lons.append(lo)   # left unwrapped (can go past +-180 near the antimeridian)
+        self.corner_lat = np.stack(lats, axis=1)
+        self.corner_lon = np.stack(lons, axis=1)
+        self.center_lat = _to_geodetic(clat)
+        self.center_lon = clon
+        self.bboxes = np.stack([
+            self.corner_lon.min(axis=1), self.corner_lat.min(axis=1),
+            self.corner_lon.max(axis=1), self.corner_lat.max(axis=1),
+        ], axis=1)
+
+        # coarse grid -> footprint indices, for point / AOI queries
+        cells = np.floor(self.bboxes / GRID_DEG).astype(np.int64)
+        nx = cells[:, 2] - cells[:, 0] + 1
+        ny = cells[:, 3] - cells[:, 1] + 1
+        all_idx = np.arange(len(cells))
+        keys, members = [], []
+        for dx in range(int(nx.max())):
+            for dy in range(int(ny.max())):
+                m = (dx < nx) & (dy < ny)
+                keys.append((cells[m, 0] + dx) * 100000 + (cells[m, 1] + dy + 1000))
+                members.append(all_idx[m])
+        keys = np.concatenate(keys)
+        members = np.concatenate(members)
+        order = np.argsort(keys, kind="stable")
+        keys, members = keys[order], members[order].astype(np.int32)
+        uniq, starts = np.unique(keys, return_index=True)
+        self._grid = {
+            (int(k // 100000), int(k % 100000) - 1000): chunk
+            for k, chunk in zip(uniq, np.split(members, starts[1:]))
+        }
+        self._loaded = True
+
+    def _idx(self, path, row):
+        self._load()
+        if not (1 <= path <= self.n_paths and 1 <= row <= self.max_row):
+            raise KeyError(f"WRS-2 {path:03d}/{row:03d} is not a descending path/row")
+        return (path - 1) * self.max_row + (row - 1)
+
+    def _path_row(self, i):
+        return int(i // self.max_row) + 1, int(i % self.max_row) + 1
+
+    # ---- lookups ----
+
+    def bbox(self, path, row):
+        """(min_lon, min_lat, max_lon, max_lat) of the footprint."""
+        i = self._idx(path, row)
+        return tuple(float(v) for v in self.bboxes[i])
+
+    def polygon(self, path, row):
+        """Footprint corners as a closed [(lon, lat), ...] ring."""
+        i = self._idx(path, row)
+        ring = [(float(lo), float(la)) for lo, la in zip(self.corner_lon[i], self.corner_lat[i])]
+        return ring + ring[:1]
+
+    def center(self, path, row):
+        i = self._idx(path, row)
+        return float(self.center_lon[i]), float(self.center_lat[i])
+
+    def _candidates(self, min_lon, min_lat, max_lon, max_lat):
+        self._load()
+        x0, y0 = math.floor(min_lon / GRID_DEG), math.floor(min_lat / GRID_DEG)
+        x1, y1 = math.floor(max_lon / GRID_DEG), math.floor(max_lat / GRID_DEG)
+        if x0 == x1 and y0 == y1:
+            return self._grid.get((x0, y0), np.empty(0, dtype=np.int32))
+        found = [self._grid[(gx, gy)] for gx in range(x0, x1 + 1) for gy in range(y0, y1 + 1)
+                 if (gx, gy) in self._grid]
+        if not found:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(found))
+
+    @staticmethod
+    def _lon_shifts(min_lon, max_lon):
+        # corners aren't wrapped, so near the antimeridian also look one turn over
+        return [0.0] + ([360.0] if min_lon < -170 else []) + ([-360.0] if max_lon > 170 else [])
+
+    def at_point(self, lon, lat):
+        """Every path/row whose footprint contains the point, closest centre first."""
+        out = []
+        for shift in self._lon_shifts(lon, lon):
+            out.extend(p for p in self._at_point(lon + shift, lat) if p not in out)
+        return out
+
+    def _at_point(self, lon, lat):
+        idx = self._candidates(lon, lat, lon, lat)
+        if len(idx) == 0:
+            return []
+        # convex quad test: the point is on the same side of all four edges
+        x = self.corner_lon[idx]
+        y = self.corner_lat[idx]
+        xn = np.roll(x, -1, axis=1)
+        yn = np.roll(y, -1, axis=1)
+        cross = (xn - x) * (lat - y) - (yn - y) * (lon - x)
+        inside = np.all(cross >= 0, axis=1) | np.all(cross <= 0, axis=1)
+        idx = idx[inside]
+        d = (self.center_lon[idx] - lon) ** 2 + (self.center_lat[idx] - lat) ** 2
+        return [self._path_row(i) for i in idx[np.argsort(d)]]
+
+    def intersecting(self, bbox):
+        """Path/rows whose footprint bbox overlaps bbox = (min_lon, min_lat, max_lon, max_lat)."""
+        min_lon, min_lat, max_lon, max_lat = bbox
+        out = set()
+        for shift in self._lon_shifts(min_lon, max_lon):
+            idx = self._candidates(min_lon + shift, min_lat, max_lon + shift, max_lat)
+            if len(idx) == 0:
+                continue
+            b = self.bboxes[idx]
+            hit = ((b[:, 0] <= max_lon + shift) & (b[:, 2] >= min_lon + shift)
+                   & (b[:, 1] <= max_lat) & (b[:, 3] >= min_lat))
+            out.update(self._path_row(i) for i in idx[hit])
+        return sorted(out)
+
+
+_default_index = None
+
+
+def get_wrs2_index():
+    """Process-wide WRS2Index, loaded on first use."""
+    global _default_index
+    if _default_index is None:
+        _default_index = WRS2Index()
+    return _default_index
+
+
+def wrs2_footprint_bbox(path, row):
+    """bbox of a descending path/row, or None if it isn't in the index."""
+    try:
+        return get_wrs2_index().bbox(path, row)
+    except (KeyError, OSError) as e:
+        print(f"WRS-2 index has no footprint for {path:03d}/{row:03d}: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    write_index()
@@ -0,0 +1,427 @@
+"""
+Zonal statistics of a dNBR GeoTIFF: per polygon (fire perimeter, municipality,
+WRS-2 cell, ...) burned area and USGS severity class histogram.
+
+    zonal_stats("data/outputs/delta_nbr_p017r023_20220601_20230801.tif", "wrs2")
+    zonal_stats(tif, feature_collection, id_field="name")
+
+Zones are rasterized once onto the dNBR grid (pixel centres, like
+rasterio.features.rasterize) into a zone-index GeoTIFF that is cached under
+ZONE_CACHE_DIR, keyed by the geometries and the grid, so asking again about
+the same polygons on any raster of that grid doesn't rasterize again.
+Polygons can overlap (WRS-2 cells always do): features are packed into as few
+non-overlapping layers as their bboxes allow, one band per layer.
+Every distinct zone set makes a new full-grid file, so the cache is capped at
+ZONE_CACHE_MAX_MB: after a write the least recently used zone rasters go first
+(a hit bumps the file's mtime), skipping anything used in the last
+ZONE_CACHE_PIN_SECONDS. A single request can't bring more than ZONE_MAX_ZONES zones.
+
+The stats pass then walks the dNBR in 512px blocks (the COG tiles), only
+inside the zones' extent, and per block and layer does one bincount over
+zone * 18 + class * 2 + changed, plus a weighted one for the mean dNBR.
+Memory is a few blocks whatever the raster or zone count.
+
+Zones can be:
+  "wrs2"                     the WRS-2 footprints that touch the raster (wrs2_index)
+  "<name>.geojson"           a file in assets/ (any path from Python)
+  a GeoJSON dict             FeatureCollection, Feature, Polygon / MultiPolygon,
+                             or a list of features. lon/lat unless zones_crs says otherwise
+
+Env:
+  DNBR_ZONE_CACHE_DIR      (default ./data/zone_cache)
+  DNBR_ZONE_CACHE_MAX_MB   (default 2048)
+  DNBR_ZONE_MAX_ZONES      (default 5000)
+"""
+import hashlib
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import rasterio
+from rasterio.features import rasterize
+from rasterio.warp import transform_bounds, transform_geom
+from rasterio.windows import Window
+
+from ThePython import classify_dnbr, COG_BLOCKSIZE, COG_COMPRESS
+from wrs2_index import get_wrs2_index
+
+ZONE_CACHE_DIR = os.environ.get("DNBR_ZONE_CACHE_DIR", os.path.join(os.getcwd(), "data", "zone_cache"))
+ZONE_ASSET_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "assets"))
+ZONE_CACHE_VERSION = "1"
+ZONE_CACHE_MAX_MB = float(os.environ.get("DNBR_ZONE_CACHE_MAX_MB", "2048"))
+ZONE_CACHE_PIN_SECONDS = 5 * 60
+ZONE_MAX_ZONES = int(os.environ.get("DNBR_ZONE_MAX_ZONES", "5000"))
+DEFAULT_THRESHOLD = 0.27   # same "burned" cut as delta_nbr_stats
+BLOCK = COG_BLOCKSIZE
+
+# classify_dnbr codes; 0 here = a valid pixel outside every class range
+CLASS_NAMES = (
+    "unclassified",
+    "enhanced_regrowth_high",
+    "enhanced_regrowth_low",
+    "unburned",
+    "low",
+    "moderate_low",
+    "moderate_high",
+    "high",
+)
+_NODATA_CLASS = len(CLASS_NAMES)          # 8, nodata slot in the histogram
+_BINS = (len(CLASS_NAMES) + 1) * 2       # (class or nodata) x changed
+
+
+# ---- zones in ----
+
+def _features(zones):
+    if isinstance(zones, list):
+        return zones
+    if not isinstance(zones, dict):
+        raise RuntimeError("zones must be a GeoJSON object or a list of features")
+    kind = zones.get("type")
+    if kind == "FeatureCollection":
+        feats = zones.get("features") or []
+        if not isinstance(feats, list):
+            raise RuntimeError("FeatureCollection features must be a list")
+        return feats
+    if kind == "Feature":
+        return [zones]
+    if kind in ("Polygon", "MultiPolygon"):
+        return [{"type": "Feature", "properties": {}, "geometry": zones}]
+    raise RuntimeError(f"Unsupported zones GeoJSON type: {kind!r}")
+
+
+def _is_position(p):
+    return (isinstance(p, (list, tuple)) and len(p) >= 2
+            and all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) for v in p[:2]))
+
+
+def _valid_polygon(rings):
+    # [[ring], ...], every ring at least 4 [x, y] positions (closed)
+    return (isinstance(rings, list) and rings
+            and all(isinstance(r, list) and len(r) >= 4 and all(_is_position(p) for p in r) for r in rings))
+
+
+def _check_geometry(i, geom):
+    """RuntimeError unless geom is a Polygon / MultiPolygon with sane coordinates (client input goes through here)."""
+    if not isinstance(geom, dict):
+        raise RuntimeError(f"Zone {i} has no geometry object")
+    kind = geom.get("type")
+    if kind not in ("Polygon", "MultiPolygon"):
+        raise RuntimeError(f"Zone {i} is a {kind!r}, only Polygon / MultiPolygon zones work")
+    coords = geom.get("coordinates")
+    if kind == "Polygon":
+        ok = _valid_polygon(coords)
+    else:
+        ok = isinstance(coords, list) and coords and all(_valid_polygon(poly) for poly in coords)
+    if not ok:
+        raise RuntimeError(f"Zone {i} has missing or malformed {kind} coordinates")
+
+
+def _wrs2_zones(tif_path):
+    with rasterio.open(tif_path) as src:
+        bbox = transform_bounds(src.crs, "EPSG:4326", *src.bounds, densify_pts=21)
+    index = get_wrs2_index()
+    return [
+        {
+            "type": "Feature",
+            "id": f"P{path:03d}R{row:03d}",
+            "properties": {"path": path, "row": row},
+            "geometry": {"type": "Polygon", "coordinates": [[list(pt) for pt in index.polygon(path, row)]]},
+        }
+        for path, row in index.intersecting(bbox)
+    ]
+
+
+def load_zones(zones, tif_path=None, id_field=None):
+    """
+    Normalise zones (see module docstring) to [(zone id, properties, geometry)].
+    Ids are str(properties[id_field]), else the feature "id", else its position.
+    """
+    if isinstance(zones, str):
+        if zones == "wrs2":
+            if tif_path is None:
+                raise RuntimeError("wrs2 zones need the raster they're for")
+            zones = _wrs2_zones(tif_path)
+        else:
+            with open(zones) as f:
+                zones = json.load(f)
+
+    feats = _features(zones)
+    if len(feats) > ZONE_MAX_ZONES:
+        raise RuntimeError(f"Too many zones ({len(feats)}), the limit is {ZONE_MAX_ZONES}")
+    out = []
+    seen = set()
+    for i, feat in enumerate(feats):
+        if not isinstance(feat, dict):
+            raise RuntimeError(f"Zone {i} is not a GeoJSON Feature object")
+        geom = feat.get("geometry")
+        _check_geometry(i, geom)
+        props = feat.get("properties") or {}
+        if not isinstance(props, dict):
+            raise RuntimeError(f"Zone {i} properties must be an object")
+        if id_field:
+            if id_field not in props:
+                raise RuntimeError(f"Zone {i} has no {id_field!r} property")
+            zid = str(props[id_field])
+        else:
+            zid = str(feat["id"]) if feat.get("id") is not None else str(i)
+        if zid in seen:
+            raise RuntimeError(f"Duplicate zone id {zid!r}")
+        seen.add(zid)
+        out.append((zid, props, geom))
+    if not out:
+        raise RuntimeError("No zones given")
+    return out
+
+
+def asset_zones_path(name):
+    """A GeoJSON file in assets/ by name (what the API accepts, no paths)."""
+    base = os.path.basename(name)
+    if base != name or not base.lower().endswith((".geojson", ".json")):
+        raise FileNotFoundError(name)
+    path = os.path.join(ZONE_ASSET_DIR, base)
+    if not os.path.isfile(path):
+        raise FileNotFoundError(name)
+    return path
+
+
+# ---- zone-index rasters ----
+
+def _grid_signature(src):
+    return [src.crs.to_wkt(), list(src.transform)[:6], src.width, src.height]
+
+
+def _pixel_bbox(bounds, transform, width, height):
+    """(col0, row0, col1, row1) of the pixels whose centres can fall inside bounds, clipped."""
+    inv = ~transform
+    c0, r0 = inv * (bounds[0], bounds[3])
+    c1, r1 = inv * (bounds[2], bounds[1])
+    col0 = max(0, int(math.floor(min(c0, c1))))
+    row0 = max(0, int(math.floor(min(r0, r1))))
+    col1 = min(width, int(math.ceil(max(c0, c1))))
+    row1 = min(height, int(math.ceil(max(r0, r1))))
+    return col0, row0, col1, row1
+
+
+def _geom_bounds(geom):
+    xs, ys = [], []
+
+    def walk(c):
+        if isinstance(c[0], (int, float)):
+            xs.append(c[0])
+            ys.append(c[1])
+        else:
+            for part in c:
+                walk(part)
+
+    walk(geom["coordinates"])
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _pack_layers(boxes):
+    """Greedy: each zone goes in the first layer where its pixel bbox overlaps nothing. Returns layer per zone."""
+    layers = []     # list of lists of boxes
+    out = []
+    for box in boxes:
+        for li, taken in enumerate(layers):
+            if all(box[2] <= b[0] or b[2] <= box[0] or box[3] <= b[1] or b[3] <= box[1] for b in taken):
+                taken.append(box)
+                out.append(li)
+                break
+        else:
+            layers.append([box])
+            out.append(len(layers) - 1)
+    return out
+
+
+_cache_lock = threading.Lock()
+
+
+def _evict_zone_cache(cache_dir, keep):
+    """Drop least recently used zone rasters until the cache fits in ZONE_CACHE_MAX_MB. Call with _cache_lock held."""
+    max_bytes = ZONE_CACHE_MAX_MB * 1024 * 1024
+    entries = []
+    total = 0
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".tif"):
+            continue
+        key = name[:-4]
+        try:
+            st = os.stat(os.path.join(cache_dir, name))
+        except OSError:
+            continue
+        total += st.st_size
+        entries.append((st.st_mtime, key, st.st_size))
+    if total <= max_bytes:
+        return
+
+    cutoff = time.time() - ZONE_CACHE_PIN_SECONDS
+    removed = 0
+    for mtime, key, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if key == keep or mtime >= cutoff:
+            continue
+        for ext in (".json", ".tif"):
+            try:
+                os.remove(os.path.join(cache_dir, key + ext))
+            except OSError:
+                pass
+        total -= size
+        removed += 1
+    if removed:
+        print(f"Zone cache evicted {removed} zone raster(s)")
+
+
+def zone_raster(tif_path, zones, zones_crs="EPSG:4326", cache_dir=None):
+    """
+    Path of the cached zone-index GeoTIFF for zones (from load_zones) on the
+    grid of tif_path, and its metadata (layers, extent). Pixel value = zone
+    position + 1 in the band of the zone's layer, 0 = no zone.
+    """
+    if cache_dir is None:
+        cache_dir = ZONE_CACHE_DIR
+    with rasterio.open(tif_path) as src:
+        grid = _grid_signature(src)
+        crs, transform, width, height = src.crs, src.transform, src.width, src.height
+
+    key_src = json.dumps([ZONE_CACHE_VERSION, zones_crs, grid, [g for _, _, g in zones]], sort_keys=True)
+    key = hashlib.sha1(key_src.encode()).hexdigest()[:20]
+    path = os.path.join(cache_dir, key + ".tif")
+    meta_path = os.path.join(cache_dir, key + ".json")
+
+    with _cache_lock:
+        if os.path.exists(path) and os.path.exists(meta_path):
+            os.utime(path)  # LRU: mtime = last use
+            with open(meta_path) as f:
+                return path, json.load(f)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        shapes, boxes = [], []
+        for i, (_, _, geom) in enumerate(zones):
+            g = transform_geom(zones_crs, crs, geom) if zones_crs != crs else geom
+            shapes.append((g, i + 1))
+            boxes.append(_pixel_bbox(_geom_bounds(g), transform, width, height))
+        layer_of = _pack_layers(boxes)
+        n_layers = max(layer_of) + 1
+        dtype = "uint16" if len(zones) < 65535 else "uint32"
+
+        on_raster = [b for b in boxes if b[2] > b[0] and b[3] > b[1]]
+        if on_raster:
+            extent = [min(b[0] for b in on_raster), min(b[1] for b in on_raster),
+                      max(b[2] for b in on_raster), max(b[3] for b in on_raster)]
+        else:
+            extent = [0, 0, 0, 0]
+
+        profile = {
+            "driver": "GTiff", "dtype": dtype, "count": n_layers, "width": width, "height": height,
+            "crs": crs, "transform": transform, "nodata": None,
+            "tiled": True, "blockxsize": BLOCK, "blockysize": BLOCK,
+            "compress": COG_COMPRESS, "BIGTIFF": "IF_SAFER", "sparse_ok": True,
+        }
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with rasterio.open(tmp, "w", **profile) as dst:
+            # strips of BLOCK rows over the zones' extent, only the shapes that reach the strip
+            for row0 in range(extent[1] // BLOCK * BLOCK, extent[3], BLOCK):
+                win = Window(extent[0], row0, extent[2] - extent[0], min(BLOCK, height - row0))
+                win_transform = rasterio.windows.transform(win, transform)
+                for layer in range(n_layers):
+                    todo = [shapes[i] for i, b in enumerate(boxes)
+                            if layer_of[i] == layer and b[1] < row0 + BLOCK and b[3] > row0
+                            and b[2] > b[0]]
+                    if not todo:
+                        continue
+                    arr = rasterize(todo, out_shape=(int(win.height), int(win.width)),
+                                    transform=win_transform, fill=0, dtype=dtype)
+                    dst.write(arr, layer + 1, window=win)
+        os.replace(tmp, path)
+
+        meta = {"layers": n_layers, "extent": extent, "zones": len(zones)}
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+        print(f"Rasterized {len(zones)} zones into {n_layers} layer(s): {os.path.basename(path)}")
+        _evict_zone_cache(cache_dir, keep=key)
+        return path, meta
+
+
+# ---- the stats pass ----
+
+def zonal_stats(tif_path, zones, id_field=None, threshold=DEFAULT_THRESHOLD, zones_crs="EPSG:4326",
+                cache_dir=None):
+    """
+    Per-zone dNBR stats of tif_path. Returns
+      {"tif", "threshold", "pixel_area_ha", "zones": [
+          {"id", "properties", "valid_pixels", "nodata_pixels", "changed_pixels",
+           "percent_changed", "burned_ha", "mean_dnbr",
+           "classes": {name: {"pixels", "ha"}}}, ...]}
+    changed / burned = dNBR >= threshold (valid pixels only), like delta_nbr_stats.
+    Zones that don't reach the raster come back with zero pixels.
+    """
+    zones = load_zones(zones, tif_path=tif_path, id_field=id_field)
+    zpath, meta = zone_raster(tif_path, zones, zones_crs=zones_crs, cache_dir=cache_dir)
+    n = len(zones) + 1
+    hist = np.zeros(n * _BINS, dtype=np.int64)
+    dsum = np.zeros(n, dtype=np.float64)
+
+    with rasterio.open(tif_path) as src, rasterio.open(zpath) as zsrc:
+        units = src.crs.linear_units_factor[1] if src.crs.is_projected else None
+        if units is None:
+            raise RuntimeError(f"{tif_path} isn't in a projected CRS, can't compute areas")
+        pixel_ha = abs(src.transform.a * src.transform.e) * units * units / 10000.0
+        nodata = src.nodata
+
+        col0, row0, col1, row1 = meta["extent"]
+        for r in range(row0 // BLOCK * BLOCK, row1, BLOCK):
+            for c in range(col0 // BLOCK * BLOCK, col1, BLOCK):
+                win = Window(c, r, min(BLOCK, src.width - c), min(BLOCK, src.height - r))
+                zblocks = [zsrc.read(b, window=win) for b in range(1, meta["layers"] + 1)]
+                zblocks = [z for z in zblocks if z.any()]
+                if not zblocks:
+                    continue
+
+                delta = src.read(1, window=win).astype(np.float32, copy=False)
+                if nodata is not None:
+                    delta[delta == nodata] = np.nan
+                valid = np.isfinite(delta)
+                cls = classify_dnbr(delta)
+                cls[~valid] = _NODATA_CLASS
+                with np.errstate(invalid="ignore"):
+                    key = cls.astype(np.intp) * 2 + (delta >= threshold)
+
+                for z in zblocks:
+                    zi = z.astype(np.intp)
+                    hist += np.bincount((zi * _BINS + key).ravel(), minlength=n * _BINS)
+                    dsum += np.bincount(zi[valid], weights=delta[valid], minlength=n)
+
+    h = hist.reshape(n, len(CLASS_NAMES) + 1, 2)
+    out = []
+    for i, (zid, props, _) in enumerate(zones, start=1):
+        per_class = h[i, :len(CLASS_NAMES)].sum(axis=1)
+        valid_px = int(per_class.sum())
+        changed = int(h[i, :len(CLASS_NAMES), 1].sum())
+        out.append({
+            "id": zid,
+            "properties": props,
+            "valid_pixels": valid_px,
+            "nodata_pixels": int(h[i, _NODATA_CLASS].sum()),
+            "changed_pixels": changed,
+            "percent_changed": changed / valid_px * 100 if valid_px else 0.0,
+            "burned_ha": changed * pixel_ha,
+            "mean_dnbr": float(dsum[i] / valid_px) if valid_px else None,
+            "classes": {
+                name: {"pixels": int(per_class[k]), "ha": int(per_class[k]) * pixel_ha}
+                for k, name in enumerate(CLASS_NAMES)
+            },
+        })
+    return {"tif": tif_path, "threshold": threshold, "pixel_area_ha": pixel_ha, "zones": out}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: python zonal_stats.py <dnbr.tif> <wrs2 | zones.geojson> [id_field]")
+        sys.exit(1)
+    result = zonal_stats(sys.argv[1], sys.argv[2], id_field=sys.argv[3] if len(sys.argv) > 3 else None)
+    print(json.dumps(result, indent=2))
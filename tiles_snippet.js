@@ -1,292 +0,0 @@
-const PRESET_TILES = 
-[
-  {
-    "id": "P017R015_20220622_20231017",
-    "label": "Path 017 Row 015 (20220622 vs 20231017)",
-    "url": "assets/batch_tiles/delta_nbr_P017R015.png",
-    "bounds": [
-      [
-        64.45358231348361,
-        -70.47596139775203
-      ],
-      [
-        66.66239192535278,
-        -64.96400865783008
-      ]
-    ],
-    "preDate": "2022-06-22",
-    "postDate": "2023-10-17",
-    "percentChanged": 1.6233000982643335
-  },
-  {
-    "id": "P017R016_20220621_20231008",
-    "label": "Path 017 Row 016 (20220621 vs 20231008)",
-    "url": "assets/batch_tiles/delta_nbr_P017R016.png",
-    "bounds": [
-      [
-        61.642450523362676,
-        -74.06334280729966
-      ],
-      [
-        64.01941822651042,
-        -69.31067099111203
-      ]
-    ],
-    "preDate": "2022-06-21",
-    "postDate": "2023-10-08",
-    "percentChanged": 2.6595412237377247
-  },
-  {
-    "id": "P017R017_20220621_20230924",
-    "label": "Path 017 Row 017 (20220621 vs 20230924)",
-    "url": "assets/batch_tiles/delta_nbr_P017R017.png",
-    "bounds": [
-      [
-        61.642450523362676,
-        -74.06334280729966
-      ],
-      [
-        64.01941822651042,
-        -69.31067099111203
-      ]
-    ],
-    "preDate": "2022-06-21",
-    "postDate": "2023-09-24",
-    "percentChanged": NaN
-  },
-  {
-    "id": "P017R018_20220613_20230921",
-    "label": "Path 017 Row 018 (20220613 vs 20230921)",
-    "url": "assets/batch_tiles/delta_nbr_P017R018.png",
-    "bounds": [
-      [
-        60.39481958302447,
-        -75.07466650281606
-      ],
-      [
-        62.508126729595986,
-        -70.37572637785071
-      ]
-    ],
-    "preDate": "2022-06-13",
-    "postDate": "2023-09-21",
-    "percentChanged": NaN
-  },
-  {
-    "id": "P017R019_20220613_20230929",
-    "label": "Path 017 Row 019 (20220613 vs 20230929)",
-    "url": "assets/batch_tiles/delta_nbr_P017R019.png",
-    "bounds": [
-      [
-        58.993455372617966,
-        -75.91738792120645
-      ],
-      [
-        61.14646162083876,
-        -71.47490985050965
-      ]
-    ],
-    "preDate": "2022-06-13",
-    "postDate": "2023-09-29",
-    "percentChanged": NaN
-  },
-  {
-    "id": "P017R020_20220613_20230929",
-    "label": "Path 017 Row 020 (20220613 vs 20230929)",
-    "url": "assets/batch_tiles/delta_nbr_P017R020.png",
-    "bounds": [
-      [
-        57.589458646252055,
-        -76.70482199153804
-      ],
-      [
-        59.77587510993793,
-        -72.4919709439425
-      ]
-    ],
-    "preDate": "2022-06-13",
-    "postDate": "2023-09-29",
-    "percentChanged": NaN
-  },
-  {
-    "id": "P017R021_20220613_20230929",
-    "label": "Path 017 Row 021 (20220613 vs 20230929)",
-    "url": "assets/batch_tiles/delta_nbr_P017R021.png",
-    "bounds": [
-      [
-        56.18083542699742,
-        -77.4394565038548
-      ],
-      [
-        58.39733064381791,
-        -73.43258507203021
-      ]
-    ],
-    "preDate": "2022-06-13",
-    "postDate": "2023-09-29",
-    "percentChanged": 0.005500049051855906
-  },
-  {
-    "id": "P017R022_20220601_20231015",
-    "label": "Path 017 Row 022 (20220601 vs 20231015)",
-    "url": "assets/batch_tiles/delta_nbr_P017R022.png",
-    "bounds": [
-      [
-        53.360591740265306,
-        -72.58768125372254
-      ],
-      [
-        55.62022410035092,
-        -68.9314840243011
-      ]
-    ],
-    "preDate": "2022-06-01",
-    "postDate": "2023-10-15",
-    "percentChanged": NaN
-  },
-  {
-    "id": "P017R023_20220601_20231016",
-    "label": "Path 017 Row 023 (20220601 vs 20231016)",
-    "url": "assets/batch_tiles/delta_nbr_P017R023.png",
-    "bounds": [
-      [
-        51.9449926199231,
-        -73.20715492311919
-      ],
-      [
-        54.227081386192815,
-        -69.70231264418501
-      ]
-    ],
-    "preDate": "2022-06-01",
-    "postDate": "2023-10-16",
-    "percentChanged": NaN
-  },
-  {
-    "id": "P017R024_20220623_20231016",
-    "label": "Path 017 Row 024 (20220623 vs 20231016)",
-    "url": "assets/batch_tiles/delta_nbr_P017R024.png",
-    "bounds": [
-      [
-        50.590002812588565,
-        -76.96959729969399
-      ],
-      [
-        52.761172370422656,
-        -73.53115373204574
-      ]
-    ],
-    "preDate": "2022-06-23",
-    "postDate": "2023-10-16",
-    "percentChanged": 0.4373250375905166
-  },
-  {
-    "id": "P017R025_20220623_20231016",
-    "label": "Path 017 Row 025 (20220623 vs 20231016)",
-    "url": "assets/batch_tiles/delta_nbr_P017R025.png",
-    "bounds": [
-      [
-        49.167745005623004,
-        -77.52993525660447
-      ],
-      [
-        51.362388251674005,
-        -74.2184123114753
-      ]
-    ],
-    "preDate": "2022-06-23",
-    "postDate": "2023-10-16",
-    "percentChanged": 2.7716693528560112
-  },
-  {
-    "id": "P017R026_20220623_20231001",
-    "label": "Path 017 Row 026 (20220623 vs 20231001)",
-    "url": "assets/batch_tiles/delta_nbr_P017R026.png",
-    "bounds": [
-      [
-        47.74299847240343,
-        -78.064425247893
-      ],
-      [
-        49.95661289475822,
-        -74.86874671940906
-      ]
-    ],
-    "preDate": "2022-06-23",
-    "postDate": "2023-10-01",
-    "percentChanged": 0.0023518786806901353
-  },
-  {
-    "id": "P017R027_20220623_20230930",
-    "label": "Path 017 Row 027 (20220623 vs 20230930)",
-    "url": "assets/batch_tiles/delta_nbr_P017R027.png",
-    "bounds": [
-      [
-        46.318780573030125,
-        -78.5762543129112
-      ],
-      [
-        48.54970750434361,
-        -75.48624997913186
-      ]
-    ],
-    "preDate": "2022-06-23",
-    "postDate": "2023-09-30",
-    "percentChanged": 0.7798319101163529
-  },
-  {
-    "id": "P017R028_20220623_20230930",
-    "label": "Path 017 Row 028 (20220623 vs 20230930)",
-    "url": "assets/batch_tiles/delta_nbr_P017R028.png",
-    "bounds": [
-      [
-        46.318780573030125,
-        -78.5762543129112
-      ],
-      [
-        48.54970750434361,
-        -75.48624997913186
-      ]
-    ],
-    "preDate": "2022-06-23",
-    "postDate": "2023-09-30",
-    "percentChanged": 0.14668664730119946
-  },
-  {
-    "id": "P017R029_20220623_20230930",
-    "label": "Path 017 Row 029 (20220623 vs 20230930)",
-    "url": "assets/batch_tiles/delta_nbr_P017R029.png",
-    "bounds": [
-      [
-        42.15190928732031,
-        -80.0440052110615
-      ],
-      [
-        44.18720543072206,
-        -77.13986510212898
-      ]
-    ],
-    "preDate": "2022-06-23",
-    "postDate": "2023-09-30",
-    "percentChanged": 0.6325609189046061
-  },
-  {
-    "id": "P017R030_20220623_20230922",
-    "label": "Path 017 Row 030 (20220623 vs 20230922)",
-    "url": "assets/batch_tiles/delta_nbr_P017R030.png",
-    "bounds": [
-      [
-        42.15190928732031,
-        -80.0440052110615
-      ],
-      [
-        44.18720543072206,
-        -77.13986510212898
-      ]
-    ],
-    "preDate": "2022-06-23",
-    "postDate": "2023-09-22",
-    "percentChanged": 0.5065433787595666
-  }
-]
-;